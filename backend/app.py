@@ -1,35 +1,318 @@
 """
 Flask REST API server for multimodal image analysis.
+
+Startup and /api/health import only Flask and light modules. The pipeline
+(the OpenAI SDK, httpx, pydantic, Pillow) and batch processing are imported
+by the first request that needs them, so a cold start on a serverless host
+serves its first byte without loading them; test_cold_start.py holds the
+import budget.
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from pipeline import AnalysisPipeline
+from werkzeug.exceptions import RequestEntityTooLarge
+from jobs import JobQueue, JobWorkers
 from config import Config
+from uploads import HEADER_BYTES, Base64StreamDecoder, JSONUploadReader, check_header
+import metrics
+import prompts
+import resolution
+import gc
+import json
+import os
+import sqlite3
+import threading
+import time
 import traceback
 
+class UploadRequest(Request):
+    """Request whose body limit depends on the endpoint: batches carry many images."""
+    
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'analyze_batch':
+            return Config.BATCH_MAX_REQUEST_BYTES
+        return super().max_content_length
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+# Werkzeug answers 413 to larger bodies instead of reading them
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_REQUEST_BYTES
 
 # Simplified CORS for Vercel deployment
 CORS(app) 
 
 # Initialize pipeline
 pipeline = None
+_pipeline_lock = threading.Lock()
+
+# Event loop shared by all async analyses in this process, created on first use
+runner = None
+_runner_lock = threading.Lock()
+
+# Background job queue and this process's workers, started on first use
+jobs = None
+job_workers = None
+_jobs_lock = threading.Lock()
 
 def get_pipeline():
     """Lazy initialization of pipeline."""
     global pipeline
-    if pipeline is None:
-        pipeline = AnalysisPipeline()
+    with _pipeline_lock:
+        if pipeline is None:
+            # Imported here: the analysis stack is most of the app's import time
+            from pipeline import AnalysisPipeline
+            pipeline = AnalysisPipeline()
     return pipeline
 
+def get_runner():
+    """Lazy initialization of the background event loop runner (asyncio is imported with it)."""
+    global runner
+    with _runner_lock:
+        if runner is None:
+            from async_runner import AsyncRunner
+            runner = AsyncRunner()
+    return runner
+
+def warm_up():
+    """
+    Build the pipeline and open upstream connections before traffic arrives.
+    
+    Failures are logged only; requests will then connect on demand.
+    """
+    try:
+        start = time.perf_counter()
+        pipe = get_pipeline()
+        opened = pipe.client.warm_up()
+        if pipe.async_client is not None:
+            # The async pool must be opened on the loop that serves requests
+            opened += get_runner().run(pipe.async_client.warm_up(), timeout=Config.HTTP_CONNECT_TIMEOUT * 2)
+        print(f"Warm-up finished in {time.perf_counter() - start:.2f}s "
+              f"({opened} upstream connections open)")
+    except Exception as e:
+        print(f"Warm-up failed: {str(e)}")
+
+def get_jobs():
+    """Lazy initialization of the job queue and its workers."""
+    global jobs, job_workers
+    with _jobs_lock:
+        if jobs is None:
+            jobs = JobQueue()
+            if Config.JOBS_WORKERS:
+                job_workers = JobWorkers(
+                    jobs, lambda data: run_analysis(get_pipeline(), image_data=data, endpoint='jobs')
+                ).start()
+    return jobs
+
+def preload():
+    """
+    Build, before a pre-forking server forks, what its workers can share copy-on-write.
+    
+    Loads every Pillow format plugin and builds the pipeline (clients,
+    prompts, near-duplicate index). Nothing here opens a socket or starts
+    a thread; the cache reconnects to SQLite in each worker.
+    """
+    from PIL import Image
+    Image.init()
+    get_pipeline()
+    # Keep the garbage collector from writing to (and so copying) the shared pages
+    gc.freeze()
+
+def start_background_tasks():
+    """Start per-process background work: connection warm-up and job workers."""
+    # Warm up in the background so importing the app (or the first request) never waits on it
+    if Config.WARMUP_ON_STARTUP and Config.OPENAI_API_KEY:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+    
+    # Resume jobs left queued or running by a previous process (never creates the store)
+    if Config.JOBS_WORKERS and Config.OPENAI_API_KEY and os.path.exists(Config.JOBS_DB_PATH):
+        get_jobs()
+
+def stop_background_tasks(timeout=None):
+    """
+    Let this process's job workers finish their running jobs, then stop them.
+    
+    Args:
+        timeout: Seconds to wait for each worker thread (None waits until done)
+    """
+    if job_workers is not None:
+        job_workers.stop(timeout)
+
+def run_analysis(pipe, image_data=None, base64_data=None, fields=None, endpoint='analyze'):
+    """
+    Analyze an upload on the async path when enabled, else synchronously.
+    
+    Args:
+        pipe: AnalysisPipeline instance
+        image_data: File-like object (multipart upload)
+        base64_data: Base64 string (JSON upload)
+        fields: Output fields to generate (defaults to all five)
+        endpoint: Endpoint name for tier routing ('analyze' or 'jobs')
+        
+    Returns:
+        dict: Analysis results
+    """
+    if pipe.async_client is None:
+        if base64_data is not None:
+            return pipe.process_base64_image(base64_data, fields, endpoint)
+        return pipe.process_image(image_data, fields, endpoint)
+    
+    if base64_data is not None:
+        coro = pipe.process_base64_image_async(base64_data, fields, endpoint)
+    else:
+        coro = pipe.process_image_async(image_data, fields, endpoint)
+    return get_runner().run(coro, timeout=Config.ANALYZE_TIMEOUT_SECONDS)
+
+def requested_fields(form):
+    """
+    Output fields asked for with ?fields=, a 'fields' form field or JSON key.
+    
+    Args:
+        form: Form fields or JSON keys returned by read_upload()
+        
+    Returns:
+        list: Field names, or None for all five
+        
+    Raises:
+        ValueError: If a name is not an analysis field
+    """
+    return prompts.parse_fields(request.args.get('fields', form.get('fields')))
+
+def read_upload():
+    """
+    Read the uploaded image, rejecting bad uploads from their first bytes.
+    
+    Multipart files are spooled to disk by Werkzeug and checked from their
+    header before being read. Base64 JSON bodies are decoded while they
+    stream in, so the encoded text is never held in memory.
+    
+    Returns:
+        tuple: (image bytes or None if no image was sent, other form fields or JSON keys)
+        
+    Raises:
+        ValueError: If the upload is empty, not a supported image or too large
+    """
+    with metrics.span('upload_read'):
+        if request.is_json:
+            decoder = Base64StreamDecoder(on_header=check_header)
+            return JSONUploadReader(request.stream, 'image', decoder).read()
+        if 'image' not in request.files:
+            return None, request.form
+        
+        file = request.files['image']
+        if file.filename == '':
+            raise ValueError('No file selected')
+        check_header(file.stream.read(HEADER_BYTES))
+        file.stream.seek(0)
+        return file.read(), request.form
+
+def format_sse(events):
+    """
+    Serialize (event, data) pairs as server-sent events.
+    
+    Args:
+        events: Iterable of (event name, JSON-serializable data)
+        
+    Yields:
+        str: One SSE message per event
+    """
+    try:
+        for event, data in events:
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    except TimeoutError as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+
+@app.before_request
+def start_request_timing():
+    """Start the request clock and the per-request stage collector."""
+    metrics.start_request()
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Record request latency, status and response size; add Server-Timing if enabled.
+    
+    For streamed responses this runs when the stream starts, not when it ends.
+    """
+    finished = metrics.finish_request()
+    if finished is None or not Config.METRICS_ENABLED:
+        return response
+    
+    elapsed, timings = finished
+    rule = request.url_rule  # Each proxy access costs about a microsecond
+    endpoint = rule.rule if rule is not None else 'unmatched'
+    metrics.REQUEST_SECONDS.observe(elapsed, endpoint)
+    metrics.REQUESTS.inc(1, endpoint, str(response.status_code))
+    size = response.content_length
+    if size is not None:
+        metrics.BYTES.inc(size, 'response')
+    if Config.SERVER_TIMING:
+        response.headers['Server-Timing'] = metrics.server_timing(timings, elapsed)
+    return response
+
+@app.before_request
+def reject_oversized_body():
+    """Refuse a body over the limit from its Content-Length, before any view runs."""
+    limit = request.max_content_length
+    if limit is not None and request.content_length is not None and request.content_length > limit:
+        raise RequestEntityTooLarge()
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (counters are per process)."""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint."""
-    return jsonify({
+    health = {
         'status': 'healthy',
         'model': Config.MODEL_NAME,
-        'version': '1.0.0'
-    })
+        'version': '1.0.0',
+        # Clients downscale and encode to these before uploading
+        'upload': resolution.client_limits()
+    }
+    
+    # Only report cache counters once the pipeline exists; don't build it here
+    if pipeline is not None and pipeline.cache is not None:
+        health['cache'] = pipeline.cache.stats()
+        if pipeline.near_duplicates is not None:
+            health['cache']['near_duplicates'] = pipeline.near_duplicates.stats()
+    if pipeline is not None and pipeline.async_client is not None:
+        health['async'] = {
+            'in_flight': pipeline.async_client.in_flight,
+            'max_in_flight': pipeline.async_client.max_in_flight
+        }
+    if pipeline is not None and pipeline.inflight is not None:
+        inflight = pipeline.inflight_async if pipeline.async_client is not None else pipeline.inflight
+        health['singleflight'] = inflight.stats()
+    if pipeline is not None:
+        health['http_pool'] = {'sync': pipeline.client.pool_stats()}
+        if pipeline.async_client is not None:
+            health['http_pool']['async'] = pipeline.async_client.pool_stats()
+        health['flow_control'] = pipeline.client.flow.stats()
+        for provider in pipeline.router.providers:
+            if provider.name != 'openai':
+                health[f'flow_control_{provider.name}'] = provider.client.flow.stats()
+        health['routing'] = pipeline.router.stats()
+        if pipeline.tiers is not None:
+            health['tiering'] = pipeline.tiers.stats()
+        if pipeline.history is not None:
+            health['search'] = pipeline.history.stats()
+    if jobs is not None:
+        health['jobs'] = jobs.stats()
+    if Config.PREFORK:
+        health['worker_pid'] = os.getpid()  # Caches and counters above are this worker's
+    if Config.ANALYSIS_BACKEND == 'fake':
+        # Make it obvious that answers are synthetic
+        from fake_backend import get_fake_backend
+        health['backend'] = {'name': Config.ANALYSIS_BACKEND, **get_fake_backend().stats()}
+    elif Config.ANALYSIS_BACKEND in ('record', 'replay'):
+        from record_replay import get_archive
+        health['backend'] = {'name': Config.ANALYSIS_BACKEND, **get_archive().stats()}
+    
+    return jsonify(health)
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_image():
@@ -39,9 +322,11 @@ def analyze_image():
     Accepts:
         - multipart/form-data with 'image' file
         - application/json with 'image' as base64 string
+        - optional 'fields' (query, form field or JSON key): the outputs to
+          generate, e.g. "caption,objects"; defaults to all five
         
     Returns:
-        JSON with all five analysis outputs
+        JSON with the requested analysis outputs
     """
     try:
         # Check if API key is configured
@@ -53,24 +338,16 @@ def analyze_image():
         # Get pipeline instance
         pipe = get_pipeline()
         
-        # Handle file upload
-        if 'image' in request.files:
-            file = request.files['image']
-            if file.filename == '':
-                return jsonify({'error': 'No file selected'}), 400
-            
-            # Process image
-            results = pipe.process_image(file)
-            
-        # Handle base64 data
-        elif request.is_json and 'image' in request.json:
-            base64_data = request.json['image']
-            results = pipe.process_base64_image(base64_data)
-            
-        else:
+        # Multipart file or base64 JSON
+        image_data, form = read_upload()
+        if image_data is None:
             return jsonify({
                 'error': 'No image provided. Send as multipart file or base64 JSON'
             }), 400
+        fields = requested_fields(form)
+        
+        # Process image
+        results = run_analysis(pipe, image_data=image_data, fields=fields)
         
         # Check for errors in results
         if 'error' in results:
@@ -79,30 +356,264 @@ def analyze_image():
                 'partial_results': {k: v for k, v in results.items() if k != 'error'}
             }), 500
         
+        with metrics.span('serialize'):
+            response = jsonify({
+                'success': True,
+                'results': results
+            })
+        return response
+        
+    except RequestEntityTooLarge:
+        raise
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        print(f"Error processing request: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_stream():
+    """
+    Streaming endpoint: push each output field as soon as it is generated.
+    
+    Accepts the same input as /api/analyze, including 'fields'.
+    
+    Returns:
+        text/event-stream with a 'field' event per output ({"name", "value"}),
+        then 'done' with the full results or 'error'
+    """
+    try:
+        if not Config.OPENAI_API_KEY:
+            return jsonify({
+                'error': 'API key not configured. Please set OPENAI_API_KEY in .env file'
+            }), 500
+        
+        pipe = get_pipeline()
+        
+        image_data, form = read_upload()
+        if image_data is None:
+            return jsonify({
+                'error': 'No image provided. Send as multipart file or base64 JSON'
+            }), 400
+        fields = requested_fields(form)
+        
+        if pipe.async_client is None:
+            events = pipe.stream_image(image_data, fields, 'stream')
+        else:
+            events = get_runner().iterate(
+                pipe.stream_image_async(image_data, fields, 'stream'), timeout=Config.ANALYZE_TIMEOUT_SECONDS
+            )
+        return Response(
+            stream_with_context(format_sse(events)),
+            mimetype='text/event-stream',
+            # Keep proxies from buffering the stream
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except RequestEntityTooLarge:
+        raise
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error processing stream: {str(e)}")
+        traceback.print_exc()
+        return jsonify({
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Batch endpoint: analyze many images, streaming results as they finish.
+    
+    Accepts:
+        - multipart/form-data with several 'images' files
+        - multipart/form-data with a 'zip' archive of images
+        
+    Returns:
+        application/x-ndjson with one line per image (in completion order,
+        tagged with its upload index) followed by a summary line
+    """
+    try:
+        if not Config.OPENAI_API_KEY:
+            return jsonify({
+                'error': 'API key not configured. Please set OPENAI_API_KEY in .env file'
+            }), 500
+        
+        items = [
+            (file.filename, file.read)
+            for file in request.files.getlist('images') + request.files.getlist('image')
+            if file.filename
+        ]
+        from batch import BatchProcessor, list_zip_images
+        if 'zip' in request.files:
+            items.extend(list_zip_images(request.files['zip'].stream))
+        
+        if not items:
+            return jsonify({
+                'error': "No images provided. Send 'images' files or a 'zip' archive"
+            }), 400
+        if len(items) > Config.BATCH_MAX_IMAGES:
+            return jsonify({
+                'error': f'Too many images. Max per batch: {Config.BATCH_MAX_IMAGES}'
+            }), 400
+        
+        processor = BatchProcessor(get_pipeline(), runner=get_runner())
+        return Response(
+            stream_with_context(processor.stream_ndjson(items)),
+            mimetype='application/x-ndjson'
+        )
+        
+    except RequestEntityTooLarge:
+        raise
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Error processing batch: {str(e)}")
+        traceback.print_exc()
         return jsonify({
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue an analysis and return at once; poll GET /api/jobs/<id> for the result.
+    
+    Accepts the same input as /api/analyze, plus an optional integer
+    'priority' (form field or JSON key; higher runs first).
+    
+    Returns:
+        202 with the job id; uploads identical to a pending or finished job
+        get that job's id, with 'deduplicated': true
+    """
+    try:
+        if not Config.OPENAI_API_KEY:
+            return jsonify({
+                'error': 'API key not configured. Please set OPENAI_API_KEY in .env file'
+            }), 500
+        
+        image_data, fields = read_upload()
+        if image_data is None:
+            return jsonify({
+                'error': 'No image provided. Send as multipart file or base64 JSON'
+            }), 400
+        
+        try:
+            priority = int(fields.get('priority', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'priority must be an integer'}), 400
+        if len(image_data) > Config.MAX_IMAGE_SIZE_BYTES:
+            return jsonify({
+                'error': f'Image too large. Max size: {Config.MAX_IMAGE_SIZE_MB}MB'
+            }), 400
+        
+        job_id, deduplicated = get_jobs().submit(image_data, priority)
+        response = jsonify({
             'success': True,
-            'results': results
+            'job_id': job_id,
+            'status': get_jobs().get(job_id)['status'],
+            'deduplicated': deduplicated
         })
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response, 202
         
+    except RequestEntityTooLarge:
+        raise
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
+        print(f"Error submitting job: {str(e)}")
         traceback.print_exc()
         return jsonify({
             'error': f'Internal server error: {str(e)}'
         }), 500
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Read a job's status and, once finished, its results.
+    
+    Query parameters:
+        wait: Seconds to long-poll for the job to finish (capped by JOBS_MAX_WAIT_SECONDS)
+    
+    Returns:
+        JSON job with 'status' queued, running, done or failed
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    
+    wait = max(0.0, min(wait, Config.JOBS_MAX_WAIT_SECONDS))
+    job = get_jobs().wait(job_id, wait) if wait else get_jobs().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/search', methods=['GET'])
+def search_history():
+    """
+    Search past analyses by text.
+    
+    Query parameters:
+        q: Free text, e.g. "beach sunset stories"
+        k: Number of results (default 10, at most SEARCH_MAX_RESULTS)
+    
+    Returns:
+        JSON with 'results': stored analyses with their image hash and score, best first
+    """
+    if not Config.SEARCH_ENABLED:
+        return jsonify({'error': 'Search is disabled (SEARCH_ENABLED=False)'}), 404
+    
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': "Missing query parameter 'q'"}), 400
+    try:
+        k = int(request.args.get('k', 10))
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    k = max(1, min(k, Config.SEARCH_MAX_RESULTS))
+    
+    from search import get_result_store
+    try:
+        store = get_result_store()
+    except (sqlite3.Error, OSError) as e:
+        print(f"Search history unavailable: {str(e)}")
+        return jsonify({'error': 'Search history is unavailable'}), 503
+    with metrics.span('search'):
+        results = store.search(query, k)
+    return jsonify({'query': query, 'results': results, 'total': store.stats()['entries']})
+
 @app.errorhandler(404)
 def not_found(e):
     """Handle 404 errors."""
     return jsonify({'error': 'Endpoint not found'}), 404
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """Handle bodies over MAX_CONTENT_LENGTH."""
+    return jsonify({
+        'error': f'Request too large. Max size: {request.max_content_length / 1024 / 1024:.0f}MB'
+    }), 413
+
 @app.errorhandler(500)
 def internal_error(e):
     """Handle 500 errors."""
     return jsonify({'error': 'Internal server error'}), 500
 
+if Config.PREFORK:
+    # Imported once in the server's master process (gunicorn.conf.py); each
+    # worker starts its background tasks after the fork
+    preload()
+else:
+    start_background_tasks()
+
 if __name__ == '__main__':
     print(f"Starting server on port {Config.PORT}...")
     print(f"Using model: {Config.MODEL_NAME}")
@@ -0,0 +1,115 @@
+"""
+Background event loop for the async analysis path.
+"""
+import asyncio
+import queue
+import threading
+
+_END = object()
+
+
+class AsyncRunner:
+    """
+    Run coroutines on one long-lived event loop in a daemon thread.
+
+    Flask views are synchronous; they hand their analysis coroutine to this
+    loop and wait for the result. All upstream calls then share one loop,
+    one connection pool and one concurrency limit, no matter how many
+    request threads are waiting.
+    """
+
+    def __init__(self):
+        """Initialize runner; the loop starts on first use."""
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """The running background loop, started on demand."""
+        with self._lock:
+            if self._loop is None:
+                ready = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run_loop, args=(ready,), name='analysis-loop', daemon=True
+                )
+                self._thread.start()
+                ready.wait()
+            return self._loop
+
+    def _run_loop(self, ready):
+        """Thread body: own the loop until the process exits."""
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        ready.set()
+        self._loop.run_forever()
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the background loop.
+
+        Args:
+            coro: Coroutine object
+
+        Returns:
+            concurrent.futures.Future: Future for the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the background loop and wait for its result.
+
+        Args:
+            coro: Coroutine object
+            timeout: Seconds before the coroutine is cancelled (None waits forever)
+
+        Returns:
+            Result of the coroutine
+
+        Raises:
+            TimeoutError: If the timeout expires; the coroutine is cancelled
+        """
+        if timeout is not None:
+            coro = asyncio.wait_for(coro, timeout)
+        try:
+            return self.submit(coro).result()
+        except asyncio.TimeoutError:
+            # Distinct from the builtin before Python 3.11
+            raise TimeoutError(f"Analysis timed out after {timeout}s")
+    
+    def iterate(self, agen, timeout=None):
+        """
+        Drive an async generator on the background loop and yield its items here.
+        
+        Args:
+            agen: Async generator object
+            timeout: Seconds before the whole iteration is cancelled (None waits forever)
+        
+        Yields:
+            Items produced by the async generator
+        
+        Raises:
+            TimeoutError: If the timeout expires; the generator is cancelled
+        """
+        items = queue.Queue()
+        
+        async def pump():
+            async for item in agen:
+                items.put(item)
+        
+        coro = pump() if timeout is None else asyncio.wait_for(pump(), timeout)
+        future = self.submit(coro)
+        future.add_done_callback(lambda _: items.put(_END))
+        try:
+            while True:
+                item = items.get()
+                if item is _END:
+                    break
+                yield item
+            future.result()
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Analysis timed out after {timeout}s")
+        finally:
+            # Consumer went away (e.g. client disconnected): stop the producer
+            future.cancel()
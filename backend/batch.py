@@ -0,0 +1,164 @@
+"""
+Batch analysis: parallel preprocessing and bounded-concurrency analysis of many images.
+"""
+import asyncio
+import json
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from preprocess_pool import submit_ingest
+from config import Config
+
+
+def list_zip_images(archive):
+    """
+    List the images inside a zip archive without extracting them.
+
+    Args:
+        archive: File-like object containing a zip file
+
+    Returns:
+        list: (filename, loader) pairs; loader() returns the member's bytes
+
+    Raises:
+        ValueError: If the archive is invalid or holds too many images
+    """
+    try:
+        zf = zipfile.ZipFile(archive)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid zip archive: {str(e)}")
+
+    items = []
+    for info in zf.infolist():
+        name = info.filename
+        extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        if info.is_dir() or name.startswith('__MACOSX/') or extension not in Config.ALLOWED_EXTENSIONS:
+            continue
+        items.append((name, _zip_loader(zf, info)))
+    return items
+
+
+def _zip_loader(zf, info):
+    """Loader that refuses oversized members before decompressing them."""
+    def load():
+        if info.file_size > Config.MAX_IMAGE_SIZE_BYTES:
+            raise ValueError(f"Image too large. Max size: {Config.MAX_IMAGE_SIZE_MB}MB")
+        return zf.read(info)
+    return load
+
+
+class BatchProcessor:
+    """Fan a batch of uploads out over the preprocessing pool and the pipeline."""
+
+    def __init__(self, pipeline, runner=None, max_concurrency=None):
+        """
+        Initialize batch processor.
+
+        Args:
+            pipeline: AnalysisPipeline instance
+            runner: AsyncRunner used when the pipeline has an async client
+            max_concurrency: Maximum analyses in flight for this batch
+        """
+        self.pipeline = pipeline
+        self.runner = runner if pipeline.async_client is not None else None
+        self.max_concurrency = max_concurrency or Config.BATCH_MAX_CONCURRENCY
+
+    def process(self, items):
+        """
+        Analyze every item, yielding one record per image as soon as it finishes.
+
+        At most 2 * max_concurrency images are loaded at any time, so memory
+        stays bounded for large albums.
+
+        Args:
+            items: List of (filename, loader) pairs; loader() returns file bytes
+
+        Yields:
+            dict: Per-image record, then a final summary record
+        """
+        threads = None if self.runner else ThreadPoolExecutor(max_workers=self.max_concurrency)
+        semaphore = asyncio.Semaphore(self.max_concurrency) if self.runner else None
+        window = self.max_concurrency * 2
+        pending = {}  # future -> (stage, index, filename)
+        queue = iter(enumerate(items))
+        succeeded = failed = 0
+
+        def fill():
+            """Start preprocessing until the window is full."""
+            while len(pending) < window:
+                try:
+                    index, (filename, loader) = next(queue)
+                except StopIteration:
+                    return
+                try:
+                    future = submit_ingest(loader())
+                except Exception as e:
+                    future = _failed_future(e)
+                pending[future] = ('preprocess', index, filename)
+
+        try:
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, index, filename = pending.pop(future)
+                    error = future.exception()
+
+                    if stage == 'preprocess' and error is None:
+                        image = future.result()
+                        if self.runner:
+                            analysis = self.runner.submit(
+                                self._bounded(semaphore, self.pipeline.analyze_preprocessed_async(image, endpoint='batch'))
+                            )
+                        else:
+                            analysis = threads.submit(self.pipeline.analyze_preprocessed, image, endpoint='batch')
+                        pending[analysis] = ('analyze', index, filename)
+                        continue
+
+                    record = {'index': index, 'filename': filename}
+                    if error is not None:
+                        record.update({'success': False, 'error': str(error)})
+                    elif 'error' in future.result():
+                        results = future.result()
+                        record.update({'success': False, 'error': results['error']})
+                    else:
+                        record.update({'success': True, 'results': future.result()})
+
+                    if record['success']:
+                        succeeded += 1
+                    else:
+                        failed += 1
+                    yield record
+                fill()
+        finally:
+            for future in pending:
+                future.cancel()
+            if threads is not None:
+                threads.shutdown(wait=False)
+
+        yield {'done': True, 'total': succeeded + failed, 'succeeded': succeeded, 'failed': failed}
+
+    @staticmethod
+    async def _bounded(semaphore, coro):
+        """Await a coroutine while holding a slot of the batch semaphore."""
+        async with semaphore:
+            return await coro
+
+    def stream_ndjson(self, items):
+        """
+        Serialize process() as newline-delimited JSON.
+
+        Args:
+            items: List of (filename, loader) pairs
+
+        Yields:
+            str: One JSON document per line
+        """
+        for record in self.process(items):
+            yield json.dumps(record) + '\n'
+
+
+def _failed_future(error):
+    """A completed future carrying an exception, for items that fail to load."""
+    future = Future()
+    future.set_exception(error)
+    return future
@@ -0,0 +1,110 @@
+"""
+Load benchmark: sync worker path vs async path against a local fake OpenAI server.
+Usage: python bench_async.py [num_requests] [upstream_latency_seconds] [sync_workers]
+"""
+import contextlib
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fake_openai import FakeOpenAIServer
+
+
+def print_separator(char='-', length=70):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_uploads(count):
+    """Distinct small PNG uploads so nothing is served from the cache."""
+    from PIL import Image
+    uploads = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new('RGB', (256, 256), (i % 256, (i * 7) % 256, (i * 13) % 256)).save(buffer, 'PNG')
+        uploads.append(buffer.getvalue())
+    return uploads
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, wall, latencies, errors):
+    """Print one result line."""
+    print(f"{name:<28} wall {wall:6.2f}s  {len(latencies) / wall:7.1f} req/s  "
+          f"p50 {percentile(latencies, 50):5.2f}s  p99 {percentile(latencies, 99):5.2f}s  "
+          f"errors {errors}")
+
+
+def run_sync(pipe, uploads, workers):
+    """Each request holds one of `workers` threads for its whole duration (sync Flask workers)."""
+    def one(data):
+        start = time.perf_counter()
+        result = pipe.process_image(io.BytesIO(data))
+        return time.perf_counter() - start, 'error' in result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        outcomes = list(pool.map(one, uploads))
+    return time.perf_counter() - start, [o[0] for o in outcomes], sum(o[1] for o in outcomes)
+
+
+def run_async(pipe, uploads):
+    """All requests are in flight at once on the shared loop, capped by the concurrency limit."""
+    import asyncio
+
+    async def one(data):
+        start = time.perf_counter()
+        result = await pipe.process_image_async(io.BytesIO(data))
+        return time.perf_counter() - start, 'error' in result
+
+    async def all_requests():
+        return await asyncio.gather(*(one(data) for data in uploads))
+
+    start = time.perf_counter()
+    outcomes = asyncio.run(all_requests())
+    return time.perf_counter() - start, [o[0] for o in outcomes], sum(o[1] for o in outcomes)
+
+
+def main():
+    """Main entry point."""
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    sync_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    server = FakeOpenAIServer(latency=latency).start()
+    os.environ.update({
+        'OPENAI_API_KEY': 'fake-key',
+        'OPENAI_BASE_URL': server.base_url,
+        'CACHE_ENABLED': 'False'
+    })
+    from pipeline import AnalysisPipeline
+
+    print_separator('=')
+    print(f"{num_requests} requests, upstream latency {latency}s, fake server {server.base_url}")
+    print_separator('=')
+    uploads = make_uploads(num_requests)
+    pipe = AnalysisPipeline()
+
+    # Pipeline progress prints would swamp the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        sync_result = run_sync(pipe, uploads, sync_workers)
+    report(f"sync ({sync_workers} workers)", *sync_result)
+
+    # Fresh pipeline so the async client binds to the benchmark's event loop
+    pipe = AnalysisPipeline()
+    with contextlib.redirect_stdout(io.StringIO()):
+        async_result = run_async(pipe, uploads)
+    report(f"async (cap {pipe.async_client.max_in_flight})", *async_result)
+
+    print_separator('=')
+    print(f"Upstream requests served: {server.request_count}")
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Offline benchmark of the vision encoding profiles: payload size, encode time and estimated tokens.
+Usage: python bench_encoding.py [iterations] [model]
+"""
+import io
+import sys
+import time
+from config import Config
+from image_processor import ImageProcessor, estimate_image_tokens
+
+SIZES = [(640, 480), (1600, 1200), (3024, 4032), (4000, 6000)]
+
+
+def print_separator(char='-', length=78):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_upload(size):
+    """Encode a photo-like test image (smooth gradients plus noise) as a camera JPEG."""
+    import numpy as np
+    from PIL import Image
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    pixels += rng.normal(0, 12, pixels.shape).astype(np.float32)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def main():
+    """Main entry point."""
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    model = sys.argv[2] if len(sys.argv) > 2 else Config.MODEL_NAME
+
+    print_separator('=')
+    print(f"Encoding profiles (encode ms averaged over {iterations}; tokens estimated for {model})")
+    print_separator('=')
+    print(f"{'upload':<12}{'profile':<10}{'sent as':<16}{'detail':<8}"
+          f"{'payload KB':>11}{'encode ms':>11}{'img tokens':>11}")
+    print_separator()
+    for size in SIZES:
+        data = make_upload(size)
+        label = f"{size[0]}x{size[1]}"
+        for name in Config.ENCODING_PROFILES:
+            start = time.perf_counter()
+            for _ in range(iterations):
+                prepared = ImageProcessor.ingest(data, profile=name)
+            elapsed = (time.perf_counter() - start) / iterations
+            sent = f"{prepared.size[0]}x{prepared.size[1]} {prepared.format}"
+            print(f"{label:<12}{name:<10}{sent:<16}{prepared.detail:<8}"
+                  f"{len(prepared.payload) / 1024:>11.0f}{elapsed * 1000:>11.1f}"
+                  f"{prepared.estimated_tokens(model):>11}")
+        print_separator()
+
+    # What the API would charge for the original upload, for reference
+    for size in SIZES:
+        print(f"{size[0]}x{size[1]} sent unmodified at detail=high: "
+              f"~{estimate_image_tokens(size, 'high', model)} image tokens")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark field selection: latency and generated tokens per subset of output fields.
+Usage: python bench_fields.py [--requests N] [--concurrency C] [--latency SPEC] [--seconds-per-token S]
+
+Runs the pipeline against the fake backend, whose latency is a sampled time
+to first token plus a decoding time per completion token, so asking for
+fewer fields returns sooner the way a real model does. For each subset it
+reports median and p95 latency, completion tokens per request and the
+max_tokens reserved against the tokens-per-minute limit, with the savings
+over all five fields.
+
+The last section shows the per-field cache: images first analysed for
+caption and objects are then asked for all five fields, and only the three
+missing ones are generated.
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench_async import percentile
+from bench_harness import make_image
+
+SUBSETS = [
+    ['caption', 'summary', 'objects', 'mood', 'story'],
+    ['caption'],
+    ['caption', 'objects'],
+    ['caption', 'summary', 'objects'],
+    ['story'],
+]
+
+
+def print_separator(char='-', length=96):
+    """Print a separator line."""
+    print(char * length)
+
+
+def run(pipe, uploads, fields, concurrency):
+    """
+    Analyze every upload once for the given fields.
+
+    Returns:
+        tuple: (latencies, completion tokens generated, errors)
+    """
+    import metrics
+    tokens_before = metrics.TOKENS.value('completion')
+
+    def one(data):
+        start = time.perf_counter()
+        result = pipe.process_image(data, fields)
+        return time.perf_counter() - start, 'error' in result
+
+    # The pipeline logs every call
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, uploads))
+    latencies = [elapsed for elapsed, failed in outcomes if not failed]
+    errors = sum(1 for _, failed in outcomes if failed)
+    return latencies, metrics.TOKENS.value('completion') - tokens_before, errors
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=32, help='Requests per subset')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--latency', default='lognormal:0.4,0.2', help='Fake time to first token')
+    parser.add_argument('--seconds-per-token', type=float, default=0.01, help='Fake decoding time per token')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'ANALYSIS_BACKEND': 'fake',
+        'FAKE_LATENCY': args.latency,
+        'FAKE_SECONDS_PER_TOKEN': str(args.seconds_per_token),
+        'CACHE_ENABLED': 'False',
+        'SINGLEFLIGHT_ENABLED': 'False',
+        'PHASH_ENABLED': 'False',
+        'ASYNC_ENABLED': 'False',
+        'WARMUP_ON_STARTUP': 'False',
+    })
+    from config import Config
+    from pipeline import AnalysisPipeline
+    import prompts
+
+    # Distinct images, so neither the cache nor the fake's per-body draws repeat
+    uploads = [make_image((640 + i, 480), 'JPEG', 'RGB') for i in range(args.requests)]
+    pipe = AnalysisPipeline()
+
+    print_separator('=')
+    print(f"{args.requests} requests per subset from {args.concurrency} clients; fake time to first token "
+          f"{args.latency}, {args.seconds_per_token * 1000:.0f}ms per completion token")
+    print_separator('=')
+    print(f"{'fields':<36} {'p50':>8} {'p95':>8} {'tokens':>7} {'max_tokens':>11} {'latency':>8} {'tokens':>7}")
+    print_separator()
+    baseline = None
+    for fields in SUBSETS:
+        latencies, tokens, errors = run(pipe, uploads, fields, args.concurrency)
+        p50 = percentile(latencies, 50)
+        per_request = tokens / args.requests
+        if baseline is None:
+            baseline = (p50, per_request)
+        print(f"{','.join(fields):<36} {p50 * 1000:6.0f}ms {percentile(latencies, 95) * 1000:6.0f}ms "
+              f"{per_request:7.0f} {prompts.get_max_tokens(fields):11d} "
+              f"{1 - p50 / baseline[0]:8.0%} {1 - per_request / baseline[1]:7.0%}"
+              + (f"  errors {errors}" if errors else ''))
+    print_separator()
+    print("Savings are relative to all five fields")
+
+    print_separator('=')
+    print("Per-field cache: caption,objects first, then all five fields")
+    print_separator()
+    Config.CACHE_ENABLED = True
+    Config.CACHE_DB_PATH = None
+    cached_pipe = AnalysisPipeline()
+    first = ['caption', 'objects']
+    for label, fields in (('caption,objects (cold)', first), ('all five (3 generated)', None)):
+        latencies, tokens, errors = run(cached_pipe, uploads, fields, args.concurrency)
+        print(f"{label:<36} {percentile(latencies, 50) * 1000:6.0f}ms {percentile(latencies, 95) * 1000:6.0f}ms "
+              f"{tokens / args.requests:7.0f} tokens/request" + (f"  errors {errors}" if errors else ''))
+    latencies, tokens, _ = run(cached_pipe, uploads, None, args.concurrency)
+    print(f"{'all five (cached)':<36} {percentile(latencies, 50) * 1000:6.0f}ms "
+          f"{percentile(latencies, 95) * 1000:6.0f}ms {tokens / args.requests:7.0f} tokens/request")
+    print_separator('=')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""
+Offline benchmark harness: the pipeline and the Flask app against the fake backend.
+Usage: python bench_harness.py [--requests N] [--concurrency C] [--latency SPEC]
+                               [--error-rate R] [--output FILE] [--baseline FILE]
+                               [--replay RECORDING [--latency-scale S]]
+
+No API key or network is needed: ANALYSIS_BACKEND=fake answers in-process
+(see fake_backend.py), so with the default zero latency every millisecond
+measured is our own. Requests cycle through a synthetic corpus covering
+sizes, formats, RGBA and huge dimensions. Each scenario runs in a fresh
+interpreter so its CPU time and peak RSS are its own.
+
+With --replay, answers come from a recording of the real API instead
+(ANALYSIS_BACKEND=replay, see record_replay.py), at the recorded latency
+times --latency-scale. Corpus images that were not recorded borrow a
+recorded answer to the same request, so any recording made with the
+current prompts and models will do.
+
+Results are written as JSON. With --baseline, metrics that got worse than
+the baseline by more than --tolerance are listed and the exit status is 1.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench_async import percentile
+from bench_ingest import peak_rss_kb
+
+# (name, size, format, mode)
+CORPUS = [
+    ('small-jpeg', (640, 480), 'JPEG', 'RGB'),
+    ('photo-jpeg', (3024, 4032), 'JPEG', 'RGB'),
+    ('screenshot-png', (1920, 1080), 'PNG', 'RGB'),
+    ('rgba-png', (1024, 1024), 'PNG', 'RGBA'),
+    ('photo-webp', (1600, 1200), 'WEBP', 'RGB'),
+    ('palette-gif', (800, 600), 'GIF', 'P'),
+    ('huge-jpeg', (9000, 6000), 'JPEG', 'RGB'),
+    ('panorama-jpeg', (12000, 1500), 'JPEG', 'RGB'),
+]
+SCENARIOS = ['pipeline', 'pipeline_async', 'app']
+
+# Metric -> True if higher is better
+COMPARED = {
+    'throughput_rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'cpu_ms_per_request': False,
+    'peak_rss_mb': False,
+}
+
+
+def print_separator(char='-', length=100):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_image(size, fmt, mode):
+    """Encode a photo-like test image (smooth gradients plus noise); same bytes every run."""
+    import numpy as np
+    from PIL import Image
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    pixels += rng.normal(0, 6, pixels.shape).astype(np.float32)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    if mode == 'RGBA':
+        alpha = Image.fromarray(np.clip(x + 0 * y, 0, 255).astype(np.uint8))
+        img.putalpha(alpha)
+    elif mode == 'P':
+        img = img.convert('P', palette=Image.ADAPTIVE)
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **({'quality': 85} if fmt in ('JPEG', 'WEBP') else {}))
+    return buffer.getvalue()
+
+
+def cpu_seconds():
+    """User + system CPU time of this process, all threads included."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_pipeline(uploads, num_requests, concurrency):
+    """Sync pipeline from a thread pool. Returns [(corpus name, seconds, ok)]."""
+    from pipeline import AnalysisPipeline
+    pipeline = AnalysisPipeline()
+
+    def one(i):
+        name, data = uploads[i % len(uploads)]
+        start = time.perf_counter()
+        results = pipeline.process_image(data)
+        return name, time.perf_counter() - start, 'error' not in results
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(num_requests)))
+
+
+def run_pipeline_async(uploads, num_requests, concurrency):
+    """Async pipeline, `concurrency` requests in flight. Returns [(corpus name, seconds, ok)]."""
+    from pipeline import AnalysisPipeline
+    pipeline = AnalysisPipeline()
+
+    async def all_requests():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            name, data = uploads[i % len(uploads)]
+            async with semaphore:
+                start = time.perf_counter()
+                results = await pipeline.process_image_async(data)
+                return name, time.perf_counter() - start, 'error' not in results
+
+        return await asyncio.gather(*(one(i) for i in range(num_requests)))
+
+    return asyncio.run(all_requests())
+
+
+def run_app(uploads, num_requests, concurrency):
+    """POST /api/analyze through the Flask test client. Returns [(corpus name, seconds, ok)]."""
+    import app as app_module
+
+    def one(i):
+        name, data = uploads[i % len(uploads)]
+        client = app_module.app.test_client()
+        start = time.perf_counter()
+        response = client.post('/api/analyze', data={'image': (io.BytesIO(data), name)})
+        return name, time.perf_counter() - start, response.status_code == 200
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(num_requests)))
+
+
+def run_scenario(scenario, corpus_dir, num_requests, concurrency):
+    """Child process body: run one scenario and print its metrics as JSON."""
+    uploads = []
+    for name, *_ in CORPUS:
+        with open(os.path.join(corpus_dir, name), 'rb') as f:
+            uploads.append((name, f.read()))
+    runner = {'pipeline': run_pipeline, 'pipeline_async': run_pipeline_async, 'app': run_app}[scenario]
+
+    # One untimed pass over the corpus: imports, client setup, first-use costs
+    with contextlib.redirect_stdout(io.StringIO()):
+        runner(uploads, len(uploads), 1)
+        rss_before = peak_rss_kb()
+        cpu_start = cpu_seconds()
+        wall_start = time.perf_counter()
+        outcomes = runner(uploads, num_requests, concurrency)
+        wall = time.perf_counter() - wall_start
+        cpu = cpu_seconds() - cpu_start
+
+    if os.environ['ANALYSIS_BACKEND'] == 'replay':
+        from record_replay import get_archive
+        upstream = get_archive().stats()['replayed']
+    else:
+        from fake_backend import get_fake_backend
+        upstream = get_fake_backend().stats()['requests']
+    latencies = [seconds for _, seconds, _ in outcomes]
+    by_image = {}
+    for name, seconds, _ in outcomes:
+        by_image.setdefault(name, []).append(seconds)
+    print(json.dumps({
+        'requests': len(outcomes),
+        'errors': sum(1 for _, _, ok in outcomes if not ok),
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(outcomes) / wall, 2),
+        'upstream_calls_per_request': round(upstream / (len(outcomes) + len(uploads)), 3),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'cpu_ms_per_request': round(cpu / len(outcomes) * 1000, 2),
+        'peak_rss_mb': round(peak_rss_kb() / 1024, 1),
+        'peak_rss_growth_mb': round((peak_rss_kb() - rss_before) / 1024, 1),
+        'p50_ms_by_image': {name: round(percentile(values, 50) * 1000, 2) for name, values in by_image.items()}
+    }))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Metrics that regressed against a baseline run.
+
+    Args:
+        results: This run's 'scenarios' dict
+        baseline: The baseline run's 'scenarios' dict
+        tolerance: Allowed relative change in the bad direction
+
+    Returns:
+        list: (scenario, metric, baseline value, current value, relative change)
+    """
+    regressions = []
+    for scenario, current in results.items():
+        previous = baseline.get(scenario)
+        if previous is None:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            before, after = previous.get(metric), current.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append((scenario, metric, before, after, change))
+    return regressions
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', default='0', help="Fake upstream latency spec, e.g. 'lognormal:1.5,0.4'")
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of fake upstream calls that fail')
+    parser.add_argument('--response-chars', type=int, default=1500, help='Size of the fake analysis JSON')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--replay', help='Replay this recording (RECORDING_PATH) instead of the fake backend')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Factor on recorded latency with --replay')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--output', default='bench_results.json', help='Where to write this run')
+    parser.add_argument('--baseline', help='Earlier --output file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='Allowed relative regression')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)  # Child mode
+    parser.add_argument('--corpus-dir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    os.environ.update({
+        'ANALYSIS_BACKEND': 'fake',
+        'FAKE_LATENCY': args.latency,
+        'FAKE_ERROR_RATE': str(args.error_rate),
+        'FAKE_RESPONSE_CHARS': str(args.response_chars),
+        'FAKE_SEED': str(args.seed),
+        # Every request must do the full work
+        'CACHE_ENABLED': 'False',
+        'SINGLEFLIGHT_ENABLED': 'False',
+        'WARMUP_ON_STARTUP': 'False',
+        'JOBS_WORKERS': '0',
+    })
+    if args.replay:
+        if not os.path.exists(args.replay):
+            parser.error(f"no recording at {args.replay}; record one with ANALYSIS_BACKEND=record")
+        os.environ.update({
+            'ANALYSIS_BACKEND': 'replay',
+            'RECORDING_PATH': os.path.abspath(args.replay),
+            'REPLAY_LATENCY_SCALE': str(args.latency_scale),
+            'REPLAY_FALLBACK': 'True',
+        })
+    if args.scenario:
+        run_scenario(args.scenario, args.corpus_dir, args.requests, args.concurrency)
+        return
+
+    import tempfile
+    from config import Config
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    print_separator('=')
+    if args.replay:
+        print(f"{args.requests} requests per scenario, concurrency {args.concurrency}, replaying {args.replay} "
+              f"at {args.latency_scale:g}x recorded latency")
+    else:
+        print(f"{args.requests} requests per scenario, concurrency {args.concurrency}, fake latency "
+              f"'{args.latency}', error rate {args.error_rate:.0%}")
+    print_separator('=')
+    corpus = {}
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        for name, size, fmt, mode in CORPUS:
+            data = make_image(size, fmt, mode)
+            if len(data) > Config.MAX_IMAGE_SIZE_BYTES:
+                raise SystemExit(f"Corpus image {name} is {len(data) / 1024 / 1024:.1f} MB, over MAX_IMAGE_SIZE")
+            corpus[name] = {'size': list(size), 'format': fmt, 'mode': mode, 'kb': round(len(data) / 1024)}
+            with open(os.path.join(corpus_dir, name), 'wb') as f:
+                f.write(data)
+        print('corpus: ' + ', '.join(f"{name} {info['size'][0]}x{info['size'][1]} {info['kb']}KB"
+                                     for name, info in corpus.items()))
+        print_separator()
+        print(f"{'scenario':<16}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'CPU ms/req':>12}{'peak RSS MB':>13}{'errors':>8}")
+        print_separator()
+
+        results = {}
+        for scenario in scenarios:
+            output = subprocess.run(
+                [sys.executable, __file__, '--scenario', scenario, '--corpus-dir', corpus_dir,
+                 '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                 '--latency', args.latency, '--error-rate', str(args.error_rate),
+                 '--response-chars', str(args.response_chars), '--seed', str(args.seed)]
+                + (['--replay', args.replay, '--latency-scale', str(args.latency_scale)] if args.replay else []),
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = results[scenario] = json.loads(output.strip().splitlines()[-1])
+            print(f"{scenario:<16}{result['throughput_rps']:>9.1f}{result['p50_ms']:>10.1f}"
+                  f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['cpu_ms_per_request']:>12.1f}"
+                  f"{result['peak_rss_mb']:>13.0f}{result['errors']:>8}")
+
+    run = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'settings': {
+            'requests': args.requests, 'concurrency': args.concurrency, 'latency': args.latency,
+            'error_rate': args.error_rate, 'response_chars': args.response_chars, 'seed': args.seed,
+            **({'replay': args.replay, 'latency_scale': args.latency_scale} if args.replay else {})
+        },
+        'corpus': corpus,
+        'scenarios': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print_separator('=')
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != run['settings']:
+            print("Warning: baseline was run with different settings")
+        regressions = compare(results, baseline.get('scenarios', {}), args.tolerance)
+        if not regressions:
+            print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+            return
+        print(f"Regressions beyond {args.tolerance:.0%} against {args.baseline}:")
+        for scenario, metric, before, after, change in regressions:
+            print(f"  {scenario:<16}{metric:<22}{before:>10} -> {after:<10} ({change:+.1%})")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
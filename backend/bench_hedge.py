@@ -0,0 +1,137 @@
+"""
+Benchmark hedged requests and failover across two local fake providers.
+Usage: python bench_hedge.py [num_requests] [concurrency] [slow_fraction]
+
+Both stubs answer most requests in ~0.2s and a slow_fraction of them in
+1.5-2.5s, so p99 is several times p50. Requests go through ProviderRouter on
+the async path from `concurrency` clients issuing requests back to back.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from bench_async import percentile
+from fake_openai import FakeOpenAIServer
+
+# (label, hedging, hedge target, primary stub fails every request)
+SCENARIOS = [
+    ('single provider', False, 'same', False),
+    ('hedge same provider', True, 'same', False),
+    ('hedge other provider', True, 'other', False),
+    ('primary down, failover', False, 'other', True),
+]
+
+
+def print_separator(char='-', length=96):
+    """Print a separator line."""
+    print(char * length)
+
+
+def heavy_tail(slow_fraction):
+    """Latency sampler: mostly fast, occasionally very slow."""
+    def latency():
+        if random.random() < slow_fraction:
+            return random.uniform(1.5, 2.5)
+        return random.uniform(0.15, 0.25)
+    return latency
+
+
+def make_image():
+    """One prepared upload; every request sends the same payload."""
+    from PIL import Image
+    from image_processor import ImageProcessor
+    buffer = io.BytesIO()
+    Image.new('RGB', (512, 384), (40, 160, 90)).save(buffer, 'PNG')
+    return ImageProcessor().ingest(buffer.getvalue())
+
+
+def run_scenario(servers, image, num_requests, concurrency, hedging, target):
+    """
+    Analyze num_requests times through a fresh router over the two stubs.
+
+    Returns:
+        tuple: (latencies of successes, errors, router)
+    """
+    from config import Config
+    from openai_client import AsyncOpenAIClient
+    from prompts import get_analysis_prompt
+    from router import Provider, ProviderRouter
+
+    prompt = get_analysis_prompt()
+    latencies = []
+    errors = 0
+
+    async def all_requests():
+        nonlocal errors
+        clients = []
+        for server in servers:
+            Config.OPENAI_BASE_URL = server.base_url
+            clients.append(AsyncOpenAIClient())
+        router = ProviderRouter(
+            [Provider(name, None, client) for name, client in zip(('a', 'b'), clients)],
+            hedge_enabled=hedging, hedge_target=target
+        )
+        remaining = [num_requests]
+
+        async def client():
+            nonlocal errors
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = time.perf_counter()
+                try:
+                    await router.analyze_async(image, prompt)
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        for c in clients:
+            await c.http_client.aclose()
+        return router
+
+    router = asyncio.run(all_requests())
+    return latencies, errors, router
+
+
+def main():
+    """Main entry point."""
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 600
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    slow_fraction = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    os.environ.update({'OPENAI_API_KEY': 'fake-key', 'CACHE_ENABLED': 'False'})
+    import rate_limit
+    from config import Config
+
+    print_separator('=')
+    print(f"{num_requests} requests from {concurrency} clients; {slow_fraction:.0%} of upstream "
+          f"calls take 1.5-2.5s, the rest 0.15-0.25s; hedge at p{Config.HEDGE_PERCENTILE:g}")
+    print_separator('=')
+    print(f"{'scenario':<24} {'p50':>6} {'p95':>6} {'p99':>6} {'max':>6} {'errors':>7} "
+          f"{'upstream':>9} {'hedges':>7} {'won':>5} {'failovers':>10}")
+    print_separator()
+    image = make_image()
+    for label, hedging, target, primary_down in SCENARIOS:
+        servers = [
+            FakeOpenAIServer(latency=heavy_tail(slow_fraction), error_rate=1.0 if primary_down else 0.0).start(),
+            FakeOpenAIServer(latency=heavy_tail(slow_fraction)).start(),
+        ]
+        rate_limit._flow_controls.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies, errors, router = run_scenario(
+                servers, image, num_requests, concurrency, hedging, target
+            )
+        upstream = sum(server.request_count for server in servers)
+        for server in servers:
+            server.stop()
+        print(f"{label:<24} " + ' '.join(f"{percentile(latencies, pct):5.2f}s" for pct in (50, 95, 99, 100))
+              + f" {errors / num_requests:7.1%} {upstream / num_requests:8.2f}x {router.hedges:7} "
+              f"{router.hedge_wins:5} {router.failovers:10}")
+    print_separator('=')
+
+
+if __name__ == '__main__':
+    main()
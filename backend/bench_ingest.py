@@ -0,0 +1,148 @@
+"""
+Benchmark CPU time and peak RSS of image ingest: legacy decode chain vs single-pass ingest.
+Usage: python bench_ingest.py [iterations]
+
+Each case runs in a fresh interpreter so peak RSS reflects a single request.
+"""
+import base64
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES = [(640, 480), (1600, 1200), (3024, 4032), (4000, 6000)]
+FORMATS = ['JPEG', 'PNG']
+PATHS = ['legacy-multipart', 'ingest-multipart', 'legacy-base64', 'ingest-base64']
+
+
+def print_separator(char='-', length=70):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_upload(size, fmt):
+    """Encode a photo-like test image (smooth gradients plus noise)."""
+    import numpy as np
+    from PIL import Image
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=2)
+    pixels += rng.normal(0, 12, pixels.shape).astype(np.float32)
+    img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, quality=90) if fmt == 'JPEG' else img.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process in KB.
+
+    Prefers VmHWM: on Linux ru_maxrss survives exec, so a child would report
+    the parent's peak.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def legacy_request(data, as_base64):
+    """The pre-ingest chain: validate, preprocess, encode at q95 (plus base64 round trip)."""
+    from image_processor import ImageProcessor
+    from openai_client import OpenAIClient
+    if as_base64:
+        img = ImageProcessor.base64_to_image(base64.b64encode(data).decode('ascii'))
+        buffer = io.BytesIO()
+        img.convert('RGB').save(buffer, format='JPEG')
+        data = buffer.getvalue()
+    upload = io.BytesIO(data)
+    is_valid, error = ImageProcessor.validate_image(upload)
+    assert is_valid, error
+    image = ImageProcessor.preprocess_image(upload)
+    return OpenAIClient._image_to_base64(image)
+
+
+def ingest_request(data, as_base64):
+    """Single-pass ingest: one decode at most, payload reused for the API call."""
+    from image_processor import ImageProcessor
+    from openai_client import OpenAIClient
+    if as_base64:
+        data = ImageProcessor.decode_base64(base64.b64encode(data).decode('ascii'))
+    prepared = ImageProcessor.ingest(data)
+    prepared.thumbnail  # The pipeline hashes this for near-duplicate lookup
+    return OpenAIClient._image_to_base64(prepared)
+
+
+def run_case(path, upload_path, iterations):
+    """Child process body: measure one path on one upload."""
+    with open(upload_path, 'rb') as f:
+        data = f.read()
+    handler = legacy_request if path.startswith('legacy') else ingest_request
+    as_base64 = path.endswith('base64')
+    import image_processor, openai_client  # noqa: F401  (exclude import cost)
+
+    rss_before = peak_rss_kb()
+    cpu_start = time.process_time()
+    handler(data, as_base64)
+    first_cpu = time.process_time() - cpu_start
+    rss_peak = peak_rss_kb()
+
+    cpu_start = time.process_time()
+    for _ in range(iterations - 1):
+        handler(data, as_base64)
+    cpu = (first_cpu + time.process_time() - cpu_start) / iterations
+    print(json.dumps({'cpu_ms': cpu * 1000, 'rss_mb': max(0, rss_peak - rss_before) / 1024,
+                      'upload_kb': len(data) / 1024}))
+
+
+def main():
+    """Main entry point."""
+    if len(sys.argv) > 1 and sys.argv[1] == '--case':
+        path, upload_path, iterations = sys.argv[2:5]
+        run_case(path, upload_path, int(iterations))
+        return
+
+    from config import Config
+
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print_separator('=')
+    print(f"Ingest benchmark (CPU ms per request, averaged over {iterations}; "
+          f"RSS growth of the first request)")
+    print_separator('=')
+    print(f"{'image':<18}{'path':<20}{'upload KB':>10}{'CPU ms':>10}{'peak RSS MB':>13}")
+    print_separator()
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in SIZES:
+            for fmt in FORMATS:
+                label = f"{width}x{height} {fmt}"
+                data = make_upload((width, height), fmt)
+                if len(data) > Config.MAX_IMAGE_SIZE_BYTES:
+                    print(f"{label:<18}{'skipped':<20}{len(data) / 1024:>10.0f}  over MAX_IMAGE_SIZE")
+                    continue
+                upload_path = os.path.join(tmp, 'upload')
+                with open(upload_path, 'wb') as f:
+                    f.write(data)
+                for path in PATHS:
+                    output = subprocess.run(
+                        [sys.executable, __file__, '--case', path, upload_path, str(iterations)],
+                        capture_output=True, text=True, check=True
+                    ).stdout
+                    row = json.loads(output.strip().splitlines()[-1])
+                    print(f"{label:<18}{path:<20}{row['upload_kb']:>10.0f}{row['cpu_ms']:>10.1f}"
+                          f"{row['rss_mb']:>13.1f}")
+            print_separator()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark keyframe extraction from animations: time, peak memory and upstream cost.
+Usage: python bench_keyframes.py [--count K] [--cases 50x480x270,200x480x270,...] [--formats GIF,WEBP]
+
+Each case runs in a fresh interpreter so peak RSS reflects one animation:
+
+- lazy: keyframes.keyframe_sheet(), which decodes one frame at a time, once
+  for the signatures and again for the K frames tiled into the sheet
+- eager: every frame decoded into memory first (ImageSequence), then the
+  same selection; the sheet itself is not built
+
+The synthetic animations cut between four scenes, so a good selection shows
+every scene. The last columns compare one call for the sheet with one call
+per frame.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from bench_ingest import peak_rss_kb
+
+CASES = [(50, (480, 270)), (200, (480, 270)), (1000, (480, 270)), (200, (1280, 720))]
+FORMATS = ['GIF', 'WEBP']
+METHODS = ['lazy', 'eager']
+SCENES = 4
+COLORS = [(200, 40, 40), (40, 160, 60), (40, 60, 200), (220, 200, 40)]
+
+
+def print_separator(char='-', length=120):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_animation(frames, size, fmt):
+    """Encode an animation of SCENES scenes, each a flat colour with a moving ball."""
+    from PIL import Image, ImageDraw
+    width, height = size
+    images = []
+    for index in range(frames):
+        img = Image.new('RGB', size, COLORS[index * SCENES // frames])
+        x = (index * 7) % width
+        ImageDraw.Draw(img).ellipse((x, height // 3, x + height // 4, height // 3 + height // 4), fill='white')
+        images.append(img)
+    buffer = io.BytesIO()
+    images[0].save(buffer, format=fmt, save_all=True, append_images=images[1:], duration=40, loop=0)
+    return buffer.getvalue()
+
+
+def extract_eager(img, count):
+    """Decode every frame up front, then select. Returns frame indices."""
+    import numpy as np
+    from PIL import Image, ImageSequence
+    import keyframes
+    frames = [frame.convert('RGB') for frame in ImageSequence.Iterator(img)]
+    size = keyframes.SIGNATURE_SIZE
+    signatures = np.stack([
+        np.asarray(frame.convert('L').resize((size, size), Image.Resampling.BOX), dtype=np.float32).ravel()
+        for frame in frames
+    ])
+    return keyframes.select_keyframes(signatures, count)
+
+
+def run_case(path, method, count):
+    """Child process body: extract keyframes from one file and print metrics as JSON."""
+    from PIL import Image
+    from image_processor import PreparedImage
+    import keyframes
+    with open(path, 'rb') as f:
+        data = f.read()
+    rss_before = peak_rss_kb()
+
+    start = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    frames = img.n_frames
+    if method == 'lazy':
+        sheet, indices = keyframes.keyframe_sheet(img, count)
+        sheet_size = sheet.size
+    else:
+        indices = extract_eager(img, count)
+        sheet_size = None
+    elapsed = time.perf_counter() - start
+
+    frame_tokens = PreparedImage(b'', img.size, detail='high').estimated_tokens()
+    sheet_tokens = PreparedImage(b'', sheet_size, detail='high').estimated_tokens() if sheet_size else None
+    print(json.dumps({
+        'frames': frames,
+        'ms': round(elapsed * 1000, 1),
+        'peak_rss_growth_mb': round((peak_rss_kb() - rss_before) / 1024, 1),
+        'keyframes': indices,
+        'scenes': sorted({index * SCENES // frames for index in indices}),
+        'sheet_tokens': sheet_tokens,
+        'per_frame_tokens': frame_tokens * frames,
+    }))
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=4, help='Keyframes per animation')
+    parser.add_argument('--cases', default=','.join(f'{n}x{w}x{h}' for n, (w, h) in CASES),
+                        help='Comma-separated FRAMESxWIDTHxHEIGHT')
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--case', nargs=2, help=argparse.SUPPRESS)  # Child mode: PATH METHOD
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case[0], args.case[1], args.count)
+        return
+
+    cases = []
+    for spec in args.cases.split(','):
+        frames, width, height = (int(value) for value in spec.split('x'))
+        cases.append((frames, (width, height)))
+
+    print_separator('=')
+    print(f"{args.count} keyframes per animation, {SCENES} scenes each; fresh interpreter per cell")
+    print_separator('=')
+    print(f"{'animation':<22}{'file':>9}  {'method':<7}{'time':>9}{'peak RSS':>11}  {'keyframes':<22}"
+          f"{'scenes':>7}{'tokens: sheet':>15}{'per frame':>12}")
+    print_separator()
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in args.formats.split(','):
+            for frames, size in cases:
+                path = os.path.join(tmp, f'{frames}x{size[0]}x{size[1]}.{fmt.lower()}')
+                data = make_animation(frames, size, fmt)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                for method in METHODS:
+                    output = subprocess.run(
+                        [sys.executable, __file__, '--count', str(args.count), '--case', path, method],
+                        capture_output=True, text=True, check=True
+                    ).stdout
+                    result = json.loads(output.strip().splitlines()[-1])
+                    label = f"{fmt} {frames}f {size[0]}x{size[1]}" if method == METHODS[0] else ''
+                    file_kb = f"{len(data) / 1024:7.0f}KB" if method == METHODS[0] else ''
+                    sheet = f"{result['sheet_tokens']:15,}" if result['sheet_tokens'] else f"{'-':>15}"
+                    print(f"{label:<22}{file_kb:>9}  {method:<7}{result['ms']:7.0f}ms{result['peak_rss_growth_mb']:8.1f}MB  "
+                          f"{str(result['keyframes']):<22}{len(result['scenes']):>5}/{SCENES}{sheet}"
+                          f"{result['per_frame_tokens']:12,}")
+            print_separator()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+Microbenchmark the cost of instrumentation on the request path.
+Usage: python bench_metrics.py [pairs_per_round] [rounds]
+
+Measures each primitive (span, counter, histogram, request hooks) in
+isolation, then times POST /api/analyze through the Flask test client with
+METRICS_ENABLED alternating off/on request by request, on two paths:
+
+- cache hit: no upstream call, the shortest request and the worst case for
+  relative overhead
+- full analysis: cache off, against a local stub that answers instantly, so
+  everything but real upstream latency is on the clock
+
+An A/A run (metrics on in both arms) gives the timing noise floor.
+"""
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+import timeit
+
+OVERHEAD_BUDGET = 0.01
+
+
+def print_separator(char='-', length=78):
+    """Print a separator line."""
+    print(char * length)
+
+
+def per_call(stmt, setup_globals, number=200000):
+    """Best-of-5 nanoseconds per call of stmt."""
+    timer = timeit.Timer(stmt, globals=setup_globals)
+    return min(timer.repeat(repeat=5, number=number)) / number * 1e9
+
+
+def time_pairs(client, upload, pairs, settings=(False, True)):
+    """
+    Median seconds per request for each of two METRICS_ENABLED settings.
+
+    Requests alternate between the settings one by one, so drift in the
+    machine's speed (GC, frequency scaling, other load) hits both equally.
+
+    Returns:
+        tuple: (median of the first setting, median of the second)
+    """
+    from config import Config
+    durations = ([], [])
+    for i in range(2 * pairs):
+        arm = i % 2
+        Config.METRICS_ENABLED = settings[arm]
+        start = time.perf_counter()
+        response = client.post('/api/analyze', data={'image': (io.BytesIO(upload), 'bench.png')})
+        durations[arm].append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return statistics.median(durations[0]), statistics.median(durations[1])
+
+
+def compare(client, upload, pairs, rounds):
+    """
+    Relative overhead of metrics (off vs on) and of nothing (on vs on), per round.
+
+    Returns:
+        tuple: (overheads, noise, median seconds per request with metrics off)
+    """
+    overheads, noise, baselines = [], [], []
+    for _ in range(rounds):
+        off, on = time_pairs(client, upload, pairs)
+        overheads.append((on - off) / off)
+        baselines.append(off)
+        first, second = time_pairs(client, upload, pairs, settings=(True, True))
+        noise.append((second - first) / first)
+    return overheads, noise, statistics.median(baselines)
+
+
+def main():
+    """Main entry point."""
+    pairs = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    from fake_openai import FakeOpenAIServer
+    server = FakeOpenAIServer(latency=0.0).start()
+    os.environ.update({
+        'OPENAI_API_KEY': 'fake-key',
+        'OPENAI_BASE_URL': server.base_url,
+        'CACHE_ENABLED': 'True',
+        'WARMUP_ON_STARTUP': 'False'
+    })
+    from PIL import Image
+    from flask import jsonify
+    from config import Config
+    import metrics
+    import app as app_module
+
+    print_separator('=')
+    print("Instrumentation primitives (enabled)")
+    print_separator()
+    scope = {'metrics': metrics, 'app': app_module}
+    primitives = [
+        ('span', "with metrics.span('bench'): pass"),
+        ('counter inc', "metrics.BYTES.inc(100, 'upload')"),
+        ('histogram observe', "metrics.STAGE_SECONDS.observe(0.01, 'bench')"),
+    ]
+    for name, stmt in primitives:
+        print(f"{name:<22} {per_call(stmt, scope):7.0f} ns")
+    with app_module.app.test_request_context('/api/analyze', method='POST'):
+        scope['response'] = jsonify({})
+        hooks = per_call('app.start_request_timing(); app.record_request_metrics(response)', scope, number=20000)
+    print(f"{'request hooks':<22} {hooks:7.0f} ns")
+    Config.METRICS_ENABLED = False
+    print(f"{'span (disabled)':<22} {per_call(primitives[0][1], scope):7.0f} ns")
+    Config.METRICS_ENABLED = True
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (256, 256), (30, 120, 210)).save(buffer, 'PNG')
+    upload = buffer.getvalue()
+    client = app_module.app.test_client()
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.post('/api/analyze', data={'image': (io.BytesIO(upload), 'bench.png')})  # Fill the cache
+
+    print_separator()
+    print(f"POST /api/analyze, {rounds} rounds of {pairs} off/on pairs (median, range over rounds)")
+    print_separator()
+    print(f"{'path':<16} {'request':>10} {'overhead':>26} {'noise floor (A/A)':>22}")
+    passed = True
+    pipeline = app_module.get_pipeline()
+    for label, cache in (('cache hit', pipeline.cache), ('full analysis', None)):
+        pipeline.cache = cache
+        with contextlib.redirect_stdout(io.StringIO()):
+            overheads, noise, baseline = compare(client, upload, pairs, rounds)
+        overhead = statistics.median(overheads)
+        print(f"{label:<16} {baseline * 1e6:8.0f}us {overhead:+9.2%} ({min(overheads):+.2%}..{max(overheads):+.2%}) "
+              f"{statistics.median(noise):+9.2%} ({min(noise):+.2%}..{max(noise):+.2%})")
+        if label == 'full analysis':
+            passed = overhead < OVERHEAD_BUDGET
+    print_separator('=')
+    print(f"{'PASS' if passed else 'FAIL'}: overhead on a full analysis under {OVERHEAD_BUDGET:.0%}")
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
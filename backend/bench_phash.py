@@ -0,0 +1,126 @@
+"""
+Benchmark for the perceptual-hash near-duplicate index.
+Usage: python bench_phash.py [num_entries] [num_queries]
+"""
+import io
+import sys
+import time
+import numpy as np
+from PIL import Image, ImageDraw
+from phash import HammingIndex, dhash, hamming_distance
+from config import Config
+
+
+def print_separator(char='-', length=70):
+    """Print a separator line."""
+    print(char * length)
+
+
+def synthetic_photo(size=(1600, 1200), seed=0):
+    """Build a structured test image (gradients and shapes, not noise)."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    x = np.linspace(0, 1, width)[None, :]
+    y = np.linspace(0, 1, height)[:, None]
+    pixels = np.stack([
+        255 * x * np.ones_like(y),
+        255 * y * np.ones_like(x),
+        255 * (1 - x) * y
+    ], axis=2).astype(np.uint8)
+    img = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x0, y0 = rng.integers(0, width - 200), rng.integers(0, height - 200)
+        color = tuple(int(c) for c in rng.integers(0, 255, 3))
+        draw.ellipse([x0, y0, x0 + rng.integers(50, 400), y0 + rng.integers(50, 400)], fill=color)
+    return img
+
+
+def recompress(img, scale, quality):
+    """Simulate a phone re-upload: resize and JPEG-recompress."""
+    size = (int(img.width * scale), int(img.height * scale))
+    buffer = io.BytesIO()
+    img.resize(size, Image.Resampling.BILINEAR).save(buffer, format='JPEG', quality=quality)
+    buffer.seek(0)
+    return Image.open(buffer).convert('RGB')
+
+
+def bench_robustness():
+    """Report hash distances between originals and re-encoded copies."""
+    print("\nHash robustness (distance to original, max allowed "
+          f"{Config.PHASH_MAX_DISTANCE}):")
+    variants = [(1.0, 95), (0.5, 85), (0.35, 70), (0.25, 60)]
+    for seed in range(3):
+        original = synthetic_photo(seed=seed)
+        base = dhash(original)
+        distances = [hamming_distance(base, dhash(recompress(original, s, q))) for s, q in variants]
+        print(f"  image {seed}: " + ", ".join(
+            f"{s:.2f}x q{q} -> {d}" for (s, q), d in zip(variants, distances)))
+
+    unrelated = [dhash(synthetic_photo(seed=seed)) for seed in range(10, 20)]
+    pairs = [hamming_distance(a, b) for i, a in enumerate(unrelated) for b in unrelated[i + 1:]]
+    print(f"  unrelated images: min distance {min(pairs)}, mean {np.mean(pairs):.1f}")
+
+    img = synthetic_photo(size=(2048, 1536))
+    start = time.perf_counter()
+    for _ in range(50):
+        dhash(img)
+    print(f"  dhash of 2048x1536 image: {(time.perf_counter() - start) / 50 * 1000:.2f} ms")
+
+
+def bench_index(num_entries, num_queries, max_distance):
+    """Build an index of random hashes and time radius lookups."""
+    rng = np.random.default_rng(42)
+    hashes = rng.integers(0, np.iinfo(np.uint64).max, num_entries, dtype=np.uint64, endpoint=True)
+
+    index = HammingIndex()
+    start = time.perf_counter()
+    index.extend(hashes, range(num_entries))
+    build = time.perf_counter() - start
+    print(f"\nIndex of {num_entries:,} hashes built in {build:.2f}s")
+
+    # Half the queries are perturbed copies of stored hashes, half are random
+    targets = rng.integers(0, num_entries, num_queries)
+    queries = []
+    for i, target in enumerate(targets):
+        if i % 2 == 0:
+            query = int(hashes[target])
+            for bit in rng.choice(64, int(rng.integers(0, max_distance + 1)), replace=False):
+                query ^= 1 << int(bit)
+            queries.append((query, int(target)))
+        else:
+            queries.append((int(rng.integers(0, np.iinfo(np.uint64).max, dtype=np.uint64)), None))
+
+    timings = []
+    found = 0
+    for query, target in queries:
+        start = time.perf_counter()
+        matches = index.search(query, max_distance)
+        timings.append(time.perf_counter() - start)
+        if target is not None and any(value == target for _, value in matches):
+            found += 1
+
+    timings = np.array(timings) * 1000
+    print(f"Lookups within distance {max_distance} ({num_queries:,} queries):")
+    print(f"  p50 {np.percentile(timings, 50):.3f} ms  p99 {np.percentile(timings, 99):.3f} ms  "
+          f"max {timings.max():.3f} ms")
+    print(f"  recall on perturbed queries: {found}/{(num_queries + 1) // 2}")
+    return np.percentile(timings, 50)
+
+
+def main():
+    """Main entry point."""
+    num_entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    print_separator('=')
+    print("Perceptual hash benchmark")
+    print_separator('=')
+    bench_robustness()
+    p50 = bench_index(num_entries, num_queries, Config.PHASH_MAX_DISTANCE)
+    print_separator('=')
+    print("PASS: sub-millisecond median lookup" if p50 < 1.0 else "FAIL: median lookup >= 1 ms")
+
+
+if __name__ == '__main__':
+    main()
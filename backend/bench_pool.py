@@ -0,0 +1,144 @@
+"""
+Benchmark the upstream connection pool and warm-up against a local fake OpenAI server.
+Usage: python bench_pool.py [num_requests] [upstream_latency_seconds] [connect_latency_seconds] [steady_concurrency]
+
+The stub delays every new connection by connect_latency to stand in for the
+TCP + TLS handshake to a remote API, so connection reuse shows up in latency.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from bench_async import make_uploads, percentile
+from fake_openai import FakeOpenAIServer
+
+FIRST_REQUEST_TRIALS = 20
+
+# Pool variants for the load runs: (label, config overrides)
+POOL_VARIANTS = [
+    ('no keep-alive', {'HTTP_MAX_KEEPALIVE': 0}),
+    ('SDK defaults (1000/100)', {'HTTP_MAX_CONNECTIONS': 1000, 'HTTP_MAX_KEEPALIVE': 100}),
+    ('configured', {}),
+]
+
+
+def print_separator(char='-', length=78):
+    """Print a separator line."""
+    print(char * length)
+
+
+def report(name, latencies, connections, wall=None):
+    """Print one result line."""
+    line = (f"{name:<26} p50 {percentile(latencies, 50) * 1000:6.0f} ms  "
+            f"p99 {percentile(latencies, 99) * 1000:6.0f} ms  connections {connections:5}")
+    if wall is not None:
+        line += f"  wall {wall:5.1f}s"
+    print(line)
+
+
+def first_request(runner, upload, warm):
+    """
+    Latency of the first analysis a fresh process serves.
+
+    Cold: the pipeline is built lazily inside the request and connects on
+    demand. Warm: the startup hook already built it and opened connections.
+    """
+    from pipeline import AnalysisPipeline
+
+    if warm:
+        pipe = AnalysisPipeline()
+        runner.run(pipe.async_client.warm_up())
+        start = time.perf_counter()
+    else:
+        start = time.perf_counter()
+        pipe = AnalysisPipeline()
+    runner.run(pipe.process_image_async(io.BytesIO(upload)))
+    return time.perf_counter() - start
+
+
+def run_load(runner, uploads, concurrency):
+    """
+    Analyze every upload with `concurrency` clients issuing requests back to back.
+
+    Returns:
+        tuple: (per-request latencies, wall seconds)
+    """
+    from pipeline import AnalysisPipeline
+
+    pipe = AnalysisPipeline()
+    queue = list(reversed(uploads))
+    latencies = []
+
+    async def client():
+        while queue:
+            data = queue.pop()
+            start = time.perf_counter()
+            await pipe.process_image_async(io.BytesIO(data))
+            latencies.append(time.perf_counter() - start)
+
+    async def all_clients():
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    runner.run(all_clients())
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    """Main entry point."""
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    connect_latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    steady_concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 32
+
+    server = FakeOpenAIServer(latency=latency, connect_latency=connect_latency).start()
+    os.environ.update({
+        'OPENAI_API_KEY': 'fake-key',
+        'OPENAI_BASE_URL': server.base_url,
+        'CACHE_ENABLED': 'False'
+    })
+    from async_runner import AsyncRunner
+    from config import Config
+
+    print_separator('=')
+    print(f"Upstream latency {latency}s, connect latency {connect_latency}s, "
+          f"fake server {server.base_url}")
+    print_separator('=')
+    runner = AsyncRunner()
+    uploads = make_uploads(num_requests)
+
+    print(f"First request of a fresh process ({FIRST_REQUEST_TRIALS} trials)")
+    print_separator()
+    for warm in (False, True):
+        connections_before = server.connection_count
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = [first_request(runner, uploads[0], warm) for _ in range(FIRST_REQUEST_TRIALS)]
+        report('warm-up hook' if warm else 'lazy (cold)', latencies,
+               server.connection_count - connections_before)
+
+    defaults = {name: getattr(Config, name) for name in ('HTTP_MAX_CONNECTIONS', 'HTTP_MAX_KEEPALIVE')}
+    runs = [
+        (f"Steady load: {num_requests} requests from {steady_concurrency} clients", steady_concurrency),
+        (f"Burst: {num_requests} requests at once, up to {Config.ASYNC_MAX_IN_FLIGHT} in flight",
+         num_requests),
+    ]
+    for title, concurrency in runs:
+        print_separator()
+        print(title)
+        print_separator()
+        for label, overrides in POOL_VARIANTS:
+            for name, value in dict(defaults, **overrides).items():
+                setattr(Config, name, value)
+            connections_before = server.connection_count
+            with contextlib.redirect_stdout(io.StringIO()):
+                latencies, wall = run_load(runner, uploads, concurrency)
+            report(label, latencies, server.connection_count - connections_before, wall)
+
+    print_separator('=')
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Compare the single-process dev server with pre-forked gunicorn workers, over HTTP.
+Usage: python bench_prefork.py [--workers N] [--requests N] [--concurrency C] [--latency SPEC]
+
+Both servers run against the fake backend (ANALYSIS_BACKEND=fake), so the
+numbers measure our own CPU (upload parsing, decoding, resizing, JSON) plus
+the simulated upstream latency. Throughput is measured with the result cache
+off; a second run replays uploads with the cache on to show how many
+requests each setup answers from cache once every image has been seen.
+
+Pre-forking pays off with the number of cores: one process is held to one
+core by the GIL during image work, N workers are not. On a single core
+expect no throughput gain, only the shared cache.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from bench_async import percentile
+from bench_harness import CORPUS, make_image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Photo-sized inputs, so per-request CPU is realistic
+SIZES = ['small-jpeg', 'photo-jpeg', 'screenshot-png', 'photo-webp']
+
+
+def print_separator(char='-', length=92):
+    """Print a separator line."""
+    print(char * length)
+
+
+def start_server(kind, port, workers, env):
+    """Start 'dev' (python app.py) or 'gunicorn' and wait until it answers."""
+    env = dict(os.environ, PORT=str(port), WEB_WORKERS=str(workers), **env)
+    if kind == 'dev':
+        command = [sys.executable, 'app.py']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', 'app:app', '--access-logfile', '/dev/null']
+    process = subprocess.Popen(command, cwd=HERE, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f'http://127.0.0.1:{port}/api/health', timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start on port {port}")
+
+
+def stop_server(process):
+    """SIGTERM: both servers finish in-flight requests first."""
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_load(port, uploads, num_requests, concurrency):
+    """
+    POST /api/analyze num_requests times from `concurrency` clients.
+
+    Returns:
+        tuple: (wall seconds, latencies, errors, cache sources)
+    """
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, 'client'):
+            local.client = httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=120)
+        name, data = uploads[i % len(uploads)]
+        start = time.perf_counter()
+        response = local.client.post('/api/analyze', files={'image': (name, data)})
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            return elapsed, False, None
+        return elapsed, True, response.json()['results']['metadata'].get('cache_source')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(num_requests)))
+    wall = time.perf_counter() - start
+    latencies = [elapsed for elapsed, ok, _ in outcomes if ok]
+    errors = sum(1 for _, ok, _ in outcomes if not ok)
+    return wall, latencies, errors, [source for _, ok, source in outcomes if ok]
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', default='lognormal:0.5,0.3', help='Fake upstream latency spec')
+    parser.add_argument('--port', type=int, default=5099)
+    args = parser.parse_args()
+
+    corpus = {name: spec for name, *spec in CORPUS}
+    uploads = [(name, make_image(*corpus[name])) for name in SIZES]
+    base_env = {
+        'ANALYSIS_BACKEND': 'fake', 'FAKE_LATENCY': args.latency, 'FAKE_SEED': '1',
+        'JOBS_WORKERS': '0', 'WARMUP_ON_STARTUP': 'False', 'DEBUG': 'False',
+    }
+    servers = [('dev server (1 process)', 'dev'), (f'gunicorn ({args.workers} workers)', 'gunicorn')]
+
+    print_separator('=')
+    print(f"{os.cpu_count()} CPUs, {args.requests} requests from {args.concurrency} clients, "
+          f"fake upstream latency {args.latency}")
+    print_separator('=')
+    print("Throughput, result cache off")
+    print_separator()
+    for label, kind in servers:
+        process = start_server(kind, args.port, args.workers,
+                               dict(base_env, CACHE_ENABLED='False', SINGLEFLIGHT_ENABLED='False'))
+        try:
+            run_load(args.port, uploads, args.concurrency, args.concurrency)  # Warm-up
+            wall, latencies, errors, _ = run_load(args.port, uploads, args.requests, args.concurrency)
+        finally:
+            stop_server(process)
+        print(f"{label:<26} {len(latencies) / wall:7.1f} req/s  "
+              f"p50 {percentile(latencies, 50) * 1000:6.0f} ms  "
+              f"p95 {percentile(latencies, 95) * 1000:6.0f} ms  errors {errors}")
+
+    print_separator()
+    print("Cache hits once every upload has been analysed once")
+    print_separator()
+    cache_runs = servers + [(f'gunicorn, per-worker cache', 'gunicorn-memory')]
+    for label, kind in cache_runs:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(base_env, CACHE_ENABLED='True', PHASH_ENABLED='False',
+                       CACHE_DB_PATH='' if kind == 'gunicorn-memory' else os.path.join(tmp, 'cache.sqlite3'))
+            if kind == 'dev':
+                env['CACHE_DB_PATH'] = ''  # One process: its memory tier is the whole cache
+            process = start_server('dev' if kind == 'dev' else 'gunicorn', args.port, args.workers, env)
+            try:
+                run_load(args.port, uploads, len(uploads), 1)
+                wall, latencies, errors, sources = run_load(args.port, uploads, args.requests, args.concurrency)
+            finally:
+                stop_server(process)
+        hits = sum(1 for source in sources if source is not None)
+        print(f"{label:<26} {len(latencies) / wall:7.1f} req/s  "
+              f"hit rate {hits / max(1, len(sources)):6.1%}  errors {errors}")
+    print_separator('=')
+
+
+if __name__ == '__main__':
+    main()
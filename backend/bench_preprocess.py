@@ -0,0 +1,114 @@
+"""
+Benchmark preprocessing of 12MP uploads: request threads vs the process pool.
+Usage: python bench_preprocess.py [--requests N] [--workers N] [--concurrency 1,4,16]
+
+Each cell runs N ingests of a 12MP JPEG / RGBA WebP mix (the WebP also needs
+compositing onto white) from `concurrency` threads, the way concurrent
+requests would. It reports images per second, median latency and the CPU
+time the server process itself spends per image, which is what holds the
+GIL and competes with request handling:
+
+- thread: ImageProcessor.ingest() on the request thread (holds the GIL)
+- pool (pickle): the same in the process pool, bytes pickled both ways
+- pool (shared memory): preprocess_pool.submit_ingest()
+
+for each resampling filter. The pool only beats threads with spare cores;
+`--workers` defaults to one per CPU.
+"""
+import argparse
+import os
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bench_async import percentile
+from bench_harness import make_image
+from image_processor import ImageProcessor
+from config import Config
+import preprocess_pool
+
+SIZE = (4000, 3000)  # 12MP
+FILTERS = ['lanczos', 'reduce+bilinear']
+
+
+def print_separator(char='-', length=112):
+    """Print a separator line."""
+    print(char * length)
+
+
+def ingest_thread(data, resample):
+    return ImageProcessor.ingest(data, resample=resample)
+
+
+def ingest_pickled(data, resample):
+    # What batches did before: bytes in, PreparedImage (payload + preview) pickled back
+    return preprocess_pool.get_preprocess_pool().submit(ImageProcessor.ingest, data, None, resample).result()
+
+
+def ingest_shared(data, resample):
+    return preprocess_pool.submit_ingest(data, resample=resample).result()
+
+
+MODES = [
+    ('thread', ingest_thread),
+    ('pool (pickle)', ingest_pickled),
+    ('pool (shared memory)', ingest_shared),
+]
+
+
+def cpu_seconds():
+    """CPU time of this process (pool workers excluded)."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_cell(ingest, uploads, resample, num_requests, concurrency):
+    """Returns (images per second, latencies, CPU seconds of this process per image)."""
+    def one(i):
+        start = time.perf_counter()
+        ingest(uploads[i % len(uploads)], resample)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    cpu_start = cpu_seconds()
+    with ThreadPoolExecutor(max_workers=concurrency) as threads:
+        latencies = list(threads.map(one, range(num_requests)))
+    cpu = (cpu_seconds() - cpu_start) / num_requests
+    return num_requests / (time.perf_counter() - start), latencies, cpu
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--concurrency', default='1,4,16')
+    args = parser.parse_args()
+    Config.BATCH_PREPROCESS_WORKERS = args.workers
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    uploads = [make_image(SIZE, 'JPEG', 'RGB'), make_image(SIZE, 'WEBP', 'RGBA')]
+    # Start the workers before timing anything
+    for _ in range(args.workers):
+        ingest_shared(uploads[0], 'lanczos')
+
+    print_separator('=')
+    print(f"{os.cpu_count()} CPUs, {args.workers} pool workers, {args.requests} ingests per cell, "
+          f"12MP JPEG ({len(uploads[0]) / 2**20:.1f}MB) + RGBA WebP ({len(uploads[1]) / 2**20:.1f}MB)")
+    print_separator('=')
+    for resample in FILTERS:
+        print(f"Filter: {resample}")
+        print_separator()
+        for label, ingest in MODES:
+            cells = []
+            cpu_per_image = []
+            for concurrency in levels:
+                rate, latencies, cpu = run_cell(ingest, uploads, resample, args.requests, concurrency)
+                cells.append(f"c={concurrency:<3} {rate:5.1f}/s p50 {percentile(latencies, 50) * 1000:5.0f}ms")
+                cpu_per_image.append(cpu)
+            print(f"{label:<22} " + "  ".join(cells) +
+                  f"  server CPU {sum(cpu_per_image) / len(cpu_per_image) * 1000:4.0f}ms/image")
+        print_separator()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Benchmark retry policies against a local fake OpenAI server that throttles with 429s.
+Usage: python bench_ratelimit.py [num_requests] [stub_requests_per_second] [upstream_latency_seconds]
+
+Every request is issued at once through the async client, the way a burst
+of uploads reaches it. Compared:
+  legacy      the SDK's own retries (2) under three fixed-backoff attempts
+  adaptive    AIMD concurrency, decorrelated jitter, Retry-After, retry budget
+  adaptive +  the same with RATE_LIMIT_RPM matched to the stub
+"denied" counts retries refused by the retry budget.
+"""
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+from bench_async import percentile
+from fake_openai import FakeOpenAIServer
+
+# (label, legacy policy, client-side RPM as a fraction of the stub's rate)
+POLICIES = [
+    ('legacy fixed backoff', True, None),
+    ('adaptive', False, None),
+    ('adaptive + RPM limit', False, 0.95),
+]
+
+
+def print_separator(char='-', length=96):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_image():
+    """One prepared upload; every request sends the same payload."""
+    from PIL import Image
+    from image_processor import ImageProcessor
+    buffer = io.BytesIO()
+    Image.new('RGB', (512, 384), (90, 140, 200)).save(buffer, 'PNG')
+    return ImageProcessor().ingest(buffer.getvalue())
+
+
+async def legacy_analyze(client, image, prompt, max_retries=3):
+    """The retry loop this client had before flow control: 1s, 2s between attempts."""
+    for attempt in range(max_retries):
+        try:
+            return await client.analyze_image(image, prompt)
+        except Exception:
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)
+            else:
+                raise
+
+
+def run_policy(image, num_requests, legacy):
+    """
+    Send num_requests analyses at once.
+
+    Returns:
+        tuple: (latencies of successes, errors, wall seconds)
+    """
+    from openai_client import AsyncOpenAIClient
+    from prompts import get_analysis_prompt
+
+    prompt = get_analysis_prompt()
+    latencies = []
+    errors = 0
+
+    async def one(client):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            if legacy:
+                await legacy_analyze(client, image, prompt)
+            else:
+                await client.analyze_with_retry(image, prompt)
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors += 1
+
+    async def all_requests():
+        client = AsyncOpenAIClient()
+        if legacy:
+            client.client = client.client.with_options(max_retries=2)  # The SDK default
+        await asyncio.gather(*(one(client) for _ in range(num_requests)))
+        await client.http_client.aclose()
+
+    start = time.perf_counter()
+    asyncio.run(all_requests())
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    """Main entry point."""
+    num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    stub_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+
+    os.environ.update({'OPENAI_API_KEY': 'fake-key', 'CACHE_ENABLED': 'False'})
+    import rate_limit
+    from config import Config
+
+    print_separator('=')
+    print(f"{num_requests} requests at once; stub accepts {stub_rate:g} req/s "
+          f"({stub_rate * 60:g} RPM), latency {latency}s")
+    print_separator('=')
+    print(f"{'policy':<22} {'ok/s':>6} {'errors':>7} {'upstream calls':>15} {'429s':>6} "
+          f"{'denied':>7} {'p50':>7} {'p99':>7} {'wall':>7}")
+    print_separator()
+    image = make_image()
+    for label, legacy, rpm_fraction in POLICIES:
+        server = FakeOpenAIServer(latency=latency, rate_limit=stub_rate).start()
+        Config.OPENAI_BASE_URL = server.base_url
+        Config.RATE_LIMIT_RPM = int(stub_rate * 60 * rpm_fraction) if rpm_fraction else 0
+        rate_limit._flow_controls.clear()  # Fresh limits for each policy
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies, errors, wall = run_policy(image, num_requests, legacy)
+        server.stop()
+        denied = rate_limit.get_flow_control().budget.exhausted
+        p50 = f"{percentile(latencies, 50):6.2f}s" if latencies else '      -'
+        p99 = f"{percentile(latencies, 99):6.2f}s" if latencies else '      -'
+        amplification = server.request_count / num_requests
+        print(f"{label:<22} {len(latencies) / wall:6.1f} {errors / num_requests:7.1%} "
+              f"{server.request_count:8} ({amplification:3.1f}x) {server.throttled_count:6} "
+              f"{denied:7} {p50} {p99} {wall:6.1f}s")
+    print_separator('=')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Benchmark the search index: build time, memory per entry and query latency.
+Usage: python bench_search.py [--entries 100000,1000000] [--dimensions 512,1024] [--queries 200]
+
+Each case runs in a fresh interpreter so peak RSS reflects one index. The
+corpus is synthetic: documents of 60-120 words drawn from a Zipf-distributed
+vocabulary, about the length of the five analysis fields together.
+
+- build: search.encode() plus Int8Index.add(), 10k documents at a time
+  (corpus generation is not timed)
+- memory: bytes per entry held by the index arrays, and peak RSS growth
+- query: Int8Index.search() for 2-4 word queries, k=10
+- recall@10: overlap with an exact float32 search of the same weighted
+  vectors, for cases of at most --exact-max entries
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from bench_async import percentile
+from bench_ingest import peak_rss_kb
+
+ENTRIES = [100_000, 1_000_000]
+DIMENSIONS = [512, 1024]
+VOCABULARY = 20_000
+CHUNK = 10_000
+
+
+def print_separator(char='-', length=108):
+    """Print a separator line."""
+    print(char * length)
+
+
+def make_texts(rng, count, words):
+    """Documents of 60-120 Zipf-distributed words."""
+    lengths = rng.integers(60, 121, count)
+    ranks = (rng.zipf(1.1, int(lengths.sum())) - 1) % len(words)
+    texts, start = [], 0
+    for length in lengths:
+        texts.append(' '.join(words[rank] for rank in ranks[start:start + length]))
+        start += length
+    return texts
+
+
+def make_queries(rng, count, words):
+    """2-4 word queries from the middle of the vocabulary, where search is useful."""
+    return [' '.join(words[rank] for rank in rng.integers(20, 2000, rng.integers(2, 5))) for _ in range(count)]
+
+
+def exact_scores(dense, index, query):
+    """Float32 cosine scores with the index's query weighting."""
+    buckets, weights = index.query_vector(query)
+    return dense[:, buckets] @ weights
+
+
+def dense_vectors(texts, dimensions):
+    """Unit-length float32 vectors, unquantized."""
+    import numpy as np
+    from search import term_weights
+    dense = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        weights = term_weights(text, dimensions)
+        dense[row, list(weights)] = list(weights.values())
+    dense /= np.maximum(np.linalg.norm(dense, axis=1), 1e-12)[:, None]
+    return dense
+
+
+def run_case(entries, dimensions, queries, exact_max):
+    """Child process body: build one index, query it and print metrics as JSON."""
+    import numpy as np
+    from search import Int8Index, encode
+    rng = np.random.default_rng(0)
+    words = [f'w{rank}' for rank in range(VOCABULARY)]
+    rss_before = peak_rss_kb()
+
+    index = Int8Index(dimensions)
+    dense = np.zeros((entries, dimensions), dtype=np.float32) if entries <= exact_max else None
+    build = 0.0
+    for start in range(0, entries, CHUNK):
+        texts = make_texts(rng, min(CHUNK, entries - start), words)
+        begin = time.perf_counter()
+        codes, scales = encode(texts, dimensions)
+        index.add(codes, scales)
+        build += time.perf_counter() - begin
+        if dense is not None:
+            dense[start:start + len(texts)] = dense_vectors(texts, dimensions)
+    rss_growth = peak_rss_kb() - rss_before - (dense.nbytes // 1024 if dense is not None else 0)
+
+    query_texts = make_queries(rng, queries, words)
+    index.search(query_texts[0])  # Warm up
+    latencies, recalls = [], []
+    for query in query_texts:
+        begin = time.perf_counter()
+        hits = index.search(query, 10)
+        latencies.append(time.perf_counter() - begin)
+        if dense is not None:
+            scores = exact_scores(dense, index, query)
+            truth = set(np.argpartition(scores, -10)[-10:].tolist())
+            recalls.append(len(truth & {position for position, _ in hits}) / 10)
+
+    print(json.dumps({
+        'build_s': round(build, 2),
+        'per_second': round(entries / build),
+        'bytes_per_entry': round(index.nbytes / entries, 1),
+        'used_bytes_per_entry': dimensions + 4,
+        'rss_growth_mb': round(rss_growth / 1024, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'recall': round(sum(recalls) / len(recalls), 3) if recalls else None,
+    }))
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--entries', default=','.join(str(n) for n in ENTRIES), help='Comma-separated index sizes')
+    parser.add_argument('--dimensions', default=','.join(str(d) for d in DIMENSIONS), help='Comma-separated hash buckets')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--exact-max', type=int, default=100_000, help='Largest index to check recall on')
+    parser.add_argument('--case', nargs=2, type=int, help=argparse.SUPPRESS)  # Child mode: ENTRIES DIMENSIONS
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case[0], args.case[1], args.queries, args.exact_max)
+        return
+
+    print_separator('=')
+    print(f"{args.queries} queries of 2-4 words, k=10; vocabulary {VOCABULARY:,}; fresh interpreter per case")
+    print_separator('=')
+    print(f"{'entries':>10}{'dims':>6}{'build':>9}{'docs/s':>10}{'bytes/entry':>13}{'(used)':>8}"
+          f"{'RSS growth':>12}{'p50':>10}{'p95':>10}{'recall@10':>11}")
+    print_separator()
+    for entries in (int(value) for value in args.entries.split(',')):
+        for dimensions in (int(value) for value in args.dimensions.split(',')):
+            output = subprocess.run(
+                [sys.executable, __file__, '--queries', str(args.queries), '--exact-max', str(args.exact_max),
+                 '--case', str(entries), str(dimensions)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            recall = f"{result['recall']:11.3f}" if result['recall'] is not None else f"{'-':>11}"
+            print(f"{entries:>10,}{dimensions:>6}{result['build_s']:8.1f}s{result['per_second']:>10,}"
+                  f"{result['bytes_per_entry']:13.1f}{result['used_bytes_per_entry']:>8}"
+                  f"{result['rss_growth_mb']:10.1f}MB{result['p50_ms']:8.2f}ms{result['p95_ms']:8.2f}ms{recall}")
+    print_separator()
+
+
+if __name__ == '__main__':
+    main()
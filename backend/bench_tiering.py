@@ -0,0 +1,232 @@
+"""
+Replay model tiering over recorded answers, to tune its thresholds without calling the API.
+Usage: python bench_tiering.py [--record] [--recording FILE] [--models MINI,LARGE] [--thresholds 0,0.5,...]
+
+--record asks every tier model for all five fields of every image once,
+through the real client stack, and saves each answer with its latency and
+token usage as a JSON line. By default that is the fake backend; with
+ANALYSIS_BACKEND=openai and a key it records the live API, once, for as
+many replays as needed. --images DIR records your own photos instead of
+synthetic ones.
+
+Replay calls nothing. For each TIER_MIN_CONFIDENCE it runs the same checks
+as the pipeline (tiering.ModelTiers.check) on the recorded answers and
+reports the escalation rate, calls, tokens, cost and latency per image, next
+to each model on its own. An escalated call asks for fewer fields than the
+recorded answer holds; it is charged the recorded prompt tokens, the
+completion tokens of its fields' share of the answer and the full recorded
+latency, so replayed escalations are slightly pessimistic.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from bench_async import percentile
+from bench_harness import make_image
+
+MODELS = ['gpt-4o-mini', 'gpt-4o']
+# USD per million input/output tokens, for the cost column
+PRICES = {'gpt-4o-mini': (0.15, 0.60), 'gpt-4o': (2.50, 10.00)}
+THRESHOLDS = [0, 0.3, 0.5, 0.7, 0.9]
+
+
+def print_separator(char='-', length=112):
+    """Print a separator line."""
+    print(char * length)
+
+
+def load_images(directory, count):
+    """(name, bytes) pairs: files from a directory, or `count` synthetic photos."""
+    if directory:
+        names = sorted(name for name in os.listdir(directory)
+                       if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.gif')))
+        images = []
+        for name in names[:count]:
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append((name, f.read()))
+        return images
+    # Distinct sizes, so the fake draws a different answer for each
+    return [(f'synthetic-{i}', make_image((640 + 8 * i, 480), 'JPEG', 'RGB')) for i in range(count)]
+
+
+def record(path, models, images):
+    """Ask each model for every field of each image; write one JSON line per answer."""
+    import metrics
+    import prompts
+    from image_processor import ImageProcessor
+    from openai_client import OpenAIClient
+
+    client = OpenAIClient()
+    processor = ImageProcessor()
+    prompt = prompts.get_analysis_prompt()
+    written = 0
+    with open(path, 'w') as out:
+        for name, data in images:
+            image = processor.ingest(data)
+            for model in models:
+                before = [metrics.MODEL_TOKENS.value(model, kind) for kind in ('prompt', 'completion')]
+                start = time.perf_counter()
+                try:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        text = client.analyze_with_retry(image, prompt, fields=list(prompts.ANALYSIS_FIELDS),
+                                                         model=model)
+                except Exception as e:
+                    print(f"{name} on {model} failed: {str(e)}")
+                    continue
+                seconds = time.perf_counter() - start
+                prompt_tokens, completion_tokens = (
+                    metrics.MODEL_TOKENS.value(model, kind) - count
+                    for kind, count in zip(('prompt', 'completion'), before)
+                )
+                out.write(json.dumps({
+                    'image': name, 'model': model, 'text': text, 'seconds': round(seconds, 4),
+                    'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                }) + '\n')
+                written += 1
+    print(f"Recorded {written} answers for {len(images)} images to {path}")
+
+
+def load_recording(path):
+    """
+    Recorded answers by image, parsed once.
+
+    Returns:
+        dict: image -> model -> record, with 'fields' (valid fields of the answer) added
+    """
+    from json_stream import parse_analysis
+    import prompts
+    answers = {}
+    with open(path) as f:
+        for line in f:
+            entry = json.loads(line)
+            entry['fields'], _, _ = parse_analysis(entry['text'], list(prompts.ANALYSIS_FIELDS))
+            answers.setdefault(entry['image'], {})[entry['model']] = entry
+    return answers
+
+
+def replay_image(tiers, answers, fields):
+    """
+    Tier one image's recorded answers.
+
+    Returns:
+        dict: calls, seconds, tokens per model, fields still missing and the model of each delivered field
+    """
+    ask = list(fields)
+    outcome = {'calls': 0, 'seconds': 0.0, 'tokens': {}, 'missing': 0, 'models': {}}
+    for tier, model in enumerate(tiers.models):
+        if not ask:
+            break
+        entry = answers[model]
+        found = {name: entry['fields'][name] for name in ask if name in entry['fields']}
+        missing = [name for name in ask if name not in found]
+        total_chars = sum(len(value) for value in entry['fields'].values()) or 1
+        share = 1.0 if ask == list(fields) else sum(len(value) for value in found.values()) / total_chars
+        prompt_tokens, completion_tokens = outcome['tokens'].get(model, (0, 0))
+        outcome['tokens'][model] = (prompt_tokens + entry['prompt_tokens'],
+                                    completion_tokens + entry['completion_tokens'] * share)
+        outcome['calls'] += 1
+        outcome['seconds'] += entry['seconds']
+        tiers.record_call(model, entry['seconds'], ask)
+        if tier == tiers.last:
+            outcome['models'].update((name, model) for name in found)
+            outcome['missing'] += len(missing)
+            break
+        accepted, ask = tiers.check(model, found, missing)
+        outcome['models'].update((name, model) for name in accepted)
+    return outcome
+
+
+def replay(answers, models, threshold, prices):
+    """Replay every image at one threshold; returns summary numbers."""
+    from tiering import ModelTiers
+    import prompts
+    tiers = ModelTiers(models, routes='', min_confidence=threshold)
+    outcomes = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for per_model in answers.values():
+            if all(model in per_model for model in models):
+                outcomes.append(replay_image(tiers, per_model, prompts.ANALYSIS_FIELDS))
+    count = len(outcomes) or 1
+    cost = 0.0
+    for outcome in outcomes:
+        for model, (prompt_tokens, completion_tokens) in outcome['tokens'].items():
+            price_in, price_out = prices.get(model, (0.0, 0.0))
+            cost += (prompt_tokens * price_in + completion_tokens * price_out) / 1e6
+    stats = tiers.stats()['tiers']
+    first = stats[models[0]]
+    delivered = sum(len(outcome['models']) for outcome in outcomes) or 1
+    return {
+        'images': len(outcomes),
+        'escalation_rate': first['escalation_rate'] if len(models) > 1 else 0.0,
+        'calls': sum(outcome['calls'] for outcome in outcomes) / count,
+        'tokens': sum(sum(p + c for p, c in outcome['tokens'].values()) for outcome in outcomes) / count,
+        'cost_per_1k': cost / count * 1000,
+        'p50': percentile([outcome['seconds'] for outcome in outcomes], 50) if outcomes else 0,
+        'p95': percentile([outcome['seconds'] for outcome in outcomes], 95) if outcomes else 0,
+        'largest_share': sum(
+            1 for outcome in outcomes for model in outcome['models'].values() if model == models[-1]
+        ) / delivered,
+        'missing': sum(outcome['missing'] for outcome in outcomes),
+    }
+
+
+def parse_prices(spec):
+    """'model=IN/OUT,...' in USD per million tokens."""
+    prices = dict(PRICES)
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        model, _, pair = item.partition('=')
+        price_in, price_out = (float(value) for value in pair.split('/'))
+        prices[model.strip()] = (price_in, price_out)
+    return prices
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--record', action='store_true', help='Record answers first (fake backend unless '
+                        'ANALYSIS_BACKEND is set)')
+    parser.add_argument('--recording', default='tiering_recording.jsonl')
+    parser.add_argument('--models', default=','.join(MODELS), help='Tier models, cheapest first')
+    parser.add_argument('--images', help='Directory of images to record (default: synthetic)')
+    parser.add_argument('--count', type=int, default=60, help='Images to record')
+    parser.add_argument('--thresholds', default=','.join(str(t) for t in THRESHOLDS),
+                        help='TIER_MIN_CONFIDENCE values to replay')
+    parser.add_argument('--prices', default='', help="Override prices: 'model=IN/OUT' USD per 1M tokens")
+    args = parser.parse_args()
+    models = [name.strip() for name in args.models.split(',') if name.strip()]
+
+    if args.record:
+        os.environ.setdefault('ANALYSIS_BACKEND', 'fake')
+        # A fake model cuts some answers short, so there is something to escalate
+        os.environ.setdefault('FAKE_TRUNCATE_RATE', '0.15')
+        os.environ.setdefault('FAKE_LATENCY', 'lognormal:0.2,0.3')
+        os.environ.setdefault('FAKE_SECONDS_PER_TOKEN', '0.0005')
+        os.environ.update({'RETRY_MAX_ATTEMPTS': '1', 'WARMUP_ON_STARTUP': 'False'})
+        record(args.recording, models, load_images(args.images, args.count))
+
+    answers = load_recording(args.recording)
+    prices = parse_prices(args.prices)
+    print_separator('=')
+    print(f"Replaying {args.recording}: {len(answers)} images, tiers {' > '.join(models)}")
+    print_separator('=')
+    print(f"{'policy':<26}{'escalated':>10}{'calls':>7}{'tokens':>8}{'$/1k img':>10}{'p50':>9}{'p95':>9}"
+          f"{'from ' + models[-1]:>20}{'missing':>9}")
+    print_separator()
+    rows = [(f'only {model}', [model], 0.0) for model in models]
+    rows += [(f'tiered, confidence {threshold:g}', models, threshold)
+             for threshold in (float(value) for value in args.thresholds.split(','))]
+    for label, tier_models, threshold in rows:
+        result = replay(answers, tier_models, threshold, prices)
+        share = result['largest_share'] if tier_models[-1] == models[-1] else 0.0
+        escalated = f"{result['escalation_rate']:10.1%}" if len(tier_models) > 1 else f"{'-':>10}"
+        print(f"{label:<26}{escalated}{result['calls']:7.2f}{result['tokens']:8.0f}{result['cost_per_1k']:10.2f}"
+              f"{result['p50']:8.2f}s{result['p95']:8.2f}s{share:20.1%}{result['missing']:9d}")
+    print_separator()
+    print("escalated: fields the first tier failed; from <model>: delivered fields the largest model wrote; "
+          "missing: fields no tier answered")
+
+
+if __name__ == '__main__':
+    main()
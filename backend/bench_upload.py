@@ -0,0 +1,156 @@
+"""
+Benchmark upload bytes and time-to-result: base64 JSON vs multipart vs multipart after client-side resizing.
+Usage: python bench_upload.py [--repeats N] [--uplink 2,10,50] [--latency SPEC]
+
+The frontend used to send phone photos as they came off the camera. It now
+downscales and re-encodes them in a Web Worker to the `upload` limits of
+/api/health before posting them as multipart. Here the worker is emulated
+with Pillow (same target size arithmetic, same format and quality), and
+each body is posted to /api/analyze through the Flask test client against
+the fake backend:
+
+- body: bytes on the wire
+- client: time to resize and encode (Pillow here; a browser's canvas differs)
+- server: median time from request to response, including the fake model latency
+- time-to-result at each uplink: client + body transfer + server
+- passthrough: whether the server sent the upload upstream without re-encoding it
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import statistics
+import time
+from bench_harness import make_image
+
+# (name, size, format, mode): camera photos and a phone screenshot
+PHOTOS = [
+    ('phone-12mp', (4032, 3024), 'JPEG', 'RGB'),
+    ('phone-portrait', (3024, 4032), 'JPEG', 'RGB'),
+    ('phone-24mp', (6000, 4000), 'JPEG', 'RGB'),
+    ('screenshot-png', (1170, 2532), 'PNG', 'RGB'),
+]
+MODES = ['base64 JSON', 'multipart', 'multipart resized']
+
+
+def print_separator(char='-', length=128):
+    """Print a separator line."""
+    print(char * length)
+
+
+def target_size(size, limits):
+    """Size the frontend's resize worker picks (resize-worker.js targetSize())."""
+    width, height = size
+    ratio = min(1, limits['max_dimension'] / width, limits['max_dimension'] / height)
+    width, height = max(1, int(width * ratio)), max(1, int(height * ratio))
+    if limits['max_short_side']:
+        ratio = min(1, limits['max_short_side'] / min(width, height))
+        width, height = max(1, int(width * ratio)), max(1, int(height * ratio))
+    return width, height
+
+
+def client_resize(data, mime_type, limits):
+    """
+    What the resize worker uploads for a file.
+
+    Returns:
+        bytes: The re-encoded image, or data itself when it already fits or
+            re-encoding would not make it smaller
+    """
+    from PIL import Image
+    img = Image.open(io.BytesIO(data))
+    target = target_size(img.size, limits)
+    if target == img.size and mime_type == limits['format']:
+        return data
+    if img.mode != 'RGB':
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img.convert('RGBA'), mask=img.convert('RGBA').split()[3])
+        img = background
+    img = img.resize(target, Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    img.save(buffer, format=limits['format'].split('/')[1].upper(), quality=limits['quality'])
+    resized = buffer.getvalue()
+    return resized if len(resized) < len(data) else data
+
+
+def request_body(mode, data, filename):
+    """(kwargs for the test client's post(), bytes on the wire)."""
+    from werkzeug.test import EnvironBuilder
+    if mode == 'base64 JSON':
+        body = json.dumps({'image': base64.b64encode(data).decode('ascii')})
+        return {'data': body, 'content_type': 'application/json'}, len(body)
+    form = lambda: {'image': (io.BytesIO(data), filename)}
+    length = int(EnvironBuilder(method='POST', data=form()).get_environ()['CONTENT_LENGTH'])
+    return {'data': form, 'content_type': 'multipart/form-data'}, length
+
+
+def post(client, kwargs):
+    """POST /api/analyze once. Returns (seconds, response JSON)."""
+    data = kwargs['data']() if callable(kwargs['data']) else kwargs['data']
+    start = time.perf_counter()
+    response = client.post('/api/analyze', data=data, content_type=kwargs['content_type'])
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.get_json()
+    return elapsed, response.get_json()
+
+
+def main():
+    """Main entry point."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5, help='Requests per photo and mode')
+    parser.add_argument('--uplink', default='2,10,50', help='Uplink speeds in Mbit/s')
+    parser.add_argument('--latency', default='1.5', help='Fake model latency spec')
+    args = parser.parse_args()
+    uplinks = [float(value) for value in args.uplink.split(',')]
+
+    os.environ.update({
+        'ANALYSIS_BACKEND': 'fake',
+        'FAKE_LATENCY': args.latency,
+        # Every request must do the full work
+        'CACHE_ENABLED': 'False',
+        'SINGLEFLIGHT_ENABLED': 'False',
+        'PHASH_ENABLED': 'False',
+        'ASYNC_ENABLED': 'False',
+        'WARMUP_ON_STARTUP': 'False',
+        'JOBS_WORKERS': '0',
+    })
+    import app as app_module
+    client = app_module.app.test_client()
+    limits = client.get('/api/health').get_json()['upload']
+
+    print_separator('=')
+    print(f"Client limits from /api/health: fit {limits['max_dimension']}px, shortest side "
+          f"{limits['max_short_side']}px, {limits['format']} quality {limits['quality']}; "
+          f"fake model latency '{args.latency}', median of {args.repeats}")
+    print_separator('=')
+    print(f"{'photo':<26}{'mode':<19}{'body':>9}{'client':>9}{'server':>9}"
+          + ''.join(f"{f'@{mbit:g}Mbit/s':>13}" for mbit in uplinks) + f"{'passthrough':>13}")
+    print_separator()
+    for name, size, fmt, mode in PHOTOS:
+        original = make_image(size, fmt, mode)
+        mime_type = f'image/{fmt.lower()}'
+        start = time.perf_counter()
+        resized = client_resize(original, mime_type, limits)
+        client_seconds = time.perf_counter() - start
+
+        for upload_mode in MODES:
+            data = resized if upload_mode == 'multipart resized' else original
+            prep = client_seconds if upload_mode == 'multipart resized' else 0.0
+            kwargs, length = request_body(upload_mode, data, f"{name}.{fmt.lower()}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                post(client, kwargs)  # First use of this size: imports, pools
+                runs = [post(client, kwargs) for _ in range(args.repeats)]
+            server = statistics.median(seconds for seconds, _ in runs)
+            passthrough = runs[0][1]['results']['metadata']['payload_bytes'] == len(data)
+            totals = [prep + length * 8 / (mbit * 1e6) + server for mbit in uplinks]
+            label = f"{name} {size[0]}x{size[1]}" if upload_mode == MODES[0] else ''
+            print(f"{label:<26}{upload_mode:<19}{length / 1024:7.0f}KB{prep * 1000:7.0f}ms{server * 1000:7.0f}ms"
+                  + ''.join(f"{total * 1000:11.0f}ms" for total in totals)
+                  + f"{'yes' if passthrough else 'no':>13}")
+        print_separator()
+
+
+if __name__ == '__main__':
+    main()
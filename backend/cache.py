@@ -0,0 +1,265 @@
+"""
+Content-addressed cache for analysis results.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+
+
+def make_cache_key(image_bytes, model, prompt, generation_config, image_shape=None):
+    """
+    Build a cache key from everything that determines an analysis result.
+
+    Args:
+        image_bytes: Preprocessed image data
+        model: Model name used for the analysis
+        prompt: Prompt text sent with the image
+        generation_config: Generation parameters (temperature, max_tokens, ...)
+        image_shape: Optional (mode, size) when image_bytes are raw pixels
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    digest = hashlib.sha256()
+    if image_shape is not None:
+        digest.update(repr(image_shape).encode('utf-8') + b'\0')
+    digest.update(image_bytes)
+    digest.update(b'\0' + model.encode('utf-8'))
+    digest.update(b'\0' + prompt.encode('utf-8'))
+    digest.update(b'\0' + json.dumps(generation_config, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def make_prompt_key(base_key, prompt):
+    """
+    Build the key of one prompt's answer for an image.
+
+    Args:
+        base_key: make_cache_key() of the image and settings, with an empty prompt
+        prompt: Prompt text (e.g. the prompt asking for a single field)
+
+    Returns:
+        str: Hex digest identifying the answer
+    """
+    return hashlib.sha256(f'{base_key}\0{prompt}'.encode('utf-8')).hexdigest()
+
+
+def make_context_key(model, prompt, generation_config):
+    """
+    Identify the request settings independently of the image.
+
+    Near-duplicate matches are only valid between requests that share this key.
+
+    Args:
+        model: Model name used for the analysis
+        prompt: Prompt text sent with the image
+        generation_config: Generation parameters
+
+    Returns:
+        str: Hex digest of the settings
+    """
+    return make_cache_key(b'', model, prompt, generation_config)
+
+
+class ResultCache:
+    """
+    Two-tier result cache: in-memory LRU with TTL, optional SQLite on disk.
+
+    The disk tier can be shared by several processes (pre-forked server
+    workers): it uses WAL journaling, and a cache built before a fork
+    reconnects in each child on first use.
+    """
+
+    def __init__(self, max_entries=None, ttl_seconds=None, db_path=None):
+        """
+        Initialize cache tiers.
+
+        Args:
+            max_entries: Maximum number of entries held in memory
+            ttl_seconds: Lifetime of an entry in either tier
+            db_path: Path of the SQLite file for the disk tier (None disables it)
+        """
+        self.max_entries = max_entries if max_entries is not None else Config.CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else Config.CACHE_TTL_SECONDS
+        self.db_path = db_path if db_path is not None else Config.CACHE_DB_PATH
+
+        self._memory = OrderedDict()  # key -> (expires_at, serialized value)
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None  # Process that opened _db
+        self._inherited_db = None  # Parent's connection after a fork, kept open but unused
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if self.db_path:
+            self._open_db()
+
+    def _connect(self):
+        """Open this process's connection to the disk tier."""
+        # Waits on other processes' writes rather than failing with "database is locked"
+        self._db = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')  # Readers in other processes never block
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        """Reconnect in a forked child (SQLite connections must not cross a fork). Caller holds the lock."""
+        if self._db is not None and self._pid != os.getpid():
+            self._inherited_db = self._db  # Not closed: closing would act on the parent's file handle
+            self._connect()
+
+    def _open_db(self):
+        """Open the disk tier and drop rows that expired while we were down."""
+        self._connect()
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, '
+            'phash INTEGER, context TEXT)'
+        )
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(results)')}
+        for column, kind in (('phash', 'INTEGER'), ('context', 'TEXT')):
+            if column not in columns:
+                self._db.execute(f'ALTER TABLE results ADD COLUMN {column} {kind}')
+        self._db.execute('DELETE FROM results WHERE expires_at <= ?', (time.time(),))
+        self._db.commit()
+
+    def get(self, key, record_stats=True):
+        """
+        Look up a cached result.
+
+        Args:
+            key: Cache key from make_cache_key()
+            record_stats: Whether the lookup counts towards hits and misses
+
+        Returns:
+            tuple: (result dict or None, source) where source is 'memory', 'disk' or None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    if record_stats:
+                        self.hits += 1
+                    return json.loads(value), 'memory'
+                del self._memory[key]
+                self.expirations += 1
+
+            self._check_fork()
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, expires_at FROM results WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        self._store_memory(key, value, expires_at)
+                        if record_stats:
+                            self.hits += 1
+                            self.disk_hits += 1
+                        return json.loads(value), 'disk'
+                    self._db.execute('DELETE FROM results WHERE key = ?', (key,))
+                    self._db.commit()
+                    self.expirations += 1
+
+            if record_stats:
+                self.misses += 1
+            return None, None
+
+    def set(self, key, result, phash=None, context=None):
+        """
+        Store a result in every enabled tier.
+
+        Args:
+            key: Cache key from make_cache_key()
+            result: JSON-serializable result dict
+            phash: Optional perceptual hash, persisted so the near-duplicate
+                index can be rebuilt after a restart
+            context: Context key from make_context_key() that goes with phash
+        """
+        value = json.dumps(result)
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._store_memory(key, value, expires_at)
+            self._check_fork()
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO results (key, value, expires_at, phash, context) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (key, value, expires_at, _to_signed64(phash), context)
+                )
+                self._db.commit()
+
+    def _store_memory(self, key, value, expires_at):
+        """Insert into the LRU tier, evicting the oldest entries. Caller holds the lock."""
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def perceptual_entries(self):
+        """
+        List persisted perceptual hashes of live disk entries.
+
+        Returns:
+            list: (phash, (context, key, expires_at)) pairs for
+                NearDuplicateIndex.load(), soonest to expire first
+        """
+        if self._db is None:
+            return []
+        with self._lock:
+            self._check_fork()
+            rows = self._db.execute(
+                'SELECT phash, context, key, expires_at FROM results WHERE phash IS NOT NULL AND expires_at > ? '
+                'ORDER BY expires_at',
+                (time.time(),)
+            ).fetchall()
+        return [
+            (phash & 0xFFFFFFFFFFFFFFFF, (context, key, expires_at)) for phash, context, key, expires_at in rows
+        ]
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._check_fork()
+            if self._db is not None:
+                self._db.execute('DELETE FROM results')
+                self._db.commit()
+
+    def stats(self):
+        """
+        Return cache counters.
+
+        Returns:
+            dict: Hit, miss and eviction counts plus current size
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'entries': len(self._memory),
+                'disk_enabled': self._db is not None
+            }
+
+
+def _to_signed64(value):
+    """Map an unsigned 64-bit hash onto SQLite's signed INTEGER range."""
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= (1 << 63) else value
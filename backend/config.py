@@ -2,29 +2,181 @@
 Configuration settings for the multimodal AI system.
 """
 import os
+import tempfile
 from pathlib import Path
-from dotenv import load_dotenv
 
-# Load .env from the same directory as this file
+# Load .env from the same directory as this file (deployments set real env vars; skip the import there)
 env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path)
+if env_path.exists():
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=env_path)
+
+# Where SQLite stores are created by default; on Vercel only the temp directory is writable
+DATA_DIR = Path(tempfile.gettempdir()) if os.getenv('VERCEL') else Path(__file__).parent
 
 class Config:
     """Application configuration."""
     
     # Analysis Settings
     MODEL_NAME = os.getenv("MODEL_NAME", "gpt-4o-mini")
+    # Model tiering (tiering.py): models cheapest first, e.g. 'gpt-4o-mini,gpt-4o'; empty = MODEL_NAME alone
+    MODEL_TIERS = [name.strip() for name in os.getenv('MODEL_TIERS', '').split(',') if name.strip()]
+    TIER_ROUTES = os.getenv('TIER_ROUTES', '')  # Starting tier per endpoint or field, e.g. 'stream=1,story=1'
+    TIER_MIN_CONFIDENCE = float(os.getenv('TIER_MIN_CONFIDENCE', 0.5))  # Lower-scoring fields escalate; 0 = only missing ones
     PORT = int(os.getenv('PORT', 5000))
     DEBUG = os.getenv('DEBUG', 'False').lower() == 'true'
     
+    # Analysis backend: 'openai' (the real API), 'fake' (offline, deterministic; see fake_backend.py),
+    # 'record' (the real API, saving each answer) or 'replay' (offline, from the recording; see record_replay.py)
+    ANALYSIS_BACKEND = os.getenv('ANALYSIS_BACKEND', 'openai').lower()
+    
     # API Configuration
-    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_API_KEY = os.getenv('OPENAI_API_KEY') or ('fake-key' if ANALYSIS_BACKEND in ('fake', 'replay') else None)
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # Override for proxies/local stubs
+    GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+    GEMINI_MODEL_NAME = os.getenv('GEMINI_MODEL_NAME', 'gemini-1.5-flash')
+    SAFETY_SETTINGS = None  # Gemini defaults
+    
+    # Provider routing: comma-separated, in priority order (openai, gemini)
+    PROVIDERS = [name.strip() for name in os.getenv('PROVIDERS', 'openai').split(',') if name.strip()]
+    FAILOVER_ERROR_THRESHOLD = int(os.getenv('FAILOVER_ERROR_THRESHOLD', 5))  # Consecutive failures
+    FAILOVER_COOLDOWN_SECONDS = float(os.getenv('FAILOVER_COOLDOWN_SECONDS', 30))
+    # Hedged requests: a second request once the first is slower than the
+    # primary's HEDGE_PERCENTILE latency; first answer wins, the other is cancelled
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'False').lower() == 'true'
+    HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 0.5))  # Seconds
+    HEDGE_TARGET = os.getenv('HEDGE_TARGET', 'other')  # 'other' provider or the 'same' one
+    HEDGE_BUDGET_RATIO = float(os.getenv('HEDGE_BUDGET_RATIO', 0.1))  # Hedges per recent call
+    
+    # Async request path
+    ASYNC_ENABLED = os.getenv('ASYNC_ENABLED', 'True').lower() == 'true'
+    ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 256))  # Upstream calls per process
+    ANALYZE_TIMEOUT_SECONDS = float(os.getenv('ANALYZE_TIMEOUT_SECONDS', 120))
+    
+    # Upstream flow control: client-side rate limits (0 = off; set to your account's
+    # limits), AIMD concurrency that halves on 429s, and jittered retries
+    RATE_LIMIT_RPM = int(os.getenv('RATE_LIMIT_RPM', 0))
+    RATE_LIMIT_TPM = int(os.getenv('RATE_LIMIT_TPM', 0))
+    RATE_LIMIT_TPM_BURST = int(os.getenv('RATE_LIMIT_TPM_BURST', 0))  # Tokens an idle process may send at once; 0 = the largest request
+    GEMINI_RATE_LIMIT_RPM = int(os.getenv('GEMINI_RATE_LIMIT_RPM', 0))  # Gemini has its own limits, counters and budget
+    AIMD_INITIAL_CONCURRENCY = int(os.getenv('AIMD_INITIAL_CONCURRENCY', 16))  # Slow-start window
+    AIMD_MIN_CONCURRENCY = int(os.getenv('AIMD_MIN_CONCURRENCY', 1))
+    RETRY_MAX_ATTEMPTS = int(os.getenv('RETRY_MAX_ATTEMPTS', 4))
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 0.5))
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 20))  # Longer Retry-After fails fast
+    RETRY_BUDGET_RATIO = float(os.getenv('RETRY_BUDGET_RATIO', 0.2))  # Retries per recent request
+    RETRY_BUDGET_MIN_PER_SECOND = float(os.getenv('RETRY_BUDGET_MIN_PER_SECOND', 1))
+    
+    # Upstream HTTP connection pool (shared by all calls of a client)
+    HTTP_MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', ASYNC_MAX_IN_FLIGHT))
+    # Idle connections kept open. Enough for steady traffic; httpcore scans idle
+    # connections on every request, so a large idle pool costs CPU under bursts.
+    HTTP_MAX_KEEPALIVE = int(os.getenv('HTTP_MAX_KEEPALIVE', 32))
+    HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 60))
+    HTTP2 = os.getenv('HTTP2', 'False').lower() == 'true'  # Requires the 'h2' package
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', ANALYZE_TIMEOUT_SECONDS))
+    # Off by default on Vercel: a cold start serving /api/health would import the whole pipeline
+    WARMUP_ON_STARTUP = os.getenv('WARMUP_ON_STARTUP', 'False' if os.getenv('VERCEL') else 'True').lower() == 'true'
+    WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', 4))  # Connections opened per client
+    
+    # Batch analysis
+    BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 500))
+    BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 8))  # Analyses in flight per batch
+    BATCH_PREPROCESS_WORKERS = int(os.getenv('BATCH_PREPROCESS_WORKERS', 0))  # Preprocessing pool; 0 = one per CPU
+    BATCH_MAX_REQUEST_BYTES = int(os.getenv('BATCH_MAX_REQUEST_MB', 512)) * 1024 * 1024
+    
+    # Instrumentation: Prometheus /metrics and an optional Server-Timing response header
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+    SERVER_TIMING = os.getenv('SERVER_TIMING', 'False').lower() == 'true'
+    
+    # Fake backend (ANALYSIS_BACKEND=fake): latency is '0.8', 'uniform:LOW,HIGH' or 'lognormal:MEDIAN,SIGMA' seconds
+    FAKE_LATENCY = os.getenv('FAKE_LATENCY', 'lognormal:1.5,0.4')
+    FAKE_ERROR_RATE = float(os.getenv('FAKE_ERROR_RATE', 0))  # Share of calls answered with a 500
+    FAKE_RESPONSE_CHARS = int(os.getenv('FAKE_RESPONSE_CHARS', 1500))  # Size of the analysis JSON
+    FAKE_SEED = int(os.getenv('FAKE_SEED', 0))
+    FAKE_TRUNCATE_RATE = float(os.getenv('FAKE_TRUNCATE_RATE', 0))  # Share of answers cut off mid-JSON
+    FAKE_SECONDS_PER_TOKEN = float(os.getenv('FAKE_SECONDS_PER_TOKEN', 0))  # Decoding time per completion token
+    
+    # Record/replay (ANALYSIS_BACKEND=record | replay): upstream answers with their timing, in SQLite
+    RECORDING_PATH = os.getenv('RECORDING_PATH', str(Path(__file__).parent / 'recording.sqlite3'))
+    REPLAY_LATENCY_SCALE = float(os.getenv('REPLAY_LATENCY_SCALE', 1))  # Factor on recorded latency; 0 = no waiting
+    REPLAY_FALLBACK = os.getenv('REPLAY_FALLBACK', 'True').lower() == 'true'  # Unrecorded images borrow a recorded answer
+    
+    # Background jobs (/api/jobs): SQLite-backed queue drained by worker threads
+    JOBS_DB_PATH = os.getenv('JOBS_DB_PATH', str(DATA_DIR / 'jobs.sqlite3'))
+    JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', 4))  # Per process; 0 = submit only
+    JOBS_LEASE_SECONDS = float(os.getenv('JOBS_LEASE_SECONDS', ANALYZE_TIMEOUT_SECONDS * 2))  # Renewed while a job runs
+    JOBS_MAX_ATTEMPTS = int(os.getenv('JOBS_MAX_ATTEMPTS', 3))  # Incl. reruns after a crash
+    JOBS_RESULT_TTL_SECONDS = int(os.getenv('JOBS_RESULT_TTL_SECONDS', 24 * 60 * 60))
+    JOBS_POLL_SECONDS = float(os.getenv('JOBS_POLL_SECONDS', 1))  # Checks for other processes' jobs
+    JOBS_MAX_WAIT_SECONDS = float(os.getenv('JOBS_MAX_WAIT_SECONDS', 25))  # Long-poll cap
+    
+    # Production server: `gunicorn app:app` with the settings in gunicorn.conf.py
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', 0))  # Pre-forked processes; 0 = one per CPU
+    WEB_THREADS = int(os.getenv('WEB_THREADS', 16))  # Request threads per process
+    WEB_MAX_REQUESTS = int(os.getenv('WEB_MAX_REQUESTS', 0))  # Recycle a worker after this many; 0 = never
+    PREFORK = False  # Set by gunicorn.conf.py: app.py preloads instead of starting threads
     
     # Image Processing
     MAX_IMAGE_SIZE_MB = 10
     MAX_IMAGE_SIZE_BYTES = MAX_IMAGE_SIZE_MB * 1024 * 1024
+    # Declared width x height; rejected from the header, before decoding (decompression bombs)
+    MAX_IMAGE_PIXELS = int(float(os.getenv('MAX_IMAGE_MEGAPIXELS', 64)) * 1_000_000)
+    # Request body limit (Flask MAX_CONTENT_LENGTH): one image as base64 plus form/JSON overhead
+    MAX_REQUEST_BYTES = MAX_IMAGE_SIZE_BYTES * 4 // 3 + 64 * 1024
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp', 'gif'}
     RESIZE_MAX_DIMENSION = 2048  # Max width or height
+    # Animated GIF/WebP/PNG: analyse a contact sheet of the KEYFRAME_COUNT most distinct
+    # frames (1 = first frame only); longer animations are sampled down to KEYFRAME_MAX_FRAMES
+    KEYFRAME_COUNT = int(os.getenv('KEYFRAME_COUNT', 4))
+    KEYFRAME_MAX_FRAMES = int(os.getenv('KEYFRAME_MAX_FRAMES', 500))
+    # Final downscale filter: lanczos, bicubic, bilinear, reduce+lanczos or reduce+bilinear
+    # (reduce+ shrinks by an integer factor first; much faster on large uploads)
+    RESAMPLE_FILTER = os.getenv('RESAMPLE_FILTER', 'lanczos')
+    # Decode/resize/encode in the process pool instead of the request thread
+    # (sized by BATCH_PREPROCESS_WORKERS); images under the threshold stay in-thread
+    PREPROCESS_IN_POOL = os.getenv('PREPROCESS_IN_POOL', 'False').lower() == 'true'
+    PREPROCESS_POOL_MIN_MEGAPIXELS = float(os.getenv('PREPROCESS_POOL_MIN_MEGAPIXELS', 2))
+    
+    # Vision encoding profile: resolution, format, quality and detail sent upstream.
+    # 'max_tiles' caps 512px tiles (and so image tokens); None keeps the
+    # resolution the model would downscale to anyway (shortest side 768px).
+    ENCODING_PROFILE = os.getenv('ENCODING_PROFILE', 'balanced')
+    ENCODING_PROFILES = {
+        'max': {'format': 'JPEG', 'quality': 95, 'detail': 'auto', 'max_tiles': None,
+                'max_dimension': 2048},  # Pre-profile behaviour
+        'balanced': {'format': 'JPEG', 'quality': 85, 'detail': 'high', 'max_tiles': None},
+        'compact': {'format': 'WEBP', 'quality': 80, 'detail': 'high', 'max_tiles': None},
+        'economy': {'format': 'JPEG', 'quality': 80, 'detail': 'high', 'max_tiles': 2},
+        'low': {'format': 'JPEG', 'quality': 80, 'detail': 'low', 'max_tiles': 0},
+    }
+    
+    # Image token pricing per model: (base tokens, tokens per 512px tile)
+    IMAGE_TOKEN_COSTS = {
+        'gpt-4o-mini': (2833, 5667),
+        'default': (85, 170),
+    }
+    
+    # Result Cache
+    CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'True').lower() == 'true'
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 1024))
+    CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', 24 * 60 * 60))
+    CACHE_DB_PATH = os.getenv('CACHE_DB_PATH')  # Optional on-disk tier (SQLite)
+    
+    # Request coalescing: concurrent identical uploads share one upstream call
+    SINGLEFLIGHT_ENABLED = os.getenv('SINGLEFLIGHT_ENABLED', 'True').lower() == 'true'
+    
+    # Near-duplicate lookup (perceptual hash)
+    PHASH_ENABLED = os.getenv('PHASH_ENABLED', 'True').lower() == 'true'
+    PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 6))  # Bits out of 64
+    
+    # Searchable history of analyses (GET /api/search)
+    SEARCH_ENABLED = os.getenv('SEARCH_ENABLED', 'True').lower() == 'true'
+    SEARCH_DB_PATH = os.getenv('SEARCH_DB_PATH', str(DATA_DIR / 'search.sqlite3'))
+    SEARCH_DIMENSIONS = int(os.getenv('SEARCH_DIMENSIONS', 512))  # Hash buckets: bytes per entry in memory
+    SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', 100))
     
     # Model Configuration
 
@@ -32,3 +184,9 @@ class Config:
         'temperature': 0.7,
         'max_tokens': 2048,
     }
+    
+    # Structured output: OpenAI responses are held to a JSON schema of the fields
+    # (needs a model that supports json_schema, e.g. gpt-4o-mini)
+    STRUCTURED_OUTPUT = os.getenv('STRUCTURED_OUTPUT', 'True').lower() == 'true'
+    # Follow-up calls asking only for the fields a response lacked (0 = fail the analysis instead)
+    MISSING_FIELD_RETRIES = int(os.getenv('MISSING_FIELD_RETRIES', 1))
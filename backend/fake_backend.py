@@ -0,0 +1,267 @@
+"""
+Deterministic in-process stand-in for the OpenAI API (ANALYSIS_BACKEND=fake).
+
+The fake sits at the HTTP transport, so the real client stack (flow control,
+retries, SDK parsing, metrics hooks) still runs and is measured; only the
+network and the model are replaced. Latency, errors, truncation and response
+size are drawn from a generator seeded by FAKE_SEED and the request body, so
+the same requests get the same answers however they are scheduled. A
+structured-output request is answered with exactly the fields its schema
+requires. With FAKE_SECONDS_PER_TOKEN, latency grows with the completion
+length the way a model's decoding time does, and answers longer than
+max_tokens are cut off.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import httpx
+from config import Config
+
+STREAM_CHUNKS = 20
+IMAGE_TOKENS = 765  # Reported per image part; a 1024px high-detail tile count
+
+_WORDS = (
+    'a the light morning quiet street river old tree window child dog market red blue soft warm '
+    'cold evening shadow path stone garden bright small tall across beside under near slowly '
+    'while people walk watch stand smile wait bicycle table city hill cloud rain sun'
+).split()
+_FIELDS = ('caption', 'summary', 'objects', 'mood', 'story')
+_SHARES = dict(zip(_FIELDS, (0.05, 0.15, 0.15, 0.05, 0.6)))  # Of the response characters, per field
+
+
+def parse_latency(spec):
+    """
+    Build a latency sampler from a spec string.
+
+    Args:
+        spec: Seconds as '0.8', 'uniform:LOW,HIGH' or 'lognormal:MEDIAN,SIGMA'
+
+    Returns:
+        callable: Takes a random.Random, returns seconds
+    """
+    kind, _, args = str(spec).partition(':')
+    try:
+        if not args:
+            seconds = float(kind)
+            return lambda rng: seconds
+        a, b = (float(value) for value in args.split(','))
+    except ValueError:
+        raise ValueError(f"Invalid latency spec '{spec}'. Use '0.8', 'uniform:0.5,2' or 'lognormal:1.2,0.5'")
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(a, b)
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(a), b)
+    raise ValueError(f"Unknown latency distribution '{kind}'. Choose from: uniform, lognormal")
+
+
+class FakeVisionBackend:
+    """Answers chat completion requests with synthetic analyses after a sampled delay."""
+
+    def __init__(self, latency=None, error_rate=None, response_chars=None, seed=None, truncate_rate=None,
+                 seconds_per_token=None):
+        """
+        Configure the fake.
+
+        Args:
+            latency: Latency spec (see parse_latency) or callable taking a
+                random.Random (defaults to Config)
+            error_rate: Share of completions failed with a 500 (defaults to Config)
+            response_chars: Approximate length of the analysis JSON (defaults to Config)
+            seed: Seed for every random draw (defaults to Config)
+            truncate_rate: Share of answers cut off mid-JSON with
+                finish_reason 'length' (defaults to Config)
+            seconds_per_token: Decoding time added per completion token, on
+                top of the sampled latency (defaults to Config)
+        """
+        latency = Config.FAKE_LATENCY if latency is None else latency
+        self.latency = latency if callable(latency) else parse_latency(latency)
+        self.error_rate = Config.FAKE_ERROR_RATE if error_rate is None else error_rate
+        self.response_chars = response_chars or Config.FAKE_RESPONSE_CHARS
+        self.seed = Config.FAKE_SEED if seed is None else seed
+        self.truncate_rate = Config.FAKE_TRUNCATE_RATE if truncate_rate is None else truncate_rate
+        self.seconds_per_token = Config.FAKE_SECONDS_PER_TOKEN if seconds_per_token is None else seconds_per_token
+        self.request_count = 0
+        self.error_count = 0
+        self.truncated_count = 0
+        self._seen = {}  # Body digest -> times seen, so retries draw anew
+        self._lock = threading.Lock()
+
+    def _draw(self, body):
+        """Random generator for one request, determined by the seed, body and repeat count."""
+        digest = hashlib.sha1(body).hexdigest()
+        with self._lock:
+            self.request_count += 1
+            if len(self._seen) > 100000:
+                self._seen.clear()  # Bounded; only repeat counts of old bodies are lost
+            occurrence = self._seen.get(digest, 0)
+            self._seen[digest] = occurrence + 1
+        return random.Random(f'{self.seed}:{digest}:{occurrence}')
+
+    def content(self, rng, fields=_FIELDS):
+        """Analysis JSON with the given fields, about response_chars characters for all five."""
+        answer = {}
+        for field in fields:
+            target = max(8, int(self.response_chars * _SHARES.get(field, 0.1)))
+            words = []
+            length = 0
+            while length < target:
+                word = rng.choice(_WORDS)
+                words.append(word)
+                length += len(word) + 1
+            text = ' '.join(words).capitalize() + '.'
+            answer[field] = '- ' + text if field == 'objects' else text
+        return json.dumps(answer)
+
+    @staticmethod
+    def _usage(request, content):
+        """Token counts in the shape of response.usage."""
+        prompt_tokens = 0
+        for message in request.get('messages', []):
+            parts = message.get('content')
+            if isinstance(parts, str):
+                parts = [{'type': 'text', 'text': parts}]
+            for part in parts or []:
+                if part.get('type') == 'image_url':
+                    prompt_tokens += IMAGE_TOKENS
+                else:
+                    prompt_tokens += len(part.get('text', '')) // 4
+        completion_tokens = len(content) // 4
+        return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                'total_tokens': prompt_tokens + completion_tokens}
+
+    @staticmethod
+    def _chunk(model, content, finish_reason=None):
+        """One SSE event of a streamed completion."""
+        delta = {'content': content} if content is not None else {}
+        body = {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+        return f'data: {json.dumps(body)}\n\n'.encode('utf-8')
+
+    def _plan(self, request):
+        """
+        Decide how to answer a request.
+
+        Returns:
+            tuple: (seconds to wait, httpx.Response or None, stream pieces or None);
+            exactly one of the last two is set
+        """
+        if request.method == 'GET' and request.url.path.rstrip('/').endswith('/models'):
+            return 0.0, httpx.Response(200, json={'object': 'list', 'data': []}), None
+        if not request.url.path.endswith('/chat/completions'):
+            return 0.0, httpx.Response(404, json={'error': {'message': 'not found'}}), None
+
+        body = request.content
+        payload = json.loads(body or b'{}')
+        rng = self._draw(body)
+        latency = max(0.0, self.latency(rng))
+        if rng.random() < self.error_rate:
+            with self._lock:
+                self.error_count += 1
+            error = {'error': {'message': 'Internal server error', 'type': 'server_error'}}
+            return latency, httpx.Response(500, json=error), None
+
+        model = payload.get('model', 'fake')
+        schema = (payload.get('response_format') or {}).get('json_schema', {}).get('schema', {})
+        content = self.content(rng, schema.get('required') or _FIELDS)
+        finish_reason = 'stop'
+        max_chars = (payload.get('max_tokens') or len(content)) * 4
+        if self.truncate_rate and rng.random() < self.truncate_rate:
+            # Ran out of max_tokens somewhere in the object
+            max_chars = min(max_chars, rng.randint(len(content) // 4, len(content) - 2))
+        if len(content) > max_chars:
+            content = content[:max_chars]
+            finish_reason = 'length'
+            with self._lock:
+                self.truncated_count += 1
+        latency += len(content) // 4 * self.seconds_per_token
+        if payload.get('stream'):
+            step = max(1, -(-len(content) // STREAM_CHUNKS))
+            pieces = [self._chunk(model, content[i:i + step]) for i in range(0, len(content), step)]
+            pieces.append(self._chunk(model, None, finish_reason))
+            if (payload.get('stream_options') or {}).get('include_usage'):
+                # Last event before [DONE]: no choices, the usage of the whole stream
+                usage = {'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                         'model': model, 'choices': [], 'usage': self._usage(payload, content)}
+                pieces[-1] += f'data: {json.dumps(usage)}\n\n'.encode('utf-8')
+            pieces[-1] += b'data: [DONE]\n\n'
+            return latency, None, pieces
+
+        completion = {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': finish_reason
+            }],
+            'usage': self._usage(payload, content)
+        }
+        return latency, httpx.Response(200, json=completion), None
+
+    def handle(self, request):
+        """httpx.MockTransport handler for httpx.Client."""
+        latency, response, pieces = self._plan(request)
+        if pieces is None:
+            time.sleep(latency)
+            return response
+
+        def stream():
+            for piece in pieces:
+                time.sleep(latency / len(pieces))
+                yield piece
+
+        return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=stream())
+
+    async def handle_async(self, request):
+        """httpx.MockTransport handler for httpx.AsyncClient."""
+        latency, response, pieces = self._plan(request)
+        if pieces is None:
+            await asyncio.sleep(latency)
+            return response
+
+        async def stream():
+            for piece in pieces:
+                await asyncio.sleep(latency / len(pieces))
+                yield piece
+
+        return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=stream())
+
+    def transport(self, is_async=False):
+        """
+        Transport to pass to httpx instead of the network.
+
+        Args:
+            is_async: Transport for httpx.AsyncClient
+
+        Returns:
+            httpx.MockTransport: Transport answering from this fake
+        """
+        return httpx.MockTransport(self.handle_async if is_async else self.handle)
+
+    def stats(self):
+        """Counters for /api/health and benchmarks."""
+        return {'requests': self.request_count, 'errors': self.error_count, 'truncated': self.truncated_count}
+
+
+_fake_backend = None
+_fake_backend_lock = threading.Lock()
+
+
+def get_fake_backend():
+    """Process-wide fake shared by the sync and async clients."""
+    global _fake_backend
+    with _fake_backend_lock:
+        if _fake_backend is None:
+            _fake_backend = FakeVisionBackend()
+        return _fake_backend
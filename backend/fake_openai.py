@@ -0,0 +1,249 @@
+"""
+Local stand-in for the OpenAI chat completions API, used by benchmarks.
+Usage: python fake_openai.py [port] [latency_seconds]
+
+Streamed requests (stream=true) receive the content in STREAM_CHUNKS pieces
+spread evenly over the latency. With rate_limit set, requests beyond that many
+per second are answered 429 with Retry-After, like the real API's throttling,
+and error_rate answers that share of requests with a 500.
+"""
+import math
+import random
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONTENT = json.dumps({
+    'caption': 'A placeholder caption from the fake backend.',
+    'summary': 'A short placeholder summary.',
+    'objects': '- Placeholder object',
+    'mood': 'Calm and synthetic.',
+    'story': 'Once upon a time, a benchmark ran without spending money.'
+})
+STREAM_CHUNKS = 20
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Load tests open hundreds of connections at once
+
+
+class FakeOpenAIServer:
+    """Threaded HTTP server answering /v1/chat/completions after a delay."""
+
+    def __init__(self, latency=0.5, port=0, content=DEFAULT_CONTENT, connect_latency=0.0,
+                 rate_limit=None, error_rate=0.0):
+        """
+        Configure the stub.
+
+        Args:
+            latency: Seconds to wait per request, or a callable returning seconds
+            port: Port to bind on 127.0.0.1 (0 picks a free port)
+            content: Message content returned by every completion
+            connect_latency: Seconds added to each new connection, standing in
+                for the TCP + TLS handshake to a remote API
+            rate_limit: Completions accepted per second (one second of burst);
+                None accepts everything
+            error_rate: Share of completions failed with a 500
+        """
+        self.latency = latency
+        self.content = content
+        self.connect_latency = connect_latency
+        self.request_count = 0
+        self.connection_count = 0
+        self.rate_limit = rate_limit
+        self.throttled_count = 0
+        self.error_rate = error_rate
+        self._allowance = rate_limit or 0.0
+        self._allowance_updated = time.monotonic()
+        self._count_lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', port), self._make_handler())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """Base URL to pass as OPENAI_BASE_URL."""
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        """Serve in a background thread; returns self for chaining."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_latency(self):
+        """Latency for the next request."""
+        return self.latency() if callable(self.latency) else self.latency
+
+    def _count(self):
+        """Record one request and return its sequence number."""
+        with self._count_lock:
+            self.request_count += 1
+            return self.request_count
+
+    def _admit(self):
+        """
+        Take one request from the rate limit.
+
+        Returns:
+            float: None if admitted, else seconds until a request would be
+        """
+        if not self.rate_limit:
+            return None
+        with self._count_lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate_limit, self._allowance
+                                  + (now - self._allowance_updated) * self.rate_limit)
+            self._allowance_updated = now
+            if self._allowance >= 1:
+                self._allowance -= 1
+                return None
+            self.throttled_count += 1
+            return (1 - self._allowance) / self.rate_limit
+
+    def _count_connection(self):
+        """Record one accepted connection."""
+        with self._count_lock:
+            self.connection_count += 1
+
+    def completion_body(self, model):
+        """JSON body of a chat completion response."""
+        return {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.content},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 850, 'completion_tokens': 300, 'total_tokens': 1150}
+        }
+
+    def chunk_body(self, model, content, finish_reason=None):
+        """JSON body of one streamed chat completion chunk."""
+        delta = {'content': content} if content is not None else {}
+        return {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]
+        }
+
+    def _make_handler(self):
+        """Build the request handler class bound to this server."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                stub._count_connection()
+                if stub.connect_latency:
+                    time.sleep(stub.connect_latency)
+
+            def _send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client cancelled the request (e.g. a losing hedge)
+                    self.close_connection = True
+
+            def _write_chunk(self, data):
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+            def _send_stream(self, model, latency, include_usage=False):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                step = max(1, -(-len(stub.content) // STREAM_CHUNKS))
+                pieces = [stub.content[i:i + step] for i in range(0, len(stub.content), step)]
+                try:
+                    for piece in pieces:
+                        time.sleep(latency / len(pieces))
+                        event = json.dumps(stub.chunk_body(model, piece))
+                        self._write_chunk(f'data: {event}\n\n'.encode('utf-8'))
+                    event = json.dumps(stub.chunk_body(model, None, 'stop'))
+                    self._write_chunk(f'data: {event}\n\n'.encode('utf-8'))
+                    if include_usage:
+                        usage = dict(stub.chunk_body(model, None), choices=[],
+                                     usage=stub.completion_body(model)['usage'])
+                        self._write_chunk(f'data: {json.dumps(usage)}\n\n'.encode('utf-8'))
+                    self._write_chunk(b'data: [DONE]\n\n')
+                    self._write_chunk(b'')
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client cancelled the stream
+                    self.close_connection = True
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/models'):
+                    self._send_json(200, {'object': 'list', 'data': []})
+                else:
+                    self._send_json(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+                stub._count()
+                wait = stub._admit()
+                if wait is not None:
+                    self._send_json(429, {'error': {
+                        'message': 'Rate limit reached for requests', 'type': 'requests',
+                        'code': 'rate_limit_exceeded'
+                    }}, headers={'Retry-After': str(math.ceil(wait)),
+                                 'retry-after-ms': str(math.ceil(wait * 1000))})
+                    return
+                if stub.error_rate and random.random() < stub.error_rate:
+                    self._send_json(500, {'error': {'message': 'Internal server error', 'type': 'server_error'}})
+                    return
+                if request.get('stream'):
+                    self._send_stream(request.get('model', 'fake'), stub._next_latency(),
+                                      (request.get('stream_options') or {}).get('include_usage', False))
+                    return
+                time.sleep(stub._next_latency())
+                self._send_json(200, stub.completion_body(request.get('model', 'fake')))
+
+        return Handler
+
+
+def main():
+    """Run the stub in the foreground."""
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8089
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    server = FakeOpenAIServer(latency=latency, port=port)
+    print(f"Fake OpenAI API on {server.base_url} ({latency}s per request)")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,90 @@
 """
 Gemini API client for vision-language tasks.
 """
-import google.generativeai as genai
 from config import Config
+from rate_limit import AsyncConcurrencyLimiter, ConcurrencyLimiter, RetryState, get_flow_control
+import metrics
+import asyncio
 import time
 
+def _generation_config():
+    """Config.GENERATION_CONFIG in Gemini's terms."""
+    return {
+        'temperature': Config.GENERATION_CONFIG['temperature'],
+        'max_output_tokens': Config.GENERATION_CONFIG['max_tokens']
+    }
+
+def _image_part(image):
+    """
+    Content part for an image.
+    
+    Args:
+        image: PreparedImage or PIL.Image object
+    
+    Returns:
+        Inline data for a PreparedImage (its payload is sent as-is), else the image
+    """
+    if hasattr(image, 'payload'):
+        return {'mime_type': image.mime_type, 'data': image.payload}
+    return image
+
+def _response_text(response):
+    """Text of a response, or a placeholder when it was blocked."""
+    try:
+        text = response.text
+    except ValueError:
+        # No candidates: .text raises instead of returning empty
+        text = None
+    if not text:
+        if hasattr(response, 'prompt_feedback'):
+            return f"[Response blocked: {response.prompt_feedback}]"
+        return "[No response generated]"
+    return text.strip()
+
 class GeminiClient:
     """Client for interacting with Google Gemini API."""
     
     def __init__(self):
         """Initialize Gemini client."""
+        self.model_name = Config.GEMINI_MODEL_NAME
+        # Same flow control as the OpenAI client, with Gemini's own limits and counters
+        self.flow = get_flow_control('gemini')
+        self.gate = self._make_gate()
+        if Config.ANALYSIS_BACKEND == 'replay':
+            # Answers come from the recording: no key or SDK needed
+            from record_replay import GeminiReplayer, get_archive
+            self.model = GeminiReplayer(get_archive(), self.model_name, _generation_config())
+            return
+        
         if not Config.GEMINI_API_KEY:
             raise ValueError("GEMINI_API_KEY not found in environment variables")
         
+        # Optional dependency: only needed when 'gemini' is in PROVIDERS
+        try:
+            import google.generativeai as genai
+        except ImportError:
+            raise ImportError("The Gemini provider needs: pip install google-generativeai")
+        
         genai.configure(api_key=Config.GEMINI_API_KEY)
         self.model = genai.GenerativeModel(
-            model_name=Config.MODEL_NAME,
-            generation_config=Config.GENERATION_CONFIG,
+            model_name=self.model_name,
+            generation_config=_generation_config(),
             safety_settings=Config.SAFETY_SETTINGS
         )
+        if Config.ANALYSIS_BACKEND == 'record':
+            from record_replay import GeminiRecorder, get_archive
+            self.model = GeminiRecorder(self.model, get_archive(), self.model_name, _generation_config())
+    
+    def _make_gate(self):
+        """Concurrency limiter for this client's calls."""
+        return ConcurrencyLimiter(self.flow.controller, count=self.flow.in_flight)
     
     def analyze_image(self, image, prompt):
         """
-        Analyze image with given prompt.
+        Analyze image with given prompt (a single attempt).
         
         Args:
-            image: PIL.Image object
+            image: PreparedImage or PIL.Image object
             prompt: Text prompt for analysis
             
         Returns:
@@ -33,42 +92,103 @@ class GeminiClient:
         """
         try:
             # Generate content
-            response = self.model.generate_content([prompt, image])
+            response = self.model.generate_content([prompt, _image_part(image)])
+            return _response_text(response)
+            
+        except Exception as e:
+            raise Exception(f"Gemini API error: {str(e)}") from e
+    
+    def analyze_with_retry(self, image, prompt, max_retries=None, fields=None, model=None):
+        """
+        Analyze image under Gemini's rate limits, retrying retryable errors.
+        
+        Same policy as OpenAIClient._create: RPM limiter, AIMD concurrency
+        slot, decorrelated jitter and the retry budget. Bad requests and
+        authentication errors are raised at once, so the router can fail over.
+        
+        Args:
+            image: PreparedImage or PIL.Image object
+            prompt: Text prompt
+            max_retries: Maximum number of attempts (defaults to Config)
+            fields: Unused; Gemini is asked for the fields by the prompt alone
+            model: Unused; Gemini runs GEMINI_MODEL_NAME whatever the tier, so tiering
+                keeps its answers without escalating them (see tiering.py)
             
-            # Handle blocked responses
-            if not response.text:
-                if hasattr(response, 'prompt_feedback'):
-                    return f"[Response blocked: {response.prompt_feedback}]"
-                return "[No response generated]"
+        Returns:
+            str: Generated response
+        """
+        contents = [prompt, _image_part(image)]
+        retry = RetryState(self.flow, max_retries)
+        while True:
+            self.flow.limiter.acquire(0)
+            try:
+                with self.gate:
+                    sent_at = time.monotonic()
+                    response = self.model.generate_content(contents)
+                self.flow.controller.on_success()
+                return _response_text(response)
+            except Exception as e:
+                delay = retry.backoff(e, sent_at)
+                if delay is None:
+                    raise Exception(f"Gemini API error: {str(e)}") from e
+                metrics.RETRIES.inc(1, type(e).__name__)
+                print(f"Gemini retry attempt {retry.attempt - 1} after {delay:.1f}s ({type(e).__name__})...")
+                time.sleep(delay)
+
+class AsyncGeminiClient(GeminiClient):
+    """Asyncio variant of GeminiClient."""
+    
+    def _make_gate(self):
+        """Concurrency limiter for this client's coroutines, sharing the sync client's count."""
+        return AsyncConcurrencyLimiter(self.flow.controller, maximum=Config.ASYNC_MAX_IN_FLIGHT, count=self.flow.in_flight)
+    
+    async def analyze_image(self, image, prompt):
+        """
+        Analyze image with given prompt without blocking the event loop.
+        
+        Args:
+            image: PreparedImage or PIL.Image object
+            prompt: Text prompt for analysis
             
-            return response.text.strip()
+        Returns:
+            str: Generated text response
+        """
+        try:
+            response = await self.model.generate_content_async([prompt, _image_part(image)])
+            return _response_text(response)
             
         except Exception as e:
-            raise Exception(f"Gemini API error: {str(e)}")
+            raise Exception(f"Gemini API error: {str(e)}") from e
     
-    def analyze_with_retry(self, image, prompt, max_retries=3):
+    async def analyze_with_retry(self, image, prompt, max_retries=None, fields=None, model=None):
         """
-        Analyze image with retry logic.
+        Coroutine version of GeminiClient.analyze_with_retry.
         
         Args:
-            image: PIL.Image object
+            image: PreparedImage or PIL.Image object
             prompt: Text prompt
-            max_retries: Maximum number of retry attempts
+            max_retries: Maximum number of attempts (defaults to Config)
+            fields: Unused; Gemini is asked for the fields by the prompt alone
+            model: Unused; Gemini runs GEMINI_MODEL_NAME whatever the tier, so tiering
+                keeps its answers without escalating them (see tiering.py)
             
         Returns:
             str: Generated response
         """
-        last_error = None
-        
-        for attempt in range(max_retries):
+        contents = [prompt, _image_part(image)]
+        retry = RetryState(self.flow, max_retries)
+        while True:
+            await self.flow.limiter.acquire_async(0)
             try:
-                return self.analyze_image(image, prompt)
+                async with self.gate:
+                    sent_at = time.monotonic()
+                    response = await self.model.generate_content_async(contents)
+                self.flow.controller.on_success()
+                return _response_text(response)
             except Exception as e:
-                last_error = e
-                if attempt < max_retries - 1:
-                    # Exponential backoff
-                    wait_time = (2 ** attempt) * 1
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    raise last_error
+                delay = retry.backoff(e, sent_at)
+                if delay is None:
+                    raise Exception(f"Gemini API error: {str(e)}") from e
+                metrics.RETRIES.inc(1, type(e).__name__)
+                print(f"Gemini retry attempt {retry.attempt - 1} after {delay:.1f}s ({type(e).__name__})...")
+                await asyncio.sleep(delay)
@@ -0,0 +1,49 @@
+"""
+Gunicorn settings for production: pre-forked workers sharing a preloaded app.
+Usage (from backend/): gunicorn app:app
+
+Gunicorn reads this file by default. The master imports the app once and
+preloads the pipeline and Pillow plugins (app.preload()), then forks the
+workers, which share those pages copy-on-write. Workers share results
+through the SQLite disk tier of the cache.
+
+Graceful restart: kill -HUP <master pid> starts new workers and gives the
+old ones graceful_timeout to finish in-flight analyses and running jobs.
+SIGTERM stops the server the same way. The code is preloaded, so new code
+needs a restart of the master.
+"""
+import os
+from pathlib import Path
+from config import Config
+
+# app.py preloads instead of starting threads in the master
+Config.PREFORK = True
+# One result cache for all workers, rather than one in-memory cache each
+if Config.CACHE_DB_PATH is None:
+    Config.CACHE_DB_PATH = str(Path(__file__).parent / 'cache.sqlite3')
+
+bind = f'0.0.0.0:{Config.PORT}'
+workers = Config.WEB_WORKERS or os.cpu_count() or 1
+# Threads per worker: requests mostly wait on the upstream API
+worker_class = 'gthread'
+threads = Config.WEB_THREADS
+preload_app = True
+# In-flight analyses get their full timeout to finish on restart or shutdown
+graceful_timeout = int(Config.ANALYZE_TIMEOUT_SECONDS) + 10
+timeout = 60  # Heartbeat: a worker silent this long is restarted
+keepalive = 5
+max_requests = Config.WEB_MAX_REQUESTS
+max_requests_jitter = Config.WEB_MAX_REQUESTS // 10
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    """Start the worker's own warm-up and job workers."""
+    import app
+    app.start_background_tasks()
+
+
+def worker_exit(server, worker):
+    """Let running jobs finish before the worker goes (they would be retried otherwise)."""
+    import app
+    app.stop_background_tasks(timeout=graceful_timeout)
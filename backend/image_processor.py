@@ -5,10 +5,312 @@ import io
 import base64
 from PIL import Image
 from config import Config
+from resolution import estimate_image_tokens, fit_within, get_encoding_profile, plan_resolution
+import keyframes
+import metrics
+
+# Filters for the final downscale: (filter, reducing_gap). With a reducing gap,
+# resize() first shrinks by an integer factor with reduce() (box averaging),
+# leaving at most that factor for the filter, which is much cheaper on big images
+RESAMPLE_FILTERS = {
+    'lanczos': (Image.Resampling.LANCZOS, None),  # Sharpest, slowest
+    'bicubic': (Image.Resampling.BICUBIC, None),
+    'bilinear': (Image.Resampling.BILINEAR, None),
+    'reduce+lanczos': (Image.Resampling.LANCZOS, 3.0),
+    'reduce+bilinear': (Image.Resampling.BILINEAR, 2.0),  # Fastest; fine at the sizes we send
+}
+
+# PIL warns above this and refuses twice this; check_pixels() refuses above it
+Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+
+# JPEG segments a passed-through upload keeps: those that change how it decodes.
+# Every other APPn and COM segment may carry EXIF (GPS, maker notes), XMP or IPTC
+JPEG_KEPT_SEGMENTS = {0xE0: b'JFIF', 0xE2: b'ICC_PROFILE\0', 0xEE: b'Adobe'}
+
+def check_pixels(size):
+    """
+    Refuse images whose declared dimensions are over MAX_IMAGE_PIXELS.
+    
+    Args:
+        size: (width, height) from the image header
+        
+    Raises:
+        PIL.Image.DecompressionBombError: If the image is too large to decode
+    """
+    width, height = size
+    if width * height > Config.MAX_IMAGE_PIXELS:
+        raise Image.DecompressionBombError(
+            f"{width}x{height} is over the {Config.MAX_IMAGE_PIXELS / 1e6:g} megapixel limit"
+        )
+
+def strip_jpeg_metadata(data):
+    """
+    Cut metadata segments out of a JPEG, leaving its compressed data untouched.
+    
+    Data after the end-of-image marker (e.g. the secondary images of an MPO,
+    with EXIF of their own) is dropped too.
+    
+    Args:
+        data: JPEG file bytes
+        
+    Returns:
+        bytes: The JPEG without metadata, or None if its segments cannot be walked
+    """
+    if data[:2] != b'\xff\xd8':
+        return None
+    kept = [data[:2]]
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # Fill byte
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # No length field
+            kept.append(data[pos:pos + 2])
+            pos += 2
+            continue
+        if marker == 0xD9:
+            return None
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], 'big')
+        if end > len(data) or end < pos + 4:
+            return None
+        if marker == 0xDA:
+            # Start of scan: markers no longer carry metadata; 0xFFD9 only occurs as the end of image
+            eoi = data.find(b'\xff\xd9', end)
+            kept.append(data[pos:] if eoi == -1 else data[pos:eoi + 2])
+            return b''.join(kept)
+        if marker in JPEG_KEPT_SEGMENTS:
+            if data[pos + 4:end].startswith(JPEG_KEPT_SEGMENTS[marker]):
+                kept.append(data[pos:end])
+        elif not (0xE1 <= marker <= 0xEF or marker == 0xFE):
+            kept.append(data[pos:end])
+        pos = end
+    return None
+
+def get_resample_filter(name=None):
+    """
+    Resolve a resampling filter name.
+    
+    Args:
+        name: Key of RESAMPLE_FILTERS, or None for Config.RESAMPLE_FILTER
+        
+    Returns:
+        tuple: (Pillow filter, reducing_gap or None)
+    """
+    name = (name or Config.RESAMPLE_FILTER).lower()
+    if name not in RESAMPLE_FILTERS:
+        raise ValueError(
+            f"Unknown resample filter '{name}'. Options: {', '.join(RESAMPLE_FILTERS)}"
+        )
+    return RESAMPLE_FILTERS[name]
+
+class PreparedImage:
+    """An upload decoded once and encoded at most once for the vision API."""
+    
+    THUMBNAIL_SIZE = 256  # Long edge of the preview used for perceptual hashing
+    DRAFT_TOLERANCE = 0.9  # JPEG draft decoding may undershoot the target by 10%
+    MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+    
+    def __init__(self, payload, size, format='JPEG', detail='auto', image=None,
+                 thumbnail=None, passthrough=False, keyframes=None):
+        """
+        Initialize prepared image.
+        
+        Args:
+            payload: Encoded image bytes sent upstream
+            size: (width, height) of the payload
+            format: Pillow format name of the payload
+            detail: Vision 'detail' level to request
+            image: Decoded RGB image, if already in memory
+            thumbnail: Small decoded preview, if already in memory
+            passthrough: True when payload is the unmodified upload
+            keyframes: Frame indices tiled into the payload, for animated uploads
+        """
+        self.payload = payload
+        self.size = tuple(size)
+        self.format = format
+        self.detail = detail
+        self.mode = 'RGB'
+        self.passthrough = passthrough
+        self.keyframes = keyframes
+        self._image = image
+        self._thumbnail = thumbnail
+    
+    @property
+    def frames(self):
+        """Number of animation frames shown in the payload."""
+        return len(self.keyframes) if self.keyframes else 1
+    
+    @property
+    def mime_type(self):
+        """MIME type of the payload."""
+        return self.MIME_TYPES[self.format]
+    
+    def estimated_tokens(self, model=None):
+        """Estimated image input tokens for this payload."""
+        return estimate_image_tokens(self.size, self.detail, model)
+    
+    @property
+    def image(self):
+        """Full-resolution RGB image, decoded from the payload on first access."""
+        if self._image is None:
+            self._image = Image.open(io.BytesIO(self.payload))
+            self._image.load()
+        return self._image
+    
+    @property
+    def thumbnail(self):
+        """Small RGB preview for hashing, derived without a second full decode."""
+        if self._thumbnail is None:
+            factor = max(1, max(self.size) // self.THUMBNAIL_SIZE)
+            self._thumbnail = self.image.reduce(factor)
+        return self._thumbnail
+    
+    def __getstate__(self):
+        # Pixels can be re-decoded from the payload; don't ship them between processes
+        state = self.__dict__.copy()
+        state['_thumbnail'] = self.thumbnail
+        state['_image'] = None
+        return state
 
 class ImageProcessor:
     """Handle image validation, preprocessing, and conversion."""
     
+    @staticmethod
+    def ingest(file_data, profile=None, resample=None):
+        """
+        Validate, decode and encode an upload in a single pass.
+        
+        The header is read once and the target resolution is planned from
+        the encoding profile. Uploads already in the profile's format, RGB
+        and within the target are passed through without re-encoding, minus
+        their metadata (EXIF, GPS, XMP), as a re-encode would drop it; larger JPEGs
+        are shrunk during decode with Image.draft() (DCT scaling) before the
+        final resize. Animations are replaced by a contact sheet of their
+        most distinct frames (keyframes.py). Everything else is decoded once
+        and encoded once.
+        
+        Args:
+            file_data: File-like object or bytes
+            profile: Encoding profile dict or name (defaults to Config)
+            resample: Resampling filter name (defaults to Config.RESAMPLE_FILTER)
+            
+        Returns:
+            PreparedImage: Payload and decoded pixels
+            
+        Raises:
+            ValueError: If the upload is empty, too large or not an image
+        """
+        profile = get_encoding_profile(profile)
+        resample, reducing_gap = get_resample_filter(resample)
+        data = ImageProcessor._read_bytes(file_data)
+        metrics.BYTES.inc(len(data), 'upload')
+        
+        if len(data) > Config.MAX_IMAGE_SIZE_BYTES:
+            raise ValueError(f"Image too large. Max size: {Config.MAX_IMAGE_SIZE_MB}MB")
+        if not data:
+            raise ValueError("Empty file")
+        
+        try:
+            with metrics.span('validate'):
+                img = Image.open(io.BytesIO(data))
+                width, height = img.size
+                check_pixels(img.size)
+                target = plan_resolution((width, height), profile)
+            
+            frames = None
+            if Config.KEYFRAME_COUNT > 1 and keyframes.is_animated(img):
+                # One image for the whole animation; never passed through
+                with metrics.span('keyframes'):
+                    img, frames = keyframes.keyframe_sheet(img)
+                width, height = img.size
+                target = plan_resolution((width, height), profile)
+            
+            payload = None
+            if (img.format == profile['format'] and img.mode == 'RGB'
+                    and width <= target[0] and height <= target[1]):
+                payload = ImageProcessor._passthrough_payload(data, img)
+            if payload is not None:
+                # Already suitable: send the upload as is, decode only a reduced preview
+                with metrics.span('preprocess'):
+                    ratio = min(1.0, PreparedImage.THUMBNAIL_SIZE / max(width, height))
+                    img.draft('RGB', (max(1, int(width * ratio)), max(1, int(height * ratio))))
+                    img.load()
+                return PreparedImage(
+                    payload, (width, height), profile['format'], profile['detail'],
+                    thumbnail=img, passthrough=True
+                )
+            
+            with metrics.span('preprocess'):
+                if img.format == 'JPEG' and (width > target[0] or height > target[1]):
+                    # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 while decoding;
+                    # landing slightly under the target beats decoding at full size
+                    tolerance = PreparedImage.DRAFT_TOLERANCE
+                    img.draft('RGB', (int(target[0] * tolerance), int(target[1] * tolerance)))
+                
+                img = ImageProcessor._to_rgb(img)
+                if img.width > target[0] or img.height > target[1]:
+                    img = img.resize(fit_within(img.size, *target), resample, reducing_gap=reducing_gap)
+            
+            with metrics.span('encode'):
+                buffer = io.BytesIO()
+                img.save(buffer, format=profile['format'], quality=profile['quality'])
+            return PreparedImage(
+                buffer.getvalue(), img.size, profile['format'], profile['detail'], image=img,
+                keyframes=frames
+            )
+        except Image.DecompressionBombError as e:
+            raise ValueError(f"Image too large: {str(e)}")
+        except Exception as e:
+            raise ValueError(f"Invalid image format: {str(e)}")
+    
+    @staticmethod
+    def _passthrough_payload(data, img):
+        """
+        An upload's bytes to send without re-encoding, stripped of metadata.
+        
+        Returns:
+            bytes: Payload, or None if the upload must be re-encoded instead
+                (metadata that cannot be cut out, or a JPEG that cannot be parsed)
+        """
+        if img.format == 'JPEG':
+            return strip_jpeg_metadata(data)
+        if any(key in img.info for key in ('exif', 'xmp', 'XML:com.adobe.xmp')):
+            return None
+        return data
+    
+    @staticmethod
+    def _read_bytes(file_data):
+        """Read an upload into bytes exactly once."""
+        if isinstance(file_data, (bytes, bytearray)):
+            return bytes(file_data)
+        if hasattr(file_data, 'seek'):
+            file_data.seek(0)
+        return file_data.read()
+    
+    @staticmethod
+    def _to_rgb(img):
+        """
+        Convert to RGB, compositing transparency onto white.
+        
+        Args:
+            img: PIL.Image in any mode
+            
+        Returns:
+            PIL.Image: Decoded RGB image
+        """
+        if img.mode == 'RGB':
+            img.load()
+            return img
+        if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[3])  # Use alpha channel as mask
+            return background
+        return img.convert('RGB')
+    
     @staticmethod
     def validate_image(file_data):
         """
@@ -105,6 +407,26 @@ class ImageProcessor:
         img.save(buffer, format=format, quality=95)
         return buffer.getvalue()
     
+    @staticmethod
+    def decode_base64(base64_string):
+        """
+        Decode base64 image data to bytes without decoding the image itself.
+        
+        Args:
+            base64_string: Base64 encoded image (with or without data URI prefix)
+            
+        Returns:
+            bytes: Image file data
+        """
+        # Remove data URI prefix if present
+        if ',' in base64_string:
+            base64_string = base64_string.split(',')[1]
+        
+        try:
+            return base64.b64decode(base64_string)
+        except Exception as e:
+            raise ValueError(f"Invalid base64 image data: {str(e)}")
+    
     @staticmethod
     def base64_to_image(base64_string):
         """
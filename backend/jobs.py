@@ -0,0 +1,393 @@
+"""
+Background analysis jobs: a persistent SQLite queue drained by local worker threads.
+Usage: python jobs.py [workers]  (standalone worker process for the same queue)
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from config import Config
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+FINISH_ATTEMPTS = 3  # Writes of a job's outcome before leaving it to the lease
+
+
+class JobQueue:
+    """
+    Job store shared by every process using the same SQLite file.
+
+    Jobs are claimed highest priority first, then oldest first. A claimed job
+    holds a lease that its worker renews while the analysis runs; if the
+    worker dies, the job is queued again once the lease expires, up to
+    JOBS_MAX_ATTEMPTS attempts. Uploads with the same bytes
+    share one job while it is pending or its result is kept.
+    """
+
+    def __init__(self, db_path=None, lease_seconds=None, max_attempts=None, result_ttl=None):
+        """
+        Open (or create) the job store.
+
+        Args:
+            db_path: Path of the SQLite file (defaults to Config)
+            lease_seconds: How long a job is held without a renewal (defaults to Config)
+            max_attempts: Attempts before a job is failed for good (defaults to Config)
+            result_ttl: Seconds finished jobs are kept (defaults to Config)
+        """
+        self.db_path = db_path or Config.JOBS_DB_PATH
+        self.lease_seconds = lease_seconds or Config.JOBS_LEASE_SECONDS
+        self.max_attempts = max_attempts or Config.JOBS_MAX_ATTEMPTS
+        self.result_ttl = result_ttl or Config.JOBS_RESULT_TTL_SECONDS
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)  # Notified when a job of this process ends
+        self._work = threading.Condition()  # Wakes an idle worker of this process
+
+        # Autocommit; claims use explicit IMMEDIATE transactions
+        self._db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id TEXT PRIMARY KEY, status TEXT NOT NULL, priority INTEGER NOT NULL, '
+            'image_hash TEXT NOT NULL, payload BLOB, result TEXT, error TEXT, '
+            'attempts INTEGER NOT NULL DEFAULT 0, lease_expires REAL, '
+            'created_at REAL NOT NULL, started_at REAL, finished_at REAL)'
+        )
+        self._db.execute(
+            'CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, created_at)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS jobs_image_hash ON jobs (image_hash)')
+        self.purge()
+
+    def submit(self, data, priority=0):
+        """
+        Queue an analysis of an upload, or join an existing job for the same bytes.
+
+        Args:
+            data: Raw image file bytes
+            priority: Higher runs first
+
+        Returns:
+            tuple: (job id, deduplicated)
+        """
+        image_hash = hashlib.sha256(data).hexdigest()
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._db.execute(
+                    'SELECT id, status, priority FROM jobs WHERE image_hash = ? AND status != ? '
+                    'AND (finished_at IS NULL OR finished_at >= ?) ORDER BY created_at DESC LIMIT 1',
+                    (image_hash, FAILED, now - self.result_ttl)
+                ).fetchone()
+                if row is not None:
+                    job_id, status, current = row
+                    if status == QUEUED and priority > current:
+                        # The more urgent submission decides where it sits in the queue
+                        self._db.execute('UPDATE jobs SET priority = ? WHERE id = ?', (priority, job_id))
+                    self._db.execute('COMMIT')
+                    return job_id, True
+
+                job_id = uuid.uuid4().hex
+                self._db.execute(
+                    'INSERT INTO jobs (id, status, priority, image_hash, payload, created_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (job_id, QUEUED, priority, image_hash, data, now)
+                )
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        with self._work:
+            self._work.notify()
+        return job_id, False
+
+    def claim(self):
+        """
+        Take the next job, requeueing jobs whose worker stopped renewing its lease.
+
+        Returns:
+            tuple: (job id, attempt, payload bytes) or None if nothing is queued
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._recover_expired(now)
+                row = self._db.execute(
+                    'SELECT id, attempts, payload FROM jobs WHERE status = ? '
+                    'ORDER BY priority DESC, created_at LIMIT 1',
+                    (QUEUED,)
+                ).fetchone()
+                if row is None:
+                    self._db.execute('COMMIT')
+                    return None
+                job_id, attempts, payload = row
+                self._db.execute(
+                    'UPDATE jobs SET status = ?, attempts = ?, lease_expires = ?, started_at = ? '
+                    'WHERE id = ?',
+                    (RUNNING, attempts + 1, now + self.lease_seconds, now, job_id)
+                )
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return job_id, attempts + 1, bytes(payload)
+
+    def renew(self, job_id, attempt):
+        """
+        Extend the lease of a running job while its analysis goes on.
+
+        Args:
+            job_id: Job id returned by claim()
+            attempt: Attempt number returned by claim()
+
+        Returns:
+            bool: False if the lease was already lost to another attempt
+        """
+        with self._lock:
+            return self._db.execute(
+                'UPDATE jobs SET lease_expires = ? WHERE id = ? AND status = ? AND attempts = ?',
+                (time.time() + self.lease_seconds, job_id, RUNNING, attempt)
+            ).rowcount > 0
+
+    def _recover_expired(self, now):
+        """Requeue (or give up on) running jobs whose lease ran out. Caller holds a transaction."""
+        self._db.execute(
+            'UPDATE jobs SET status = ?, error = ?, payload = NULL, finished_at = ? '
+            'WHERE status = ? AND lease_expires < ? AND attempts >= ?',
+            (FAILED, 'Worker stopped before finishing the job', now, RUNNING, now, self.max_attempts)
+        )
+        recovered = self._db.execute(
+            'UPDATE jobs SET status = ?, lease_expires = NULL WHERE status = ? AND lease_expires < ?',
+            (QUEUED, RUNNING, now)
+        ).rowcount
+        if recovered:
+            print(f"Requeued {recovered} job(s) from a stopped worker")
+
+    def finish(self, job_id, attempt, results=None, error=None):
+        """
+        Store the outcome of a claimed job.
+
+        Ignored if the lease was lost and the job was claimed again since
+        (a requeued job that nobody has claimed yet takes the result).
+
+        Args:
+            job_id: Job id returned by claim()
+            attempt: Attempt number returned by claim()
+            results: Analysis results
+            error: Error message if the analysis failed
+        """
+        status = FAILED if error is not None else DONE
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, payload = NULL, '
+                'lease_expires = NULL, finished_at = ? WHERE id = ? AND status IN (?, ?) AND attempts = ?',
+                (status, json.dumps(results) if results is not None else None, error,
+                 time.time(), job_id, RUNNING, QUEUED, attempt)
+            )
+            self._finished.notify_all()
+
+    def get(self, job_id):
+        """
+        Look up a job.
+
+        Returns:
+            dict: Public view of the job, or None if unknown
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT id, status, priority, attempts, created_at, started_at, finished_at, '
+                'result, error FROM jobs WHERE id = ?',
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, priority, attempts, created_at, started_at, finished_at, result, error = row
+        job = {
+            'job_id': job_id,
+            'status': status,
+            'priority': priority,
+            'attempts': attempts,
+            'created_at': created_at,
+            'started_at': started_at,
+            'finished_at': finished_at
+        }
+        if result is not None:
+            job['results'] = json.loads(result)
+        if error is not None:
+            job['error'] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """
+        Long-poll a job until it finishes or the timeout passes.
+
+        Jobs finished by this process wake the caller at once; jobs run by
+        other processes are noticed by re-reading the store periodically.
+
+        Args:
+            job_id: Job id
+            timeout: Seconds to wait at most
+
+        Returns:
+            dict: Job as returned by get(), or None if unknown
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in (DONE, FAILED) or remaining <= 0:
+                return job
+            with self._lock:
+                self._finished.wait(min(remaining, Config.JOBS_POLL_SECONDS))
+
+    def wait_for_work(self, timeout):
+        """Block an idle worker until a job is submitted here or the timeout passes."""
+        with self._work:
+            self._work.wait(timeout)
+
+    def wake_workers(self):
+        """Wake every idle worker of this process."""
+        with self._work:
+            self._work.notify_all()
+
+    def purge(self):
+        """Delete finished jobs older than the result TTL."""
+        with self._lock:
+            self._db.execute(
+                'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+                (DONE, FAILED, time.time() - self.result_ttl)
+            )
+
+    def stats(self):
+        """Job counts by status for /api/health."""
+        with self._lock:
+            rows = self._db.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = {status: 0 for status in (QUEUED, RUNNING, DONE, FAILED)}
+        counts.update(dict(rows))
+        return counts
+
+
+class JobWorkers:
+    """Threads in this process that drain a JobQueue."""
+
+    def __init__(self, queue, analyze, workers=None):
+        """
+        Initialize workers (not started).
+
+        Args:
+            queue: JobQueue to drain
+            analyze: Callable taking upload bytes and returning a results dict
+            workers: Number of worker threads (defaults to Config)
+        """
+        self.queue = queue
+        self.analyze = analyze
+        self.workers = workers or Config.JOBS_WORKERS
+        self._threads = []
+        self._stopping = threading.Event()
+        self._stopped = threading.Event()  # Running jobs are over; the heartbeat may end
+        self._running = set()  # (job id, attempt) of the jobs running here, for the heartbeat
+        self._running_lock = threading.Lock()
+
+    def start(self):
+        """Start the worker threads and their lease heartbeat; returns self for chaining."""
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True).start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop taking jobs and wait for the running ones to finish."""
+        self._stopping.set()
+        self.queue.wake_workers()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._stopped.set()
+
+    def _heartbeat(self):
+        """
+        Renew the leases of the jobs running here, three times per lease.
+
+        However long an analysis takes, its job is only requeued once this
+        process stops renewing it, i.e. once it has died.
+        """
+        while not self._stopped.wait(self.queue.lease_seconds / 3):
+            with self._running_lock:
+                running = list(self._running)
+            for job_id, attempt in running:
+                try:
+                    if not self.queue.renew(job_id, attempt):
+                        print(f"Lost the lease of job {job_id}; its result will be ignored")
+                except sqlite3.Error as e:
+                    print(f"Job queue error renewing job {job_id}: {str(e)}")
+
+    def _run(self):
+        """Worker loop: claim, analyze, record."""
+        while not self._stopping.is_set():
+            try:
+                job = self.queue.claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {str(e)}")
+                job = None
+            if job is None:
+                self.queue.wait_for_work(Config.JOBS_POLL_SECONDS)
+                continue
+
+            job_id, attempt, payload = job
+            with self._running_lock:
+                self._running.add((job_id, attempt))
+            try:
+                results = self.analyze(payload)
+                self._finish(job_id, attempt, results=results, error=results.get('error'))
+            except Exception as e:
+                traceback.print_exc()
+                self._finish(job_id, attempt, error=str(e))
+            finally:
+                with self._running_lock:
+                    self._running.discard((job_id, attempt))
+
+    def _finish(self, job_id, attempt, results=None, error=None):
+        """
+        Store a job's outcome, retrying a busy database a few times.
+
+        A worker must survive a failed write: if every attempt fails, the job
+        stays RUNNING until its lease expires and is then run again.
+        """
+        for retry in range(FINISH_ATTEMPTS):
+            try:
+                self.queue.finish(job_id, attempt, results=results, error=error)
+                return
+            except sqlite3.Error as e:
+                print(f"Job queue error storing job {job_id} (attempt {retry + 1}/{FINISH_ATTEMPTS}): {str(e)}")
+                if retry + 1 < FINISH_ATTEMPTS:
+                    time.sleep(Config.JOBS_POLL_SECONDS)
+
+
+def main():
+    """Drain the queue without serving HTTP, e.g. next to a serverless API."""
+    import sys
+    from pipeline import AnalysisPipeline
+
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else Config.JOBS_WORKERS
+    pipeline = AnalysisPipeline()
+    job_workers = JobWorkers(
+        JobQueue(), lambda data: pipeline.process_image(data, endpoint='jobs'), workers=workers or 1
+    ).start()
+    print(f"Draining {Config.JOBS_DB_PATH} with {job_workers.workers} workers")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        print("Finishing running jobs...")
+        job_workers.stop()
+
+
+if __name__ == '__main__':
+    main()
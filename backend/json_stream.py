@@ -0,0 +1,174 @@
+"""
+Incremental parser for the JSON object returned by the analysis prompt.
+"""
+import json
+
+
+class JSONFieldParser:
+    """
+    Parse a JSON object as it streams in, emitting each top-level field once complete.
+
+    Text before the opening brace (such as a ```json fence) is skipped, as is
+    anything after the matching closing brace. A member that is not valid JSON
+    is skipped (and counted in .skipped) rather than failing the rest. Each
+    chunk is scanned once, so feeding a response token by token costs the same
+    as parsing it whole.
+    """
+
+    def __init__(self):
+        """Initialize parser state."""
+        self.fields = {}
+        self.skipped = 0  # Members that were not valid JSON
+        self.done = False
+        self.text = ''  # Everything fed so far
+        self._pos = 0  # Next character of text to scan
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = None
+
+    def feed(self, chunk):
+        """
+        Consume a chunk of model output.
+
+        Args:
+            chunk: Next piece of text
+
+        Returns:
+            list: (name, value) pairs for fields completed by this chunk
+        """
+        self.text += chunk
+        if self.done:
+            return []
+
+        text = self.text
+        completed = []
+        start, self._pos = self._pos, len(text)
+        for pos in range(start, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif self._depth == 0:
+                if char == '{':
+                    self._depth = 1
+                    self._member_start = pos + 1
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    completed.extend(self._close_member(text, pos))
+                    self.done = True
+                    break
+            elif char == ',' and self._depth == 1:
+                completed.extend(self._close_member(text, pos))
+        return completed
+
+    def _close_member(self, text, end):
+        """Parse the `"name": value` member ending at text[end] and record it."""
+        member = text[self._member_start:end].strip()
+        self._member_start = end + 1
+        if not member:
+            return []
+        try:
+            parsed = json.loads('{' + member + '}')
+        except json.JSONDecodeError:
+            self.skipped += 1
+            return []
+        self.fields.update(parsed)
+        return list(parsed.items())
+
+    def result(self):
+        """
+        Return the parsed object once the stream has ended.
+
+        Returns:
+            dict: All fields of the object
+
+        Raises:
+            ValueError: If no complete JSON object was received
+        """
+        if not self.done:
+            if self._depth == 0:
+                # No object at all: let json report what it did get
+                try:
+                    return json.loads(self.text)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"No JSON object in model response: {str(e)}")
+            raise ValueError("Model response ended before the JSON object was complete")
+        return dict(self.fields)
+
+
+def parse_json_response(text):
+    """
+    Extract the JSON object from a complete model response.
+
+    Args:
+        text: Raw model output, possibly wrapped in a markdown code block
+
+    Returns:
+        dict: Parsed object
+
+    Raises:
+        ValueError: If the response holds no valid JSON object
+    """
+    parser = JSONFieldParser()
+    parser.feed(text)
+    return parser.result()
+
+
+def text_value(value):
+    """A field value as text, or None if it is not usable; bullet lists given as arrays are joined."""
+    if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+        return '\n'.join(item if item.lstrip().startswith('-') else f'- {item}' for item in value)
+    if isinstance(value, str) and value.strip():
+        return value
+    return None
+
+
+def parse_analysis(text, fields):
+    """
+    Parse and validate a model response against the analysis fields, salvaging what it can.
+
+    A schema-conforming response is parsed with one json.loads(). Anything
+    else (code fences, trailing text, a response cut off by max_tokens, an
+    invalid member) goes through JSONFieldParser, which keeps every member
+    completed before the damage. Fields that are absent, empty or not text
+    are reported missing so they alone can be asked for again.
+
+    Args:
+        text: Raw model output
+        fields: Field names the response should hold
+
+    Returns:
+        tuple: (dict of valid fields in `fields` order, list of missing
+            field names, True if the response needed repair)
+    """
+    try:
+        parsed = json.loads(text)
+        repaired = False
+    except json.JSONDecodeError:
+        parser = JSONFieldParser()
+        parser.feed(text)
+        parsed = parser.fields
+        repaired = True
+    if not isinstance(parsed, dict):
+        parsed, repaired = {}, True
+
+    results = {}
+    missing = []
+    for name in fields:
+        value = text_value(parsed.get(name))
+        if value is None:
+            missing.append(name)
+        else:
+            repaired = repaired or value is not parsed[name]
+            results[name] = value
+    return results, missing, repaired
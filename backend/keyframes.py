@@ -0,0 +1,134 @@
+"""
+Keyframes of animated uploads, tiled into one contact sheet.
+
+An animated GIF, WebP or PNG can hold hundreds of frames. The first frame
+alone misses most of it, and a call per frame costs a call per frame. Frames
+are decoded one at a time and reduced to small grayscale signatures; the K
+frames that differ most from each other are then decoded again and pasted
+into a grid, which is analysed as a single image in one upstream call.
+"""
+import math
+import numpy as np
+from PIL import Image
+from config import Config
+
+SIGNATURE_SIZE = 32  # Frames are compared as 32x32 grayscale
+SHEET_GAP = 8  # Pixels between tiles
+SHEET_GAP_COLOR = (64, 64, 64)  # Dark, so white frame edges stay apart
+
+
+def is_animated(img):
+    """True for an opened image with more than one frame."""
+    return getattr(img, 'n_frames', 1) > 1
+
+
+def frame_signatures(img, max_frames=None):
+    """
+    Small grayscale copy of each frame, decoded one frame at a time.
+
+    Args:
+        img: Opened PIL.Image with several frames
+        max_frames: Frames to sample at most, evenly spaced (defaults to
+            Config.KEYFRAME_MAX_FRAMES)
+
+    Returns:
+        tuple: (frame indices, float32 array of one flattened signature per row)
+    """
+    max_frames = max_frames or Config.KEYFRAME_MAX_FRAMES
+    step = max(1, math.ceil(img.n_frames / max_frames))
+    indices = list(range(0, img.n_frames, step))
+    signatures = np.empty((len(indices), SIGNATURE_SIZE * SIGNATURE_SIZE), dtype=np.float32)
+    for row, index in enumerate(indices):
+        # seek() applies the frame on top of the previous ones; only this frame is held
+        img.seek(index)
+        small = img.convert('L').resize(
+            (SIGNATURE_SIZE, SIGNATURE_SIZE), Image.Resampling.BOX, reducing_gap=2.0
+        )
+        signatures[row] = np.asarray(small, dtype=np.float32).ravel()
+    return indices, signatures
+
+
+def select_keyframes(signatures, count):
+    """
+    Rows of the `count` most distinct signatures, in playback order.
+
+    Farthest-point sampling: start from the first frame, then keep adding
+    the frame whose mean absolute difference to its nearest chosen frame is
+    largest. Each step is one vectorized pass over all signatures. Stops
+    early once every remaining frame repeats a chosen one.
+
+    Args:
+        signatures: Array from frame_signatures()
+        count: Frames to choose
+
+    Returns:
+        list: Row numbers, ascending
+    """
+    chosen = [0]
+    distance = np.abs(signatures - signatures[0]).mean(axis=1)
+    while len(chosen) < min(count, len(signatures)):
+        row = int(distance.argmax())
+        if distance[row] == 0:
+            break
+        chosen.append(row)
+        distance = np.minimum(distance, np.abs(signatures - signatures[row]).mean(axis=1))
+    return sorted(chosen)
+
+
+def contact_sheet(img, indices, max_dimension=None):
+    """
+    Tile frames into a grid, left to right and top to bottom.
+
+    Frames are decoded again one at a time, in order, and pasted straight
+    into the sheet; transparency is composited onto white.
+
+    Args:
+        img: Opened PIL.Image with several frames
+        indices: Frame indices to tile, ascending
+        max_dimension: Longest side of the sheet (defaults to Config.RESIZE_MAX_DIMENSION)
+
+    Returns:
+        PIL.Image: RGB sheet
+    """
+    max_dimension = max_dimension or Config.RESIZE_MAX_DIMENSION
+    columns = math.ceil(math.sqrt(len(indices)))
+    rows = math.ceil(len(indices) / columns)
+    width, height = img.size
+    scale = min(
+        1.0,
+        (max_dimension - SHEET_GAP * (columns - 1)) / (columns * width),
+        (max_dimension - SHEET_GAP * (rows - 1)) / (rows * height),
+    )
+    tile = (max(1, int(width * scale)), max(1, int(height * scale)))
+    sheet = Image.new(
+        'RGB',
+        (columns * tile[0] + SHEET_GAP * (columns - 1), rows * tile[1] + SHEET_GAP * (rows - 1)),
+        SHEET_GAP_COLOR
+    )
+    for position, index in enumerate(indices):
+        img.seek(index)
+        frame = img.convert('RGBA')
+        if frame.size != tile:
+            frame = frame.resize(tile, Image.Resampling.LANCZOS, reducing_gap=3.0)
+        background = Image.new('RGB', tile, (255, 255, 255))
+        background.paste(frame, mask=frame.split()[3])
+        row, column = divmod(position, columns)
+        sheet.paste(background, (column * (tile[0] + SHEET_GAP), row * (tile[1] + SHEET_GAP)))
+    return sheet
+
+
+def keyframe_sheet(img, count=None, max_frames=None):
+    """
+    Contact sheet of the most distinct frames of an animation.
+
+    Args:
+        img: Opened PIL.Image with several frames
+        count: Keyframes to pick at most (defaults to Config.KEYFRAME_COUNT)
+        max_frames: Frames to compare at most (defaults to Config.KEYFRAME_MAX_FRAMES)
+
+    Returns:
+        tuple: (RGB sheet, indices of the frames on it)
+    """
+    indices, signatures = frame_signatures(img, max_frames)
+    keyframes = [indices[row] for row in select_keyframes(signatures, count or Config.KEYFRAME_COUNT)]
+    return contact_sheet(img, keyframes), keyframes
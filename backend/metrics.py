@@ -0,0 +1,287 @@
+"""
+In-process metrics: stage timing spans, counters and histograms in Prometheus text format.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from config import Config
+
+# Seconds; covers fast local stages up to slow upstream calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+_request_start = contextvars.ContextVar('request_start', default=None)
+
+
+def _format_labels(names, values, extra=''):
+    """Render a label set as {a="x",b="y"}."""
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        """
+        Create and register a counter.
+
+        Args:
+            name: Metric name
+            help_text: HELP line
+            labelnames: Label names; values are passed positionally to inc()
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, *labelvalues):
+        """Add amount to the series for labelvalues."""
+        if not Config.METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues):
+        """Current value of one series."""
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        """Exposition lines for every series."""
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {value}' for labels, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        """
+        Create and register a histogram.
+
+        Args:
+            name: Metric name
+            help_text: HELP line
+            labelnames: Label names; values are passed positionally to observe()
+            buckets: Upper bounds, ascending (+Inf is implied)
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *labelvalues):
+        """Record one value in the series for labelvalues."""
+        if not Config.METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labelvalues):
+        """Number of values recorded in one series."""
+        series = self._series.get(labelvalues)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        """Exposition lines (cumulative buckets, sum and count) for every series."""
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        lines = []
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    'analysis_stage_seconds', 'Time spent in each request stage', ('stage',)
+)
+UPSTREAM_TTFB_SECONDS = Histogram(
+    'upstream_ttfb_seconds', 'Time from sending an upstream request to its response headers'
+)
+REQUEST_SECONDS = Histogram(
+    'http_request_seconds', 'HTTP request latency by endpoint', ('endpoint',)
+)
+REQUESTS = Counter('http_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'status'))
+BYTES = Counter(
+    'transfer_bytes_total', 'Bytes received in uploads, sent upstream and sent in responses', ('direction',)
+)
+UPSTREAM_REQUESTS = Counter('upstream_requests_total', 'Upstream HTTP requests sent')
+RETRIES = Counter('upstream_retries_total', 'Upstream retries by error type', ('error',))
+TOKENS = Counter('upstream_tokens_total', 'Tokens reported by the API', ('kind',))
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Analyses by how they were answered: memory, disk, near_duplicate, '
+    'coalesced, partial (some fields cached) or miss', ('result',)
+)
+# Parse time is the json_parse stage; wasted calls over parsed responses is the wasted-call rate
+PARSED_RESPONSES = Counter(
+    'analysis_responses_parsed_total', 'Model responses by parse outcome: valid, repaired, '
+    'partial (missing fields asked for again) or invalid (nothing usable)', ('outcome',)
+)
+WASTED_CALLS = Counter(
+    'analysis_wasted_calls_total', 'Paid model calls whose output was thrown away'
+)
+MODEL_TOKENS = Counter('upstream_model_tokens_total', 'Tokens reported by the API by model', ('model', 'kind'))
+# Model tiering (tiering.py); escalations over fields asked is a tier's escalation rate
+TIER_CALL_SECONDS = Histogram('analysis_tier_call_seconds', 'Upstream call latency by tier model', ('model',))
+TIER_FIELDS = Counter('analysis_tier_fields_total', 'Fields asked of each tier model', ('model',))
+TIER_ESCALATIONS = Counter(
+    'analysis_tier_escalations_total', 'Fields passed on to the next tier, by the model that failed them '
+    'and why: missing, low_confidence or error', ('model', 'reason')
+)
+
+
+class span:
+    """
+    Time a block as one stage: `with metrics.span('encode'): ...`.
+
+    The duration goes to analysis_stage_seconds and, inside a request being
+    timed, to that request's Server-Timing entries.
+    """
+
+    __slots__ = ('stage', '_start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if Config.METRICS_ENABLED:
+            record_stage(self.stage, time.perf_counter() - self._start)
+        return False
+
+
+def record_stage(stage, seconds):
+    """Record a stage duration measured elsewhere."""
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Repeated stages (e.g. retries) add up
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def start_request():
+    """
+    Start the clock and the stage collector for the current request.
+
+    Coroutines scheduled on the AsyncRunner loop inherit the collector;
+    executor jobs need carry_context().
+    """
+    _request_start.set(time.perf_counter())
+    _request_timings.set({})
+
+
+def finish_request():
+    """
+    Stop the clock for the current request.
+
+    Returns:
+        tuple: (seconds since start_request, stage timings dict), or None if
+        start_request was not called
+    """
+    start = _request_start.get()
+    if start is None:
+        return None
+    return time.perf_counter() - start, _request_timings.get()
+
+
+def carry_context(fn):
+    """Wrap fn to run in a copy of the current context (for run_in_executor)."""
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def server_timing(timings, total=None):
+    """
+    Format timings as a Server-Timing header value.
+
+    Args:
+        timings: Stage name -> seconds
+        total: Optional whole-request seconds
+
+    Returns:
+        str: e.g. 'preprocess;dur=12.3, upstream;dur=840.2'
+    """
+    entries = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def httpx_event_hooks(is_async=False):
+    """
+    Event hooks that measure upstream time to first byte.
+
+    httpx calls the response hook once headers arrive, before the body is read.
+
+    Args:
+        is_async: Return coroutine hooks for httpx.AsyncClient
+
+    Returns:
+        dict: event_hooks argument for httpx.Client / AsyncClient
+    """
+    def on_request(request):
+        request.extensions['metrics_start'] = time.perf_counter()
+        UPSTREAM_REQUESTS.inc()
+
+    def on_response(response):
+        start = response.request.extensions.get('metrics_start')
+        if start is not None:
+            seconds = time.perf_counter() - start
+            UPSTREAM_TTFB_SECONDS.observe(seconds)
+            record_stage('upstream_ttfb', seconds)
+
+    if not is_async:
+        return {'request': [on_request], 'response': [on_response]}
+
+    async def on_request_async(request):
+        on_request(request)
+
+    async def on_response_async(response):
+        on_response(response)
+
+    return {'request': [on_request_async], 'response': [on_response_async]}
+
+
+def render():
+    """
+    All metrics in Prometheus text exposition format (version 0.0.4).
+
+    Returns:
+        str: Metrics page body
+    """
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -1,12 +1,208 @@
 """
 OpenAI API client for vision-language tasks.
 """
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from config import Config
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import prompts
+from rate_limit import AsyncConcurrencyLimiter, ConcurrencyLimiter, RetryState, get_flow_control
+import asyncio
 import base64
+import httpx
 from io import BytesIO
 import time
 
+
+def _build_request(model, base64_image, prompt, mime_type='image/jpeg', detail='auto', response_format=None,
+                   max_tokens=None):
+    """
+    Build chat completion arguments for an image + prompt request.
+    
+    Args:
+        model: Model name
+        base64_image: Base64 encoded image
+        prompt: Text prompt for analysis
+        mime_type: MIME type of the encoded image
+        detail: Vision detail level ('low', 'high' or 'auto')
+        response_format: Structured output format, if any
+        max_tokens: Output token allowance (defaults to Config)
+    
+    Returns:
+        dict: Keyword arguments for chat.completions.create()
+    """
+    request = {
+        'model': model,
+        'messages': [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime_type};base64,{base64_image}",
+                            "detail": detail
+                        }
+                    }
+                ]
+            }
+        ],
+        'max_tokens': max_tokens or Config.GENERATION_CONFIG['max_tokens'],
+        'temperature': Config.GENERATION_CONFIG['temperature']
+    }
+    if response_format is not None:
+        request['response_format'] = response_format
+    return request
+
+
+def _http_client_options(is_async=False):
+    """
+    Connection pool settings shared by the sync and async httpx clients.
+    
+    With ANALYSIS_BACKEND=fake the transport is the in-process fake instead of the network;
+    with record or replay it is the archive (see record_replay.py).
+    
+    Args:
+        is_async: Options for httpx.AsyncClient
+    
+    Returns:
+        dict: Keyword arguments for httpx.Client / httpx.AsyncClient
+    """
+    http2 = Config.HTTP2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("HTTP2=True but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+    
+    options = {
+        'limits': httpx.Limits(
+            max_connections=Config.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+        ),
+        'timeout': httpx.Timeout(Config.HTTP_READ_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+        'http2': http2,
+        'event_hooks': metrics.httpx_event_hooks(is_async)
+    }
+    if Config.ANALYSIS_BACKEND == 'fake':
+        from fake_backend import get_fake_backend
+        options['transport'] = get_fake_backend().transport(is_async)
+    elif Config.ANALYSIS_BACKEND in ('record', 'replay'):
+        from record_replay import get_archive
+        options['transport'] = get_archive().transport(is_async, options)
+    elif Config.ANALYSIS_BACKEND != 'openai':
+        raise ValueError(
+            f"Unknown ANALYSIS_BACKEND '{Config.ANALYSIS_BACKEND}'. Choose from: openai, fake, record, replay"
+        )
+    return options
+
+
+def _pool_stats(http_client):
+    """
+    Describe the connections currently held by an httpx client.
+    
+    Args:
+        http_client: httpx.Client or httpx.AsyncClient
+    
+    Returns:
+        dict: Open, idle and active connection counts plus pool limits
+    """
+    # httpx has no public pool API; read httpcore's pool defensively
+    pool = getattr(getattr(http_client, '_transport', None), '_pool', None)
+    connections = list(getattr(pool, 'connections', []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        'open': len(connections),
+        'idle': idle,
+        'active': len(connections) - idle,
+        'max_connections': Config.HTTP_MAX_CONNECTIONS,
+        'max_keepalive': Config.HTTP_MAX_KEEPALIVE,
+        'http2': bool(getattr(pool, '_http2', False))
+    }
+
+
+def _max_tokens(fields):
+    """Output allowance for a request: sized to its fields, if known."""
+    if fields is None:
+        return Config.GENERATION_CONFIG['max_tokens']
+    return prompts.get_max_tokens(fields)
+
+
+def _estimated_request_tokens(model, image, prompt, fields=None):
+    """
+    Tokens a request may consume, for the tokens-per-minute limit.
+    
+    Args:
+        model: Model name
+        image: PreparedImage or PIL.Image object
+        prompt: Text prompt for analysis
+        fields: Analysis fields the prompt asks for
+    
+    Returns:
+        int: Image + prompt tokens plus the output allowance
+    """
+    image_tokens = image.estimated_tokens(model) if hasattr(image, 'estimated_tokens') else 0
+    # ~4 characters per token is close enough for budgeting
+    return image_tokens + len(prompt) // 4 + _max_tokens(fields)
+
+
+def _record_usage(flow, estimated, usage, model):
+    """
+    Count the tokens a response reports and correct the TPM reservation.
+    
+    Args:
+        flow: FlowControl in use
+        estimated: Tokens reserved before the call
+        usage: response.usage (may be None)
+        model: Model the request asked for
+    """
+    if usage is None:
+        return
+    metrics.TOKENS.inc(usage.prompt_tokens, 'prompt')
+    metrics.TOKENS.inc(usage.completion_tokens, 'completion')
+    metrics.MODEL_TOKENS.inc(usage.prompt_tokens, model, 'prompt')
+    metrics.MODEL_TOKENS.inc(usage.completion_tokens, model, 'completion')
+    flow.limiter.reconcile(estimated, usage.total_tokens)
+
+
+def _stream_request(request):
+    """A request's streaming form, asking for usage in a final chunk so streams are counted like other calls."""
+    return dict(request, stream=True, stream_options={'include_usage': True})
+
+
+def _request_for(model, image, prompt, fields=None):
+    """
+    Encode an image and build its request, logging the payload it costs.
+    
+    Args:
+        model: Model name
+        image: PreparedImage or PIL.Image object
+        prompt: Text prompt for analysis
+        fields: Analysis fields the prompt asks for; max_tokens is sized to
+            them and, with STRUCTURED_OUTPUT, the response is held to a JSON
+            schema of them
+    
+    Returns:
+        dict: Keyword arguments for chat.completions.create()
+    """
+    with metrics.span('base64_encode'):
+        base64_image = OpenAIClient._image_to_base64(image)
+    metrics.BYTES.inc(len(base64_image), 'upstream_request')
+    response_format = None
+    if fields is not None and Config.STRUCTURED_OUTPUT:
+        response_format = prompts.get_response_format(fields)
+    if hasattr(image, 'payload'):
+        print(f"Image payload: {image.size[0]}x{image.size[1]} {image.format}, "
+              f"{len(image.payload) / 1024:.0f} KB, detail={image.detail}, "
+              f"~{image.estimated_tokens(model)} image tokens")
+        return _build_request(model, base64_image, prompt, image.mime_type, image.detail, response_format,
+                              _max_tokens(fields))
+    return _build_request(model, base64_image, prompt, response_format=response_format, max_tokens=_max_tokens(fields))
+
+
 class OpenAIClient:
     """Client for interacting with OpenAI GPT-4 Vision API."""
     
@@ -15,89 +211,381 @@ class OpenAIClient:
         if not Config.OPENAI_API_KEY:
             raise ValueError("OPENAI_API_KEY not found in environment variables")
         
-        self.client = OpenAI(api_key=Config.OPENAI_API_KEY)
+        self.http_client = httpx.Client(**_http_client_options())
+        # Retries are handled by the flow control below, not stacked on the SDK's
+        self.client = OpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            http_client=self.http_client,
+            max_retries=0
+        )
         self.model = Config.MODEL_NAME
+        self.flow = get_flow_control()
+        self.gate = ConcurrencyLimiter(self.flow.controller, count=self.flow.in_flight)
     
-    def _image_to_base64(self, image):
+    def warm_up(self, connections=None):
         """
-        Convert PIL Image to base64 string.
+        Open pooled connections ahead of traffic with cheap concurrent requests.
         
         Args:
-            image: PIL.Image object
-            
+            connections: Number of connections to open (defaults to Config)
+        
+        Returns:
+            int: Connections opened successfully
+        """
+        connections = connections or Config.WARMUP_CONNECTIONS
+        
+        def ping(_):
+            try:
+                self.client.models.list()
+                return True
+            except Exception as e:
+                print(f"Warm-up request failed: {str(e)}")
+                return False
+        
+        # Concurrent requests force distinct connections
+        with ThreadPoolExecutor(max_workers=connections) as pool:
+            return sum(pool.map(ping, range(connections)))
+    
+    def pool_stats(self):
+        """Connection pool counters for /api/health."""
+        return _pool_stats(self.http_client)
+    
+    @staticmethod
+    def _image_to_base64(image):
+        """
+        Convert image to base64 string.
+        
+        Args:
+            image: PreparedImage (its payload is used as is) or PIL.Image
+        
         Returns:
             str: Base64 encoded image
         """
+        if hasattr(image, 'payload'):
+            return base64.b64encode(image.payload).decode('utf-8')
+        
         buffer = BytesIO()
         image.save(buffer, format='JPEG', quality=95)
         return base64.b64encode(buffer.getvalue()).decode('utf-8')
     
     def analyze_image(self, image, prompt):
         """
-        Analyze image with given prompt using GPT-4 Vision.
+        Analyze image with given prompt using GPT-4 Vision (a single attempt).
         
         Args:
-            image: PIL.Image object
+            image: PreparedImage or PIL.Image object
             prompt: Text prompt for analysis
-            
+        
         Returns:
             str: Generated text response
         """
         try:
-            # Convert image to base64
-            base64_image = self._image_to_base64(image)
-            
             # Create message with image and prompt
             response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": prompt},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=Config.GENERATION_CONFIG['max_tokens'],
-                temperature=Config.GENERATION_CONFIG['temperature']
+                **_request_for(self.model, image, prompt)
             )
             
             # Extract text from response
             return response.choices[0].message.content.strip()
-            
+        
         except Exception as e:
-            raise Exception(f"OpenAI API error: {str(e)}")
+            raise Exception(f"OpenAI API error: {str(e)}") from e
     
-    def analyze_with_retry(self, image, prompt, max_retries=3):
+    def analyze_with_retry(self, image, prompt, max_retries=None, fields=None, model=None):
         """
-        Analyze image with retry logic.
+        Analyze image under the shared rate limits, retrying retryable errors.
         
         Args:
-            image: PIL.Image object
+            image: PreparedImage or PIL.Image object
             prompt: Text prompt
-            max_retries: Maximum number of retry attempts
-            
+            max_retries: Maximum number of attempts (defaults to Config)
+            fields: Analysis fields the prompt asks for (structured output schema)
+            model: Model to ask (defaults to Config.MODEL_NAME)
+        
         Returns:
             str: Generated response
         """
-        last_error = None
+        model = model or self.model
+        request = _request_for(model, image, prompt, fields)
+        tokens = _estimated_request_tokens(model, image, prompt, fields)
+        response = self._create(request, tokens, max_retries)
+        _record_usage(self.flow, tokens, response.usage, model)
+        return response.choices[0].message.content.strip()
+    
+    def _create(self, request, tokens, max_retries=None):
+        """
+        Send a completion request through the flow control.
+        
+        Waits for the RPM/TPM limiter and a concurrency slot, then retries
+        retryable errors with decorrelated jitter, honoring Retry-After and
+        the process-wide retry budget. Backoff waits do not hold a slot,
+        and the slot is freed whichever way the call ends.
+        
+        A stream keeps its slot while it is read, so long generations count
+        against the concurrency limit: the caller calls _release_slot() once
+        it is closed.
+        
+        Args:
+            request: Keyword arguments for chat.completions.create()
+            tokens: Estimated tokens of the request
+            max_retries: Maximum number of attempts (defaults to Config)
         
-        for attempt in range(max_retries):
+        Returns:
+            Completion response (or stream when request has stream=True)
+        """
+        retry = RetryState(self.flow, max_retries)
+        while True:
+            self.flow.limiter.acquire(tokens)
+            self.gate.acquire()
             try:
-                return self.analyze_image(image, prompt)
+                sent_at = time.monotonic()
+                response = self.client.chat.completions.create(**request)
             except Exception as e:
-                last_error = e
-                if attempt < max_retries - 1:
-                    # Exponential backoff
-                    wait_time = (2 ** attempt) * 1
-                    print(f"Retry attempt {attempt + 1} after {wait_time}s...")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    raise last_error
+                self.gate.release()
+                delay = retry.backoff(e, sent_at)
+                if delay is None:
+                    raise Exception(f"OpenAI API error: {str(e)}") from e
+                metrics.RETRIES.inc(1, type(e).__name__)
+                print(f"Retry attempt {retry.attempt - 1} after {delay:.1f}s ({type(e).__name__})...")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Interrupted: nothing to retry, but the slot must not leak
+                self.gate.release()
+                raise
+            if not request.get('stream'):
+                self._release_slot(True)
+            return response
+    
+    def _release_slot(self, completed):
+        """Free the slot of a call; a call that completed counts as an AIMD success."""
+        self.gate.release()
+        if completed:
+            self.flow.controller.on_success()
+    
+    def stream_image(self, image, prompt, max_retries=None, fields=None, model=None):
+        """
+        Analyze image, yielding the response text as it is generated.
+        
+        Opening the stream goes through the same flow control as
+        analyze_with_retry, and the stream holds its concurrency slot until
+        it is closed; once tokens have been yielded, errors are raised to
+        the caller.
+        
+        Args:
+            image: PreparedImage or PIL.Image object
+            prompt: Text prompt for analysis
+            max_retries: Maximum number of attempts to open the stream
+            fields: Analysis fields the prompt asks for (structured output schema)
+            model: Model to ask (defaults to Config.MODEL_NAME)
+        
+        Yields:
+            str: Text deltas
+        """
+        model = model or self.model
+        request = _request_for(model, image, prompt, fields)
+        tokens = _estimated_request_tokens(model, image, prompt, fields)
+        stream = self._create(_stream_request(request), tokens, max_retries)
+        
+        completed = False
+        try:
+            usage = None
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                usage = getattr(chunk, 'usage', None) or usage
+            completed = True
+            _record_usage(self.flow, tokens, usage, model)
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}") from e
+        finally:
+            try:
+                stream.close()
+            finally:
+                self._release_slot(completed)
+
+
+class AsyncOpenAIClient:
+    """Asyncio variant of OpenAIClient; its in-flight calls count against the same limit as the sync client's."""
+    
+    def __init__(self, max_in_flight=None):
+        """
+        Initialize async OpenAI client.
+        
+        Args:
+            max_in_flight: Maximum concurrent upstream calls (defaults to Config)
+        """
+        if not Config.OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY not found in environment variables")
+        
+        self.http_client = httpx.AsyncClient(**_http_client_options(is_async=True))
+        self.client = AsyncOpenAI(
+            api_key=Config.OPENAI_API_KEY,
+            base_url=Config.OPENAI_BASE_URL,
+            http_client=self.http_client,
+            max_retries=0
+        )
+        self.model = Config.MODEL_NAME
+        self.max_in_flight = max_in_flight or Config.ASYNC_MAX_IN_FLIGHT
+        self.flow = get_flow_control()
+        self.gate = AsyncConcurrencyLimiter(self.flow.controller, maximum=self.max_in_flight, count=self.flow.in_flight)
+    
+    async def warm_up(self, connections=None):
+        """
+        Coroutine version of OpenAIClient.warm_up; run it on the loop that serves traffic.
+        
+        Args:
+            connections: Number of connections to open (defaults to Config)
+        
+        Returns:
+            int: Connections opened successfully
+        """
+        connections = connections or Config.WARMUP_CONNECTIONS
+        
+        async def ping():
+            try:
+                await self.client.models.list()
+                return True
+            except Exception as e:
+                print(f"Warm-up request failed: {str(e)}")
+                return False
+        
+        return sum(await asyncio.gather(*(ping() for _ in range(connections))))
+    
+    def pool_stats(self):
+        """Connection pool counters for /api/health."""
+        return _pool_stats(self.http_client)
+    
+    @property
+    def in_flight(self):
+        """Upstream calls currently holding a concurrency slot."""
+        return self.gate.in_flight
+    
+    async def analyze_image(self, image, prompt):
+        """
+        Analyze image with given prompt without blocking the event loop (a single attempt).
+        
+        Args:
+            image: PreparedImage or PIL.Image object
+            prompt: Text prompt for analysis
+        
+        Returns:
+            str: Generated text response
+        """
+        # Encoding is CPU-bound; keep it off the loop
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(None, metrics.carry_context(_request_for), self.model, image, prompt)
+        
+        try:
+            response = await self.client.chat.completions.create(**request)
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}") from e
+        
+        return response.choices[0].message.content.strip()
+    
+    async def analyze_with_retry(self, image, prompt, max_retries=None, fields=None, model=None):
+        """
+        Analyze image under the shared rate limits, retrying retryable errors.
+        
+        Args:
+            image: PreparedImage or PIL.Image object
+            prompt: Text prompt
+            max_retries: Maximum number of attempts (defaults to Config)
+            fields: Analysis fields the prompt asks for (structured output schema)
+            model: Model to ask (defaults to Config.MODEL_NAME)
+        
+        Returns:
+            str: Generated response
+        """
+        model = model or self.model
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(
+            None, metrics.carry_context(_request_for), model, image, prompt, fields
+        )
+        tokens = _estimated_request_tokens(model, image, prompt, fields)
+        response = await self._create(request, tokens, max_retries)
+        _record_usage(self.flow, tokens, response.usage, model)
+        return response.choices[0].message.content.strip()
+    
+    async def _create(self, request, tokens, max_retries=None):
+        """
+        Coroutine version of OpenAIClient._create.
+        
+        Hedging and request timeouts cancel calls routinely. A call cancelled
+        before it was sent gives its tokens back to the TPM bucket; one
+        cancelled in flight keeps them, as the API counts it anyway. Either
+        way its concurrency slot is freed.
+        """
+        retry = RetryState(self.flow, max_retries)
+        while True:
+            try:
+                await self.flow.limiter.acquire_async(tokens)
+                await self.gate.acquire_async()
+            except asyncio.CancelledError:
+                self.flow.limiter.reconcile(tokens, 0)
+                raise
+            try:
+                sent_at = time.monotonic()
+                response = await self.client.chat.completions.create(**request)
+            except Exception as e:
+                self.gate.release()
+                delay = retry.backoff(e, sent_at)
+                if delay is None:
+                    raise Exception(f"OpenAI API error: {str(e)}") from e
+                metrics.RETRIES.inc(1, type(e).__name__)
+                print(f"Retry attempt {retry.attempt - 1} after {delay:.1f}s ({type(e).__name__})...")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Cancelled: nothing to retry, but the slot must not leak
+                self.gate.release()
+                raise
+            if not request.get('stream'):
+                self._release_slot(True)
+            return response
+    
+    def _release_slot(self, completed):
+        """Free the slot of a call; a call that completed counts as an AIMD success."""
+        self.gate.release()
+        if completed:
+            self.flow.controller.on_success()
+    
+    async def stream_image(self, image, prompt, max_retries=None, fields=None, model=None):
+        """
+        Async generator version of OpenAIClient.stream_image.
+        
+        Args:
+            image: PreparedImage or PIL.Image object
+            prompt: Text prompt for analysis
+            max_retries: Maximum number of attempts to open the stream
+            fields: Analysis fields the prompt asks for (structured output schema)
+            model: Model to ask (defaults to Config.MODEL_NAME)
+        
+        Yields:
+            str: Text deltas
+        """
+        model = model or self.model
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(
+            None, metrics.carry_context(_request_for), model, image, prompt, fields
+        )
+        tokens = _estimated_request_tokens(model, image, prompt, fields)
+        stream = await self._create(_stream_request(request), tokens, max_retries)
+        
+        completed = False
+        try:
+            usage = None
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                usage = getattr(chunk, 'usage', None) or usage
+            completed = True
+            _record_usage(self.flow, tokens, usage, model)
+        except Exception as e:
+            raise Exception(f"OpenAI API error: {str(e)}") from e
+        finally:
+            try:
+                await stream.close()
+            finally:
+                self._release_slot(completed)
@@ -0,0 +1,319 @@
+"""
+Perceptual hashing and near-duplicate lookup for uploaded images.
+"""
+import threading
+import time
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+CHUNK_BITS = 16
+NUM_CHUNKS = HASH_BITS // CHUNK_BITS
+MIN_CONTRAST = 8  # Grey levels; flatter thumbnails carry no usable structure
+
+# Popcount of every byte value, used when np.bitwise_count is unavailable (NumPy < 2.0)
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _popcount64(values):
+    """Count set bits of a uint64 array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _masks_within(radius):
+    """All CHUNK_BITS-wide bit masks with at most `radius` bits set."""
+    masks = np.arange(1 << CHUNK_BITS, dtype=np.uint32)
+    counts = _popcount64(masks.astype(np.uint64))
+    return masks[counts <= radius].astype(np.uint16)
+
+
+def dhash(image, hash_size=8):
+    """
+    Compute a 64-bit difference hash of an image.
+
+    The image is reduced to a (hash_size + 1) x hash_size grayscale thumbnail
+    and each bit records whether a pixel is brighter than its right neighbour,
+    which survives resizing and recompression.
+
+    Args:
+        image: PIL.Image
+        hash_size: Number of rows (and bits per row) in the hash
+
+    Returns:
+        int: Unsigned perceptual hash, or None for near-uniform images whose
+            hash would collide with every other flat image
+    """
+    thumb = image.resize((hash_size + 1, hash_size), Image.Resampling.BOX).convert('L')
+    pixels = np.asarray(thumb, dtype=np.int16)
+    if pixels.max() - pixels.min() < MIN_CONTRAST:
+        return None
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distance(a, b):
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count('1')
+
+
+class HammingIndex:
+    """
+    Multi-index hash table for Hamming-radius search over 64-bit hashes.
+
+    Each hash is split into four 16-bit chunks, and each chunk position gets a
+    sorted lookup table. By the pigeonhole principle, two hashes within
+    distance r agree to within r // 4 bits on at least one chunk, so only the
+    buckets near the query's chunks need to be checked. New entries go to a
+    small pending tail that is scanned linearly until the tables are rebuilt.
+    """
+
+    MIN_PENDING_REBUILD = 4096
+
+    def __init__(self, capacity=1024):
+        """
+        Initialize an empty index.
+
+        Args:
+            capacity: Initial number of hash slots to allocate
+        """
+        self._hashes = np.empty(capacity, dtype=np.uint64)
+        self._values = []
+        self._tables = []  # per chunk: (sorted chunk keys, entry ids)
+        self._indexed = 0  # entries covered by the tables
+        self._masks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def add(self, phash, value):
+        """
+        Add a hash to the index.
+
+        Args:
+            phash: Unsigned 64-bit hash from dhash()
+            value: Payload returned by search()
+        """
+        with self._lock:
+            size = len(self._values)
+            if size == len(self._hashes):
+                grown = np.empty(size * 2, dtype=np.uint64)
+                grown[:size] = self._hashes
+                self._hashes = grown
+            self._hashes[size] = phash
+            self._values.append(value)
+
+    def extend(self, phashes, values):
+        """
+        Bulk-add hashes and rebuild the lookup tables once.
+
+        Args:
+            phashes: Iterable of unsigned 64-bit hashes
+            values: Payloads matching phashes
+        """
+        new = np.asarray(phashes, dtype=np.uint64)
+        with self._lock:
+            size = len(self._values)
+            if size + len(new) > len(self._hashes):
+                grown = np.empty(max(size + len(new), size * 2), dtype=np.uint64)
+                grown[:size] = self._hashes[:size]
+                self._hashes = grown
+            self._hashes[size:size + len(new)] = new
+            self._values.extend(values)
+            self._rebuild()
+
+    def values(self):
+        """Payloads of every entry, oldest first."""
+        with self._lock:
+            return list(self._values)
+
+    def drop_oldest(self, count):
+        """
+        Remove the entries added first and rebuild the lookup tables.
+
+        Args:
+            count: Number of entries to remove
+        """
+        with self._lock:
+            size = len(self._values)
+            count = min(count, size)
+            if count == 0:
+                return
+            self._hashes[:size - count] = self._hashes[count:size].copy()
+            del self._values[:count]
+            self._rebuild()
+
+    def _rebuild(self):
+        """Re-sort the chunk tables over every entry. Caller holds the lock."""
+        size = len(self._values)
+        hashes = self._hashes[:size]
+        self._tables = []
+        for chunk in range(NUM_CHUNKS):
+            keys = ((hashes >> np.uint64(chunk * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.uint16)
+            order = np.argsort(keys, kind='stable').astype(np.int32)
+            self._tables.append((keys[order], order))
+        self._indexed = size
+
+    def _neighbour_masks(self, radius):
+        """Cached chunk masks within `radius` bits."""
+        if radius not in self._masks:
+            self._masks[radius] = _masks_within(radius)
+        return self._masks[radius]
+
+    def search(self, phash, max_distance):
+        """
+        Find stored hashes within a Hamming distance of a query.
+
+        Args:
+            phash: Unsigned 64-bit query hash
+            max_distance: Maximum number of differing bits
+
+        Returns:
+            list: (distance, value) pairs, nearest first
+        """
+        with self._lock:
+            size = len(self._values)
+            if size == 0:
+                return []
+            pending = size - self._indexed
+            if pending > max(self.MIN_PENDING_REBUILD, self._indexed // 4):
+                self._rebuild()
+
+            query = np.uint64(phash)
+            masks = self._neighbour_masks(max_distance // NUM_CHUNKS)
+            candidates = [np.arange(self._indexed, size, dtype=np.int32)]
+            for chunk, (keys, order) in enumerate(self._tables):
+                probe = np.uint16((phash >> (chunk * CHUNK_BITS)) & 0xFFFF) ^ masks
+                lo = np.searchsorted(keys, probe, side='left')
+                hi = np.searchsorted(keys, probe, side='right')
+                lengths = hi - lo
+                total = int(lengths.sum())
+                if total == 0:
+                    continue
+                # Expand the [lo, hi) ranges into one flat index array
+                starts = np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)
+                candidates.append(order[np.arange(total) + starts])
+
+            ids = np.unique(np.concatenate(candidates))
+            distances = _popcount64(self._hashes[ids] ^ query)
+            keep = distances <= max_distance
+            ids, distances = ids[keep], distances[keep]
+            ranked = np.argsort(distances, kind='stable')
+            return [(int(distances[i]), self._values[ids[i]]) for i in ranked]
+
+
+class NearDuplicateIndex:
+    """
+    Map perceptual hashes of analyzed images to their result cache keys.
+
+    Entries live as long as the cache entries they point to: each expires
+    with the cache TTL, and at most max_entries are kept, matching a cache
+    without a disk tier. Entries are added in expiry order, so both limits
+    drop the oldest ones; that happens in batches, keeping add() cheap.
+    """
+
+    TRIM_SLACK = 0.25  # Share of max_entries allowed over the limit between trims
+    TRIM_INTERVAL = 60.0  # Seconds between checks for expired entries
+
+    def __init__(self, max_distance, max_entries=None, ttl_seconds=None):
+        """
+        Initialize an empty index.
+
+        Args:
+            max_distance: Largest Hamming distance treated as the same image
+            max_entries: Most entries kept (None for no limit)
+            ttl_seconds: Lifetime of an entry (None for no expiry)
+        """
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._index = HammingIndex()
+        self._next_trim = time.monotonic() + self.TRIM_INTERVAL
+        self._trim_lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.dropped = 0
+
+    def load(self, entries):
+        """
+        Seed the index, e.g. from ResultCache.perceptual_entries().
+
+        Args:
+            entries: (phash, (context, key, expires_at)) pairs, soonest to expire first
+        """
+        entries = list(entries)
+        if entries:
+            phashes, values = zip(*entries)
+            self._index.extend(phashes, values)
+            self._trim(force=True)
+
+    def add(self, phash, context, key):
+        """
+        Remember the cache key of an analyzed image.
+
+        Args:
+            phash: Perceptual hash of the image
+            context: Context key of the request settings
+            key: Result cache key
+        """
+        expires_at = time.time() + self.ttl_seconds if self.ttl_seconds is not None else float('inf')
+        self._index.add(phash, (context, key, expires_at))
+        self._trim()
+
+    def _trim(self, force=False):
+        """Drop expired entries and the oldest ones over max_entries, once enough have piled up."""
+        over = 0 if self.max_entries is None else len(self._index) - self.max_entries
+        slack = 0 if self.max_entries is None else max(1, int(self.max_entries * self.TRIM_SLACK))
+        if not force and over <= slack and time.monotonic() < self._next_trim:
+            return
+        with self._trim_lock:
+            self._next_trim = time.monotonic() + self.TRIM_INTERVAL
+            now = time.time()
+            values = self._index.values()
+            expired = 0
+            while expired < len(values) and values[expired][2] <= now:
+                expired += 1
+            count = max(expired, len(values) - self.max_entries if self.max_entries is not None else 0)
+            self._index.drop_oldest(count)
+            self.dropped += count
+
+    def candidates(self, phash, context):
+        """
+        Cache keys of earlier images that look like this one, nearest first.
+
+        Args:
+            phash: Perceptual hash of the query image
+            context: Only entries analyzed with these settings are returned
+
+        Returns:
+            list: (distance, cache key) pairs
+        """
+        self.lookups += 1
+        now = time.time()
+        return [
+            (distance, key)
+            for distance, (entry_context, key, expires_at) in self._index.search(phash, self.max_distance)
+            if entry_context == context and expires_at > now
+        ]
+
+    def record_hit(self):
+        """Count a lookup that was answered from a near-duplicate."""
+        self.hits += 1
+
+    def stats(self):
+        """
+        Return index counters.
+
+        Returns:
+            dict: Entry count, lookups, hits and entries dropped as their cache entries went
+        """
+        return {
+            'entries': len(self._index),
+            'max_entries': self.max_entries,
+            'dropped': self.dropped,
+            'lookups': self.lookups,
+            'hits': self.hits,
+            'max_distance': self.max_distance
+        }
@@ -1,88 +1,854 @@
 """
 Main processing pipeline for multimodal image analysis.
 """
-from openai_client import OpenAIClient
+from openai_client import OpenAIClient, AsyncOpenAIClient
 from image_processor import ImageProcessor
+from cache import ResultCache, make_cache_key, make_context_key, make_prompt_key
+from phash import NearDuplicateIndex, dhash
+from search import get_result_store
+from json_stream import JSONFieldParser, parse_analysis, text_value
+from singleflight import SingleFlight, AsyncSingleFlight
+from router import create_router
+from tiering import ModelTiers, TIERED_PROVIDER
+from config import Config
+import metrics
+import preprocess_pool
 import prompts
+import asyncio
+import hashlib
+import sqlite3
+import time
+
+class _AnalysisRequest:
+    """State carried from preprocessing to the upstream call for one image."""
+    
+    def __init__(self, image, fields, endpoint=None):
+        self.image = image  # PreparedImage
+        self.endpoint = endpoint  # 'analyze', 'stream', 'batch' or 'jobs': picks the starting tier
+        self.requested = fields  # Output fields the caller asked for
+        self.fields = fields  # Output fields to generate: those not found in the cache
+        self.prompt = prompts.get_analysis_prompt(fields, image.frames)
+        self.base_key = None  # Image and settings; field entries are keyed off it
+        self.cache_key = None  # Image, settings and requested fields; shared by coalesced requests
+        self.context_key = None
+        self.phash = None
+        self.cached = None  # Result served without an upstream call
+        self.cached_fields = {}  # Requested fields found in the cache when others were not
+        self.models = {}  # Generated field -> model that answered it, with tiering
+        self.failover_fields = set()  # Generated fields another provider answered; kept out of the cache
 
 class AnalysisPipeline:
     """Orchestrate the five-stage analysis pipeline."""
     
     def __init__(self):
-        """Initialize pipeline with OpenAI client."""
+        """Initialize pipeline with OpenAI clients, provider router and result cache."""
         self.client = OpenAIClient()
+        self.async_client = AsyncOpenAIClient() if Config.ASYNC_ENABLED else None
+        # Failover and hedging across providers; streaming always uses OpenAI
+        self.router = create_router(self.client, self.async_client)
+        # Cheap model first, larger ones for the fields it fails
+        self.tiers = ModelTiers() if Config.MODEL_TIERS else None
+        self.model_name = self.tiers.name if self.tiers is not None else self.client.model
         self.processor = ImageProcessor()
+        self.cache = ResultCache() if Config.CACHE_ENABLED else None
+        self.near_duplicates = None
+        if self.cache is not None and Config.PHASH_ENABLED:
+            # Bounded like the cache: by its TTL, and by its size when there is no disk tier
+            self.near_duplicates = NearDuplicateIndex(
+                Config.PHASH_MAX_DISTANCE,
+                max_entries=self.cache.max_entries if not self.cache.db_path else None,
+                ttl_seconds=self.cache.ttl_seconds
+            )
+            self.near_duplicates.load(self.cache.perceptual_entries())
+        # Concurrent identical uploads share one upstream call
+        self.inflight = SingleFlight() if Config.SINGLEFLIGHT_ENABLED else None
+        self.inflight_async = AsyncSingleFlight() if Config.SINGLEFLIGHT_ENABLED else None
+        # Every analysis is kept for /api/search
+        self.history = self._open_history() if Config.SEARCH_ENABLED else None
+    
+    @staticmethod
+    def _open_history():
+        """The search history store, or None when it cannot be opened (e.g. a read-only disk)."""
+        try:
+            return get_result_store()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Search history disabled: cannot open {Config.SEARCH_DB_PATH}: {str(e)}")
+            return None
     
-    def process_image(self, image_data):
+    def process_image(self, image_data, fields=None, endpoint=None):
         """
         Process image through complete pipeline in a single request.
         
         Args:
             image_data: File-like object, bytes, or PIL.Image
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
             
         Returns:
-            dict: Analysis results with all five outputs
+            dict: Analysis results with the requested outputs
         """
-        import json
-        import re
-
-        # Validate and preprocess
-        is_valid, error = self.processor.validate_image(image_data)
-        if not is_valid:
-            raise ValueError(error)
+        return self._analyze(self._prepare(image_data, fields, endpoint))
+    
+    def analyze_preprocessed(self, image, fields=None, endpoint=None):
+        """
+        Analyze an image that already went through validation and preprocessing.
+        
+        Args:
+            image: PreparedImage returned by ImageProcessor.ingest()
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Returns:
+            dict: Analysis results with the requested outputs
+        """
+        return self._analyze(self._prepare_image(image, fields, endpoint))
+    
+    async def process_image_async(self, image_data, fields=None, endpoint=None):
+        """
+        Coroutine version of process_image for the async request path.
+        
+        Validation and preprocessing run in the default executor so the event
+        loop only ever waits on the upstream call.
+        
+        Args:
+            image_data: File-like object, bytes, or PIL.Image
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Returns:
+            dict: Analysis results with the requested outputs
+        """
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(
+            None, metrics.carry_context(self._prepare), image_data, fields, endpoint
+        )
+        return await self._analyze_async(request)
+    
+    async def analyze_preprocessed_async(self, image, fields=None, endpoint=None):
+        """
+        Coroutine version of analyze_preprocessed.
+        
+        Args:
+            image: PreparedImage returned by ImageProcessor.ingest()
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Returns:
+            dict: Analysis results with the requested outputs
+        """
+        loop = asyncio.get_running_loop()
+        request = await loop.run_in_executor(
+            None, metrics.carry_context(self._prepare_image), image, fields, endpoint
+        )
+        return await self._analyze_async(request)
+    
+    def _analyze(self, request):
+        """Run the upstream call for a prepared request unless it was cached or is in flight."""
+        if request.cached is not None:
+            return request.cached
+        
+        try:
+            if self.inflight is None:
+                return self._call_upstream(request)
+            results, shared = self.inflight.do(request.cache_key, self._call_upstream, request)
+            return self._shared_result(request, results) if shared else results
+            
+        except Exception as e:
+            return self._error_result(e)
+    
+    def _call_upstream(self, request):
+        """Single stage: consolidated analysis of one prepared request."""
+        if self.tiers is not None:
+            return self._complete(request, *self._call_tiers(request))
+        print("Running consolidated image analysis...")
+        with metrics.span('upstream'):
+            response_text, provider = self.router.analyze(request.image, request.prompt, request.fields)
+        self._note_provider(request, provider, request.fields)
+        results, missing = self._parse(response_text, request.fields)
+        return self._complete(request, self._fill_missing(request, results, missing), provider)
+    
+    def _call_tiers(self, request):
+        """
+        Ask each tier for the fields that start there or that the tier below failed.
+        
+        Args:
+            request: _AnalysisRequest from _prepare()
+            
+        Returns:
+            tuple: (every requested field in order, name of the provider that answered last)
+        """
+        results, escalated, provider = {}, [], None
+        groups = self.tiers.start_tiers(request.fields, request.endpoint)
+        for tier, model in enumerate(self.tiers.models):
+            ask = [name for name in request.fields if name in groups[tier] or name in escalated]
+            if not ask:
+                continue
+            print(f"Running image analysis on {model}: {', '.join(ask)}")
+            start = time.monotonic()
+            try:
+                with metrics.span('upstream'):
+                    response_text, provider = self.router.analyze(
+                        request.image, self._tier_prompt(request, ask), ask, model
+                    )
+            except Exception as e:
+                if tier == self.tiers.last:
+                    raise
+                escalated = self.tiers.fail(model, ask, e)
+                continue
+            self._note_provider(request, provider, ask)
+            tiered = provider == TIERED_PROVIDER
+            if tiered:
+                self.tiers.record_call(model, time.monotonic() - start, ask)
+            found, missing = self._parse(response_text, ask)
+            if tier == self.tiers.last:
+                self._keep_last_tier(request, model if tiered else self._provider_model(provider), ask, results, found)
+                return self._fill_missing(request, dict(results, **found), missing, model), provider
+            if tiered:
+                escalated = self._keep_tier(request, model, results, found, missing)
+            else:
+                escalated = self._keep_failover(request, provider, results, found, missing)
+        return {name: results[name] for name in request.fields}, provider
+    
+    def _tier_prompt(self, request, fields):
+        """The request's prompt, or one for a subset of its fields."""
+        if fields == request.fields:
+            return request.prompt
+        return prompts.get_analysis_prompt(fields, request.image.frames)
+    
+    def _keep_tier(self, request, model, results, found, missing):
+        """
+        Add the fields a tier below the last got right to results.
+        
+        Returns:
+            list: Field names to ask of the next tier
+        """
+        accepted, escalated = self.tiers.check(model, found, missing)
+        results.update(accepted)
+        request.models.update((name, model) for name in accepted)
+        if not accepted:
+            metrics.WASTED_CALLS.inc()
+        return escalated
+    
+    def _keep_failover(self, request, provider, results, found, missing):
+        """
+        Add the fields another provider answered in a tier's place to results.
+        
+        Tier models are models of TIERED_PROVIDER; a failover provider runs its
+        own model whatever the tier, so asking it again on the next tier would
+        get the same answer. Its fields are kept without confidence checks or
+        tier counters, and only the missing ones go on to the next tier.
+        
+        Returns:
+            list: Field names to ask of the next tier
+        """
+        results.update(found)
+        request.models.update((name, self._provider_model(provider)) for name in found)
+        if not found:
+            metrics.WASTED_CALLS.inc()
+        return list(missing)
+    
+    @staticmethod
+    def _note_provider(request, provider, fields):
+        """
+        Remember fields asked of a provider other than TIERED_PROVIDER.
         
-        image = self.processor.preprocess_image(image_data)
+        Cache keys name the OpenAI model (or tiers) a request was meant for;
+        another provider's answer stored under them would be served as that
+        model's until it expired, so _complete() does not cache these fields.
+        """
+        if provider != TIERED_PROVIDER:
+            request.failover_fields.update(fields)
+    
+    def _provider_model(self, provider):
+        """Model a provider other than TIERED_PROVIDER answers with, for metadata.models."""
+        for candidate in self.router.providers:
+            if candidate.name == provider:
+                return getattr(candidate.client, 'model_name', provider)
+        return provider
+    
+    @staticmethod
+    def _keep_last_tier(request, model, fields, results, found):
+        """Record the last tier as the source of the fields it was asked for."""
+        request.models.update((name, model) for name in fields)
+        if results and not found:
+            # _fill_missing() counts an empty first answer only when nothing came before it
+            metrics.WASTED_CALLS.inc()
+    
+    async def _analyze_async(self, request):
+        """Coroutine version of _analyze using the async client."""
+        if request.cached is not None:
+            return request.cached
         
         try:
-            # Single stage: Consolidated Analysis
-            print("Running consolidated image analysis...")
-            prompt = prompts.get_analysis_prompt()
-            response_text = self.client.analyze_with_retry(image, prompt)
-            
-            # Extract JSON from response (handling potential markdown blocks)
-            json_match = re.search(r'(\{.*\})', response_text, re.DOTALL)
-            if json_match:
-                results = json.loads(json_match.group(1))
+            if self.inflight_async is None:
+                return await self._call_upstream_async(request)
+            results, shared = await self.inflight_async.do(
+                request.cache_key, self._call_upstream_async, request
+            )
+            return self._shared_result(request, results) if shared else results
+            
+        except Exception as e:
+            return self._error_result(e)
+    
+    async def _call_upstream_async(self, request):
+        """Coroutine version of _call_upstream."""
+        if self.tiers is not None:
+            return await self._complete_async(request, *await self._call_tiers_async(request))
+        print("Running consolidated image analysis (async)...")
+        with metrics.span('upstream'):
+            response_text, provider = await self.router.analyze_async(
+                request.image, request.prompt, request.fields
+            )
+        self._note_provider(request, provider, request.fields)
+        results, missing = self._parse(response_text, request.fields)
+        return await self._complete_async(
+            request, await self._fill_missing_async(request, results, missing), provider
+        )
+    
+    async def _call_tiers_async(self, request):
+        """Coroutine version of _call_tiers."""
+        results, escalated, provider = {}, [], None
+        groups = self.tiers.start_tiers(request.fields, request.endpoint)
+        for tier, model in enumerate(self.tiers.models):
+            ask = [name for name in request.fields if name in groups[tier] or name in escalated]
+            if not ask:
+                continue
+            print(f"Running image analysis on {model} (async): {', '.join(ask)}")
+            start = time.monotonic()
+            try:
+                with metrics.span('upstream'):
+                    response_text, provider = await self.router.analyze_async(
+                        request.image, self._tier_prompt(request, ask), ask, model
+                    )
+            except Exception as e:
+                if tier == self.tiers.last:
+                    raise
+                escalated = self.tiers.fail(model, ask, e)
+                continue
+            self._note_provider(request, provider, ask)
+            tiered = provider == TIERED_PROVIDER
+            if tiered:
+                self.tiers.record_call(model, time.monotonic() - start, ask)
+            found, missing = self._parse(response_text, ask)
+            if tier == self.tiers.last:
+                self._keep_last_tier(request, model if tiered else self._provider_model(provider), ask, results, found)
+                return await self._fill_missing_async(request, dict(results, **found), missing, model), provider
+            if tiered:
+                escalated = self._keep_tier(request, model, results, found, missing)
             else:
-                # Fallback if no JSON structure found
-                results = json.loads(response_text)
+                escalated = self._keep_failover(request, provider, results, found, missing)
+        return {name: results[name] for name in request.fields}, provider
+    
+    @staticmethod
+    def _parse(response_text, fields):
+        """
+        Validate a model response against the fields it was asked for, counting the outcome.
+        
+        Args:
+            response_text: Raw model output
+            fields: Field names asked for
+            
+        Returns:
+            tuple: (dict of valid fields, list of missing field names)
+        """
+        with metrics.span('json_parse'):
+            results, missing, repaired = parse_analysis(response_text, fields)
+        if not results:
+            outcome = 'invalid'
+        elif missing:
+            outcome = 'partial'
+        else:
+            outcome = 'repaired' if repaired else 'valid'
+        metrics.PARSED_RESPONSES.inc(1, outcome)
+        return results, missing
+    
+    def _fill_missing(self, request, results, missing, model=None):
+        """
+        Ask again, with a prompt and schema for those fields only, for what a response lacked.
+        
+        Up to MISSING_FIELD_RETRIES follow-up calls are made, so a response
+        cut off or garbled in one field does not throw away the others.
+        
+        Args:
+            request: _AnalysisRequest from _prepare()
+            results: Valid fields parsed from the first response
+            missing: Field names it lacked
+            model: Model to ask (defaults to the client's)
+            
+        Returns:
+            dict: Every requested field, in order
+            
+        Raises:
+            ValueError: If fields are still missing after the follow-up calls
+        """
+        calls, wasted = 1, int(not results)
+        while missing and calls <= Config.MISSING_FIELD_RETRIES:
+            print(f"Asking again for missing fields: {', '.join(missing)}")
+            with metrics.span('upstream'):
+                response_text, provider = self.router.analyze(
+                    request.image, prompts.get_analysis_prompt(missing, request.image.frames), missing, model
+                )
+            self._note_provider(request, provider, missing)
+            found, missing = self._parse(response_text, missing)
+            results.update(found)
+            calls += 1
+            wasted += int(not found)
+        return self._assemble(request, results, missing, calls, wasted)
+    
+    async def _fill_missing_async(self, request, results, missing, model=None):
+        """Coroutine version of _fill_missing."""
+        calls, wasted = 1, int(not results)
+        while missing and calls <= Config.MISSING_FIELD_RETRIES:
+            print(f"Asking again for missing fields: {', '.join(missing)}")
+            with metrics.span('upstream'):
+                response_text, provider = await self.router.analyze_async(
+                    request.image, prompts.get_analysis_prompt(missing, request.image.frames), missing, model
+                )
+            self._note_provider(request, provider, missing)
+            found, missing = self._parse(response_text, missing)
+            results.update(found)
+            calls += 1
+            wasted += int(not found)
+        return self._assemble(request, results, missing, calls, wasted)
+    
+    @staticmethod
+    def _assemble(request, results, missing, calls, wasted):
+        """Order the fields of a complete analysis, or fail it; counts the calls thrown away."""
+        if missing:
+            metrics.WASTED_CALLS.inc(calls)
+            raise ValueError(f"Model response is missing or has invalid fields: {', '.join(missing)}")
+        if wasted:
+            metrics.WASTED_CALLS.inc(wasted)
+        return {name: results[name] for name in request.fields}
+    
+    def _shared_result(self, request, results):
+        """Copy of another request's in-flight result, with this request's metadata."""
+        shared = dict(results)
+        shared['metadata'] = self._metadata(request.image, cache_source='coalesced')
+        metrics.CACHE_LOOKUPS.inc(1, 'coalesced')
+        return shared
+    
+    def stream_image(self, image_data, fields=None, endpoint=None):
+        """
+        Process an image, yielding each output field as soon as the model completes it.
+        
+        Fields found in the cache are yielded first.
+        
+        Args:
+            image_data: File-like object, bytes, or PIL.Image
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Yields:
+            tuple: ('field', {'name': ..., 'value': ...}) per output field, then
+                ('done', results) or ('error', error_result)
+        """
+        call = leader = None
+        try:
+            request = self._prepare(image_data, fields, endpoint)
+            if request.cached is not None:
+                yield from self._cached_events(request.cached)
+                return
+            
+            if self.inflight is not None:
+                call, leader = self.inflight.claim(request.cache_key)
+                if not leader:
+                    # Identical image already being analyzed: wait for it
+                    results = self._shared_result(request, call.wait())
+                    yield from self._cached_events(results)
+                    return
+            
+            print("Streaming consolidated image analysis...")
+            for name, value in request.cached_fields.items():
+                yield 'field', {'name': name, 'value': value}
+            parser = JSONFieldParser()
+            sent = {}  # Field -> value the client has been sent
+            model = self._stream_model(request)
+            start = time.monotonic()
+            for chunk in self.client.stream_image(request.image, request.prompt, fields=request.fields, model=model):
+                for name, value in self._new_fields(request, parser.feed(chunk), sent):
+                    yield 'field', {'name': name, 'value': value}
+            self._record_stream(request, model, time.monotonic() - start)
+            results, missing = self._parse(parser.text, request.fields)
+            results = self._fill_missing(request, results, missing, model)
+            for name, value in self._new_fields(request, results.items(), sent):
+                yield 'field', {'name': name, 'value': value}
+            results = self._complete(request, dict(results, **sent))
+            if leader:
+                self.inflight.settle(request.cache_key, call, result=results)
+            yield 'done', results
             
-            # Ensure metadata is added
-            results['metadata'] = {
-                'image_size': image.size,
-                'image_mode': image.mode
-            }
+        except Exception as e:
+            if leader:
+                self.inflight.settle(request.cache_key, call, error=e)
+            yield 'error', self._error_result(e)
+        finally:
+            if leader:
+                # Client went away mid-stream: release the waiters
+                self.inflight.settle(request.cache_key, call, error=Exception("Analysis was cancelled"))
+    
+    async def stream_image_async(self, image_data, fields=None, endpoint=None):
+        """
+        Async generator version of stream_image using the async client.
+        
+        Args:
+            image_data: File-like object, bytes, or PIL.Image
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Yields:
+            tuple: Same events as stream_image
+        """
+        future = leader = None
+        try:
+            loop = asyncio.get_running_loop()
+            request = await loop.run_in_executor(
+                None, metrics.carry_context(self._prepare), image_data, fields, endpoint
+            )
+            if request.cached is not None:
+                for event in self._cached_events(request.cached):
+                    yield event
+                return
+            
+            if self.inflight_async is not None:
+                future, leader = self.inflight_async.claim(request.cache_key)
+                if not leader:
+                    # Identical image already being analyzed: wait for it
+                    results = self._shared_result(request, await asyncio.shield(future))
+                    for event in self._cached_events(results):
+                        yield event
+                    return
+            
+            print("Streaming consolidated image analysis (async)...")
+            for name, value in request.cached_fields.items():
+                yield 'field', {'name': name, 'value': value}
+            parser = JSONFieldParser()
+            sent = {}  # Field -> value the client has been sent
+            model = self._stream_model(request)
+            start = time.monotonic()
+            async for chunk in self.async_client.stream_image(
+                request.image, request.prompt, fields=request.fields, model=model
+            ):
+                for name, value in self._new_fields(request, parser.feed(chunk), sent):
+                    yield 'field', {'name': name, 'value': value}
+            self._record_stream(request, model, time.monotonic() - start)
+            results, missing = self._parse(parser.text, request.fields)
+            results = await self._fill_missing_async(request, results, missing, model)
+            for name, value in self._new_fields(request, results.items(), sent):
+                yield 'field', {'name': name, 'value': value}
+            results = await self._complete_async(request, dict(results, **sent))
+            if leader:
+                self.inflight_async.settle(request.cache_key, future, result=results)
+            yield 'done', results
+            
+        except Exception as e:
+            if leader:
+                self.inflight_async.settle(request.cache_key, future, error=e)
+            yield 'error', self._error_result(e)
+        finally:
+            if leader:
+                # Cancelled mid-stream (timeout or disconnect): release the waiters
+                self.inflight_async.settle(request.cache_key, future, error=Exception("Analysis was cancelled"))
+    
+    def _stream_model(self, request):
+        """Model a stream runs on: its starting tier, or the client's model without tiering."""
+        if self.tiers is None:
+            return None
+        return self.tiers.stream_model(request.fields, request.endpoint or 'stream')
+    
+    @staticmethod
+    def _new_fields(request, fields, sent):
+        """
+        Fields to send to a stream's client: requested, valid and not sent before.
+        
+        Values are normalized as parse_analysis() does, so each field goes out
+        once, with the value the final results will hold.
+        
+        Args:
+            request: _AnalysisRequest from _prepare()
+            fields: (name, value) pairs, from the parser or the final results
+            sent: Field -> value already sent; updated with the fields returned
+        
+        Returns:
+            list: (name, value) pairs
+        """
+        new = []
+        for name, value in fields:
+            value = text_value(value)
+            if name in request.fields and name not in sent and value is not None:
+                sent[name] = value
+                new.append((name, value))
+        return new
+    
+    def _record_stream(self, request, model, seconds):
+        """Count a finished stream against its tier."""
+        if self.tiers is not None:
+            self.tiers.record_call(model, seconds, request.fields)
+            request.models.update((name, model) for name in request.fields)
+    
+    @staticmethod
+    def _cached_events(results):
+        """Replay a cached result as stream events."""
+        for name, value in results.items():
+            if name != 'metadata':
+                yield 'field', {'name': name, 'value': value}
+        yield 'done', results
+    
+    def _prepare(self, image_data, fields=None, endpoint=None):
+        """
+        Validate and preprocess an upload, then try to answer it from the cache.
+        
+        Args:
+            image_data: File-like object, bytes, or PIL.Image
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Returns:
+            _AnalysisRequest: Request state; .cached is set on a cache hit
+        """
+        # Validate, decode and encode in one pass
+        if Config.PREPROCESS_IN_POOL:
+            return self._prepare_image(preprocess_pool.ingest(image_data), fields, endpoint)
+        return self._prepare_image(self.processor.ingest(image_data), fields, endpoint)
+    
+    def _prepare_image(self, image, fields=None, endpoint=None):
+        """
+        Build the request state for a preprocessed image and check the cache.
+        
+        Each field is cached on its own, so a request for more fields than
+        an earlier one only generates the ones not seen yet.
+        
+        Args:
+            image: PreparedImage returned by ImageProcessor.ingest()
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Returns:
+            _AnalysisRequest: Request state; .cached is set on a cache hit,
+                .cached_fields and .fields on a partial one
+        """
+        request = _AnalysisRequest(image, list(fields or prompts.ANALYSIS_FIELDS), endpoint)
+        # The detail level changes what the model sees, so it is part of the key
+        generation_config = dict(Config.GENERATION_CONFIG, detail=image.detail)
+        
+        # Content key shared by the cache and request coalescing
+        if self.cache is not None or self.inflight is not None:
+            request.base_key = make_cache_key(image.payload, self.model_name, '', generation_config)
+            request.cache_key = make_prompt_key(request.base_key, request.prompt)
+        
+        if self.cache is None:
+            return request
+        
+        # Serve repeated uploads from the cache
+        found, source = self._cached_fields(request.base_key, request.requested)
+        if len(found) == len(request.requested):
+            return self._cache_hit(request, found, source)
+        
+        # Fall back to a resized/recompressed copy analyzed earlier
+        if self.near_duplicates is not None:
+            request.context_key = make_context_key(self.model_name, '', generation_config)
+            request.phash = dhash(image.thumbnail)
+            candidates = []
+            if request.phash is not None:
+                candidates = self.near_duplicates.candidates(request.phash, request.context_key)
+            for distance, key in candidates:
+                near, _ = self._cached_fields(key, request.requested, record_stats=False)
+                if len(near) == len(request.requested):
+                    self.near_duplicates.record_hit()
+                    self._cache_hit(request, near, 'near_duplicate')
+                    request.cached['metadata']['phash_distance'] = distance
+                    return request
+        
+        if found:
+            # Generate only what the cache lacks
+            request.cached_fields = found
+            request.fields = [name for name in request.requested if name not in found]
+            request.prompt = prompts.get_analysis_prompt(request.fields, request.image.frames)
+            metrics.CACHE_LOOKUPS.inc(1, 'partial')
+        else:
+            metrics.CACHE_LOOKUPS.inc(1, 'miss')
+        return request
+    
+    def _cached_fields(self, base_key, fields, record_stats=True):
+        """
+        Look up the cache entries of an image's fields.
+        
+        Args:
+            base_key: Key of the image and settings
+            fields: Field names to look up
+            record_stats: Whether the lookups count towards cache hits and misses
             
-            return results
+        Returns:
+            tuple: (dict of the fields found, 'disk' if any came from disk else 'memory')
+        """
+        found = {}
+        source = 'memory'
+        for name in fields:
+            entry, tier = self.cache.get(self._field_key(base_key, name), record_stats)
+            if entry is not None and name in entry:
+                found[name] = entry[name]
+                if tier == 'disk':
+                    source = 'disk'
+        return found, source
+    
+    @staticmethod
+    def _field_key(base_key, name):
+        """Cache key of one field of an image's analysis."""
+        return make_prompt_key(base_key, prompts.get_analysis_prompt([name]))
+    
+    def _cache_hit(self, request, found, source):
+        """Mark a request as answered from the cache."""
+        cached = {name: found[name] for name in request.requested}
+        cached['metadata'] = self._metadata(request.image, cache_source=source)
+        metrics.CACHE_LOOKUPS.inc(1, source)
+        request.cached = cached
+        return request
+    
+    def _complete(self, request, results, provider='openai', history=True):
+        """
+        Store generated fields in the cache, merge in cached ones and attach metadata.
+        
+        Fields another provider answered after a failover are not cached (see
+        _note_provider()).
+        
+        Args:
+            request: _AnalysisRequest from _prepare()
+            results: Generated fields, validated
+            provider: Name of the provider that answered
+            history: Also record the analysis for /api/search
             
+        Returns:
+            dict: Analysis results with the requested fields, in order
+        """
+        if self.cache is not None:
+            for name in request.fields:
+                if name not in request.failover_fields:
+                    self.cache.set(self._field_key(request.base_key, name), {name: results[name]})
+            if request.phash is not None and not request.cached_fields:
+                # First analysis of this image: an entry carrying its hash, so the index survives restarts
+                self.cache.set(request.base_key, {}, phash=request.phash, context=request.context_key)
+                self.near_duplicates.add(request.phash, request.context_key, request.base_key)
+        
+        merged = dict(request.cached_fields, **results)
+        if history:
+            self._record_history(request, merged)
+        results = {name: merged[name] for name in request.requested}
+        
+        # Ensure metadata is added
+        results['metadata'] = self._metadata(request.image)
+        results['metadata']['provider'] = provider
+        if request.cached_fields:
+            results['metadata']['cached_fields'] = list(request.cached_fields)
+        if request.models:
+            results['metadata']['models'] = {name: request.models[name] for name in request.fields}
+        
+        return results
+    
+    async def _complete_async(self, request, results, provider='openai'):
+        """Coroutine version of _complete: the history write (SQLite, a lock) runs off the event loop."""
+        completed = self._complete(request, results, provider, history=False)
+        if self.history is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                None, metrics.carry_context(self._record_history), request, dict(request.cached_fields, **results)
+            )
+        return completed
+    
+    def _record_history(self, request, fields):
+        """Record an analysis for /api/search; a failure is logged, never returned to the caller."""
+        if self.history is None:
+            return
+        try:
+            with metrics.span('history'):
+                self.history.record(hashlib.sha256(request.image.payload).hexdigest(), fields)
         except Exception as e:
-            print(f"Pipeline error: {str(e)}")
-            return {
-                'error': str(e),
-                'caption': 'Error analyzing image',
-                'summary': 'Could not generate summary due to an error.',
-                'objects': '- Error',
-                'mood': 'Error',
-                'story': 'Error'
-            }
+            print(f"Search history write failed: {str(e)}")
+    
+    @staticmethod
+    def _error_result(error):
+        """
+        Build the placeholder result returned when analysis fails.
+        
+        Args:
+            error: Exception raised during analysis
+            
+        Returns:
+            dict: Result with an 'error' key
+        """
+        print(f"Pipeline error: {str(error)}")
+        return {
+            'error': str(error),
+            'caption': 'Error analyzing image',
+            'summary': 'Could not generate summary due to an error.',
+            'objects': '- Error',
+            'mood': 'Error',
+            'story': 'Error'
+        }
 
+    @staticmethod
+    def _metadata(image, cache_source=None):
+        """
+        Build the metadata block attached to every result.
+        
+        Args:
+            image: PreparedImage sent upstream
+            cache_source: 'memory', 'disk' or 'near_duplicate' when served from the cache,
+                'coalesced' when shared with an identical in-flight request
+            
+        Returns:
+            dict: Result metadata; 'keyframes' lists the frames of an animated
+                upload that were analysed
+        """
+        metadata = {
+            'image_size': image.size,
+            'image_mode': image.mode,
+            'payload_bytes': len(image.payload),
+            'estimated_image_tokens': image.estimated_tokens(),
+            'cached': cache_source is not None,
+            'cache_source': cache_source
+        }
+        if image.keyframes:
+            metadata['keyframes'] = image.keyframes
+        return metadata
     
-    def process_base64_image(self, base64_string):
+    def process_base64_image(self, base64_string, fields=None, endpoint=None):
         """
         Process base64 encoded image.
         
         Args:
             base64_string: Base64 encoded image data
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
             
         Returns:
             dict: Analysis results
         """
-        image = self.processor.base64_to_image(base64_string)
+        return self.process_image(self._base64_to_buffer(base64_string), fields, endpoint)
+    
+    async def process_base64_image_async(self, base64_string, fields=None, endpoint=None):
+        """
+        Coroutine version of process_base64_image.
         
-        # Convert to bytes for processing
-        import io
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG')
-        buffer.seek(0)
+        Args:
+            base64_string: Base64 encoded image data
+            fields: Output fields to generate (defaults to all five)
+            endpoint: Endpoint the request came from, for tier routing
+            
+        Returns:
+            dict: Analysis results
+        """
+        loop = asyncio.get_running_loop()
+        buffer = await loop.run_in_executor(None, self._base64_to_buffer, base64_string)
+        return await self.process_image_async(buffer, fields, endpoint)
+    
+    def _base64_to_buffer(self, base64_string):
+        """
+        Decode base64 image data for process_image, without touching the pixels.
         
-        return self.process_image(buffer)
+        Args:
+            base64_string: Base64 encoded image data
+            
+        Returns:
+            bytes: Image file data
+        """
+        return self.processor.decode_base64(base64_string)
\ No newline at end of file
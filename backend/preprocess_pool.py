@@ -0,0 +1,179 @@
+"""
+Image preprocessing in worker processes, with buffers handed over in shared memory.
+
+Decoding, resizing, alpha compositing and encoding hold the GIL for long
+stretches, so concurrent requests preprocessing in threads queue behind each
+other. Worker processes run them in parallel. The upload is copied once into
+a shared memory block; the worker writes the encoded payload and the preview
+pixels back into the same block, so no image buffer goes through pickle or
+the pool's pipe. Only a small description of the result does.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, InvalidStateError, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image
+from image_processor import ImageProcessor, PreparedImage, get_encoding_profile
+from config import Config
+import metrics
+
+MIN_BLOCK_BYTES = 1024 * 1024  # Room for the payload and preview of small uploads
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_preprocess_pool():
+    """Process pool shared by requests and batches, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = Config.BATCH_PREPROCESS_WORKERS or os.cpu_count() or 1
+            # Spawn rather than fork: the server process runs an event loop thread
+            _pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+    return _pool
+
+
+def _ingest_shared(name, length, profile, resample):
+    """
+    Worker body: ingest the upload in a shared block and write the result back into it.
+
+    Args:
+        name: Shared memory block holding the upload in its first `length` bytes
+        length: Upload size
+        profile: Encoding profile dict
+        resample: Resampling filter name
+
+    Returns:
+        dict: Description of the PreparedImage; 'payload' and 'thumbnail'
+            hold (offset, length) in the block, or the bytes themselves if
+            they did not fit
+    """
+    # Spawned workers share the parent's resource tracker, so the block stays
+    # registered once and the parent's unlink() unregisters it
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        prepared = ImageProcessor.ingest(bytes(block.buf[:length]), profile, resample)
+        thumbnail = prepared.thumbnail
+        pixels = thumbnail.tobytes()
+        result = {
+            'size': prepared.size,
+            'format': prepared.format,
+            'detail': prepared.detail,
+            'passthrough': prepared.passthrough,
+            'keyframes': prepared.keyframes,
+            'thumbnail_mode': thumbnail.mode,
+            'thumbnail_size': thumbnail.size,
+        }
+        # A passthrough payload is the upload, which the parent still has
+        payload = b'' if prepared.passthrough else prepared.payload
+        if len(payload) + len(pixels) <= block.size:
+            block.buf[:len(payload)] = payload
+            block.buf[len(payload):len(payload) + len(pixels)] = pixels
+            result['payload'] = (0, len(payload))
+            result['thumbnail'] = (len(payload), len(pixels))
+        else:
+            result['payload'] = payload
+            result['thumbnail'] = pixels
+        return result
+    finally:
+        block.close()
+
+
+def _read_block(block, value):
+    """Bytes stored in the block at (offset, length), or value itself if it was returned inline."""
+    if isinstance(value, tuple):
+        offset, length = value
+        return bytes(block.buf[offset:offset + length])
+    return value
+
+
+def submit_ingest(data, profile=None, resample=None):
+    """
+    Ingest an upload in the process pool.
+
+    Args:
+        data: Raw image file bytes
+        profile: Encoding profile dict or name (defaults to Config)
+        resample: Resampling filter name (defaults to Config.RESAMPLE_FILTER)
+
+    Returns:
+        concurrent.futures.Future: Resolves to a PreparedImage, or raises
+            the ValueError ImageProcessor.ingest() would
+    """
+    profile = get_encoding_profile(profile)
+    resample = resample or Config.RESAMPLE_FILTER
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), MIN_BLOCK_BYTES))
+    block.buf[:len(data)] = data
+    prepared = Future()
+
+    def finish(work):
+        image = error = None
+        try:
+            result = work.result()
+            payload = data if result['passthrough'] else _read_block(block, result['payload'])
+            thumbnail = Image.frombytes(result['thumbnail_mode'], result['thumbnail_size'],
+                                        _read_block(block, result['thumbnail']))
+            image = PreparedImage(
+                payload, result['size'], result['format'], result['detail'],
+                thumbnail=thumbnail, passthrough=result['passthrough'], keyframes=result['keyframes']
+            )
+        except BaseException as e:
+            error = e
+        # Free the block before anyone waiting on the result runs
+        block.close()
+        block.unlink()
+        try:
+            if error is not None:
+                prepared.set_exception(error)
+            else:
+                prepared.set_result(image)
+        except InvalidStateError:
+            pass  # Cancelled by the caller
+
+    try:
+        work = get_preprocess_pool().submit(_ingest_shared, block.name, len(data), profile, resample)
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    work.add_done_callback(finish)
+    # Cancelling the result drops the work if no worker has started it yet
+    prepared.add_done_callback(lambda future: future.cancelled() and work.cancel())
+    return prepared
+
+
+def ingest(file_data, profile=None, resample=None):
+    """
+    ImageProcessor.ingest() in the process pool, for images worth the handoff.
+
+    Images under PREPROCESS_POOL_MIN_MEGAPIXELS (and anything whose header
+    cannot be read, so the error comes from ingest() itself) are processed in
+    the calling thread.
+
+    Args:
+        file_data: File-like object or bytes
+        profile: Encoding profile dict or name (defaults to Config)
+        resample: Resampling filter name (defaults to Config.RESAMPLE_FILTER)
+
+    Returns:
+        PreparedImage: Payload and preview; the full-size image is decoded
+            from the payload only if something asks for it
+    """
+    data = ImageProcessor._read_bytes(file_data)
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        width = height = 0
+    small = width * height < Config.PREPROCESS_POOL_MIN_MEGAPIXELS * 1_000_000
+    if small or len(data) > Config.MAX_IMAGE_SIZE_BYTES:
+        return ImageProcessor.ingest(data, profile, resample)
+
+    # The worker's validate/preprocess/encode spans stay in the worker; time the whole handoff
+    metrics.BYTES.inc(len(data), 'upload')
+    with metrics.span('preprocess'):
+        return submit_ingest(data, profile, resample).result()
@@ -1,15 +1,140 @@
-def get_analysis_prompt():
-    """Generate a consolidated prompt for all five analysis tasks in one request."""
-    return """Analyze this image in detail and provide the following five outputs in a JSON format:
+"""
+Analysis prompt and the structured-output schema for its fields.
+"""
+from config import Config
 
-1. "caption": A single factual sentence describing the main subject and action.
-2. "summary": A 3-5 line descriptive summary including visual details (colors, lighting, atmosphere).
-3. "objects": A bulleted list of all visible objects, people, and entities.
-4. "mood": A 2-3 sentence analysis of the emotional tone and atmosphere.
-5. "story": A creative 5-10 line short story inspired by the image.
+ANALYSIS_FIELDS = ('caption', 'summary', 'objects', 'mood', 'story')
+
+FIELD_INSTRUCTIONS = {
+    'caption': 'A single factual sentence describing the main subject and action.',
+    'summary': 'A 3-5 line descriptive summary including visual details (colors, lighting, atmosphere).',
+    'objects': 'A bulleted list of all visible objects, people, and entities.',
+    'mood': 'A 2-3 sentence analysis of the emotional tone and atmosphere.',
+    'story': 'A creative 5-10 line short story inspired by the image.',
+}
+
+# Output allowance per field; all five plus the JSON around them make up the 2048 of GENERATION_CONFIG
+FIELD_MAX_TOKENS = {
+    'caption': 96,
+    'summary': 320,
+    'objects': 512,
+    'mood': 224,
+    'story': 832,
+}
+JSON_OVERHEAD_TOKENS = 64
+
+_COUNT_WORDS = ('one', 'two', 'three', 'four', 'five')
+
+# Prepended for animated uploads, which are sent as a grid of keyframes (keyframes.py)
+CONTACT_SHEET_NOTE = (
+    "This image is a contact sheet of {frames} frames from one animation, in playback order "
+    "from left to right and top to bottom. Treat it as a single moving scene: describe what "
+    "happens across the frames, not each frame separately, and do not mention the grid.\n\n"
+)
+
+
+def _check_fields(fields):
+    """Field names as a list, defaulting to all of them."""
+    fields = list(fields or ANALYSIS_FIELDS)
+    unknown = [name for name in fields if name not in FIELD_INSTRUCTIONS]
+    if unknown:
+        raise ValueError(f"Unknown analysis field(s): {', '.join(unknown)}. "
+                         f"Choose from: {', '.join(ANALYSIS_FIELDS)}")
+    return fields
+
+
+def parse_fields(value):
+    """
+    Field selection from a request parameter.
+
+    Args:
+        value: None, a comma-separated string or a list of field names
+
+    Returns:
+        list: Field names in ANALYSIS_FIELDS order, or None for all of them
+
+    Raises:
+        ValueError: If a name is not an analysis field
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+        raise ValueError("'fields' must be a comma-separated string or a list of field names")
+    names = {name.strip() for name in value if name.strip()}
+    if not names:
+        return None
+    _check_fields(names)
+    return [name for name in ANALYSIS_FIELDS if name in names]
+
+
+def get_max_tokens(fields=None):
+    """
+    Output token allowance for a response holding the fields.
+
+    Args:
+        fields: Field names (defaults to all five)
+
+    Returns:
+        int: max_tokens for the request, never above GENERATION_CONFIG's
+    """
+    fields = _check_fields(fields)
+    budget = JSON_OVERHEAD_TOKENS + sum(FIELD_MAX_TOKENS[name] for name in fields)
+    return min(budget, Config.GENERATION_CONFIG['max_tokens'])
+
+
+def get_analysis_prompt(fields=None, frames=1):
+    """
+    Generate a consolidated prompt for the analysis tasks in one request.
+
+    Args:
+        fields: Field names to ask for, in order (defaults to all five)
+        frames: Animation frames tiled into the image (1 for a still image)
+
+    Returns:
+        str: Prompt text
+    """
+    fields = _check_fields(fields)
+    outputs = '\n'.join(
+        f'{number}. "{name}": {FIELD_INSTRUCTIONS[name]}' for number, name in enumerate(fields, 1)
+    )
+    keys = ', '.join(f'"{name}"' for name in fields)
+    count = f"{_COUNT_WORDS[len(fields) - 1]} output{'s' if len(fields) > 1 else ''}"
+    sheet = CONTACT_SHEET_NOTE.format(frames=frames) if frames > 1 else ''
+    return f"""{sheet}Analyze this image in detail and provide the following {count} in a JSON format:
+
+{outputs}
 
 Requirements for JSON format:
-- Use precisely these keys: "caption", "summary", "objects", "mood", "story"
+- Use precisely these keys: {keys}
 - Ensure the JSON is valid and well-formatted.
 - Provide only the JSON object, nothing else."""
 
+
+def get_response_format(fields=None):
+    """
+    Structured-output `response_format` holding the model to a JSON object with the fields.
+
+    Args:
+        fields: Field names to require (defaults to all five)
+
+    Returns:
+        dict: response_format argument for chat.completions.create()
+    """
+    fields = _check_fields(fields)
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': 'image_analysis',
+            'strict': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    name: {'type': 'string', 'description': FIELD_INSTRUCTIONS[name]} for name in fields
+                },
+                'required': fields,
+                'additionalProperties': False,
+            },
+        },
+    }
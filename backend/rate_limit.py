@@ -0,0 +1,562 @@
+"""
+Client-side flow control for upstream calls: rate limits, adaptive concurrency and retries.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from collections import deque
+import openai
+from config import Config
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_flow_controls = {}
+_flow_control_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        """
+        Initialize a full bucket.
+
+        Args:
+            rate_per_minute: Sustained rate
+            capacity: Largest burst (defaults to one second's worth, since
+                per-minute limits are enforced over shorter periods upstream)
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount):
+        """
+        Take tokens now, going into debt if needed.
+
+        Callers that go into debt wait their turn, so reservations are served
+        in order instead of racing for the refill.
+
+        Args:
+            amount: Tokens to take
+
+        Returns:
+            float: Seconds to wait before using them
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def refund(self, amount):
+        """Return tokens that were reserved but not used."""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits shared by all clients in the process."""
+
+    def __init__(self, rpm=None, tpm=None, tpm_burst=None):
+        """
+        Initialize limiter.
+
+        Args:
+            rpm: Requests per minute (0 or None disables the limit)
+            tpm: Tokens per minute (0 or None disables the limit)
+            tpm_burst: Tokens an idle limiter lets through at once; at least one
+                second's worth. Set it to the largest request, or a single image
+                request goes into debt and waits even after minutes of idling.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm, max(tpm / 60.0, tpm_burst or 0)) if tpm else None
+        self.delayed = 0
+        self.delay_seconds = 0.0
+
+    def reserve(self, tokens):
+        """
+        Reserve one request and an estimated token count.
+
+        Args:
+            tokens: Estimated tokens of the request (prompt + image + max output)
+
+        Returns:
+            float: Seconds to wait before sending
+        """
+        delay = 0.0
+        if self._requests is not None:
+            delay = self._requests.reserve(1)
+        if self._tokens is not None:
+            delay = max(delay, self._tokens.reserve(tokens))
+        if delay > 0:
+            self.delayed += 1
+            self.delay_seconds += delay
+        return delay
+
+    def acquire(self, tokens):
+        """Block the calling thread until the request may be sent."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens):
+        """Coroutine version of acquire()."""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def reconcile(self, estimated, actual):
+        """
+        Correct the token bucket once the real usage is known.
+
+        Args:
+            estimated: Tokens reserved before the call
+            actual: Tokens reported by the API
+        """
+        if self._tokens is None or actual is None:
+            return
+        if actual < estimated:
+            self._tokens.refund(estimated - actual)
+        else:
+            self._tokens.reserve(actual - estimated)
+
+    def stats(self):
+        """Counters for /api/health."""
+        return {
+            'rpm': self.rpm or None,
+            'tpm': self.tpm or None,
+            'delayed': self.delayed,
+            'delay_seconds': round(self.delay_seconds, 3)
+        }
+
+
+class AIMDController:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+
+    Like TCP, it starts in slow start: each success raises the limit by one
+    (doubling it every round trip) until the first throttle. After that every
+    success raises it by increase / limit (about +1 per round trip) and a
+    throttled response multiplies it by decrease. Calls sent before the last
+    cut were sized by the old limit, so their throttles don't cut it again.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, increase=1.0, decrease=0.5):
+        """
+        Initialize controller in slow start.
+
+        Args:
+            maximum: Upper bound for the limit
+            minimum: Lower bound for the limit
+            initial: Starting limit (defaults to maximum, i.e. no slow start)
+            increase: Additive step per round trip
+            decrease: Multiplicative factor on throttling
+        """
+        self.maximum = maximum
+        self.minimum = minimum
+        self.increase = increase
+        self.decrease = decrease
+        self._limit = float(min(maximum, max(minimum, initial or maximum)))
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self.throttles = 0
+
+    @property
+    def limit(self):
+        """Current concurrency limit."""
+        return max(self.minimum, int(self._limit))
+
+    def on_success(self):
+        """Record a successful call."""
+        with self._lock:
+            step = 1.0 if self._slow_start else self.increase / self._limit
+            self._limit = min(self.maximum, self._limit + step)
+
+    def on_throttle(self, sent_at):
+        """
+        Record a throttled (429) call.
+
+        Args:
+            sent_at: time.monotonic() when the call was sent
+        """
+        with self._lock:
+            self.throttles += 1
+            self._slow_start = False
+            if sent_at >= self._last_decrease:
+                self._limit = max(self.minimum, self._limit * self.decrease)
+                self._last_decrease = time.monotonic()
+
+
+class InFlightCount:
+    """
+    Calls holding a concurrency slot, counted once for the whole process.
+
+    The sync and async limiters share one count, so threads and coroutines
+    together stay under the AIMD limit. Threads wait on a condition;
+    coroutines wait on a future of their own loop, woken thread-safely by
+    whichever side releases a slot.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._condition = threading.Condition()
+        self._waiters = []  # (loop, future) of coroutines waiting for a slot
+
+    def acquire(self, limit):
+        """
+        Block the calling thread until a slot is free, then take it.
+
+        Args:
+            limit: Callable returning the current number of slots
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.count < limit())
+            self.count += 1
+
+    async def acquire_async(self, limit):
+        """Coroutine version of acquire()."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                if self.count < limit():
+                    self.count += 1
+                    return
+                waiter = loop.create_future()
+                self._waiters.append((loop, waiter))
+            await waiter
+
+    def release(self):
+        """Free a slot and wake everyone waiting for one."""
+        with self._condition:
+            self.count -= 1
+            self._condition.notify_all()
+            waiters, self._waiters = self._waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                pass  # Its loop has closed
+
+
+def _wake(waiter):
+    """Resolve a slot waiter unless it was cancelled."""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """Context manager holding threads while the controller's limit is reached."""
+
+    def __init__(self, controller, maximum=None, count=None):
+        """
+        Initialize limiter.
+
+        Args:
+            controller: AIMDController supplying the limit
+            maximum: Fixed upper bound applied on top of the controller's limit
+            count: InFlightCount shared with other limiters (defaults to one of its own)
+        """
+        self.controller = controller
+        self.maximum = maximum
+        self.count = count or InFlightCount()
+
+    @property
+    def limit(self):
+        """Slots currently available in total."""
+        if self.maximum is None:
+            return self.controller.limit
+        return min(self.maximum, self.controller.limit)
+
+    @property
+    def in_flight(self):
+        """Calls currently holding a slot, across every limiter sharing the count."""
+        return self.count.count
+
+    def acquire(self):
+        """Take a slot, waiting for one; release() it when the call is over."""
+        self.count.acquire(lambda: self.limit)
+
+    def release(self):
+        """Free a slot taken by acquire()."""
+        self.count.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """Async context manager holding coroutines while the controller's limit is reached."""
+
+    async def acquire_async(self):
+        """Coroutine version of acquire()."""
+        await self.count.acquire_async(lambda: self.limit)
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+        return False
+
+
+class RetryBudget:
+    """
+    Process-wide cap on retries: at most `ratio` of recent requests, plus a small floor.
+
+    Under a broad outage this stops retries from multiplying the load on an
+    upstream that is already failing.
+    """
+
+    def __init__(self, ratio, min_per_second, window=10.0):
+        """
+        Initialize budget.
+
+        Args:
+            ratio: Retries allowed per request in the window
+            min_per_second: Retries always allowed per second, for low traffic
+            window: Seconds of history considered
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+        self.exhausted = 0
+
+    def _prune(self, now):
+        cutoff = now - self.window
+        for events in (self._requests, self._retries):
+            while events and events[0] < cutoff:
+                events.popleft()
+
+    def record_request(self):
+        """Count a new (first-attempt) request."""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_spend(self):
+        """
+        Take one retry from the budget.
+
+        Returns:
+            bool: False if the budget is exhausted
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                self.exhausted += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self):
+        """Counters for /api/health."""
+        with self._lock:
+            self._prune(time.monotonic())
+            return {'recent_requests': len(self._requests), 'recent_retries': len(self._retries),
+                    'exhausted': self.exhausted}
+
+
+def error_status(error):
+    """
+    HTTP status of an upstream error.
+
+    Args:
+        error: Exception raised by the OpenAI SDK (status_code) or the Gemini
+            SDK (google.api_core errors carry it as an int code)
+
+    Returns:
+        int: Status, or None for errors without a response
+    """
+    status = getattr(error, 'status_code', None)
+    if status is None and isinstance(getattr(error, 'code', None), int):
+        status = error.code
+    return status
+
+
+def is_retryable(error):
+    """
+    Whether an upstream error is worth retrying.
+
+    Throttling, timeouts, connection failures and 5xx are; bad requests,
+    authentication errors and the like fail the same way every time.
+
+    Args:
+        error: Exception raised by the OpenAI or Gemini SDK
+
+    Returns:
+        bool: True if a retry may succeed
+    """
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # APIConnectionError includes APITimeoutError
+    return isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError))
+
+
+def retry_after(error):
+    """
+    Read the server's requested delay from an error response.
+
+    Args:
+        error: Exception raised by the OpenAI SDK
+
+    Returns:
+        float: Seconds to wait, or None if the server did not say
+    """
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        value = headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # HTTP-date form
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryState:
+    """Retry bookkeeping for one logical call: attempts, decorrelated jitter and budget."""
+
+    def __init__(self, flow, max_attempts=None):
+        """
+        Start a call; counts it against the retry budget's request total.
+
+        Args:
+            flow: FlowControl in use
+            max_attempts: Attempts including the first (defaults to Config)
+        """
+        self.flow = flow
+        self.max_attempts = max_attempts or Config.RETRY_MAX_ATTEMPTS
+        self.attempt = 1
+        self._sleep = Config.RETRY_BASE_DELAY
+        flow.budget.record_request()
+
+    def backoff(self, error, sent_at):
+        """
+        Decide whether to retry after an error, and when.
+
+        Delays follow decorrelated jitter (uniform between the base delay and
+        three times the previous delay, capped), and are never shorter than
+        the server's Retry-After.
+
+        Args:
+            error: Exception raised by the attempt
+            sent_at: time.monotonic() when the attempt was sent
+
+        Returns:
+            float: Seconds to wait before the next attempt, or None to give up
+        """
+        if error_status(error) == 429:
+            self.flow.controller.on_throttle(sent_at)
+        if self.attempt >= self.max_attempts or not is_retryable(error):
+            return None
+
+        server_delay = retry_after(error)
+        if server_delay is not None and server_delay > Config.RETRY_MAX_DELAY:
+            return None  # Not worth holding the request that long
+        if not self.flow.budget.try_spend():
+            return None
+
+        self._sleep = min(Config.RETRY_MAX_DELAY,
+                          random.uniform(Config.RETRY_BASE_DELAY, self._sleep * 3))
+        delay = self._sleep
+        if server_delay is not None:
+            # Spread the wake-ups of everyone told the same Retry-After
+            delay = max(delay, server_delay + random.uniform(0, Config.RETRY_BASE_DELAY))
+        self.attempt += 1
+        self.flow.retries += 1
+        return delay
+
+
+def largest_request_tokens():
+    """
+    Estimated tokens of the largest single request.
+
+    Returns:
+        int: The costliest image on any configured model, plus the full prompt and output allowance
+    """
+    import prompts
+    import resolution
+    models = Config.MODEL_TIERS or [Config.MODEL_NAME]
+    image_tokens = max(resolution.max_image_tokens(model) for model in models)
+    return image_tokens + len(prompts.get_analysis_prompt()) // 4 + Config.GENERATION_CONFIG['max_tokens']
+
+
+class FlowControl:
+    """Rate limiter, AIMD controller and retry budget shared by every client of a provider in the process."""
+
+    def __init__(self, provider='openai'):
+        """
+        Initialize from Config.
+
+        Args:
+            provider: 'openai' or 'gemini'; each has its own account limits,
+                so its own limiter, controller and budget
+        """
+        if provider == 'gemini':
+            # Requests only: Gemini's token accounting differs from the OpenAI estimate
+            self.limiter = RateLimiter(Config.GEMINI_RATE_LIMIT_RPM)
+        else:
+            self.limiter = RateLimiter(
+                Config.RATE_LIMIT_RPM, Config.RATE_LIMIT_TPM,
+                tpm_burst=Config.RATE_LIMIT_TPM_BURST or largest_request_tokens()
+            )
+        self.controller = AIMDController(
+            maximum=Config.ASYNC_MAX_IN_FLIGHT,
+            minimum=Config.AIMD_MIN_CONCURRENCY,
+            initial=Config.AIMD_INITIAL_CONCURRENCY
+        )
+        self.budget = RetryBudget(Config.RETRY_BUDGET_RATIO, Config.RETRY_BUDGET_MIN_PER_SECOND)
+        self.in_flight = InFlightCount()  # Shared by the sync and async clients' limiters
+        self.retries = 0
+
+    def stats(self):
+        """Counters for /api/health."""
+        return {
+            'rate_limit': self.limiter.stats(),
+            'concurrency_limit': self.controller.limit,
+            'in_flight': self.in_flight.count,
+            'throttled': self.controller.throttles,
+            'retries': self.retries,
+            'retry_budget': self.budget.stats()
+        }
+
+
+def get_flow_control(provider='openai'):
+    """Process-wide FlowControl of a provider, created on first use."""
+    with _flow_control_lock:
+        if provider not in _flow_controls:
+            _flow_controls[provider] = FlowControl(provider)
+        return _flow_controls[provider]
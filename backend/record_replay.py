@@ -0,0 +1,515 @@
+"""
+Record upstream calls once, replay them offline (ANALYSIS_BACKEND=record | replay).
+
+With ANALYSIS_BACKEND=record the clients call the real APIs as usual, and
+every successful completion is also saved to a SQLite archive
+(RECORDING_PATH): the response body, zlib-compressed, with its time to first
+byte and total time. An exchange is keyed by the SHA-256 of the image sent
+(the same hash /api/search uses) and a hash of everything else in the
+request: model, prompt, schema, max_tokens, streaming.
+
+With ANALYSIS_BACKEND=replay a local stand-in answers from the archive after
+the recorded latency times REPLAY_LATENCY_SCALE (1 = as recorded, 0 = at
+once), so Flask, the pipeline, flow control and SDK parsing all run as they
+did against the API, without a key or the network. An image recorded several
+times replays its recordings in turn. With REPLAY_FALLBACK an image never
+recorded gets the answer of another image to the same request, chosen by its
+hash, so any corpus can be load-tested against a small archive.
+
+OpenAI calls are captured at the httpx transport, like the fake backend. The
+Gemini SDK does not go through httpx, so its model object is wrapped instead.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import httpx
+from config import Config
+
+# Hop-by-hop and encoding headers of a recorded response; the body is kept decoded
+_DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+
+def _digest(value):
+    """SHA-256 hex digest of bytes, or of a value as canonical JSON."""
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.sha256(value).hexdigest()
+
+
+def request_keys(body):
+    """
+    Keys of a chat completion request.
+
+    Args:
+        body: Request body (JSON bytes)
+
+    Returns:
+        tuple: (prompt key, image hash); the image hash is '' without an image
+    """
+    payload = json.loads(body or b'{}')
+    image_hash = ''
+    for message in payload.get('messages', []):
+        parts = message.get('content')
+        if not isinstance(parts, list):
+            continue
+        for index, part in enumerate(parts):
+            if part.get('type') != 'image_url':
+                continue
+            url = part.get('image_url', {}).get('url', '')
+            if not image_hash:
+                head, _, data = url.partition(',')
+                image_hash = _digest(base64.b64decode(data) if head.startswith('data:') else url.encode())
+            # Detail depends on the image, not the request
+            parts[index] = {'type': 'image_url'}
+    return _digest(payload), image_hash
+
+
+def gemini_keys(model_name, generation_config, contents):
+    """
+    Keys of a Gemini generate_content call.
+
+    Args:
+        model_name: Gemini model
+        generation_config: Its generation config
+        contents: Prompt strings and image parts (inline data dicts or PIL images)
+
+    Returns:
+        tuple: (prompt key, image hash)
+    """
+    texts = []
+    image_hash = ''
+    for part in contents:
+        if isinstance(part, str):
+            texts.append(part)
+        elif not image_hash:
+            data = part['data'] if isinstance(part, dict) else part.tobytes()
+            image_hash = _digest(data)
+    return _digest({'model': model_name, 'generation_config': generation_config, 'contents': texts}), image_hash
+
+
+def _sse_events(body):
+    """A recorded event stream split back into its events."""
+    events = [event + b'\n\n' for event in body.split(b'\n\n') if event.strip()]
+    return events or [body]
+
+
+class Archive:
+    """
+    Recorded exchanges in SQLite.
+
+    Several processes may record into one archive; replaying reads the keys
+    once and fetches bodies by id, so an archive is not meant to grow while
+    it is being replayed.
+    """
+
+    def __init__(self, path=None):
+        """
+        Open the archive.
+
+        Args:
+            path: SQLite file (defaults to Config.RECORDING_PATH)
+        """
+        self.path = path or Config.RECORDING_PATH
+        self.recorded = 0
+        self.replayed = 0
+        self.fallbacks = 0
+        self.misses = 0
+        self._keys = None  # prompt key -> image hash -> recording ids, loaded on the first replay
+        self._turns = {}  # (prompt key, image hash) -> replays served, to take recordings in turn
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._inherited_db = None
+        self._open_db()
+
+    def _connect(self):
+        """Open this process's connection."""
+        self._db = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        """Reconnect in a forked child. Caller holds the lock."""
+        if self._pid != os.getpid():
+            self._inherited_db = self._db  # Not closed: closing would act on the parent's file handle
+            self._connect()
+
+    def _open_db(self):
+        """Open the database, creating the table on first use."""
+        self._connect()
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS exchanges ('
+            'id INTEGER PRIMARY KEY, provider TEXT NOT NULL, prompt_key TEXT NOT NULL, image_hash TEXT NOT NULL, '
+            'model TEXT, content_type TEXT, body BLOB NOT NULL, ttfb REAL NOT NULL, seconds REAL NOT NULL, '
+            'recorded_at REAL NOT NULL)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS exchanges_keys ON exchanges (prompt_key, image_hash)')
+        self._db.commit()
+
+    def save(self, provider, keys, model, content_type, body, ttfb, seconds):
+        """
+        Save one exchange.
+
+        Args:
+            provider: 'openai' or 'gemini'
+            keys: (prompt key, image hash)
+            model: Model that answered
+            content_type: Content-Type of the body
+            body: Response body (bytes)
+            ttfb: Seconds to the first byte of the body
+            seconds: Seconds to the last byte
+        """
+        with self._lock:
+            self._check_fork()
+            self._db.execute(
+                'INSERT INTO exchanges (provider, prompt_key, image_hash, model, content_type, body, ttfb, seconds, '
+                'recorded_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (provider, keys[0], keys[1], model, content_type, zlib.compress(body), ttfb, seconds, time.time())
+            )
+            self._db.commit()
+            self.recorded += 1
+
+    def _load_keys(self):
+        """Read every recording's keys. Caller holds the lock."""
+        self._keys = {}
+        for row_id, prompt_key, image_hash in self._db.execute(
+            'SELECT id, prompt_key, image_hash FROM exchanges ORDER BY id'
+        ):
+            self._keys.setdefault(prompt_key, {}).setdefault(image_hash, []).append(row_id)
+
+    def find(self, keys):
+        """
+        The recording to replay for a request.
+
+        Args:
+            keys: (prompt key, image hash)
+
+        Returns:
+            dict: content_type, body, ttfb and seconds, or None when nothing matches
+        """
+        prompt_key, image_hash = keys
+        with self._lock:
+            self._check_fork()
+            if self._keys is None:
+                self._load_keys()
+            images = self._keys.get(prompt_key, {})
+            if image_hash not in images:
+                if not images or not Config.REPLAY_FALLBACK:
+                    self.misses += 1
+                    return None
+                # Same image, same stand-in: the choice depends only on the hash
+                recorded = sorted(images)
+                image_hash = recorded[int(image_hash[:8] or '0', 16) % len(recorded)]
+                self.fallbacks += 1
+            ids = images[image_hash]
+            turn = self._turns.get((prompt_key, image_hash), 0)
+            self._turns[(prompt_key, image_hash)] = turn + 1
+            content_type, body, ttfb, seconds = self._db.execute(
+                'SELECT content_type, body, ttfb, seconds FROM exchanges WHERE id = ?', (ids[turn % len(ids)],)
+            ).fetchone()
+            self.replayed += 1
+        return {'content_type': content_type, 'body': zlib.decompress(body), 'ttfb': ttfb, 'seconds': seconds}
+
+    def transport(self, is_async=False, options=None):
+        """
+        Transport to pass to httpx, recording or replaying per ANALYSIS_BACKEND.
+
+        Args:
+            is_async: Transport for httpx.AsyncClient
+            options: The client's options; recording forwards with the same limits and timeouts
+
+        Returns:
+            httpx.MockTransport: Transport answering through this archive
+        """
+        if Config.ANALYSIS_BACKEND == 'record':
+            handler = Recorder(self, options or {})
+        else:
+            handler = Replayer(self)
+        return httpx.MockTransport(handler.handle_async if is_async else handler.handle)
+
+    def stats(self):
+        """Counters for /api/health and benchmarks."""
+        with self._lock:
+            self._check_fork()
+            exchanges = self._db.execute('SELECT COUNT(*) FROM exchanges').fetchone()[0]
+            return {
+                'path': str(self.path),
+                'exchanges': exchanges,
+                'recorded': self.recorded,
+                'replayed': self.replayed,
+                'fallbacks': self.fallbacks,
+                'misses': self.misses,
+                'latency_scale': Config.REPLAY_LATENCY_SCALE,
+            }
+
+
+def _is_completion(request):
+    """Whether a request is a chat completion, the only calls recorded and replayed."""
+    return request.method == 'POST' and request.url.path.endswith('/chat/completions')
+
+
+def _recorded_response(response, content):
+    """A forwarded response with its body already decoded."""
+    headers = [(name, value) for name, value in response.headers.items() if name.lower() not in _DROPPED_HEADERS]
+    return httpx.Response(response.status_code, headers=headers, content=content)
+
+
+class Recorder:
+    """httpx.MockTransport handlers that forward to the API and save completions."""
+
+    def __init__(self, archive, options):
+        """
+        Initialize the recorder.
+
+        Args:
+            archive: Archive to save to
+            options: httpx client options to forward with (limits, timeout, http2)
+        """
+        self.archive = archive
+        self.options = {name: options[name] for name in ('limits', 'timeout', 'http2') if name in options}
+        self._client = None
+        self._async_client = None
+
+    def _save(self, request, response, body, start, first_byte):
+        """Save a completed exchange if it is a successful completion."""
+        if response.status_code != 200 or not _is_completion(request):
+            return
+        end = time.perf_counter()
+        self.archive.save(
+            'openai', request_keys(request.content), json.loads(request.content).get('model'),
+            response.headers.get('content-type'), body, (first_byte or end) - start, end - start
+        )
+
+    def handle(self, request):
+        """Handler for httpx.Client."""
+        if self._client is None:
+            self._client = httpx.Client(**self.options)
+        start = time.perf_counter()
+        response = self._client.send(request, stream=True)
+        if not response.headers.get('content-type', '').startswith('text/event-stream'):
+            try:
+                body = response.read()
+            finally:
+                response.close()
+            self._save(request, response, body, start, None)
+            return _recorded_response(response, body)
+
+        def stream():
+            pieces, first_byte = [], None
+            try:
+                for piece in response.iter_bytes():
+                    first_byte = first_byte or time.perf_counter()
+                    pieces.append(piece)
+                    yield piece
+            finally:
+                response.close()
+            # Only streams read to the end are saved
+            self._save(request, response, b''.join(pieces), start, first_byte)
+
+        return _recorded_response(response, stream())
+
+    async def handle_async(self, request):
+        """Handler for httpx.AsyncClient."""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(**self.options)
+        start = time.perf_counter()
+        response = await self._async_client.send(request, stream=True)
+        if not response.headers.get('content-type', '').startswith('text/event-stream'):
+            try:
+                body = await response.aread()
+            finally:
+                await response.aclose()
+            self._save(request, response, body, start, None)
+            return _recorded_response(response, body)
+
+        async def stream():
+            pieces, first_byte = [], None
+            try:
+                async for piece in response.aiter_bytes():
+                    first_byte = first_byte or time.perf_counter()
+                    pieces.append(piece)
+                    yield piece
+            finally:
+                await response.aclose()
+            self._save(request, response, b''.join(pieces), start, first_byte)
+
+        return _recorded_response(response, stream())
+
+
+class Replayer:
+    """httpx.MockTransport handlers that answer from the archive."""
+
+    def __init__(self, archive, latency_scale=None):
+        """
+        Initialize the replayer.
+
+        Args:
+            archive: Archive to answer from
+            latency_scale: Factor on recorded latencies (defaults to Config.REPLAY_LATENCY_SCALE)
+        """
+        self.archive = archive
+        self.latency_scale = Config.REPLAY_LATENCY_SCALE if latency_scale is None else latency_scale
+
+    def _plan(self, request):
+        """
+        Decide how to answer a request.
+
+        Returns:
+            tuple: (seconds before the first byte, httpx.Response or None, (stream events, seconds between them)
+            or None); exactly one of the last two is set
+        """
+        if request.method == 'GET' and request.url.path.rstrip('/').endswith('/models'):
+            return 0.0, httpx.Response(200, json={'object': 'list', 'data': []}), None
+        if not _is_completion(request):
+            return 0.0, httpx.Response(404, json={'error': {'message': 'not found'}}), None
+
+        entry = self.archive.find(request_keys(request.content))
+        if entry is None:
+            error = {'error': {'message': 'No recording for this request', 'type': 'replay_miss'}}
+            return 0.0, httpx.Response(404, json=error), None
+        if not entry['content_type'].startswith('text/event-stream'):
+            response = httpx.Response(200, headers={'Content-Type': entry['content_type']}, content=entry['body'])
+            return entry['seconds'] * self.latency_scale, response, None
+        events = _sse_events(entry['body'])
+        gap = max(0.0, entry['seconds'] - entry['ttfb']) * self.latency_scale / len(events)
+        return entry['ttfb'] * self.latency_scale, None, (events, gap)
+
+    def handle(self, request):
+        """Handler for httpx.Client."""
+        latency, response, stream_plan = self._plan(request)
+        time.sleep(latency)
+        if stream_plan is None:
+            return response
+        events, gap = stream_plan
+
+        def stream():
+            for index, event in enumerate(events):
+                if index:
+                    time.sleep(gap)
+                yield event
+
+        return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=stream())
+
+    async def handle_async(self, request):
+        """Handler for httpx.AsyncClient."""
+        latency, response, stream_plan = self._plan(request)
+        await asyncio.sleep(latency)
+        if stream_plan is None:
+            return response
+        events, gap = stream_plan
+
+        async def stream():
+            for index, event in enumerate(events):
+                if index:
+                    await asyncio.sleep(gap)
+                yield event
+
+        return httpx.Response(200, headers={'Content-Type': 'text/event-stream'}, content=stream())
+
+
+class ReplayedResponse:
+    """The part of a Gemini response GeminiClient reads."""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class GeminiRecorder:
+    """A genai.GenerativeModel that saves each answer's text."""
+
+    def __init__(self, model, archive, model_name, generation_config):
+        """
+        Initialize the recorder.
+
+        Args:
+            model: genai.GenerativeModel to call
+            archive: Archive to save to
+            model_name: Its model name
+            generation_config: Its generation config, part of the key
+        """
+        self.model = model
+        self.archive = archive
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def _save(self, contents, response, seconds):
+        """Save an answer; blocked answers have no text and are not saved."""
+        try:
+            text = response.text
+        except ValueError:
+            return
+        if text:
+            keys = gemini_keys(self.model_name, self.generation_config, contents)
+            self.archive.save('gemini', keys, self.model_name, 'text/plain', text.encode(), seconds, seconds)
+
+    def generate_content(self, contents):
+        """Call the model and save its answer."""
+        start = time.perf_counter()
+        response = self.model.generate_content(contents)
+        self._save(contents, response, time.perf_counter() - start)
+        return response
+
+    async def generate_content_async(self, contents):
+        """Call the model and save its answer (async)."""
+        start = time.perf_counter()
+        response = await self.model.generate_content_async(contents)
+        self._save(contents, response, time.perf_counter() - start)
+        return response
+
+
+class GeminiReplayer:
+    """Stands in for genai.GenerativeModel, answering from the archive."""
+
+    def __init__(self, archive, model_name, generation_config, latency_scale=None):
+        """
+        Initialize the replayer.
+
+        Args:
+            archive: Archive to answer from
+            model_name: Model name recorded with
+            generation_config: Generation config recorded with
+            latency_scale: Factor on recorded latencies (defaults to Config.REPLAY_LATENCY_SCALE)
+        """
+        self.archive = archive
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.latency_scale = Config.REPLAY_LATENCY_SCALE if latency_scale is None else latency_scale
+
+    def _find(self, contents):
+        """The recording for a call; raises LookupError without one."""
+        entry = self.archive.find(gemini_keys(self.model_name, self.generation_config, contents))
+        if entry is None:
+            raise LookupError("No recording for this request")
+        return entry
+
+    def generate_content(self, contents):
+        """Answer after the recorded latency."""
+        entry = self._find(contents)
+        time.sleep(entry['seconds'] * self.latency_scale)
+        return ReplayedResponse(entry['body'].decode())
+
+    async def generate_content_async(self, contents):
+        """Answer after the recorded latency (async)."""
+        entry = self._find(contents)
+        await asyncio.sleep(entry['seconds'] * self.latency_scale)
+        return ReplayedResponse(entry['body'].decode())
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """Process-wide archive shared by every client."""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = Archive()
+        return _archive
@@ -0,0 +1,153 @@
+"""
+Sizing rules for images sent to the vision API, free of Pillow.
+
+Planning a resolution and estimating its tokens only needs arithmetic on
+(width, height), so these live apart from image_processor: /api/health
+reports the same limits to clients without importing the imaging stack.
+"""
+from config import Config
+
+TILE_SIZE = 512  # Vision models bill high-detail images per 512px tile
+HIGH_DETAIL_FIT = 2048  # Server-side: fit within 2048 x 2048...
+HIGH_DETAIL_SHORT_SIDE = 768  # ...then scale the shortest side down to 768
+LOW_DETAIL_SIZE = 512
+
+
+def fit_within(size, max_width, max_height):
+    """Scale (width, height) down to fit a box, never up."""
+    width, height = size
+    ratio = min(1.0, max_width / width, max_height / height)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def _tile_count(size):
+    """Number of 512px tiles covering an image."""
+    width, height = size
+    return -(-width // TILE_SIZE) * -(-height // TILE_SIZE)
+
+
+def _model_view(size):
+    """Resolution a high-detail image is reduced to by the API before tiling."""
+    width, height = fit_within(size, HIGH_DETAIL_FIT, HIGH_DETAIL_FIT)
+    ratio = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def get_encoding_profile(profile=None):
+    """
+    Resolve an encoding profile.
+
+    Args:
+        profile: Profile dict, profile name, or None for Config.ENCODING_PROFILE
+
+    Returns:
+        dict: Profile settings
+    """
+    if isinstance(profile, dict):
+        return profile
+    name = profile or Config.ENCODING_PROFILE
+    if name not in Config.ENCODING_PROFILES:
+        raise ValueError(
+            f"Unknown encoding profile '{name}'. Options: {', '.join(Config.ENCODING_PROFILES)}"
+        )
+    return Config.ENCODING_PROFILES[name]
+
+
+
+def plan_resolution(size, profile):
+    """
+    Choose the resolution to send for an image under a profile.
+
+    High-detail images are sent at the resolution the API would reduce them
+    to anyway, so the extra pixels of a larger upload cost bandwidth without
+    changing what the model sees. 'max_tiles' shrinks further, to the largest
+    size that fits in that many tiles.
+
+    Args:
+        size: (width, height) of the decoded upload
+        profile: Profile dict from get_encoding_profile()
+
+    Returns:
+        tuple: Target (width, height)
+    """
+    if profile.get('max_dimension'):
+        return fit_within(size, profile['max_dimension'], profile['max_dimension'])
+    if profile['detail'] == 'low':
+        return fit_within(size, LOW_DETAIL_SIZE, LOW_DETAIL_SIZE)
+
+    target = _model_view(size)
+    max_tiles = profile.get('max_tiles')
+    if max_tiles and _tile_count(target) > max_tiles:
+        width, height = target
+        # Candidate scales put one edge exactly on a tile boundary
+        scales = sorted(
+            {n * TILE_SIZE / width for n in range(1, -(-width // TILE_SIZE))} |
+            {n * TILE_SIZE / height for n in range(1, -(-height // TILE_SIZE))},
+            reverse=True
+        )
+        for scale in scales:
+            candidate = (max(1, round(width * scale)), max(1, round(height * scale)))
+            if _tile_count(candidate) <= max_tiles:
+                return candidate
+        return fit_within(target, TILE_SIZE, TILE_SIZE)
+    return target
+
+
+def client_limits(profile=None):
+    """
+    Downscaling and encoding a client can apply before uploading.
+
+    An image fitted within max_dimension, with its shortest side then
+    scaled down to max_short_side (both rounding down, as fit_within() does),
+    and encoded in the profile's format is what ingest() would have sent;
+    the server passes it through without decoding it in full. Profiles with
+    max_tiles are shrunk further on the server.
+
+    Args:
+        profile: Profile dict, profile name, or None for Config.ENCODING_PROFILE
+
+    Returns:
+        dict: max_dimension, max_short_side (or None), max_tiles, format
+            (MIME type), quality (0-100), and the max_bytes and max_pixels
+            an upload may have
+    """
+    profile = get_encoding_profile(profile)
+    if profile.get('max_dimension'):
+        box, short_side = profile['max_dimension'], None
+    elif profile['detail'] == 'low':
+        box, short_side = LOW_DETAIL_SIZE, None
+    else:
+        box, short_side = HIGH_DETAIL_FIT, HIGH_DETAIL_SHORT_SIDE
+    return {
+        'max_dimension': box,
+        'max_short_side': short_side,
+        'max_tiles': profile.get('max_tiles'),
+        'format': f"image/{profile['format'].lower()}",
+        'quality': profile['quality'],
+        'max_bytes': Config.MAX_IMAGE_SIZE_BYTES,
+        'max_pixels': Config.MAX_IMAGE_PIXELS,
+    }
+
+
+def estimate_image_tokens(size, detail, model=None):
+    """
+    Estimate the input tokens an image costs.
+
+    Args:
+        size: (width, height) sent to the API
+        detail: 'low', 'high' or 'auto'
+        model: Model name (defaults to Config.MODEL_NAME)
+
+    Returns:
+        int: Estimated image tokens
+    """
+    costs = Config.IMAGE_TOKEN_COSTS
+    base, per_tile = costs.get(model or Config.MODEL_NAME, costs['default'])
+    if detail == 'low' or (detail == 'auto' and max(size) <= LOW_DETAIL_SIZE):
+        return base
+    return base + per_tile * _tile_count(_model_view(size))
+
+
+def max_image_tokens(model=None):
+    """Most input tokens one image can cost: high detail, at the most tiles the API's resizing leaves."""
+    return estimate_image_tokens((HIGH_DETAIL_FIT, HIGH_DETAIL_SHORT_SIDE), 'high', model)
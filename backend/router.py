@@ -0,0 +1,396 @@
+"""
+Provider routing: failover between vision providers and hedged requests against tail latency.
+"""
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from config import Config
+from rate_limit import RetryBudget
+
+HEDGE_MIN_SAMPLES = 20  # Latencies needed before the hedge delay is trusted
+
+
+class LatencyHistogram:
+    """
+    Log-bucketed latency histogram that forgets old samples.
+
+    Buckets grow by GROWTH, so a percentile is accurate to within that
+    factor. Counts are halved every `half_life` samples so percentiles
+    follow the provider's recent behaviour.
+    """
+
+    MIN_SECONDS = 0.005
+    GROWTH = 1.15
+    BUCKETS = 90  # Up to ~1500s
+
+    def __init__(self, half_life=1000):
+        """
+        Initialize an empty histogram.
+
+        Args:
+            half_life: Samples after which old counts weigh half
+        """
+        self.half_life = half_life
+        self._counts = [0.0] * self.BUCKETS
+        self._total = 0.0
+        self._since_decay = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Add one latency sample."""
+        index = 0
+        if seconds > self.MIN_SECONDS:
+            index = min(self.BUCKETS - 1, int(math.log(seconds / self.MIN_SECONDS, self.GROWTH)) + 1)
+        with self._lock:
+            self._counts[index] += 1
+            self._total += 1
+            self._since_decay += 1
+            if self._since_decay >= self.half_life:
+                self._counts = [count / 2 for count in self._counts]
+                self._total /= 2
+                self._since_decay = 0
+
+    @property
+    def count(self):
+        """Weighted number of samples."""
+        return self._total
+
+    def percentile(self, pct):
+        """
+        Upper bound of the bucket holding the pct-th percentile.
+
+        Args:
+            pct: Percentile, 0-100
+
+        Returns:
+            float: Seconds, or None without samples
+        """
+        with self._lock:
+            if not self._total:
+                return None
+            rank = self._total * pct / 100
+            seen = 0.0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.MIN_SECONDS * self.GROWTH ** index
+        return self.MIN_SECONDS * self.GROWTH ** (self.BUCKETS - 1)
+
+
+class Provider:
+    """A vision backend with its clients, latency histogram and health."""
+
+    def __init__(self, name, client, async_client=None):
+        """
+        Initialize provider.
+
+        Args:
+            name: Name reported in results and stats
+            client: Client with analyze_with_retry(image, prompt, fields=None, model=None)
+            async_client: Client with a coroutine analyze_with_retry, if any
+        """
+        self.name = name
+        self.client = client
+        self.async_client = async_client
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.ejected_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def healthy(self):
+        """False while ejected after repeated failures."""
+        return time.monotonic() >= self.ejected_until
+
+    def record_success(self, seconds):
+        """Record a completed call."""
+        self.latency.record(seconds)
+        with self._lock:
+            self.calls += 1
+            self.consecutive_errors = 0
+
+    def record_cancelled(self, seconds):
+        """
+        Record a call abandoned after a hedge won.
+
+        Its latency is at least `seconds`; recording that keeps a slow
+        provider's histogram from only ever seeing its fast calls.
+        """
+        self.latency.record(seconds)
+
+    def record_failure(self):
+        """Record a failed call; eject the provider once failures pile up."""
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.consecutive_errors += 1
+            if self.consecutive_errors >= Config.FAILOVER_ERROR_THRESHOLD:
+                # After the cooldown it gets traffic again; one more failure re-ejects it
+                self.ejected_until = time.monotonic() + Config.FAILOVER_COOLDOWN_SECONDS
+                self.consecutive_errors = Config.FAILOVER_ERROR_THRESHOLD - 1
+                print(f"Provider {self.name} ejected for {Config.FAILOVER_COOLDOWN_SECONDS:g}s")
+
+    def stats(self):
+        """Counters for /api/health."""
+        latency = {f'p{pct}': self.latency.percentile(pct) for pct in (50, 95, 99)}
+        return {
+            'healthy': self.healthy,
+            'calls': self.calls,
+            'errors': self.errors,
+            'latency_seconds': {name: round(value, 3) if value else None for name, value in latency.items()}
+        }
+
+
+class ProviderRouter:
+    """
+    Send each analysis to the best available provider.
+
+    The first healthy provider in configured order is the primary; when it
+    fails, the call fails over to the next. With hedging on, a call that has
+    not answered within the primary's HEDGE_PERCENTILE latency gets a second
+    request (to the next provider, or the same one) and the first answer
+    wins. Hedges are capped at HEDGE_BUDGET_RATIO of recent calls so a
+    general slowdown does not double the load.
+    """
+
+    def __init__(self, providers, hedge_enabled=None, hedge_percentile=None, hedge_target=None):
+        """
+        Initialize router.
+
+        Args:
+            providers: Provider objects in priority order
+            hedge_enabled: Send hedged requests (defaults to Config)
+            hedge_percentile: Primary latency percentile after which to hedge (defaults to Config)
+            hedge_target: 'other' to hedge on the next provider, 'same' for the primary (defaults to Config)
+        """
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = providers
+        self.hedge_enabled = Config.HEDGE_ENABLED if hedge_enabled is None else hedge_enabled
+        self.hedge_percentile = hedge_percentile or Config.HEDGE_PERCENTILE
+        self.hedge_target = hedge_target or Config.HEDGE_TARGET
+        self.budget = RetryBudget(Config.HEDGE_BUDGET_RATIO, 0)
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def candidates(self, use_async=False):
+        """
+        Providers to try, best first: healthy ones in order, then ejected ones as a last resort.
+
+        Args:
+            use_async: Only providers with an async client
+
+        Returns:
+            list: Provider objects
+        """
+        usable = [p for p in self.providers if (p.async_client if use_async else p.client) is not None]
+        return [p for p in usable if p.healthy] + [p for p in usable if not p.healthy]
+
+    def hedge_delay(self, provider):
+        """
+        Seconds to wait for the provider before hedging.
+
+        Returns:
+            float: Delay, or None if hedging is off or there is no latency history yet
+        """
+        if not self.hedge_enabled or provider.latency.count < HEDGE_MIN_SAMPLES:
+            return None
+        return max(Config.HEDGE_MIN_DELAY, provider.latency.percentile(self.hedge_percentile))
+
+    def _hedge_provider(self, candidates):
+        """Provider to send the hedged request to."""
+        if self.hedge_target == 'other' and len(candidates) > 1 and candidates[1].healthy:
+            return candidates[1]
+        return candidates[0]
+
+    @property
+    def executor(self):
+        """Thread pool running sync calls while hedging, created on first use."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=Config.ASYNC_MAX_IN_FLIGHT, thread_name_prefix='hedge'
+                )
+            return self._executor
+
+    @staticmethod
+    def _call(provider, image, prompt, fields, model):
+        """Run one call on a provider, recording its outcome."""
+        start = time.monotonic()
+        try:
+            text = provider.client.analyze_with_retry(image, prompt, fields=fields, model=model)
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - start)
+        return text
+
+    def analyze(self, image, prompt, fields=None, model=None):
+        """
+        Analyze an image on the sync path.
+
+        Threads cannot be cancelled: a losing hedge runs to completion in
+        the pool and its answer is discarded.
+
+        Args:
+            image: PreparedImage
+            prompt: Text prompt for analysis
+            fields: Analysis fields the prompt asks for (structured output schema)
+            model: Model to ask (defaults to each client's own)
+
+        Returns:
+            tuple: (response text, provider name)
+        """
+        candidates = self.candidates()
+        primary = candidates[0]
+        self.budget.record_request()
+        delay = self.hedge_delay(primary)
+
+        if delay is None:
+            # Nothing to race: call in the request thread, then fail over in order
+            for provider in candidates:
+                try:
+                    return self._call(provider, image, prompt, fields, model), provider.name
+                except Exception as e:
+                    error = e
+                    if provider is not candidates[-1]:
+                        self.failovers += 1
+                        print(f"Provider {provider.name} failed, failing over: {str(e)}")
+            raise error
+
+        pending = {self.executor.submit(self._call, primary, image, prompt, fields, model): primary}
+        hedge = None
+        done, _ = wait(pending, timeout=delay)
+        if not done and self.budget.try_spend():
+            target = self._hedge_provider(candidates)
+            hedge = self.executor.submit(self._call, target, image, prompt, fields, model)
+            pending[hedge] = target
+            self.hedges += 1
+        remaining = [p for p in candidates if p not in pending.values()]
+
+        error = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                if future.exception() is None:
+                    if future is hedge:
+                        self.hedge_wins += 1
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result(), provider.name
+                error = future.exception()
+            if not pending and remaining:
+                provider = remaining.pop(0)
+                self.failovers += 1
+                print(f"Failing over to provider {provider.name}: {str(error)}")
+                pending[self.executor.submit(self._call, provider, image, prompt, fields, model)] = provider
+        raise error
+
+    @staticmethod
+    async def _call_async(provider, image, prompt, fields, model):
+        """Coroutine version of _call; a cancelled call records a lower-bound latency."""
+        start = time.monotonic()
+        try:
+            text = await provider.async_client.analyze_with_retry(image, prompt, fields=fields, model=model)
+        except asyncio.CancelledError:
+            provider.record_cancelled(time.monotonic() - start)
+            raise
+        except Exception:
+            provider.record_failure()
+            raise
+        provider.record_success(time.monotonic() - start)
+        return text
+
+    async def analyze_async(self, image, prompt, fields=None, model=None):
+        """
+        Coroutine version of analyze; losing requests are cancelled.
+
+        Args:
+            image: PreparedImage
+            prompt: Text prompt for analysis
+            fields: Analysis fields the prompt asks for (structured output schema)
+            model: Model to ask (defaults to each client's own)
+
+        Returns:
+            tuple: (response text, provider name)
+        """
+        candidates = self.candidates(use_async=True)
+        primary = candidates[0]
+        self.budget.record_request()
+        delay = self.hedge_delay(primary)
+
+        pending = {asyncio.ensure_future(self._call_async(primary, image, prompt, fields, model)): primary}
+        hedge = None
+        error = None
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done and self.budget.try_spend():
+                    target = self._hedge_provider(candidates)
+                    hedge = asyncio.ensure_future(self._call_async(target, image, prompt, fields, model))
+                    pending[hedge] = target
+                    self.hedges += 1
+            remaining = [p for p in candidates if p not in pending.values()]
+
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result(), provider.name
+                    error = task.exception()
+                if not pending and remaining:
+                    provider = remaining.pop(0)
+                    self.failovers += 1
+                    print(f"Failing over to provider {provider.name}: {str(error)}")
+                    pending[asyncio.ensure_future(self._call_async(provider, image, prompt, fields, model))] = provider
+            raise error
+        finally:
+            # The loser (or everything, if the caller was cancelled)
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        """Counters for /api/health."""
+        return {
+            'providers': {p.name: p.stats() for p in self.providers},
+            'hedging': self.hedge_enabled,
+            'hedges': self.hedges,
+            'hedge_wins': self.hedge_wins,
+            'failovers': self.failovers
+        }
+
+
+def create_router(openai_client, async_openai_client=None):
+    """
+    Build the router for the providers listed in Config.PROVIDERS.
+
+    Args:
+        openai_client: OpenAIClient already owned by the pipeline
+        async_openai_client: AsyncOpenAIClient, if the async path is enabled
+
+    Returns:
+        ProviderRouter: Router over the configured providers
+    """
+    providers = []
+    for name in Config.PROVIDERS:
+        if name == 'openai':
+            providers.append(Provider('openai', openai_client, async_openai_client))
+        elif name == 'gemini':
+            from gemini_client import GeminiClient, AsyncGeminiClient
+            providers.append(Provider(
+                'gemini', GeminiClient(), AsyncGeminiClient() if async_openai_client is not None else None
+            ))
+        else:
+            raise ValueError(f"Unknown provider '{name}'. Choose from: openai, gemini")
+    return ProviderRouter(providers)
@@ -0,0 +1,420 @@
+"""
+Searchable history of analyses: hashed TF-IDF vectors in an int8 index.
+
+Every fresh analysis is stored in SQLite with the hash of its image and the
+text of its fields. The text becomes a hashed term-frequency vector: no
+vocabulary to fit or ship, words are hashed into DIMENSIONS buckets with a
+random sign. Vectors are L2-normalized and quantized to int8 with one float
+scale per entry. Queries are weighted by inverse document frequency (the
+lnc.ltc scheme: log tf and cosine for documents; log tf, idf and cosine for
+queries), so stored vectors never need re-weighting as the history grows.
+
+The index is laid out by dimension, one int8 row per bucket and one column
+per entry. A query of a few words touches a handful of buckets, so scoring
+reads those rows only: an exact scan over every entry at a few bytes each.
+"""
+import functools
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+import numpy as np
+from config import Config
+
+TEXT_FIELDS = ('caption', 'summary', 'objects', 'mood', 'story')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have he her his in into is it its of on or she '
+    'that the their there they this to was were while with'.split()
+)
+LOAD_BATCH = 50_000  # Rows read from SQLite per step when rebuilding the index
+
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def _stem(word):
+    """Fold plurals: stories -> story, boats -> boat."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _bucket(word, dimensions):
+    """
+    (token, bucket, sign) of a lowercased word, or None for a stop word.
+
+    CRC32 of the folded word is stable across processes, unlike hash().
+    """
+    if word in STOP_WORDS:
+        return None
+    token = _stem(word)
+    value = zlib.crc32(token.encode())
+    return token, value % dimensions, 1.0 if value & 0x80000000 else -1.0
+
+
+def term_weights(text, dimensions):
+    """
+    Hashed log term frequencies of a text.
+
+    Returns:
+        dict: bucket -> signed weight (1 + ln tf, summed over tokens sharing the bucket)
+    """
+    # Count words first: stemming and hashing then run once per distinct word
+    counts = {}
+    for word, count in Counter(_WORD.findall(text.lower())).items():
+        term = _bucket(word, dimensions)
+        if term is not None:
+            counts[term] = counts.get(term, 0) + count
+    weights = {}
+    for (_, bucket, sign), count in counts.items():
+        weights[bucket] = weights.get(bucket, 0.0) + sign * (1.0 + math.log(count))
+    return weights
+
+
+def encode(texts, dimensions):
+    """
+    Quantized document vectors.
+
+    Args:
+        texts: Document texts
+        dimensions: Hash buckets per vector
+
+    Returns:
+        tuple: (int8 array of shape (len(texts), dimensions), float32 scales);
+            codes * scale approximates each unit-length vector
+    """
+    dense = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for row, text in enumerate(texts):
+        weights = term_weights(text, dimensions)
+        if weights:
+            dense[row, list(weights)] = list(weights.values())
+    peak = np.abs(dense).max(axis=1)
+    norm = np.linalg.norm(dense, axis=1)
+    nonzero = peak > 0
+    codes = np.zeros(dense.shape, dtype=np.int8)
+    codes[nonzero] = np.round(dense[nonzero] * (127 / peak[nonzero])[:, None])
+    scales = np.zeros(len(texts), dtype=np.float32)
+    scales[nonzero] = peak[nonzero] / (127 * norm[nonzero])
+    return codes, scales
+
+
+def document_text(fields):
+    """Searchable text of an analysis."""
+    return '\n'.join(fields[name] for name in TEXT_FIELDS if fields.get(name))
+
+
+class Int8Index:
+    """
+    Flat top-k index of int8 vectors, stored one row per dimension.
+
+    Entries are numbered by insertion; callers map positions to their own ids.
+    """
+
+    def __init__(self, dimensions, capacity=1024):
+        """
+        Initialize an empty index.
+
+        Args:
+            dimensions: Length of each vector
+            capacity: Entries to allocate room for; grows by doubling
+        """
+        self.dimensions = dimensions
+        self.codes = np.zeros((dimensions, capacity), dtype=np.int8)
+        self.scales = np.zeros(capacity, dtype=np.float32)
+        self.doc_freq = np.zeros(dimensions, dtype=np.int64)  # Entries using each bucket
+        self.size = 0
+
+    def _reserve(self, count):
+        """Grow the arrays to hold `count` more entries."""
+        needed = self.size + count
+        capacity = self.codes.shape[1]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        codes = np.zeros((self.dimensions, capacity), dtype=np.int8)
+        codes[:, :self.size] = self.codes[:, :self.size]
+        scales = np.zeros(capacity, dtype=np.float32)
+        scales[:self.size] = self.scales[:self.size]
+        self.codes, self.scales = codes, scales
+
+    def add(self, codes, scales):
+        """
+        Append entries.
+
+        Args:
+            codes: int8 array of shape (entries, dimensions)
+            scales: float32 array of shape (entries,)
+
+        Returns:
+            int: Position of the first entry added
+        """
+        start = self.size
+        self._reserve(len(codes))
+        self.codes[:, start:start + len(codes)] = codes.T
+        self.scales[start:start + len(codes)] = scales
+        self.doc_freq += np.count_nonzero(codes, axis=0)
+        self.size += len(codes)
+        return start
+
+    def replace(self, position, code, scale):
+        """Overwrite the vector at a position."""
+        self.doc_freq -= self.codes[:, position] != 0
+        self.codes[:, position] = code
+        self.scales[position] = scale
+        self.doc_freq += code != 0
+
+    def query_vector(self, text):
+        """
+        Weighted query terms.
+
+        Returns:
+            tuple: (bucket indices, float32 weights): log tf times idf, unit length
+        """
+        weights = term_weights(text, self.dimensions)
+        buckets = np.fromiter(weights, dtype=np.int64, count=len(weights))
+        values = np.fromiter(weights.values(), dtype=np.float32, count=len(weights))
+        values *= np.log((1 + self.size) / (1 + self.doc_freq[buckets])) + 1
+        norm = np.linalg.norm(values)
+        return buckets, values / norm if norm else values
+
+    def search(self, text, k=10):
+        """
+        Entries most similar to a query.
+
+        Args:
+            text: Query text
+            k: Number of results
+
+        Returns:
+            list: (position, cosine similarity) pairs, best first; only
+                positive similarities
+        """
+        buckets, weights = self.query_vector(text)
+        if not len(buckets) or not self.size:
+            return []
+        # Only the rows of the query's buckets are read
+        scores = weights @ self.codes[buckets, :self.size]
+        scores *= self.scales[:self.size]
+        # Most entries share no term with the query; selecting among their tied zeros is slow
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        top = candidates[np.argsort(scores[candidates])[::-1]]
+        return [(int(position), float(scores[position])) for position in top]
+
+    @property
+    def nbytes(self):
+        """Memory held by the arrays, including room for growth."""
+        return self.codes.nbytes + self.scales.nbytes + self.doc_freq.nbytes
+
+
+class ResultStore:
+    """
+    Analyses persisted in SQLite and searchable through an in-memory Int8Index.
+
+    Several processes (pre-forked server workers) can share the database:
+    each one adds rows written by the others before searching. A row updated
+    by another process (more fields for the same image) is ranked by its old
+    vector in this one until the next restart; its text is always current.
+    """
+
+    def __init__(self, db_path=None, dimensions=None):
+        """
+        Open the database and load its vectors.
+
+        Args:
+            db_path: SQLite file (defaults to Config.SEARCH_DB_PATH; ':memory:' keeps nothing)
+            dimensions: Hash buckets per vector (defaults to Config.SEARCH_DIMENSIONS)
+        """
+        self.db_path = db_path or Config.SEARCH_DB_PATH
+        self.dimensions = dimensions or Config.SEARCH_DIMENSIONS
+        self.index = Int8Index(self.dimensions)
+        self.ids = np.zeros(self.index.codes.shape[1], dtype=np.int64)  # Row id per position, ascending
+        self._lock = threading.Lock()
+        self._db = None
+        self._pid = None
+        self._inherited_db = None
+        self._last_id = 0
+        self._open_db()
+        with self._lock:
+            self._sync()
+
+    def _connect(self):
+        """Open this process's connection."""
+        self._db = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._pid = os.getpid()
+
+    def _check_fork(self):
+        """Reconnect in a forked child. Caller holds the lock."""
+        if self._pid != os.getpid():
+            self._inherited_db = self._db  # Not closed: closing would act on the parent's file handle
+            self._connect()
+
+    def _open_db(self):
+        """Open the database, creating the table on first use."""
+        self._connect()
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS analyses ('
+            'id INTEGER PRIMARY KEY, image_hash TEXT NOT NULL UNIQUE, created_at REAL NOT NULL, '
+            + ''.join(f'{name} TEXT, ' for name in TEXT_FIELDS) +
+            'vector BLOB NOT NULL, scale REAL NOT NULL)'
+        )
+        self._db.commit()
+
+    def _sync(self):
+        """Add rows this process has not indexed yet, in id order. Caller holds the lock."""
+        self._check_fork()
+        cursor = self._db.execute(
+            'SELECT id, vector, scale FROM analyses WHERE id > ? ORDER BY id', (self._last_id,)
+        )
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH)
+            if not rows:
+                break
+            stale = [row for row in rows if len(row[1]) != self.dimensions]
+            if stale:
+                # Written with another SEARCH_DIMENSIONS: encode again from the text
+                rows = self._reencode(rows)
+            codes = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.int8)
+            start = self.index.add(
+                codes.reshape(len(rows), self.dimensions),
+                np.array([row[2] for row in rows], dtype=np.float32)
+            )
+            if len(self.ids) < self.index.codes.shape[1]:
+                ids = np.zeros(self.index.codes.shape[1], dtype=np.int64)
+                ids[:start] = self.ids[:start]
+                self.ids = ids
+            self.ids[start:start + len(rows)] = [row[0] for row in rows]
+            self._last_id = rows[-1][0]
+
+    def _reencode(self, rows):
+        """Rows with vectors re-encoded at this store's dimensions, saved back. Caller holds the lock."""
+        ids = [row[0] for row in rows]
+        texts = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            query = (f"SELECT id, {', '.join(TEXT_FIELDS)} FROM analyses "
+                     f"WHERE id IN ({', '.join('?' * len(chunk))})")
+            for row in self._db.execute(query, chunk):
+                texts[row[0]] = document_text(dict(zip(TEXT_FIELDS, row[1:])))
+        codes, scales = encode([texts[row_id] for row_id in ids], self.dimensions)
+        self._db.executemany(
+            'UPDATE analyses SET vector = ?, scale = ? WHERE id = ?',
+            [(code.tobytes(), float(scale), row_id) for code, scale, row_id in zip(codes, scales, ids)]
+        )
+        self._db.commit()
+        return [(row_id, code.tobytes(), scale) for row_id, code, scale in zip(ids, codes, scales)]
+
+    def _position(self, row_id):
+        """Index position of a row id, or None if not indexed. Caller holds the lock."""
+        position = int(np.searchsorted(self.ids[:self.index.size], row_id))
+        if position < self.index.size and self.ids[position] == row_id:
+            return position
+        return None
+
+    def record(self, image_hash, fields):
+        """
+        Store an analysis, merging its fields into any earlier one of the same image.
+
+        Args:
+            image_hash: Hex digest of the image payload
+            fields: Output fields (caption, summary, ...); other keys are ignored
+        """
+        fields = {name: fields[name] for name in TEXT_FIELDS if fields.get(name)}
+        with self._lock:
+            self._check_fork()
+            row = self._db.execute(
+                f"SELECT id, {', '.join(TEXT_FIELDS)} FROM analyses WHERE image_hash = ?", (image_hash,)
+            ).fetchone()
+            if row is not None:
+                merged = {name: value for name, value in zip(TEXT_FIELDS, row[1:]) if value}
+                merged.update(fields)
+                fields = merged
+            codes, scales = encode([document_text(fields)], self.dimensions)
+            values = [fields.get(name) for name in TEXT_FIELDS] + [codes[0].tobytes(), float(scales[0])]
+            if row is None:
+                self._db.execute(
+                    f"INSERT INTO analyses (image_hash, created_at, {', '.join(TEXT_FIELDS)}, vector, scale) "
+                    f"VALUES (?, ?, {', '.join('?' * len(TEXT_FIELDS))}, ?, ?)",
+                    [image_hash, time.time()] + values
+                )
+            else:
+                self._db.execute(
+                    f"UPDATE analyses SET {', '.join(f'{name} = ?' for name in TEXT_FIELDS)}, "
+                    f"vector = ?, scale = ? WHERE id = ?",
+                    values + [row[0]]
+                )
+            self._db.commit()
+            if row is not None:
+                position = self._position(row[0])
+                if position is not None:
+                    self.index.replace(position, codes[0], scales[0])
+            self._sync()
+
+    def search(self, query, k=10):
+        """
+        Past analyses most similar to a text query.
+
+        Args:
+            query: Free text, e.g. "beach sunset stories"
+            k: Number of results
+
+        Returns:
+            list: Dicts with score, image_hash, created_at and the stored fields, best first
+        """
+        with self._lock:
+            self._sync()
+            hits = [(int(self.ids[position]), score) for position, score in self.index.search(query, k)]
+            if not hits:
+                return []
+            rows = self._db.execute(
+                f"SELECT id, image_hash, created_at, {', '.join(TEXT_FIELDS)} FROM analyses "
+                f"WHERE id IN ({', '.join('?' * len(hits))})",
+                [row_id for row_id, _ in hits]
+            ).fetchall()
+        by_id = {row[0]: row for row in rows}
+        results = []
+        for row_id, score in hits:
+            row = by_id.get(row_id)
+            if row is None:
+                continue
+            result = {'score': round(score, 4), 'image_hash': row[1], 'created_at': row[2]}
+            result.update((name, value) for name, value in zip(TEXT_FIELDS, row[3:]) if value)
+            results.append(result)
+        return results
+
+    def stats(self):
+        """
+        Return index counters.
+
+        Returns:
+            dict: Entries, dimensions and index memory
+        """
+        with self._lock:
+            return {
+                'entries': self.index.size,
+                'dimensions': self.dimensions,
+                'index_bytes': self.index.nbytes + self.ids.nbytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store():
+    """Process-wide store shared by the pipeline and /api/search."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore()
+        return _store
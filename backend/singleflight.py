@@ -0,0 +1,211 @@
+"""
+Request coalescing: concurrent requests for the same key share one in-flight call.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    """One in-flight call that any number of threads can wait on."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        """
+        Block until the call settles.
+
+        Returns:
+            The call's result
+
+        Raises:
+            Exception: The error the call failed with
+        """
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls per key across threads.
+
+    The first caller for a key (the leader) runs the call; callers arriving
+    while it is in flight wait and receive the same result or exception.
+    Nothing is remembered once the call settles; that is the cache's job.
+    """
+
+    def __init__(self):
+        """Initialize an empty group."""
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def claim(self, key):
+        """
+        Join the in-flight call for key, or become its leader.
+
+        A leader must call settle() even if it fails; only the first settle counts.
+
+        Args:
+            key: Hashable request key
+
+        Returns:
+            tuple: (call, is_leader)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return call, False
+            call = self._calls[key] = _Call()
+            self.leaders += 1
+            return call, True
+
+    def settle(self, key, call, result=None, error=None):
+        """
+        Publish the leader's outcome to every waiter and retire the call.
+
+        Args:
+            key: Key passed to claim()
+            call: Call returned by claim()
+            result: Result of the call
+            error: Exception the call failed with, if any
+        """
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+            if call._done.is_set():
+                return
+            call.result = result
+            call.error = error
+            call._done.set()
+
+    def do(self, key, fn, *args):
+        """
+        Run fn(*args) unless an identical call is already in flight.
+
+        Args:
+            key: Hashable request key
+            fn: Callable producing the result
+            *args: Arguments for fn
+
+        Returns:
+            tuple: (result, shared); shared is True for waiters
+
+        Raises:
+            Exception: Whatever fn raised, in the leader and every waiter
+        """
+        call, leader = self.claim(key)
+        if not leader:
+            return call.wait(), True
+
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.settle(key, call, error=e)
+            raise
+        self.settle(key, call, result=result)
+        return result, False
+
+    def stats(self):
+        """Counters for /api/health."""
+        with self._lock:
+            in_flight = len(self._calls)
+        return {'in_flight': in_flight, 'leaders': self.leaders, 'coalesced': self.coalesced}
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop.
+
+    Calls started by do() run as their own task, so a waiter that is
+    cancelled (for example by a request timeout) never cancels the call
+    the other waiters depend on.
+    """
+
+    def __init__(self):
+        """Initialize an empty group."""
+        self._calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def claim(self, key):
+        """
+        Join the in-flight call for key, or become its leader.
+
+        A leader must call settle() even if it fails; only the first settle counts.
+
+        Args:
+            key: Hashable request key
+
+        Returns:
+            tuple: (asyncio.Future, is_leader)
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future, False
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        self.leaders += 1
+        return future, True
+
+    def settle(self, key, future, result=None, error=None):
+        """
+        Publish the leader's outcome to every waiter and retire the call.
+
+        Args:
+            key: Key passed to claim()
+            future: Future returned by claim()
+            result: Result of the call
+            error: Exception the call failed with, if any
+        """
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        elif isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(error)
+            future.exception()  # Waiters are optional; don't warn if there are none
+
+    async def do(self, key, fn, *args):
+        """
+        Await fn(*args) unless an identical call is already in flight.
+
+        Args:
+            key: Hashable request key
+            fn: Coroutine function producing the result
+            *args: Arguments for fn
+
+        Returns:
+            tuple: (result, shared); shared is True for waiters
+
+        Raises:
+            Exception: Whatever fn raised, in the leader and every waiter
+        """
+        future, leader = self.claim(key)
+        if leader:
+            task = asyncio.ensure_future(fn(*args))
+
+            def publish(task):
+                if task.cancelled():
+                    self.settle(key, future, error=asyncio.CancelledError())
+                elif task.exception() is not None:
+                    self.settle(key, future, error=task.exception())
+                else:
+                    self.settle(key, future, result=task.result())
+
+            task.add_done_callback(publish)
+        return await asyncio.shield(future), not leader
+
+    def stats(self):
+        """Counters for /api/health."""
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'coalesced': self.coalesced}
@@ -0,0 +1,148 @@
+"""
+Cold-start budget: importing the app and answering /api/health must not load the analysis stack.
+Usage: python test_cold_start.py [backend dir]  (or run with pytest)
+
+On a serverless host every cold start imports the app before serving its
+first byte. The OpenAI SDK (with pydantic and httpx), Pillow and the
+pipeline are only imported once an analysis needs them. Each check runs
+in a fresh interpreter with `-X importtime`, with the environment a Vercel
+instance has.
+
+Run as a script, it prints the time-to-first-response report; pass the
+backend/ directory of another checkout (e.g. a `git worktree` of an older
+commit) to measure that tree instead.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Loaded only by analyses, never by startup or the health route
+HEAVY_MODULES = ['openai', 'pydantic', 'httpx', 'PIL', 'numpy']
+# Cumulative `-X importtime` of `import app`, best of RUNS; Flask itself is most of it
+IMPORT_BUDGET_MS = int(os.getenv('COLD_START_BUDGET_MS', 300))
+RUNS = 3
+
+# Import the app, answer one health request, report what was loaded and when
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/api/health')
+answered = time.perf_counter()
+print(json.dumps({
+    'status': response.status_code,
+    'import_ms': (imported - start) * 1000,
+    'first_response_ms': (answered - start) * 1000,
+    'heavy': sorted({name.split('.')[0] for name in sys.modules} & set(%r)),
+}))
+"""
+
+
+def cold_start(backend_dir=HERE):
+    """
+    Start a fresh interpreter that imports the app and serves /api/health once.
+
+    Args:
+        backend_dir: Directory holding app.py
+
+    Returns:
+        dict: status, import_ms and first_response_ms (measured in the child),
+            process_ms (spawn to exit), app_import_ms (cumulative importtime
+            of the app module) and heavy (HEAVY_MODULES that got loaded)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            os.environ,
+            VERCEL='1',
+            OPENAI_API_KEY='sk-test',
+            ANALYSIS_BACKEND='openai',
+            # No job store to resume from, as on a fresh instance
+            JOBS_DB_PATH=os.path.join(tmp, 'jobs.sqlite3'),
+            PYTHONDONTWRITEBYTECODE='1',
+        )
+        start = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', CHILD % HEAVY_MODULES],
+            cwd=backend_dir, env=env, capture_output=True, text=True, timeout=120
+        )
+        process_ms = (time.perf_counter() - start) * 1000
+    assert process.returncode == 0, process.stderr[-2000:]
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['process_ms'] = process_ms
+    # "import time: <self us> | <cumulative us> | <module>"
+    match = re.search(r'^import time:\s*\d+ \|\s*(\d+) \| app$', process.stderr, re.MULTILINE)
+    result['app_import_ms'] = int(match.group(1)) / 1000
+    return result
+
+
+def best_of(runs, backend_dir=HERE):
+    """Cold starts run `runs` times; each timing is the minimum, the least noisy estimate."""
+    results = [cold_start(backend_dir) for _ in range(runs)]
+    best = {key: min(r[key] for r in results) for key in ('import_ms', 'first_response_ms',
+                                                          'process_ms', 'app_import_ms')}
+    best['median_process_ms'] = statistics.median(r['process_ms'] for r in results)
+    best['status'] = results[0]['status']
+    best['heavy'] = sorted({name for r in results for name in r['heavy']})
+    return best
+
+
+def test_health_does_not_load_analysis_stack():
+    """Importing the app and serving /api/health loads none of HEAVY_MODULES."""
+    result = cold_start()
+
+    assert result['status'] == 200
+    assert result['heavy'] == []
+
+
+def test_import_within_budget():
+    """`import app` stays within IMPORT_BUDGET_MS of cumulative import time."""
+    result = best_of(RUNS)
+
+    assert result['app_import_ms'] <= IMPORT_BUDGET_MS, (
+        f"import app took {result['app_import_ms']:.0f}ms (budget {IMPORT_BUDGET_MS}ms)"
+    )
+
+
+def test_stores_default_to_temp_dir_on_vercel():
+    """The SQLite stores are created in the temp directory on Vercel, whose deployment is read-only."""
+    env = {name: value for name, value in os.environ.items() if name not in ('JOBS_DB_PATH', 'SEARCH_DB_PATH')}
+    env['VERCEL'] = '1'
+    process = subprocess.run(
+        [sys.executable, '-c', 'from config import Config; print(Config.JOBS_DB_PATH); print(Config.SEARCH_DB_PATH)'],
+        cwd=HERE, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert process.returncode == 0, process.stderr[-2000:]
+
+    paths = process.stdout.strip().splitlines()
+    assert len(paths) == 2
+    assert all(os.path.dirname(path) == tempfile.gettempdir() for path in paths)
+
+
+def print_report(backend_dir, runs=10):
+    """Print time-to-first-response of the tree in backend_dir."""
+    result = best_of(runs, backend_dir)
+    print(f"Cold start of {backend_dir} (best of {runs})")
+    print(f"  import app (-X importtime)  {result['app_import_ms']:7.0f} ms")
+    print(f"  import app (wall)           {result['import_ms']:7.0f} ms")
+    print(f"  first /api/health response  {result['first_response_ms']:7.0f} ms after start of script")
+    print(f"  process spawn to exit       {result['process_ms']:7.0f} ms (median {result['median_process_ms']:.0f} ms)")
+    print(f"  heavy modules loaded        {', '.join(result['heavy']) or 'none'}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        print_report(os.path.abspath(sys.argv[1]))
+    else:
+        for name, test in list(globals().items()):
+            if name.startswith('test_') and callable(test):
+                test()
+                print(f"✅ {name}")
+        print_report(HERE)
@@ -0,0 +1,156 @@
+"""
+Tests for flow control under cancellation: cancelled calls give back their concurrency slots.
+Usage: python test_flow_control.py  (or run with pytest)
+"""
+import asyncio
+import contextlib
+import io
+import itertools
+import time
+from PIL import Image
+from config import Config
+from fake_openai import FakeOpenAIServer
+import rate_limit
+
+SETTINGS = ('OPENAI_API_KEY', 'OPENAI_BASE_URL', 'HEDGE_MIN_DELAY', 'HEDGE_BUDGET_RATIO', 'ASYNC_ENABLED',
+            'CACHE_ENABLED', 'SINGLEFLIGHT_ENABLED', 'SEARCH_ENABLED')
+
+
+@contextlib.contextmanager
+def fake_backend(latency, **settings):
+    """Point the config at a fresh fake API with fresh flow control; settings restored after."""
+    server = FakeOpenAIServer(latency=latency).start()
+    saved = {name: getattr(Config, name) for name in SETTINGS}
+    Config.OPENAI_API_KEY = 'fake-key'
+    Config.OPENAI_BASE_URL = server.base_url
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    rate_limit._flow_controls.clear()
+    try:
+        yield server
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+        rate_limit._flow_controls.clear()
+        server.stop()
+
+
+async def wait_for_in_flight(flow, count, timeout=5.0):
+    """Wait until `count` calls hold a slot."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while flow.in_flight.count < count:
+        assert loop.time() < deadline, f"in_flight stuck at {flow.in_flight.count}"
+        await asyncio.sleep(0.02)
+
+
+def test_cancelled_calls_release_their_slots():
+    """Calls cancelled in flight or while queued for a slot leave in_flight at 0."""
+    from openai_client import AsyncOpenAIClient
+    image = Image.new('RGB', (64, 64), (90, 160, 30))
+
+    async def scenario():
+        client = AsyncOpenAIClient(max_in_flight=3)
+        tasks = [asyncio.create_task(client.analyze_with_retry(image, 'Describe it.')) for _ in range(5)]
+        # Three calls in flight, two queued behind them
+        await wait_for_in_flight(client.flow, 3)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert client.flow.in_flight.count == 0
+        assert all(task.cancelled() for task in tasks)
+
+    with fake_backend(latency=2.0):
+        asyncio.run(scenario())
+
+
+def test_hedged_requests_drain_in_flight():
+    """Every hedge that wins cancels the slow primary; no slot is left behind."""
+    from openai_client import AsyncOpenAIClient
+    from router import HEDGE_MIN_SAMPLES, Provider, ProviderRouter
+    image = Image.new('RGB', (64, 64), (200, 40, 90))
+    # Requests alternate slow and fast: each primary is slow, its hedge fast
+    latencies = itertools.cycle([2.0, 0.05])
+
+    async def scenario():
+        client = AsyncOpenAIClient()
+        provider = Provider('openai', None, client)
+        for _ in range(HEDGE_MIN_SAMPLES):
+            provider.latency.record(0.05)
+        router = ProviderRouter([provider], hedge_enabled=True, hedge_target='same')
+        for _ in range(5):
+            await router.analyze_async(image, 'Describe it.')
+        # Cancelled losers unwind on the next loop iterations
+        for _ in range(50):
+            if client.flow.in_flight.count == 0:
+                break
+            await asyncio.sleep(0.02)
+        assert router.hedge_wins == 5
+        assert client.flow.in_flight.count == 0
+
+    with fake_backend(lambda: next(latencies), HEDGE_MIN_DELAY=0.1, HEDGE_BUDGET_RATIO=1.0):
+        asyncio.run(scenario())
+
+
+def test_timed_out_analyses_release_their_slots():
+    """Requests and streams cancelled by the runner's timeout leave in_flight at 0."""
+    from async_runner import AsyncRunner
+    from pipeline import AnalysisPipeline
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (20, 140, 220)).save(buffer, 'PNG')
+    upload = buffer.getvalue()
+
+    with fake_backend(latency=2.0, ASYNC_ENABLED=True, CACHE_ENABLED=False, SINGLEFLIGHT_ENABLED=False,
+                      SEARCH_ENABLED=False):
+        pipe = AnalysisPipeline()
+        runner = AsyncRunner()
+        for _ in range(3):
+            try:
+                runner.run(pipe.process_image_async(io.BytesIO(upload)), timeout=0.3)
+                raise AssertionError("the analysis should have timed out")
+            except TimeoutError:
+                pass
+            try:
+                list(runner.iterate(pipe.stream_image_async(io.BytesIO(upload)), timeout=0.3))
+                raise AssertionError("the stream should have timed out")
+            except TimeoutError:
+                pass
+        deadline = time.monotonic() + 2.0
+        while pipe.async_client.flow.in_flight.count and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert pipe.async_client.flow.in_flight.count == 0
+
+
+def test_aborted_batches_release_their_slots():
+    """A batch whose client goes away after the first record cancels the rest without leaking slots."""
+    from async_runner import AsyncRunner
+    from batch import BatchProcessor
+    from pipeline import AnalysisPipeline
+    uploads = []
+    for i in range(4):
+        buffer = io.BytesIO()
+        Image.new('RGB', (320, 240), (60 * i, 100, 30)).save(buffer, 'PNG')
+        uploads.append(buffer.getvalue())
+    # The first analysis answers at once, the others would take a while
+    latencies = itertools.chain([0.05], itertools.repeat(2.0))
+
+    with fake_backend(lambda: next(latencies), ASYNC_ENABLED=True, CACHE_ENABLED=False,
+                      SINGLEFLIGHT_ENABLED=False, SEARCH_ENABLED=False):
+        pipe = AnalysisPipeline()
+        records = BatchProcessor(pipe, runner=AsyncRunner(), max_concurrency=4).process(
+            [(f'{i}.png', lambda upload=upload: upload) for i, upload in enumerate(uploads)]
+        )
+        assert next(records)['success']
+        records.close()
+        deadline = time.monotonic() + 2.0
+        while pipe.async_client.flow.in_flight.count and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert pipe.async_client.flow.in_flight.count == 0
+
+
+if __name__ == '__main__':
+    test_cancelled_calls_release_their_slots()
+    test_hedged_requests_drain_in_flight()
+    test_timed_out_analyses_release_their_slots()
+    test_aborted_batches_release_their_slots()
+    print("All flow control tests passed")
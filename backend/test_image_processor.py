@@ -0,0 +1,57 @@
+"""
+Tests for upload preprocessing: uploads sent without re-encoding carry no personal metadata.
+Usage: python test_image_processor.py  (or run with pytest)
+"""
+import io
+from PIL import Image
+from image_processor import ImageProcessor, strip_jpeg_metadata
+
+CAMERA = 'Example Phone 12'
+
+
+def make_upload(format, **options):
+    """A small upload carrying EXIF with a camera model and GPS position."""
+    image = Image.new('RGB', (320, 240), (30, 120, 200))
+    exif = Image.Exif()
+    exif[0x0110] = CAMERA  # Model
+    exif.get_ifd(0x8825).update({1: 'N', 2: (51.0, 30.0, 12.5), 3: 'W', 4: (0.0, 7.0, 39.0)})  # GPS
+    buffer = io.BytesIO()
+    image.save(buffer, format, exif=exif, **options)
+    return buffer.getvalue()
+
+
+def test_passed_through_jpeg_loses_its_metadata():
+    """EXIF, comments and trailing images are cut out; the pixels are untouched."""
+    upload = make_upload('JPEG', quality=90, comment=b'Taken at home') + b'\xff\xd8 secondary image'
+    prepared = ImageProcessor.ingest(upload, profile='balanced')
+
+    assert prepared.passthrough
+    assert CAMERA.encode() not in prepared.payload and b'Exif' not in prepared.payload
+    assert b'Taken at home' not in prepared.payload
+    assert prepared.payload.endswith(b'\xff\xd9')
+    stripped = Image.open(io.BytesIO(prepared.payload))
+    assert not stripped.getexif() and 'comment' not in stripped.info
+    assert list(stripped.getdata()) == list(Image.open(io.BytesIO(upload)).getdata())
+
+
+def test_webp_with_metadata_is_re_encoded():
+    """Metadata that cannot be cut out of the file is dropped by re-encoding instead."""
+    upload = make_upload('WEBP', quality=80)
+    prepared = ImageProcessor.ingest(upload, profile='compact')
+
+    assert not prepared.passthrough
+    assert CAMERA.encode() not in prepared.payload
+    assert not Image.open(io.BytesIO(prepared.payload)).getexif()
+
+
+def test_unparseable_jpeg_is_not_stripped():
+    """Bytes that are not a well-formed JPEG header give None, so ingest() re-encodes."""
+    assert strip_jpeg_metadata(b'not a jpeg') is None
+    assert strip_jpeg_metadata(b'\xff\xd8\xff\xe1\xff\xff') is None
+
+
+if __name__ == '__main__':
+    test_passed_through_jpeg_loses_its_metadata()
+    test_webp_with_metadata_is_re_encoded()
+    test_unparseable_jpeg_is_not_stripped()
+    print("All image processor tests passed")
@@ -0,0 +1,53 @@
+"""
+Tests for background jobs: a running job keeps its lease, a dead worker's job runs again.
+Usage: python test_jobs.py  (or run with pytest)
+"""
+import os
+import tempfile
+import threading
+import time
+from jobs import DONE, JobQueue, JobWorkers
+
+LEASE = 0.3
+
+
+def test_long_analysis_keeps_its_lease():
+    """A job running several leases long is renewed, not requeued and run twice."""
+    calls = []
+    lock = threading.Lock()
+
+    def analyze(data):
+        with lock:
+            calls.append(data)
+        time.sleep(LEASE * 4)
+        return {'caption': 'done'}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, 'jobs.sqlite3'), lease_seconds=LEASE)
+        workers = JobWorkers(queue, analyze, workers=2).start()
+        try:
+            job_id, _ = queue.submit(b'image bytes')
+            job = queue.wait(job_id, timeout=LEASE * 10)
+        finally:
+            workers.stop()
+        assert job['status'] == DONE
+        assert job['attempts'] == 1
+        assert len(calls) == 1
+
+
+def test_expired_lease_is_requeued():
+    """A job claimed by a worker that never renews it is claimed again once the lease expires."""
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, 'jobs.sqlite3'), lease_seconds=LEASE)
+        job_id, _ = queue.submit(b'image bytes')
+        assert queue.claim()[:2] == (job_id, 1)
+        assert queue.claim() is None
+        time.sleep(LEASE * 1.5)
+        assert queue.claim()[:2] == (job_id, 2)
+        assert not queue.renew(job_id, 1)
+
+
+if __name__ == '__main__':
+    test_long_analysis_keeps_its_lease()
+    test_expired_lease_is_requeued()
+    print("All job tests passed")
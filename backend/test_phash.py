@@ -0,0 +1,60 @@
+"""
+Tests for the near-duplicate index: bounded like the result cache it points into.
+Usage: python test_phash.py  (or run with pytest)
+"""
+import random
+import time
+from phash import NearDuplicateIndex
+
+CONTEXT = 'context'
+
+
+def random_hashes(count, seed=7):
+    """Distinct random 64-bit hashes."""
+    rng = random.Random(seed)
+    return [rng.getrandbits(64) for _ in range(count)]
+
+
+def test_index_keeps_at_most_max_entries():
+    """Adding past max_entries drops the oldest entries; recent ones are still found."""
+    index = NearDuplicateIndex(max_distance=4, max_entries=100)
+    hashes = random_hashes(1000)
+    for i, phash in enumerate(hashes):
+        index.add(phash, CONTEXT, f'key-{i}')
+        assert index.stats()['entries'] <= 100 + NearDuplicateIndex.TRIM_SLACK * 100 + 1
+
+    assert index.candidates(hashes[-1], CONTEXT) == [(0, 'key-999')]
+    assert index.candidates(hashes[0], CONTEXT) == []
+    assert index.stats()['dropped'] >= 1000 - 126
+
+
+def test_entries_expire_with_the_cache_ttl():
+    """Expired entries are never returned and are dropped on the next trim."""
+    index = NearDuplicateIndex(max_distance=4, ttl_seconds=0.2)
+    hashes = random_hashes(10)
+    for i, phash in enumerate(hashes):
+        index.add(phash, CONTEXT, f'key-{i}')
+    assert index.candidates(hashes[3], CONTEXT) == [(0, 'key-3')]
+
+    time.sleep(0.3)
+    assert index.candidates(hashes[3], CONTEXT) == []
+    index._trim(force=True)
+    assert index.stats()['entries'] == 0
+
+
+def test_load_drops_what_is_over_the_limit():
+    """Entries loaded from the disk tier are held to the same limits."""
+    later = time.time() + 3600
+    entries = [(phash, (CONTEXT, f'key-{i}', later + i)) for i, phash in enumerate(random_hashes(50))]
+    entries.insert(0, (random_hashes(1, seed=1)[0], (CONTEXT, 'expired', time.time() - 1)))
+    index = NearDuplicateIndex(max_distance=4, max_entries=20)
+    index.load(entries)
+    assert index.stats()['entries'] == 20
+    assert index.candidates(entries[-1][0], CONTEXT) == [(0, 'key-49')]
+
+
+if __name__ == '__main__':
+    test_index_keeps_at_most_max_entries()
+    test_entries_expire_with_the_cache_ttl()
+    test_load_drops_what_is_over_the_limit()
+    print("All near-duplicate index tests passed")
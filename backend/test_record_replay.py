@@ -0,0 +1,140 @@
+"""
+Tests for record/replay: answers recorded from an API are replayed offline, with their timing.
+Usage: python test_record_replay.py  (or run with pytest)
+"""
+import asyncio
+import contextlib
+import io
+import os
+import tempfile
+import time
+from PIL import Image
+from config import Config
+from fake_openai import FakeOpenAIServer
+import record_replay
+
+LATENCY = 0.3
+SETTINGS = ('ANALYSIS_BACKEND', 'OPENAI_API_KEY', 'OPENAI_BASE_URL', 'CACHE_ENABLED', 'SINGLEFLIGHT_ENABLED',
+            'RECORDING_PATH', 'REPLAY_LATENCY_SCALE', 'REPLAY_FALLBACK')
+
+
+def make_upload(color):
+    """A small PNG upload of one colour."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+UPLOADS = [make_upload((40 * i, 120, 200 - 40 * i)) for i in range(3)]
+
+
+@contextlib.contextmanager
+def backend(mode, recording, **settings):
+    """A pipeline on ANALYSIS_BACKEND=mode with a fresh archive; settings restored after."""
+    from pipeline import AnalysisPipeline
+    saved = {name: getattr(Config, name) for name in SETTINGS}
+    Config.ANALYSIS_BACKEND = mode
+    Config.OPENAI_API_KEY = 'fake-key'
+    Config.CACHE_ENABLED = False
+    Config.SINGLEFLIGHT_ENABLED = False
+    Config.RECORDING_PATH = recording
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    record_replay._archive = None
+    try:
+        yield AnalysisPipeline()
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+        record_replay._archive = None
+
+
+def record(recording):
+    """Record the uploads through a local API server; returns the results and the server's call count."""
+    server = FakeOpenAIServer(latency=LATENCY).start()
+    try:
+        with backend('record', recording, OPENAI_BASE_URL=server.base_url) as pipe:
+            results = [pipe.process_image(io.BytesIO(upload)) for upload in UPLOADS]
+            events = list(pipe.stream_image(io.BytesIO(UPLOADS[0])))
+            assert record_replay.get_archive().stats()['recorded'] == len(UPLOADS) + 1
+        return results, events, server.request_count
+    finally:
+        server.stop()
+
+
+def timed(call):
+    """(result, seconds) of a call."""
+    start = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - start
+
+
+def fields(result):
+    """The analysis fields of a pipeline result."""
+    return {name: result.get(name) for name in ('caption', 'summary', 'objects', 'mood', 'story')}
+
+
+def test_replay_returns_the_recorded_answers_offline():
+    """Replayed results match the recorded ones, sync, async and streamed, without the server."""
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = os.path.join(tmp, 'recording.sqlite3')
+        recorded, recorded_events, calls = record(recording)
+        assert calls == len(UPLOADS) + 1
+        assert all('error' not in result for result in recorded)
+
+        # Nothing listens on this address: any real call would fail
+        with backend('replay', recording, OPENAI_BASE_URL='http://127.0.0.1:9/v1', REPLAY_LATENCY_SCALE=0) as pipe:
+            replayed = [pipe.process_image(io.BytesIO(upload)) for upload in UPLOADS]
+            assert [fields(result) for result in replayed] == [fields(result) for result in recorded]
+
+            async def all_requests():
+                return await asyncio.gather(*(pipe.process_image_async(io.BytesIO(upload)) for upload in UPLOADS))
+
+            replayed_async = asyncio.run(all_requests())
+            assert [fields(result) for result in replayed_async] == [fields(result) for result in recorded]
+
+            events = list(pipe.stream_image(io.BytesIO(UPLOADS[0])))
+            assert [data for kind, data in events if kind == 'field'] == \
+                [data for kind, data in recorded_events if kind == 'field']
+            assert events[-1][0] == 'done'
+
+            stats = record_replay.get_archive().stats()
+            assert stats['exchanges'] == len(UPLOADS) + 1
+            assert stats['replayed'] == 2 * len(UPLOADS) + 1
+            assert stats['misses'] == 0 and stats['fallbacks'] == 0
+
+
+def test_replay_latency_is_recorded_latency_times_scale():
+    """Scale 1 waits about as long as the recording took; scale 0 does not wait."""
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = os.path.join(tmp, 'recording.sqlite3')
+        record(recording)
+        with backend('replay', recording, REPLAY_LATENCY_SCALE=1) as pipe:
+            _, seconds = timed(lambda: pipe.process_image(io.BytesIO(UPLOADS[1])))
+            assert seconds >= LATENCY * 0.9
+        with backend('replay', recording, REPLAY_LATENCY_SCALE=0) as pipe:
+            _, seconds = timed(lambda: pipe.process_image(io.BytesIO(UPLOADS[1])))
+            assert seconds < LATENCY / 2
+
+
+def test_unrecorded_images_fall_back_or_miss():
+    """An image never recorded borrows a recorded answer, or fails with REPLAY_FALLBACK off."""
+    with tempfile.TemporaryDirectory() as tmp:
+        recording = os.path.join(tmp, 'recording.sqlite3')
+        recorded, _, _ = record(recording)
+        unseen = make_upload((10, 10, 10))
+        with backend('replay', recording, REPLAY_LATENCY_SCALE=0) as pipe:
+            result = pipe.process_image(io.BytesIO(unseen))
+            assert fields(result) in [fields(result) for result in recorded]
+            assert record_replay.get_archive().stats()['fallbacks'] == 1
+        with backend('replay', recording, REPLAY_LATENCY_SCALE=0, REPLAY_FALLBACK=False) as pipe:
+            result = pipe.process_image(io.BytesIO(unseen))
+            assert 'error' in result
+            assert record_replay.get_archive().stats()['misses'] >= 1
+
+
+if __name__ == '__main__':
+    test_replay_returns_the_recorded_answers_offline()
+    test_replay_latency_is_recorded_latency_times_scale()
+    test_unrecorded_images_fall_back_or_miss()
+    print("All record/replay tests passed")
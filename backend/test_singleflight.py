@@ -0,0 +1,153 @@
+"""
+Tests for request coalescing: concurrent identical uploads make one upstream call.
+Usage: python test_singleflight.py  (or run with pytest)
+"""
+import asyncio
+import io
+import threading
+import time
+from PIL import Image
+from config import Config
+from fake_openai import FakeOpenAIServer
+from singleflight import SingleFlight, AsyncSingleFlight
+
+NUM_REQUESTS = 25
+
+
+def make_upload():
+    """A small PNG upload."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (200, 120, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def start_fake_backend(latency=0.3):
+    """Start the fake API and point the config at it, with the result cache off."""
+    server = FakeOpenAIServer(latency=latency).start()
+    Config.OPENAI_API_KEY = 'fake-key'
+    Config.OPENAI_BASE_URL = server.base_url
+    Config.CACHE_ENABLED = False
+    Config.SINGLEFLIGHT_ENABLED = True
+    return server
+
+
+def test_concurrent_identical_requests_make_one_upstream_call():
+    """N threads uploading the same image share a single analysis."""
+    from pipeline import AnalysisPipeline
+    server = start_fake_backend()
+    try:
+        pipe = AnalysisPipeline()
+        upload = make_upload()
+        barrier = threading.Barrier(NUM_REQUESTS)
+        results = [None] * NUM_REQUESTS
+
+        def request(i):
+            barrier.wait()
+            results[i] = pipe.process_image(io.BytesIO(upload))
+
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(NUM_REQUESTS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert server.request_count == 1
+        assert all('error' not in result for result in results)
+        assert len({result['caption'] for result in results}) == 1
+        sources = [result['metadata']['cache_source'] for result in results]
+        assert sources.count(None) == 1
+        assert sources.count('coalesced') == NUM_REQUESTS - 1
+        assert pipe.inflight.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': NUM_REQUESTS - 1}
+    finally:
+        server.stop()
+
+
+def test_concurrent_identical_requests_make_one_upstream_call_async():
+    """N coroutines uploading the same image share a single analysis."""
+    from pipeline import AnalysisPipeline
+    server = start_fake_backend()
+    try:
+        Config.ASYNC_ENABLED = True
+        pipe = AnalysisPipeline()
+        upload = make_upload()
+
+        async def all_requests():
+            return await asyncio.gather(
+                *(pipe.process_image_async(io.BytesIO(upload)) for _ in range(NUM_REQUESTS))
+            )
+
+        results = asyncio.run(all_requests())
+
+        assert server.request_count == 1
+        assert all('error' not in result for result in results)
+        sources = [result['metadata']['cache_source'] for result in results]
+        assert sources.count('coalesced') == NUM_REQUESTS - 1
+    finally:
+        server.stop()
+
+
+def test_distinct_keys_are_not_coalesced():
+    """Different keys run independently."""
+    group = SingleFlight()
+    results = [group.do(key, lambda k=key: k * 2) for key in range(3)]
+    assert results == [(0, False), (2, False), (4, False)]
+
+
+def test_errors_reach_every_waiter():
+    """When the leader's call fails, every waiter raises the same error."""
+    group = SingleFlight()
+    calls = []
+    errors = []
+    barrier = threading.Barrier(NUM_REQUESTS)
+
+    def fail():
+        calls.append(1)
+        time.sleep(0.2)
+        raise RuntimeError('upstream down')
+
+    def request():
+        barrier.wait()
+        try:
+            group.do('key', fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=request) for _ in range(NUM_REQUESTS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert errors == ['upstream down'] * NUM_REQUESTS
+    # The failure is not remembered: the next call runs again
+    assert group.do('key', lambda: 'ok') == ('ok', False)
+
+
+def test_errors_reach_every_waiter_async():
+    """Async variant: failures propagate, and a cancelled waiter does not cancel the call."""
+    group = AsyncSingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        raise RuntimeError('upstream down')
+
+    async def scenario():
+        impatient = asyncio.ensure_future(group.do('key', fail))
+        waiters = [asyncio.ensure_future(group.do('key', fail)) for _ in range(NUM_REQUESTS - 1)]
+        await asyncio.sleep(0.05)
+        impatient.cancel()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    outcomes = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(e, RuntimeError) and str(e) == 'upstream down' for e in outcomes)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
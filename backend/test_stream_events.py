@@ -0,0 +1,81 @@
+"""
+Tests for streamed analyses: each field is sent once, normalized, and matches the final results.
+Usage: python test_stream_events.py  (or run with pytest)
+"""
+import asyncio
+import contextlib
+import io
+from PIL import Image
+from config import Config
+from fake_openai import FakeOpenAIServer
+from prompts import ANALYSIS_FIELDS
+
+# A repeated member and a bullet list given as an array: raw parser output differs from the results
+CONTENT = (
+    '{"caption": "A red kite.", "caption": "A red kite over a field.", '
+    '"summary": "A kite flies over a green field on a windy day.", '
+    '"objects": ["Kite", "- Field"], "mood": "Breezy and free.", '
+    '"story": "The kite pulled at its string until the wind let it go."}'
+)
+SETTINGS = ('OPENAI_API_KEY', 'OPENAI_BASE_URL', 'ASYNC_ENABLED', 'CACHE_ENABLED', 'SINGLEFLIGHT_ENABLED',
+            'SEARCH_ENABLED')
+
+
+@contextlib.contextmanager
+def pipeline():
+    """A pipeline on a fake API answering CONTENT; settings restored after."""
+    from pipeline import AnalysisPipeline
+    server = FakeOpenAIServer(latency=0.1, content=CONTENT).start()
+    saved = {name: getattr(Config, name) for name in SETTINGS}
+    Config.OPENAI_API_KEY = 'fake-key'
+    Config.OPENAI_BASE_URL = server.base_url
+    Config.ASYNC_ENABLED = True
+    Config.CACHE_ENABLED = False
+    Config.SINGLEFLIGHT_ENABLED = False
+    Config.SEARCH_ENABLED = False
+    try:
+        yield AnalysisPipeline()
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+        server.stop()
+
+
+def make_upload():
+    """A small PNG upload."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (320, 240), (180, 60, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def check_events(events):
+    """Every field sent once, normalized, with the value the done event holds."""
+    kind, results = events[-1]
+    assert kind == 'done', results
+    fields = [data for kind, data in events if kind == 'field']
+    names = [field['name'] for field in fields]
+    assert sorted(names) == sorted(set(names)) == sorted(ANALYSIS_FIELDS)
+    for field in fields:
+        assert field['value'] == results[field['name']]
+    assert results['objects'] == '- Kite\n- Field'
+
+
+def test_sync_stream_sends_each_field_once():
+    """stream_image sends what the done event holds."""
+    with pipeline() as pipe:
+        check_events(list(pipe.stream_image(io.BytesIO(make_upload()))))
+
+
+def test_async_stream_sends_each_field_once():
+    """stream_image_async sends what the done event holds."""
+    with pipeline() as pipe:
+        async def collect():
+            return [event async for event in pipe.stream_image_async(io.BytesIO(make_upload()))]
+
+        check_events(asyncio.run(collect()))
+
+
+if __name__ == '__main__':
+    test_sync_stream_sends_each_field_once()
+    test_async_stream_sends_each_field_once()
+    print("All stream event tests passed")
@@ -0,0 +1,119 @@
+"""
+Tests for model tiering: which answers escalate, and who gets credited for them.
+Usage: python test_tiering.py  (or run with pytest)
+"""
+import io
+import json
+from PIL import Image
+from config import Config
+from router import Provider, ProviderRouter
+from tiering import ModelTiers, field_confidence
+
+STORY = (
+    '"I\'m sorry," she said, setting the lantern down on the pier. "I can\'t stay another night." '
+    'The fisherman only nodded, coiling his nets while the tide crept over the stones, and watched '
+    'her walk back along the harbour wall until the fog took the last of the light from her coat.'
+)
+REFUSAL = "I'm sorry, but I can't see the image clearly enough to write a story about it."
+SETTINGS = ('OPENAI_API_KEY', 'CACHE_ENABLED', 'CACHE_DB_PATH', 'SINGLEFLIGHT_ENABLED', 'SEARCH_ENABLED',
+            'MODEL_TIERS', 'TIER_ROUTES')
+
+
+def test_dialogue_in_prose_is_not_a_refusal():
+    """Apologies inside a story's dialogue keep their score; one opening the field is a refusal."""
+    assert field_confidence('story', STORY) >= Config.TIER_MIN_CONFIDENCE
+    assert field_confidence('story', REFUSAL) == 0.0
+    assert field_confidence('mood', 'Unable to determine the mood from this image.') == 0.0
+
+
+class FailingClient:
+    """A provider that is down."""
+
+    def analyze_with_retry(self, image, prompt, fields=None, model=None):
+        raise ConnectionError("provider unavailable")
+
+
+class AnsweringClient:
+    """A provider with one model of its own, whatever it is asked for; counts its calls."""
+
+    model_name = 'other-model'
+
+    def __init__(self):
+        self.calls = 0
+
+    def analyze_with_retry(self, image, prompt, fields=None, model=None):
+        self.calls += 1
+        # A caption short enough that a tier would escalate it
+        return json.dumps({name: 'A harbour.' if name == 'caption' else STORY for name in fields})
+
+
+def test_failover_answers_are_not_escalated_or_credited_to_a_tier():
+    """Another provider's fields are kept as answered and attributed to its own model."""
+    from pipeline import AnalysisPipeline
+    saved = {name: getattr(Config, name) for name in SETTINGS}
+    Config.OPENAI_API_KEY = 'fake-key'
+    Config.CACHE_ENABLED = False
+    Config.SINGLEFLIGHT_ENABLED = False
+    Config.SEARCH_ENABLED = False
+    Config.MODEL_TIERS = ['small-model', 'large-model']
+    Config.TIER_ROUTES = ''
+    try:
+        pipe = AnalysisPipeline()
+        other = AnsweringClient()
+        pipe.router = ProviderRouter(
+            [Provider('openai', FailingClient()), Provider('gemini', other)], hedge_enabled=False
+        )
+        buffer = io.BytesIO()
+        Image.new('RGB', (320, 240), (30, 90, 150)).save(buffer, 'PNG')
+        result = pipe.process_image(io.BytesIO(buffer.getvalue()))
+
+        assert 'error' not in result
+        assert result['caption'] == 'A harbour.'
+        assert other.calls == 1
+        assert set(result['metadata']['models'].values()) == {'other-model'}
+        tiers = pipe.tiers.stats()['tiers']
+        assert all(values['calls'] == 0 and values['escalated'] == 0 for values in tiers.values())
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+
+
+def test_failover_answers_are_not_cached_under_the_openai_key():
+    """Another provider's fields are asked again next time; OpenAI's own are served from the cache."""
+    from pipeline import AnalysisPipeline
+    saved = {name: getattr(Config, name) for name in SETTINGS}
+    Config.OPENAI_API_KEY = 'fake-key'
+    Config.CACHE_ENABLED = True
+    Config.CACHE_DB_PATH = None
+    Config.SINGLEFLIGHT_ENABLED = False
+    Config.SEARCH_ENABLED = False
+    Config.MODEL_TIERS = []
+    try:
+        pipe = AnalysisPipeline()
+        other = AnsweringClient()
+        pipe.router = ProviderRouter(
+            [Provider('openai', FailingClient()), Provider('gemini', other)], hedge_enabled=False
+        )
+        buffer = io.BytesIO()
+        Image.new('RGB', (320, 240), (30, 90, 150)).save(buffer, 'PNG')
+        for _ in range(2):
+            result = pipe.process_image(io.BytesIO(buffer.getvalue()))
+            assert 'error' not in result and not result['metadata']['cached']
+        assert other.calls == 2
+
+        recovered = AnsweringClient()
+        pipe.router = ProviderRouter([Provider('openai', recovered)], hedge_enabled=False)
+        for _ in range(2):
+            result = pipe.process_image(io.BytesIO(buffer.getvalue()))
+        assert recovered.calls == 1
+        assert result['metadata']['cached']
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+
+
+if __name__ == '__main__':
+    test_dialogue_in_prose_is_not_a_refusal()
+    test_failover_answers_are_not_escalated_or_credited_to_a_tier()
+    test_failover_answers_are_not_cached_under_the_openai_key()
+    print("All tiering tests passed")
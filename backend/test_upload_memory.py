@@ -0,0 +1,189 @@
+"""
+Tests for upload handling: bounded peak memory for 10MB uploads and early rejection.
+Usage: python test_upload_memory.py  (or run with pytest)
+
+Peak memory is measured with tracemalloc around one WSGI request, so it counts
+Python allocations (request bodies, decoded bytes, JSON) but not Pillow's pixel
+buffers, which are the same whatever the upload encoding.
+"""
+import base64
+import contextlib
+import io
+import json
+import os
+import struct
+import tracemalloc
+import zlib
+from PIL import Image
+from werkzeug.test import EnvironBuilder
+from config import Config
+
+UPLOAD_SIDE = 2950  # Random-noise JPEG of about 9.8MB at quality 95
+MAX_PEAK_RATIO = 1.5  # Peak traced memory per request, as a multiple of the upload
+
+
+def make_upload():
+    """A JPEG just under MAX_IMAGE_SIZE_MB that does not compress."""
+    noise = Image.frombytes('RGB', (UPLOAD_SIDE, UPLOAD_SIDE), os.urandom(UPLOAD_SIDE * UPLOAD_SIDE * 3))
+    buffer = io.BytesIO()
+    noise.save(buffer, 'JPEG', quality=95)
+    data = buffer.getvalue()
+    assert 9 * 1024 * 1024 < len(data) <= Config.MAX_IMAGE_SIZE_BYTES
+    return data
+
+
+def make_png_bomb(width, height):
+    """A tiny PNG declaring the given size; its pixel data is never reached."""
+    def chunk(kind, payload):
+        return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    idat = zlib.compress(b'\0' * 1024)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', idat) + chunk(b'IEND', b'')
+
+
+FAKE_SETTINGS = {
+    'ANALYSIS_BACKEND': 'fake',
+    'OPENAI_API_KEY': 'fake-key',
+    'OPENAI_BASE_URL': None,
+    'FAKE_LATENCY': 0,
+    'FAKE_ERROR_RATE': 0,
+    'CACHE_ENABLED': False,
+}
+
+
+@contextlib.contextmanager
+def fake_app():
+    """The Flask app on the fake backend with no latency and no cache; settings restored after."""
+    import app as app_module
+    saved = {name: getattr(Config, name) for name in FAKE_SETTINGS}
+    for name, value in FAKE_SETTINGS.items():
+        setattr(Config, name, value)
+    app_module.pipeline = None  # Rebuilt with the settings above
+    try:
+        yield app_module.app
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+        app_module.pipeline = None
+
+
+class CountingStream(io.BytesIO):
+    """Request body that records how much of it the server read."""
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self.bytes_read += count
+        return count
+
+
+def call(app, environ):
+    """Run one request through the WSGI app; returns (status code, JSON body, traced peak bytes)."""
+    statuses = []
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    tracemalloc.start()
+    try:
+        body = b''.join(app.wsgi_app(environ, start_response))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return statuses[0], json.loads(body), peak
+
+
+def multipart_environ(data):
+    return EnvironBuilder(path='/api/analyze', method='POST',
+                          data={'image': (io.BytesIO(data), 'upload.jpg')}).get_environ()
+
+
+def json_environ(body, content_length=None):
+    stream = CountingStream(body)
+    environ = EnvironBuilder(path='/api/analyze', method='POST', input_stream=stream,
+                             content_type='application/json').get_environ()
+    environ['CONTENT_LENGTH'] = str(content_length or len(body))
+    return environ, stream
+
+
+def test_multipart_upload_peak_memory_is_bounded():
+    """A 10MB multipart upload is analysed with peak memory close to the upload size."""
+    with fake_app() as app:
+        upload = make_upload()
+        call(app, multipart_environ(upload))  # Warm up: imports, clients, pools
+
+        status, result, peak = call(app, multipart_environ(upload))
+
+        assert status == 200, result
+        assert 'caption' in result['results']
+        print(f"   multipart: {peak / 2**20:.1f}MB peak for a {len(upload) / 2**20:.1f}MB upload")
+        assert peak < MAX_PEAK_RATIO * len(upload)
+
+
+def test_base64_json_upload_peak_memory_is_bounded():
+    """A 10MB image sent as base64 JSON is decoded as it streams, never held as text."""
+    with fake_app() as app:
+        upload = make_upload()
+        body = json.dumps({'image': base64.b64encode(upload).decode()}).encode()
+        call(app, json_environ(body)[0])
+
+        status, result, peak = call(app, json_environ(body)[0])
+
+        assert status == 200, result
+        assert 'caption' in result['results']
+        print(f"   json: {peak / 2**20:.1f}MB peak for a {len(upload) / 2**20:.1f}MB upload "
+              f"({len(body) / 2**20:.1f}MB body)")
+        assert peak < MAX_PEAK_RATIO * len(upload)
+
+
+def test_non_image_is_rejected_from_its_first_bytes():
+    """A 10MB body that is not an image is refused after reading its header."""
+    with fake_app() as app:
+        body = json.dumps({'image': base64.b64encode(os.urandom(7 * 1024 * 1024)).decode()}).encode()
+        environ, stream = json_environ(body)
+
+        status, result, _ = call(app, environ)
+
+        assert status == 400
+        assert 'Invalid image format' in result['error']
+        assert stream.bytes_read < 256 * 1024
+
+
+def test_decompression_bomb_is_rejected_from_its_header():
+    """An image declaring more than MAX_IMAGE_PIXELS is refused without being decoded."""
+    with fake_app() as app:
+        body = json.dumps({'image': base64.b64encode(make_png_bomb(20000, 20000)).decode()}).encode()
+
+        status, result, _ = call(app, json_environ(body)[0])
+
+        assert status == 400
+        assert 'Image too large' in result['error']
+
+
+def test_oversized_body_is_refused_unread():
+    """A Content-Length over MAX_REQUEST_BYTES gets a 413 before the body is read."""
+    with fake_app() as app:
+        body = b'{"image": "' + b'A' * 1024 + b'"}'
+        environ, stream = json_environ(body, content_length=Config.MAX_REQUEST_BYTES + 1)
+
+        status, result, _ = call(app, environ)
+
+        assert status == 413
+        assert 'error' in result
+        assert stream.bytes_read == 0
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"✅ {name}")
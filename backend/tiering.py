@@ -0,0 +1,218 @@
+"""
+Model tiering: a cheap model answers first, a larger one only what it got wrong.
+
+MODEL_TIERS lists models from cheapest to largest. A request's fields are
+asked of the first tier in one call. Each field that comes back missing,
+invalid or below TIER_MIN_CONFIDENCE is asked again of the next tier, and
+only those fields, so a story the small model cut short does not pay for a
+second caption. The last tier's answers are kept whatever their confidence.
+
+TIER_ROUTES raises the starting tier per endpoint or per field:
+'stream=1,story=1' streams on the second model and always writes stories
+with it. A field starts at the higher of its endpoint's and its own tier.
+Streams are never escalated, since a field is sent as soon as it is
+complete; each stream runs on its starting tier.
+
+MODEL_TIERS names models of TIERED_PROVIDER. When the router fails a tier's
+call over to another provider, that provider answers with its own model, so
+its fields are kept as they are: they are not escalated, not counted
+against the tier, and metadata.models names the provider's model.
+"""
+import re
+import threading
+from config import Config
+import metrics
+from prompts import ANALYSIS_FIELDS
+from router import LatencyHistogram
+
+ENDPOINTS = ('analyze', 'stream', 'batch', 'jobs')
+TIERED_PROVIDER = 'openai'  # The provider whose models MODEL_TIERS lists
+
+# Fewer words than this and a field was likely cut short; about half of what its instruction asks for
+MIN_WORDS = {'caption': 4, 'summary': 25, 'objects': 4, 'mood': 15, 'story': 40}
+MIN_VARIETY = 0.3  # Distinct words over words; degenerate output repeats a few words over and over
+
+# Only at the start of the field, outside quotes: "I'm sorry," in a story's dialogue is not a refusal
+_REFUSAL = re.compile(
+    r"^[^\w\"'\u2018\u201c]*(i'?m sorry|i apologi[sz]e|i can(?:no|')t|i am unable|unable to (?:see|view|analy[sz]e|determine|identify)"
+    r"|as an ai)\b",
+    re.IGNORECASE
+)
+_PLACEHOLDER = re.compile(r'^\W*(n/?a|none|unknown|not available|error)?\W*$', re.IGNORECASE)
+
+
+def field_confidence(name, text):
+    """
+    Heuristic confidence in one field of an answer.
+
+    Not a model score: refusals and placeholders get 0, short or repetitive
+    text scales down towards it. Cheap enough to run on every field.
+
+    Args:
+        name: Field name
+        text: Field value
+
+    Returns:
+        float: 0.0-1.0
+    """
+    if not isinstance(text, str) or _PLACEHOLDER.match(text) or _REFUSAL.search(text):
+        return 0.0
+    words = text.split()
+    length = min(1.0, len(words) / MIN_WORDS.get(name, 1))
+    variety = min(1.0, len({word.lower() for word in words}) / len(words) / MIN_VARIETY)
+    return round(length * variety, 3)
+
+
+def parse_routes(spec, models):
+    """
+    Starting tiers from a TIER_ROUTES string.
+
+    Args:
+        spec: Comma-separated NAME=TIER, NAME an endpoint or a field and TIER
+            an index into models or a model name, e.g. 'stream=1,story=gpt-4o'
+        models: Tier models, cheapest first
+
+    Returns:
+        dict: Name -> tier index
+
+    Raises:
+        ValueError: On an unknown name or tier
+    """
+    routes = {}
+    for item in (part.strip() for part in spec.split(',')):
+        if not item:
+            continue
+        name, _, tier = (part.strip() for part in item.partition('='))
+        if name not in ENDPOINTS and name not in ANALYSIS_FIELDS:
+            raise ValueError(f"Unknown tier route '{name}'. Choose from: {', '.join(ENDPOINTS + ANALYSIS_FIELDS)}")
+        if tier in models:
+            routes[name] = models.index(tier)
+        elif tier.isdigit() and int(tier) < len(models):
+            routes[name] = int(tier)
+        else:
+            raise ValueError(f"Invalid tier '{tier}' for route '{name}'. Use 0-{len(models) - 1} or a model name")
+    return routes
+
+
+class ModelTiers:
+    """Tier models, starting routes and per-tier counters for one process."""
+
+    def __init__(self, models=None, routes=None, min_confidence=None):
+        """
+        Initialize tiers.
+
+        Args:
+            models: Model names, cheapest first (defaults to Config.MODEL_TIERS)
+            routes: TIER_ROUTES string (defaults to Config)
+            min_confidence: field_confidence() below which a field escalates (defaults to Config)
+        """
+        self.models = list(models or Config.MODEL_TIERS)
+        if not self.models:
+            raise ValueError("At least one tier model is required")
+        self.routes = parse_routes(Config.TIER_ROUTES if routes is None else routes, self.models)
+        self.min_confidence = Config.TIER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.latency = {model: LatencyHistogram() for model in self.models}
+        self._counts = {model: {'calls': 0, 'fields': 0, 'escalated': 0} for model in self.models}
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        """The tiers as one model name, for cache keys."""
+        return '>'.join(self.models)
+
+    @property
+    def last(self):
+        """Index of the largest model."""
+        return len(self.models) - 1
+
+    def start_tiers(self, fields, endpoint=None):
+        """
+        Fields grouped by the tier they are first asked of.
+
+        Args:
+            fields: Field names of the request
+            endpoint: Endpoint the request came from (see ENDPOINTS), if any
+
+        Returns:
+            list: One list of field names per tier, in request order
+        """
+        floor = self.routes.get(endpoint, 0)
+        groups = [[] for _ in self.models]
+        for name in fields:
+            groups[max(floor, self.routes.get(name, 0))].append(name)
+        return groups
+
+    def stream_model(self, fields, endpoint='stream'):
+        """Model a stream of these fields runs on: the highest starting tier among them."""
+        groups = self.start_tiers(fields, endpoint)
+        return self.models[max(tier for tier, names in enumerate(groups) if names)]
+
+    def record_call(self, model, seconds, fields):
+        """Count one completed call to a tier and the fields it was asked for."""
+        self.latency[model].record(seconds)
+        metrics.TIER_CALL_SECONDS.observe(seconds, model)
+        metrics.TIER_FIELDS.inc(len(fields), model)
+        with self._lock:
+            self._counts[model]['calls'] += 1
+            self._counts[model]['fields'] += len(fields)
+
+    def _escalate(self, model, names, reason):
+        """Count fields passed on to the next tier."""
+        if not names:
+            return
+        metrics.TIER_ESCALATIONS.inc(len(names), model, reason)
+        with self._lock:
+            self._counts[model]['escalated'] += len(names)
+        print(f"Escalating from {model} ({reason}): {', '.join(names)}")
+
+    def check(self, model, results, missing):
+        """
+        Split a tier's answer into fields to keep and fields to ask the next tier.
+
+        Args:
+            model: Tier model that answered
+            results: Valid fields parsed from its answer
+            missing: Field names it lacked or got invalid
+
+        Returns:
+            tuple: (dict of accepted fields, list of field names to escalate)
+        """
+        accepted = {}
+        doubtful = []
+        for name, value in results.items():
+            if field_confidence(name, value) >= self.min_confidence:
+                accepted[name] = value
+            else:
+                doubtful.append(name)
+        self._escalate(model, list(missing), 'missing')
+        self._escalate(model, doubtful, 'low_confidence')
+        return accepted, list(missing) + doubtful
+
+    def fail(self, model, fields, error):
+        """
+        Count a failed call to a tier below the last; its fields escalate.
+
+        Returns:
+            list: The field names, to ask of the next tier
+        """
+        print(f"Tier {model} failed: {str(error)}")
+        metrics.TIER_FIELDS.inc(len(fields), model)
+        with self._lock:
+            self._counts[model]['fields'] += len(fields)
+        self._escalate(model, fields, 'error')
+        return list(fields)
+
+    def stats(self):
+        """Counters for /api/health."""
+        tiers = {}
+        with self._lock:
+            counts = {model: dict(values) for model, values in self._counts.items()}
+        for model, values in counts.items():
+            p50, p95 = (self.latency[model].percentile(pct) for pct in (50, 95))
+            values['escalation_rate'] = round(values['escalated'] / values['fields'], 3) if values['fields'] else None
+            values['latency_seconds'] = {'p50': round(p50, 3) if p50 else None, 'p95': round(p95, 3) if p95 else None}
+            values['tokens'] = {
+                kind: metrics.MODEL_TOKENS.value(model, kind) for kind in ('prompt', 'completion')
+            }
+            tiers[model] = values
+        return {'tiers': tiers, 'routes': self.routes, 'min_confidence': self.min_confidence}
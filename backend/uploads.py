@@ -0,0 +1,355 @@
+"""
+Upload reading with bounded memory: header checks and streaming base64 JSON bodies.
+"""
+import base64
+import binascii
+import io
+import json
+from config import Config
+
+HEADER_BYTES = 64 * 1024  # Enough for the header of every supported format, bar huge EXIF blocks
+CHUNK_BYTES = 64 * 1024
+MAX_FIELD_BYTES = 64 * 1024  # Non-image JSON values
+
+# (prefix, format) for Config.ALLOWED_EXTENSIONS; WebP is RIFF....WEBP and is checked separately
+_MAGIC = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+_WHITESPACE = b' \t\r\n'
+_BASE64_ALPHABET = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+# b64decode's default discards everything outside the alphabet; do the same per chunk
+_NOT_BASE64 = bytes(c for c in range(256) if c not in _BASE64_ALPHABET + b'=')
+
+
+def sniff_format(head):
+    """
+    Image format from the first bytes of a file.
+
+    Args:
+        head: Leading bytes (at least 12)
+
+    Returns:
+        str: Format name, or None if not a supported image type
+    """
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    for prefix, name in _MAGIC:
+        if head.startswith(prefix):
+            return name
+    return None
+
+
+def check_header(head):
+    """
+    Reject an upload from its first bytes, before the rest is read or decoded.
+
+    Checks the magic bytes, then the dimensions declared in the header
+    against MAX_IMAGE_PIXELS (decompression bombs declare huge dimensions
+    in a small file).
+
+    Args:
+        head: The first HEADER_BYTES of the upload, or all of it if shorter
+
+    Returns:
+        tuple: (format, (width, height)); the size is None if the header
+        runs past head (ingest() checks it on the full file)
+
+    Raises:
+        ValueError: If the upload is not a supported image or is too large
+    """
+    if not head:
+        raise ValueError("Empty file")
+    image_format = sniff_format(head)
+    if image_format is None:
+        raise ValueError("Invalid image format: not a JPEG, PNG, GIF or WebP file")
+    # Pillow is imported by the first upload that gets this far, not at startup
+    from PIL import Image
+    from image_processor import check_pixels
+    try:
+        # Image.open() reads the header only
+        size = Image.open(io.BytesIO(head)).size
+        check_pixels(size)
+    except Image.DecompressionBombError as e:
+        raise ValueError(f"Image too large: {str(e)}")
+    except Exception as e:
+        if len(head) < HEADER_BYTES:
+            raise ValueError(f"Invalid image format: {str(e)}")
+        return image_format, None
+    return image_format, size
+
+
+class Base64StreamDecoder:
+    """
+    Decode base64 text fed in chunks, keeping only the decoded bytes.
+
+    Accepts an optional data URI prefix and, like base64.b64decode, skips
+    characters outside the alphabet (line breaks, spaces).
+    """
+
+    def __init__(self, max_bytes=None, on_header=None):
+        """
+        Initialize decoder.
+
+        Args:
+            max_bytes: Decoded size limit (defaults to MAX_IMAGE_SIZE_BYTES)
+            on_header: Called once with the first HEADER_BYTES decoded bytes
+                (or all of them, if fewer); may raise to stop early
+        """
+        self.max_bytes = max_bytes or Config.MAX_IMAGE_SIZE_BYTES
+        self.on_header = on_header
+        self.size = 0
+        self._output = io.BytesIO()
+        self._pending = b''  # Alphabet characters not yet forming a 4-character group
+        self._prefix = b''  # Start of the text until we know if it is a data URI
+        self._started = False
+        self._header_checked = on_header is None
+
+    def feed(self, text):
+        """Decode the next chunk of base64 text (bytes)."""
+        if not self._started:
+            self._prefix += text
+            head = self._prefix.lstrip(_WHITESPACE)
+            if len(head) < 5:
+                return
+            if head.startswith(b'data:'):
+                comma = head.find(b',')
+                if comma < 0:
+                    if len(head) > 1024:
+                        raise ValueError("Invalid base64 image data: malformed data URI")
+                    return
+                head = head[comma + 1:]
+            self._started = True
+            self._prefix = b''
+            text = head
+
+        text = self._pending + text.translate(None, _NOT_BASE64)
+        usable = len(text) - len(text) % 4
+        self._pending = text[usable:]
+        if usable:
+            self._write(text[:usable])
+
+    def _write(self, text):
+        try:
+            decoded = base64.b64decode(text)
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 image data: {str(e)}")
+        self.size += len(decoded)
+        if self.size > self.max_bytes:
+            raise ValueError(f"Image too large. Max size: {Config.MAX_IMAGE_SIZE_MB}MB")
+        self._output.write(decoded)
+        if not self._header_checked and self.size >= HEADER_BYTES:
+            self._header_checked = True
+            view = self._output.getbuffer()
+            head = view[:HEADER_BYTES].tobytes()
+            view.release()
+            self.on_header(head)
+
+    def close(self):
+        """
+        Finish decoding.
+
+        Returns:
+            bytes: Decoded data
+        """
+        if not self._started:
+            head = self._prefix.lstrip(_WHITESPACE)
+            if head.startswith(b'data:'):
+                raise ValueError("Invalid base64 image data: malformed data URI")
+            self._started = True
+            self._prefix = b''
+            self.feed(head)
+        if self._pending:
+            # Let b64decode judge a short final group (missing padding is an error)
+            self._write(self._pending)
+            self._pending = b''
+        data = self._output.getvalue()
+        self._output = None
+        if not self._header_checked:
+            self._header_checked = True
+            self.on_header(data)
+        return data
+
+
+class JSONUploadReader:
+    """
+    Read a JSON object body from a stream, decoding one base64 field on the fly.
+
+    The image field never exists as text: each chunk of the body is decoded
+    as it arrives, so memory holds the decoded image plus one chunk. Other
+    fields are parsed normally (up to MAX_FIELD_BYTES each).
+    """
+
+    def __init__(self, stream, field='image', decoder=None):
+        """
+        Initialize reader.
+
+        Args:
+            stream: Binary stream of the request body
+            field: Name of the base64 field
+            decoder: Base64StreamDecoder for that field
+        """
+        self.stream = stream
+        self.field = field
+        self.decoder = decoder or Base64StreamDecoder()
+        self._buffer = b''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, keep=None):
+        """
+        Read another chunk, dropping consumed bytes before `keep` (defaults to the position).
+
+        Returns:
+            bool: False at end of stream
+        """
+        if self._eof:
+            return False
+        chunk = self.stream.read(CHUNK_BYTES)
+        if not chunk:
+            self._eof = True
+            return False
+        keep = self._pos if keep is None else keep
+        self._buffer = self._buffer[keep:] + chunk
+        self._pos -= keep
+        return True
+
+    def _next_char(self):
+        """Next non-whitespace byte (consumed), or None at end of stream."""
+        while True:
+            while self._pos < len(self._buffer):
+                char = self._buffer[self._pos:self._pos + 1]
+                self._pos += 1
+                if char not in _WHITESPACE:
+                    return char
+            if not self._fill():
+                return None
+
+    def _expect(self, expected):
+        char = self._next_char()
+        if char is None or char not in expected:
+            raise ValueError(f"Invalid JSON body: expected {expected.decode()!r}")
+        return char
+
+    def _raw_string(self):
+        """Rest of a string whose opening quote was consumed, as JSON text."""
+        start = self._pos - 1
+        escaped = False
+        while True:
+            while self._pos < len(self._buffer):
+                char = self._buffer[self._pos]
+                self._pos += 1
+                if escaped:
+                    escaped = False
+                elif char == 0x5c:  # Backslash
+                    escaped = True
+                elif char == 0x22:  # Quote
+                    return self._buffer[start:self._pos]
+                if self._pos - start > MAX_FIELD_BYTES:
+                    raise ValueError("Invalid JSON body: field too long")
+            if not self._fill(keep=start):
+                raise ValueError("Invalid JSON body: unterminated string")
+            start = 0
+
+    def _raw_value(self, first):
+        """A non-image value starting with the (consumed) byte first, as JSON text."""
+        if first == b'"':
+            return self._raw_string()
+        start = self._pos - 1
+        depth = 1 if first in (b'[', b'{') else 0
+        in_string = escaped = False
+        while True:
+            while self._pos < len(self._buffer):
+                char = self._buffer[self._pos:self._pos + 1]
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == b'\\':
+                        escaped = True
+                    elif char == b'"':
+                        in_string = False
+                elif char == b'"':
+                    in_string = True
+                elif char in (b'[', b'{'):
+                    depth += 1
+                elif char in (b']', b'}'):
+                    if depth == 0:
+                        return self._buffer[start:self._pos]  # Scalar followed by the closing brace
+                    depth -= 1
+                    if depth == 0:
+                        self._pos += 1
+                        return self._buffer[start:self._pos]
+                elif char == b',' and depth == 0:
+                    return self._buffer[start:self._pos]
+                self._pos += 1
+                if self._pos - start > MAX_FIELD_BYTES:
+                    raise ValueError("Invalid JSON body: field too long")
+            if not self._fill(keep=start):
+                return self._buffer[start:self._pos]
+            start = 0
+
+    def _stream_string(self):
+        """Feed the rest of a string (opening quote consumed) to the decoder."""
+        while True:
+            end = self._buffer.find(b'"', self._pos)
+            escape = self._buffer.find(b'\\', self._pos, end if end >= 0 else len(self._buffer))
+            if escape >= 0:
+                # Only escapes that can occur in base64 text: \/ and whitespace
+                if escape + 1 >= len(self._buffer):
+                    self.decoder.feed(self._buffer[self._pos:escape])
+                    self._pos = escape
+                    if not self._fill():
+                        raise ValueError("Invalid JSON body: unterminated string")
+                    continue
+                self.decoder.feed(self._buffer[self._pos:escape])
+                if self._buffer[escape + 1:escape + 2] == b'/':
+                    self.decoder.feed(b'/')
+                self._pos = escape + 2
+                continue
+            if end >= 0:
+                self.decoder.feed(self._buffer[self._pos:end])
+                self._pos = end + 1
+                return
+            self.decoder.feed(self._buffer[self._pos:])
+            self._pos = len(self._buffer)
+            if not self._fill():
+                raise ValueError("Invalid JSON body: unterminated string")
+
+    def read(self):
+        """
+        Parse the body.
+
+        Returns:
+            tuple: (decoded image bytes or None if the field is absent, other fields dict)
+
+        Raises:
+            ValueError: If the body is not a JSON object or the image is invalid
+        """
+        self._expect(b'{')
+        fields = {}
+        image = None
+        char = self._next_char()
+        if char == b'}':
+            return None, fields
+        while True:
+            if char != b'"':
+                raise ValueError("Invalid JSON body: expected a field name")
+            name = json.loads(self._raw_string())
+            self._expect(b':')
+            first = self._next_char()
+            if first is None:
+                raise ValueError("Invalid JSON body: missing value")
+            if name == self.field and first == b'"':
+                self._stream_string()
+                image = self.decoder.close()
+            else:
+                try:
+                    fields[name] = json.loads(self._raw_value(first))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Invalid JSON body: {str(e)}")
+            char = self._expect(b',}')
+            if char == b'}':
+                return image, fields
+            char = self._next_char()
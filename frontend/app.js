@@ -7,9 +7,15 @@ const API_BASE_URL = window.location.hostname === 'localhost' || window.location
     ? 'http://localhost:5000/api'
     : 'https://image-storytelling-backend.vercel.app/api';
 
+// Downscale and re-encode uploads in the browser first (?resize=0 turns it off, for comparison)
+const CLIENT_RESIZE = new URLSearchParams(window.location.search).get('resize') !== '0';
+const UPLOAD_ATTEMPTS = 2;
+
 // State
 let selectedImage = null;
+let previewUrl = null;
 let cameraStream = null;
+let resizeWorker = null;
 
 // DOM Elements
 const elements = {
@@ -210,27 +216,20 @@ function handleImageFile(file) {
     selectedImage = file;
     console.log('Selected image set:', selectedImage.name);
 
-    const reader = new FileReader();
-
-    reader.onload = (e) => {
-        console.log('FileReader loaded successfully');
-        elements.previewImg.src = e.target.result;
-        elements.imagePreview.hidden = false;
-
-        // Hide other states
-        elements.resultsSection.hidden = true;
-        elements.errorState.hidden = true;
-
-        console.log('Image preview should now be visible');
-    };
+    // Point the preview at the file itself rather than a base64 copy of it
+    if (previewUrl) URL.revokeObjectURL(previewUrl);
+    previewUrl = URL.createObjectURL(file);
 
-    reader.onerror = (e) => {
-        console.error('FileReader error:', e);
-        showError('Failed to read image file');
+    elements.previewImg.onerror = () => {
+        // Clearing the preview also fires this
+        if (previewUrl) showError('Failed to read image file');
     };
+    elements.previewImg.src = previewUrl;
+    elements.imagePreview.hidden = false;
 
-    console.log('Starting to read file as DataURL');
-    reader.readAsDataURL(file);
+    // Hide other states
+    elements.resultsSection.hidden = true;
+    elements.errorState.hidden = true;
 }
 
 elements.clearImageBtn.addEventListener('click', () => {
@@ -242,6 +241,76 @@ function clearImage() {
     elements.imagePreview.hidden = true;
     elements.previewImg.src = '';
     elements.fileInput.value = '';
+    if (previewUrl) {
+        URL.revokeObjectURL(previewUrl);
+        previewUrl = null;
+    }
+}
+
+// ===== Upload Preparation =====
+/**
+ * Downscale and re-encode an image in a Web Worker to the limits the
+ * backend advertises on /api/health, so a 5-10MB phone photo goes over the
+ * wire at the size the backend would have reduced it to anyway.
+ *
+ * Resolves to { blob, resized, width, height }; the blob is the original
+ * file when the backend could not be reached, the browser has no
+ * OffscreenCanvas, or resizing would not make the upload smaller.
+ */
+async function prepareUpload(file) {
+    const original = { blob: file, resized: false };
+    const limits = await uploadLimitsReady;
+
+    // Animations would lose all but their first frame; the backend picks keyframes from them
+    if (!CLIENT_RESIZE || !limits || await isAnimated(file) ||
+        !window.Worker || typeof OffscreenCanvas === 'undefined') {
+        return original;
+    }
+
+    if (!resizeWorker) {
+        resizeWorker = new Worker('resize-worker.js');
+    }
+
+    const result = await new Promise(resolve => {
+        resizeWorker.onmessage = (e) => resolve(e.data);
+        resizeWorker.onerror = (e) => resolve({ error: e.message });
+        resizeWorker.postMessage({ file, limits });
+    });
+
+    if (result.error) {
+        console.warn('Client-side resize failed, uploading the original:', result.error);
+        return original;
+    }
+    // Some browsers cannot encode every format (canvas falls back to PNG)
+    if (result.blob.type !== limits.format || result.blob.size >= file.size) {
+        return original;
+    }
+    return result;
+}
+
+/**
+ * Whether a file may hold several frames: any GIF, a WebP with the
+ * animation flag, or a PNG with an animation control chunk (APNG).
+ */
+async function isAnimated(file) {
+    if (file.type === 'image/gif') return true;
+    if (file.type !== 'image/webp' && file.type !== 'image/png') return false;
+
+    const head = new Uint8Array(await file.slice(0, 64 * 1024).arrayBuffer());
+    const text = new TextDecoder('latin1').decode(head);
+    if (file.type === 'image/webp') {
+        // RIFF....WEBPVP8X, then a flags byte where 0x02 marks an animation
+        return text.slice(12, 16) === 'VP8X' && (head[20] & 0x02) !== 0;
+    }
+    // acTL comes before the first IDAT chunk
+    const actl = text.indexOf('acTL');
+    return actl !== -1 && (text.indexOf('IDAT') === -1 || actl < text.indexOf('IDAT'));
+}
+
+function formatBytes(bytes) {
+    return bytes >= 1024 * 1024
+        ? `${(bytes / 1024 / 1024).toFixed(1)}MB`
+        : `${Math.round(bytes / 1024)}KB`;
 }
 
 // ===== Analysis =====
@@ -258,74 +327,160 @@ elements.analyzeBtn.addEventListener('click', async () => {
     elements.errorState.hidden = true;
 
     try {
-        // Prepare form data
-        const formData = new FormData();
-        formData.append('image', selectedImage);
-
-        // Call API
-        const response = await fetch(`${API_BASE_URL}/analyze`, {
-            method: 'POST',
-            body: formData
-        });
+        const started = performance.now();
+        const upload = await prepareUpload(selectedImage);
+        const prepared = performance.now();
 
-        const data = await response.json();
+        // Binary multipart; a base64 body would be a third larger
+        const formData = new FormData();
+        const name = upload.resized
+            ? `upload.${upload.blob.type.split('/')[1]}`
+            : (selectedImage.name || 'capture.jpg');
+        formData.append('image', upload.blob, name);
+
+        // Call API; fields are rendered as the server streams them.
+        // A dropped connection loses the upload, so send it again once;
+        // the server's cache makes a repeat of a finished analysis free
+        let response;
+        for (let attempt = 1; ; attempt++) {
+            try {
+                response = await fetch(`${API_BASE_URL}/analyze/stream`, {
+                    method: 'POST',
+                    body: formData
+                });
+                break;
+            } catch (error) {
+                if (attempt >= UPLOAD_ATTEMPTS) throw error;
+                console.warn(`Upload failed (${error.message}), retrying`);
+            }
+        }
 
-        if (!response.ok) {
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!response.ok || !contentType.startsWith('text/event-stream')) {
+            const data = await response.json();
             throw new Error(data.error || 'Analysis failed');
         }
 
-        // Display results
-        displayResults(data.results);
+        await readAnalysisStream(response);
+
+        const sent = upload.resized ? `${upload.width}x${upload.height}` : 'original';
+        console.log(`Upload ${formatBytes(selectedImage.size)} -> ${formatBytes(upload.blob.size)} (${sent}); ` +
+            `prepared in ${Math.round(prepared - started)}ms, result in ${Math.round(performance.now() - started)}ms`);
 
     } catch (error) {
         console.error('Analysis error:', error);
-        showError(`${error.message} (Target: ${API_BASE_URL}/analyze)`);
+        showError(`${error.message} (Target: ${API_BASE_URL}/analyze/stream)`);
     } finally {
         elements.loadingState.hidden = true;
     }
 });
 
-function displayResults(results) {
+/**
+ * Read server-sent events from the streaming endpoint, rendering each
+ * field as soon as it arrives.
+ */
+async function readAnalysisStream(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let started = false;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            message.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            const payload = JSON.parse(data);
+
+            if (event === 'field') {
+                if (!started) {
+                    startResults();
+                    started = true;
+                }
+                displayField(payload.name, payload.value);
+            } else if (event === 'done') {
+                displayResults(payload);
+                return;
+            } else if (event === 'error') {
+                throw new Error(payload.error || 'Analysis failed');
+            }
+        }
+    }
+
+    throw new Error('Connection closed before analysis finished');
+}
+
+function startResults() {
     // Display hero image (same as preview image)
     const analyzedImage = document.getElementById('analyzed-image');
     analyzedImage.src = elements.previewImg.src;
 
-    // Populate caption overlay on hero image
-    elements.resultCaption.textContent = results.caption || 'N/A';
-
-    // Populate primary summary
-    elements.resultSummary.textContent = results.summary || 'N/A';
-
-    // Populate mood
-    elements.resultMood.textContent = results.mood || 'N/A';
-
-    // Populate story
-    elements.resultStory.textContent = results.story || 'N/A';
-
-    // Handle objects list (may be bulleted)
-    if (results.objects) {
-        // If already formatted with bullets, use as-is
-        if (results.objects.includes('-') || results.objects.includes('•')) {
-            elements.resultObjects.innerHTML = results.objects
-                .split('\n')
-                .filter(line => line.trim())
-                .map(line => `<div>${line}</div>`)
-                .join('');
-        } else {
-            // Otherwise, format as list
-            elements.resultObjects.textContent = results.objects;
-        }
-    } else {
-        elements.resultObjects.textContent = 'N/A';
-    }
+    // Placeholders until each field arrives
+    [elements.resultCaption, elements.resultSummary, elements.resultObjects,
+        elements.resultMood, elements.resultStory].forEach(el => {
+        el.textContent = '…';
+    });
 
-    // Show results section
+    elements.loadingState.hidden = true;
     elements.resultsSection.hidden = false;
 
     // Scroll to results
     elements.resultsSection.scrollIntoView({ behavior: 'smooth', block: 'start' });
 }
 
+function displayField(name, value) {
+    switch (name) {
+        case 'caption':
+            // Caption overlay on hero image
+            elements.resultCaption.textContent = value || 'N/A';
+            break;
+        case 'summary':
+            elements.resultSummary.textContent = value || 'N/A';
+            break;
+        case 'mood':
+            elements.resultMood.textContent = value || 'N/A';
+            break;
+        case 'story':
+            elements.resultStory.textContent = value || 'N/A';
+            break;
+        case 'objects':
+            // Handle objects list (may be bulleted)
+            if (value && (value.includes('-') || value.includes('•'))) {
+                // If already formatted with bullets, use as-is
+                elements.resultObjects.innerHTML = value
+                    .split('\n')
+                    .filter(line => line.trim())
+                    .map(line => `<div>${line}</div>`)
+                    .join('');
+            } else {
+                // Otherwise, format as list
+                elements.resultObjects.textContent = value || 'N/A';
+            }
+            break;
+    }
+}
+
+function displayResults(results) {
+    if (elements.resultsSection.hidden) {
+        startResults();
+    }
+    ['caption', 'summary', 'objects', 'mood', 'story'].forEach(name => {
+        displayField(name, results[name]);
+    });
+}
+
 // ===== Error Handling =====
 function showError(message) {
     elements.errorMessage.textContent = message;
@@ -349,13 +504,18 @@ elements.newAnalysisBtn.addEventListener('click', () => {
 });
 
 // ===== Health Check on Load =====
-window.addEventListener('load', async () => {
-    try {
-        const response = await fetch(`${API_BASE_URL}/health`);
-        const data = await response.json();
-        console.log('Backend status:', data);
-    } catch (error) {
-        console.warn('Backend not available:', error.message);
-        console.log('Make sure to start the backend server: python backend/app.py');
-    }
+// Resolves to the backend's upload limits, or null if it could not be reached
+const uploadLimitsReady = new Promise(resolve => {
+    window.addEventListener('load', async () => {
+        try {
+            const response = await fetch(`${API_BASE_URL}/health`);
+            const data = await response.json();
+            console.log('Backend status:', data);
+            resolve(data.upload || null);
+        } catch (error) {
+            console.warn('Backend not available:', error.message);
+            console.log('Make sure to start the backend server: python backend/app.py');
+            resolve(null);
+        }
+    });
 });
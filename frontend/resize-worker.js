@@ -0,0 +1,58 @@
+/**
+ * Web Worker: downscale and re-encode an image before it is uploaded.
+ *
+ * Receives { file, limits }, where limits is the `upload` object from
+ * /api/health, and answers { blob, width, height, resized } or { error }.
+ * Decoding and encoding a 12MP photo takes long enough to freeze the page,
+ * so it happens here rather than on the main thread.
+ */
+
+/**
+ * Size the backend would send the image at: fit within max_dimension, then
+ * scale the shortest side down to max_short_side. Rounds down like the
+ * backend (resolution.py), so the upload is passed through as is.
+ */
+function targetSize(width, height, limits) {
+    let ratio = Math.min(1, limits.max_dimension / width, limits.max_dimension / height);
+    let w = Math.max(1, Math.floor(width * ratio));
+    let h = Math.max(1, Math.floor(height * ratio));
+
+    if (limits.max_short_side) {
+        ratio = Math.min(1, limits.max_short_side / Math.min(w, h));
+        w = Math.max(1, Math.floor(w * ratio));
+        h = Math.max(1, Math.floor(h * ratio));
+    }
+    return { width: w, height: h };
+}
+
+self.addEventListener('message', async (e) => {
+    const { file, limits } = e.data;
+
+    try {
+        // Applies EXIF orientation, so the model sees the photo upright
+        const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+        const { width, height } = targetSize(bitmap.width, bitmap.height, limits);
+
+        if (width === bitmap.width && height === bitmap.height && file.type === limits.format) {
+            // Already what the backend wants
+            bitmap.close();
+            self.postMessage({ blob: file, width, height, resized: false });
+            return;
+        }
+
+        const canvas = new OffscreenCanvas(width, height);
+        const ctx = canvas.getContext('2d');
+        // Transparent areas become white, as they would on the backend
+        ctx.fillStyle = '#ffffff';
+        ctx.fillRect(0, 0, width, height);
+        ctx.imageSmoothingEnabled = true;
+        ctx.imageSmoothingQuality = 'high';
+        ctx.drawImage(bitmap, 0, 0, width, height);
+        bitmap.close();
+
+        const blob = await canvas.convertToBlob({ type: limits.format, quality: limits.quality / 100 });
+        self.postMessage({ blob, width, height, resized: true });
+    } catch (error) {
+        self.postMessage({ error: error.message });
+    }
+});